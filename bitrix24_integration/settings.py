@@ -192,6 +192,10 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 100000
 
 DOCX_TEMPLATE_PATH = os.path.join(BASE_DIR, "templates", "docx")
 
+# Промежуточные данные импорта Excel (между анализом и импортом), хранятся 6 часов
+IMPORT_STAGING_DIR = os.path.join(BASE_DIR, 'import_staging')
+IMPORT_STAGING_TTL = 6 * 3600
+
 # Настройки для медиа файлов
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
@@ -0,0 +1,47 @@
+import logging
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceDataCache:
+    """
+    Кеш справочников API контактов (регионы, типы организаций, федеральные округа).
+
+    Ключи содержат номер версии: при изменении справочника версия увеличивается,
+    и старые ключи просто перестают читаться (истекут по таймауту).
+    """
+
+    CACHE_PREFIX = "contacts_ref:"
+    CACHE_TIMEOUT = 86400  # сутки, справочники меняются редко
+    VERSION_KEY = CACHE_PREFIX + "version"
+
+    @staticmethod
+    def get_version():
+        """Текущая версия справочников"""
+        version = cache.get(ReferenceDataCache.VERSION_KEY)
+        if version is None:
+            cache.add(ReferenceDataCache.VERSION_KEY, 1, None)
+            version = cache.get(ReferenceDataCache.VERSION_KEY, 1)
+        return version
+
+    @staticmethod
+    def bump_version():
+        """Инвалидирует все закешированные справочники"""
+        try:
+            cache.incr(ReferenceDataCache.VERSION_KEY)
+        except ValueError:
+            # Ключа версии ещё нет (или он истёк)
+            cache.set(ReferenceDataCache.VERSION_KEY, 2, None)
+        except Exception as e:
+            logger.error(f"Error bumping contacts reference cache version: {e}")
+
+    @staticmethod
+    def get_or_build(name, builder):
+        """Возвращает справочник из кеша, при промахе строит его через builder()"""
+        key = f"{ReferenceDataCache.CACHE_PREFIX}v{ReferenceDataCache.get_version()}:{name}"
+        data = cache.get(key)
+        if data is None:
+            data = builder()
+            cache.set(key, data, ReferenceDataCache.CACHE_TIMEOUT)
+        return data
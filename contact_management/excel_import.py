@@ -0,0 +1,374 @@
+"""
+Пакетный импорт организаций и контактов из Excel.
+
+Файл читается в режиме read_only, все ИНН, типы и регионы разрешаются одним
+запросом на справочник, запись идёт пачками в одной транзакции.
+В режиме dry_run база не меняется, возвращается только отчёт об изменениях.
+"""
+import openpyxl
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Contact, ContactEmail, ContactPhone, HistoryOrganization, Organization, OrganizationType, Region
+
+BATCH_SIZE = 500
+
+# Поля организации, которые обновляются при повторном импорте
+ORGANIZATION_UPDATE_FIELDS = ['name', 'full_name', 'type', 'federal_company', 'region', 'updated_at']
+
+PERSON_FIELDS = [
+    'last_name', 'first_name', 'middle_name', 'position',
+    'last_name_dat', 'first_name_dat', 'middle_name_dat', 'position_dat',
+    'manager', 'comment',
+]
+
+
+def clean_inn(value):
+    """ИНН из ячейки: числа без дробной части, строки без пробелов"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def clean_value(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def read_sheet_rows(ws, min_row=2):
+    """Строки листа без полностью пустых"""
+    for row in ws.iter_rows(min_row=min_row, values_only=True):
+        if row and any(cell is not None for cell in row):
+            yield row
+
+
+def first_by_name(model, names):
+    """{название: объект} одним запросом; при дублях берётся первый, как filter().first()"""
+    result = {}
+    for obj in model.objects.filter(name__in=names).order_by('id'):
+        result.setdefault(obj.name, obj)
+    return result
+
+
+def new_report(dry_run):
+    return {
+        'dry_run': dry_run,
+        'created': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'skipped': [],
+        'changes': [],
+    }
+
+
+class OrganizationExcelImporter:
+    """
+    Импорт организаций. Колонки: ИНН, название, полное наименование, тип,
+    федеральная (любое значение), регион, ИНН головной организации.
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.report = new_report(dry_run)
+
+    def parse(self, excel_file):
+        wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+        try:
+            rows = {}
+            for index, row in enumerate(read_sheet_rows(wb.active), start=2):
+                row = tuple(row) + (None,) * (7 - len(row))
+                inn = clean_inn(row[0])
+                if not inn:
+                    self.report['skipped'].append(f'Строка {index}: не указан ИНН')
+                    continue
+                # При повторе ИНН в файле побеждает последняя строка
+                rows[inn] = {
+                    'inn': inn,
+                    'name': clean_value(row[1]),
+                    'full_name': clean_value(row[2]) or '',
+                    'type_name': clean_value(row[3]),
+                    'federal_company': row[4] is not None,
+                    'region_name': clean_value(row[5]),
+                    'parent_inn': clean_inn(row[6]),
+                }
+            return rows
+        finally:
+            wb.close()
+
+    def run(self, excel_file):
+        rows = self.parse(excel_file)
+        if not rows:
+            return self.report
+
+        types = first_by_name(OrganizationType, {r['type_name'] for r in rows.values() if r['type_name']})
+        regions = first_by_name(Region, {r['region_name'] for r in rows.values() if r['region_name']})
+        all_inns = set(rows) | {r['parent_inn'] for r in rows.values() if r['parent_inn']}
+        existing = {
+            org.inn: org
+            for org in Organization.objects.filter(inn__in=all_inns).select_related('type', 'region', 'parent_company')
+        }
+
+        now = timezone.now()
+        to_upsert = []
+        history = []
+
+        for inn, row in rows.items():
+            org_type = types.get(row['type_name'])
+            region = regions.get(row['region_name'])
+            parent_exists = row['parent_inn'] in existing or row['parent_inn'] in rows
+            parent_inn = row['parent_inn'] if parent_exists else None
+
+            organization = Organization(
+                inn=inn,
+                name=row['name'],
+                full_name=row['full_name'],
+                type=org_type,
+                federal_company=row['federal_company'],
+                region=region,
+            )
+
+            current = existing.get(inn)
+            if current is None:
+                self.report['created'] += 1
+                self.report['changes'].append(f'+ {inn} {row["name"] or ""}')
+                to_upsert.append(organization)
+                continue
+
+            diff = self.diff(current, organization, parent_inn)
+            if not diff:
+                self.report['unchanged'] += 1
+                continue
+
+            self.report['updated'] += 1
+            self.report['changes'].append(f'~ {inn}: ' + '; '.join(diff))
+            to_upsert.append(organization)
+            history.append(HistoryOrganization(
+                organization=current,
+                name=current.name,
+                status='active',
+                date=now,
+            ))
+
+        if self.dry_run:
+            return self.report
+
+        with transaction.atomic():
+            Organization.objects.bulk_create(
+                to_upsert,
+                batch_size=BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['inn'],
+                update_fields=ORGANIZATION_UPDATE_FIELDS,
+            )
+            HistoryOrganization.objects.bulk_create(history, batch_size=BATCH_SIZE)
+            self.update_parents(rows, existing)
+
+        return self.report
+
+    def update_parents(self, rows, existing):
+        """Головные организации проставляются вторым проходом: они могут быть в этом же файле"""
+        ids = dict(Organization.objects.filter(
+            inn__in=set(rows) | {r['parent_inn'] for r in rows.values() if r['parent_inn']}
+        ).values_list('inn', 'id'))
+
+        to_update = []
+        for inn, row in rows.items():
+            parent_id = ids.get(row['parent_inn'])
+            current = existing.get(inn)
+            if current is not None and current.parent_company_id == parent_id:
+                continue
+            if current is None and parent_id is None:
+                continue
+            to_update.append(Organization(id=ids[inn], parent_company_id=parent_id))
+
+        Organization.objects.bulk_update(to_update, ['parent_company'], batch_size=BATCH_SIZE)
+
+    @staticmethod
+    def diff(current, new, parent_inn):
+        changes = []
+        for field, old_value, new_value in [
+            ('name', current.name, new.name),
+            ('full_name', current.full_name, new.full_name),
+            ('type', current.type_id and str(current.type), new.type_id and str(new.type)),
+            ('federal_company', current.federal_company, new.federal_company),
+            ('region', current.region_id and str(current.region), new.region_id and str(new.region)),
+            ('parent_company', current.parent_company.inn if current.parent_company else None, parent_inn),
+        ]:
+            if (old_value or None) != (new_value or None):
+                changes.append(f'{field}: {old_value!r} → {new_value!r}')
+        return changes
+
+
+class ContactExcelImporter:
+    """
+    Импорт контактов с листов "По сотрудникам", "По отделам" и "Главный контакт".
+    Уже существующие контакты (тот же сотрудник, отдел или главный контакт организации)
+    обновляются, новые телефоны и email добавляются без дублей.
+    """
+
+    SHEET_PERSON = "По сотрудникам"
+    SHEET_DEPARTMENT = "По отделам"
+    SHEET_MAIN = "Главный контакт"
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.report = new_report(dry_run)
+        self.report.update({'person': 0, 'department': 0, 'main': 0})
+
+    def parse(self, excel_file):
+        """Строки всех листов в виде словарей с ключом контакта"""
+        wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+        items = []
+        try:
+            for sheet_name in wb.sheetnames:
+                if sheet_name not in (self.SHEET_PERSON, self.SHEET_DEPARTMENT, self.SHEET_MAIN):
+                    continue
+                for index, row in enumerate(read_sheet_rows(wb[sheet_name]), start=2):
+                    row = tuple(row) + (None,) * (13 - len(row))
+                    inn = clean_inn(row[0])
+                    if not inn:
+                        self.report['skipped'].append(f'{sheet_name}, строка {index}: не указан ИНН')
+                        continue
+                    item = self.parse_row(sheet_name, row)
+                    item.update({'inn': inn, 'location': f'{sheet_name}, строка {index}'})
+                    items.append(item)
+        finally:
+            wb.close()
+        return items
+
+    def parse_row(self, sheet_name, row):
+        if sheet_name == self.SHEET_PERSON:
+            fields = dict(zip(PERSON_FIELDS[:-2], [clean_value(value) for value in row[1:9]]))
+            fields['manager'] = bool(row[9])
+            fields['comment'] = clean_value(row[12]) or ''
+            return {
+                'type': 'person',
+                'fields': fields,
+                'phone': clean_value(row[10]),
+                'email': clean_value(row[11]),
+                'key': ('person', fields['last_name'], fields['first_name'], fields['middle_name']),
+            }
+        if sheet_name == self.SHEET_DEPARTMENT:
+            department_name = clean_value(row[1])
+            return {
+                'type': 'department',
+                'fields': {'department_name': department_name, 'comment': clean_value(row[4]) or ''},
+                'phone': clean_value(row[2]),
+                'email': clean_value(row[3]),
+                'key': ('department', department_name),
+            }
+        return {
+            'type': 'main',
+            'fields': {'comment': clean_value(row[3]) or ''},
+            'phone': clean_value(row[1]),
+            'email': clean_value(row[2]),
+            'key': ('main',),
+        }
+
+    @staticmethod
+    def contact_key(contact):
+        if contact.type == 'person':
+            return ('person', contact.last_name, contact.first_name, contact.middle_name)
+        if contact.type == 'department':
+            return ('department', contact.department_name)
+        return (contact.type,)
+
+    def run(self, excel_file):
+        items = self.parse(excel_file)
+        if not items:
+            return self.report
+
+        organizations = dict(
+            Organization.objects.filter(inn__in={item['inn'] for item in items}).values_list('inn', 'id')
+        )
+        org_ids = set(organizations.values())
+
+        existing = {}
+        for contact in Contact.objects.filter(organization_id__in=org_ids).prefetch_related('phones', 'emails'):
+            existing.setdefault((contact.organization_id, self.contact_key(contact)), contact)
+
+        to_create = {}
+        to_update = {}
+        update_fields = set()
+        pending_phones = []
+        pending_emails = []
+
+        for item in items:
+            org_id = organizations.get(item['inn'])
+            if org_id is None:
+                self.report['skipped'].append(f'{item["location"]}: организация с ИНН {item["inn"]} не найдена')
+                continue
+
+            key = (org_id, item['key'])
+            contact = existing.get(key) or to_create.get(key)
+
+            if contact is None:
+                contact = Contact(organization_id=org_id, type=item['type'], **item['fields'])
+                to_create[key] = contact
+                self.report['created'] += 1
+                self.report[item['type']] += 1
+                self.report['changes'].append(f'+ {item["inn"]} {item["type"]}: {self.describe(item)}')
+            elif contact.pk:
+                diff = [
+                    f'{field}: {getattr(contact, field)!r} → {value!r}'
+                    for field, value in item['fields'].items()
+                    if (getattr(contact, field) or None) != (value or None)
+                ]
+                if diff:
+                    for field, value in item['fields'].items():
+                        setattr(contact, field, value)
+                    # bulk_update не проставляет auto_now
+                    contact.updated_at = timezone.now()
+                    update_fields.update(item['fields'])
+                    to_update[key] = contact
+                    self.report['updated'] += 1
+                    self.report['changes'].append(f'~ {item["inn"]} {item["type"]}: ' + '; '.join(diff))
+                else:
+                    self.report['unchanged'] += 1
+
+            known_phones = {p.number for p in contact.phones.all()} if contact.pk else set()
+            known_emails = {e.email.lower() for e in contact.emails.all()} if contact.pk else set()
+            if item['phone'] and item['phone'] not in known_phones:
+                pending_phones.append((key, item['phone']))
+                self.report['changes'].append(f'+ {item["inn"]} телефон {item["phone"]}')
+            if item['email'] and item['email'].lower() not in known_emails:
+                pending_emails.append((key, item['email']))
+                self.report['changes'].append(f'+ {item["inn"]} email {item["email"]}')
+
+        if self.dry_run:
+            return self.report
+
+        with transaction.atomic():
+            Contact.objects.bulk_create(list(to_create.values()), batch_size=BATCH_SIZE)
+            if to_update:
+                Contact.objects.bulk_update(
+                    list(to_update.values()), sorted(update_fields | {'updated_at'}), batch_size=BATCH_SIZE
+                )
+
+            contacts = {**existing, **to_create}
+            ContactPhone.objects.bulk_create(
+                [ContactPhone(contact=contacts[key], number=number) for key, number in dict.fromkeys(pending_phones)],
+                batch_size=BATCH_SIZE,
+            )
+            ContactEmail.objects.bulk_create(
+                [ContactEmail(contact=contacts[key], email=email) for key, email in dict.fromkeys(pending_emails)],
+                batch_size=BATCH_SIZE,
+            )
+
+        return self.report
+
+    @staticmethod
+    def describe(item):
+        fields = item['fields']
+        if item['type'] == 'person':
+            return ' '.join(filter(None, [fields['last_name'], fields['first_name'], fields['middle_name']]))
+        if item['type'] == 'department':
+            return fields['department_name'] or ''
+        return 'главный контакт'
@@ -10,4 +10,8 @@ class ContactImportFromExcel(forms.Form):
         choices=[('','---------')]+[('contacts','Контакты'),('orgs','Организации')],
         widget=forms.Select(attrs={'class': 'form-control'})
     )
-    
\ No newline at end of file
+    dry_run = forms.BooleanField(
+        label='Пробный запуск (только показать изменения)',
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from education_planner.models import ProfActivity, ROIV
+from .cache_utils import ReferenceDataCache
 
 class FederalDistrict(models.Model):
     """Модель для хранения федеральный округов"""
@@ -159,4 +162,12 @@ class Projects(models.Model):
         verbose_name_plural = "Проекты"
 
     def __str__(self):
-        return str(self.name)
\ No newline at end of file
+        return str(self.name)
+
+
+@receiver([post_save, post_delete], sender=Region)
+@receiver([post_save, post_delete], sender=FederalDistrict)
+@receiver([post_save, post_delete], sender=OrganizationType)
+def invalidate_reference_cache(sender, **kwargs):
+    """Сбрасывает кеш справочников API при изменении регионов, округов или типов организаций"""
+    ReferenceDataCache.bump_version()
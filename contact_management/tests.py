@@ -1,3 +1,88 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from education_planner.models import ProfActivity
+from .models import Contact, FederalDistrict, Organization, OrganizationType, Projects, Region
+
+
+class ContactApiQueriesTestCase(TestCase):
+    """Количество запросов API не должно зависеть от числа организаций"""
+
+    def setUp(self):
+        user = User.objects.create_user(username='api', password='api')
+        token = Token.objects.create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.counter = 0
+
+    def create_organizations(self, count):
+        for _ in range(count):
+            self.counter += 1
+            district = FederalDistrict.objects.create(name=f'Округ {self.counter}')
+            region = Region.objects.create(name=f'Регион {self.counter}', federalDistrict=district)
+            org_type = OrganizationType.objects.create(name=f'Тип {self.counter}')
+            organization = Organization.objects.create(
+                inn=str(1000000000 + self.counter),
+                name=f'Организация {self.counter}',
+                type=org_type,
+                region=region,
+            )
+            organization.prof_activity.add(ProfActivity.objects.create(name=f'Сфера {self.counter}'))
+            project = Projects.objects.create(name=f'Проект {self.counter}')
+            project.organizations.add(organization)
+            Contact.objects.create(organization=organization, type='main')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertQueriesDoNotGrow(self, url):
+        self.create_organizations(2)
+        small = self.count_queries(url)
+        self.create_organizations(20)
+        large = self.count_queries(url)
+        self.assertEqual(small, large, f'{url}: {small} запросов на 2 организации, {large} на 22')
+
+    def test_organization_list(self):
+        self.assertQueriesDoNotGrow('/contacts/api/organization/')
+
+    def test_organization_list_paginated(self):
+        self.assertQueriesDoNotGrow('/contacts/api/organization/?page_size=50')
+
+    def test_contact_list(self):
+        self.assertQueriesDoNotGrow('/contacts/api/contact/')
+
+    def test_fed_district_list(self):
+        cache.clear()
+        self.assertQueriesDoNotGrow('/contacts/api/get_all/fed_district/')
+
+
+class ReferenceDataCacheTestCase(TestCase):
+    """Справочники кешируются и сбрасываются при изменении"""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='api', password='api')
+        token = Token.objects.create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_regions_cached_and_invalidated(self):
+        Region.objects.create(name='Самарская область')
+        self.client.get('/contacts/api/get_all/region/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/contacts/api/get_all/region/')
+        self.assertFalse([q for q in queries if 'contact_management_region' in q['sql']])
+        self.assertEqual(len(response.json()), 1)
+
+        Region.objects.create(name='Ульяновская область')
+        response = self.client.get('/contacts/api/get_all/region/')
+        self.assertEqual(len(response.json()), 2)
@@ -10,206 +10,88 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import TokenAuthentication
 from rest_framework import viewsets
 from rest_framework import status
+from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Contact, Organization, Projects, Region, FederalDistrict, OrganizationType, HistoryOrganization, ContactEmail, ContactPhone
+from .models import Contact, Organization, Projects, Region, FederalDistrict, OrganizationType, HistoryOrganization
 from .forms import ContactImportFromExcel
+from .cache_utils import ReferenceDataCache
+from .excel_import import OrganizationExcelImporter, ContactExcelImporter
+from crm_connector.import_jobs import enqueue_import, get_requested_job, redirect_to_job
+from crm_connector.models import ImportJob
 from education_planner.models import ProfActivity, ROIV
 from datetime import datetime
-import openpyxl
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 
-def ExcelImportOrganization(form):
-    if form.is_valid():
-        excel_file = form.cleaned_data['excel_file']
+def ExcelImportOrganization(excel_file, dry_run=False):
+    importer = OrganizationExcelImporter(dry_run=dry_run)
 
-        try:
-            wb = openpyxl.load_workbook(excel_file)
-            ws = wb.active
-        except Exception as e:
-            return False, f'Ошибка при открытии файла: {e}'
-
-        created = 0
-        updated = 0
-
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            inn = row[0]
-            name = row[1]
-            full_name = row[2]
-            type_name = row[3]
-            federal_company = True if row[4] is not None else False
-            region_name = row[5]
-            parent_company_inn = row[6]
-
-            OrgType = OrganizationType.objects.filter(name=type_name).first()
-            region = Region.objects.filter(name=region_name).first()
-            parent_company = Organization.objects.filter(inn=parent_company_inn) or None
-
-            obj_history = Organization.objects.filter(inn=inn).first()
-            if obj_history:       
-                HistoryOrganization.objects.create(
-                    organization=obj_history,
-                    name=obj_history.name,
-                    status='active',
-                    date=datetime.now()
-                )
-                updated += 1
-            else: created += 1
-
-            Organization.objects.update_or_create(
-                inn=inn,
-                defaults={
-                    'name': name,
-                    'full_name': full_name,
-                    'type': OrgType,
-                    'federal_company': federal_company,
-                    'region': region,
-                    'parent_company': parent_company
-                }
-            )
-        return True, f"Результат: Успешный импорт, Добавлено: {created}, Обновлено: {updated}"
-    return False, f"Ошибка: Не корректная форма"
+    try:
+        report = importer.run(excel_file)
+    except Exception as e:
+        return False, f'Ошибка при импорте файла: {e}', None
 
-def ExcelImportContact(form):
-    if form.is_valid():
-        excel_file = form.cleaned_data['excel_file']
+    prefix = "Пробный запуск, изменения не сохранены" if report['dry_run'] else "Результат: Успешный импорт"
+    return True, f"{prefix}, Добавлено: {report['created']}, Обновлено: {report['updated']}, Без изменений: {report['unchanged']}", report
 
-        try:
-            wb = openpyxl.load_workbook(excel_file)
-            ws = wb.active
-        except Exception as e:
-            return False, f'Ошибка при открытии файла: {e}'
-        created_person = 0
-        created_main = 0
-        created_department = 0
-        for SheetName in wb.sheetnames:
-            if wb[SheetName] == "По сотрудникам":
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    inn = row[0]
-                    last_name = row[1]
-                    first_name = row[2]
-                    middle_name = row[3]
-                    position = row[4]
-                    last_name_dat = row[5]
-                    first_name_dat = row[6]
-                    middle_name_dat = row[7]
-                    position_dat = row[8]
-                    manager = True if row[9] else False
-                    phone = row[10]
-                    email = row[11]
-                    comment = row[12]
-
-
-                    organization = Organization.objects.filter(inn=inn).first()
-                    if organization:
-                        created_person += 1
-                        obj = Organization.objects.create(
-                            organization=organization,
-                            type='person',
-                            defaults={
-                                'first_name': first_name,
-                                'last_name': last_name,
-                                'middle_name': middle_name,
-                                'position': position,
-                                'first_name_dat': first_name_dat,
-                                'last_name_dat': last_name_dat,
-                                'middle_name_dat': middle_name_dat,
-                                'position_dat': position_dat,
-                                'manager': manager,
-                                'comment': comment                        
-                            }
-                        )
-                        if email:
-                            ContactEmail.objects.create(
-                                contact=obj,
-                                email = email
-                            )
-                        if phone:
-                            ContactPhone.objects.create(
-                                contact=obj,
-                                number=phone
-                            )
-            elif wb[SheetName] == "По отделам":
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    inn = row[0]
-                    department_name = row[1]
-                    phone = row[2]
-                    email = row[3]
-                    comment = row[4]
-
-                    organization = Organization.objects.filter(inn=inn).first()
-                    if organization:
-                        created_department += 1
-                        obj = Organization.objects.update_or_create(
-                            organization=organization,
-                            defaults={
-                                'type': 'department',
-                                'first_name': first_name,
-                                'department_name': department_name,
-                                'comment': comment                        
-                            }
-                        )
-                        if email:
-                            ContactEmail.objects.create(
-                                contact=obj,
-                                email = email
-                            )
-                        if phone:
-                            ContactPhone.objects.create(
-                                contact=obj,
-                                number=phone
-                            )
-            elif wb[SheetName] == "Главный контакт":
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    inn = row[0]
-                    phone = row[1]
-                    email = row[2]
-                    comment = row[3]
-
-
-                    organization = Organization.objects.filter(inn=inn).first()
-                    if organization:
-                        created_main += 1
-                        obj = Organization.objects.update_or_create(
-                            organization=organization,
-                            defaults={
-                                'type': 'department',
-                                'first_name': first_name,
-                                'comment': comment                        
-                            }
-                        )
-                        if email:
-                            ContactEmail.objects.create(
-                                contact=obj,
-                                email = email
-                            )
-                        if phone:
-                            ContactPhone.objects.create(
-                                contact=obj,
-                                number=phone
-                            )
-        return True, f'Импорт завершен успешно. Создано контактов: {created_person} сотрудников, {created_department} отделов, {created_main} основных контактов.'
-    return False,f'Форма не валидна'
+def ExcelImportContact(excel_file, dry_run=False):
+    importer = ContactExcelImporter(dry_run=dry_run)
+
+    try:
+        report = importer.run(excel_file)
+    except Exception as e:
+        return False, f'Ошибка при импорте файла: {e}', None
+
+    prefix = 'Пробный запуск, изменения не сохранены.' if report['dry_run'] else 'Импорт завершен успешно.'
+    return True, f"{prefix} Создано контактов: {report['person']} сотрудников, {report['department']} отделов, {report['main']} основных контактов. Обновлено: {report['updated']}.", report
+
+def run_contact_import(job, progress):
+    """Импорт контактов или организаций из Excel (обработчик ImportJob)"""
+    import_type = job.params.get('type')
+    import_function = ExcelImportContact if import_type == 'contacts' else ExcelImportOrganization
+
+    with job.file.open('rb') as excel_file:
+        success, msg, report = import_function(excel_file, job.params.get('dry_run', False))
+    if not success:
+        return {'success': False, 'message': msg}
+
+    if import_type == 'contacts':
+        progress.created = report['person'] + report['department'] + report['main']
+    else:
+        progress.created = report['created']
+    progress.updated = report['updated']
+    progress.processed = progress.total = progress.created + progress.updated + report['unchanged'] + len(report['skipped'])
+    return {'success': True, 'message': msg, 'report': report}
    
 def ContactImport(request):
     if not request.user.is_authenticated:
         messages.warning(request, 'Для доступа к импорту необходимо войти в систему.')
         return redirect(f'{settings.LOGIN_URL}?next={request.path}')
+    report = None
+    import_job = get_requested_job(request)
+    if import_job and not import_job.is_active:
+        report = import_job.result.get('report')
     if request.method == 'POST':
         form = ContactImportFromExcel(request.POST,request.FILES)
         if form.is_valid():
-            if form.cleaned_data['type'] == 'contacts':
-                success, msg = ExcelImportContact(form)
-                messages.success(request, msg) if success else messages.error(request, msg)
-            elif form.cleaned_data['type'] == 'orgs':
-                success, msg = ExcelImportOrganization(form)
-                messages.success(request, msg) if success else messages.error(request, msg)
+            import_type = form.cleaned_data['type']
+            # Файл обрабатывается в фоновой задаче, страница показывает прогресс и отчёт
+            job, created = enqueue_import(
+                ImportJob.Kind.CONTACTS,
+                dedup_key=f'contacts:{import_type}',
+                user=request.user,
+                uploaded_file=form.cleaned_data['excel_file'],
+                params={'type': import_type, 'dry_run': form.cleaned_data.get('dry_run', False)},
+            )
+            if not created:
+                messages.warning(request, f'Импорт этого типа уже выполняется (задача #{job.pk}).')
+            return redirect_to_job('contact_management:import', job)
         else:
             print("Form errors:", form.errors)
             messages.error(request, "Не валидная форма")
     else:
         form = ContactImportFromExcel()
 
-    return render(request,"contact_management/import_form.html", {'form': form})
+    return render(request,"contact_management/import_form.html", {'form': form, 'report': report, 'import_job': import_job})
 
 def api_guide(request):
     from django.contrib.auth.models import User
@@ -358,6 +240,26 @@ class OrganizationFilter(django_filters.FilterSet):
                 q_objects |= Q(prof_activity__name__icontains=val)
             return queryset.filter(q_objects).distinct()
 
+def organization_queryset():
+    """Организации со всеми связями, которые читает OrganizationSerializer"""
+    return Organization.objects.select_related(
+        'type', 'region__federalDistrict'
+    ).prefetch_related(
+        Prefetch('prof_activity', queryset=ProfActivity.objects.only('id', 'name')),
+        Prefetch('projects', queryset=Projects.objects.only('id', 'name')),
+    )
+
+class OptionalPageNumberPagination(PageNumberPagination):
+    """Постраничная выдача по ?page= / ?page_size=, без параметров — весь список, как раньше"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
 class OrganizationViewSet(viewsets.ModelViewSet):
     """Viewset организаций, только чтение списка с учетом фильтров"""
     authentication_classes = [TokenAuthentication]
@@ -366,6 +268,10 @@ class OrganizationViewSet(viewsets.ModelViewSet):
     queryset = Organization.objects.all()
     serializer_class = OrganizationSerializer
     filter_backends = [DjangoFilterBackend]
+    pagination_class = OptionalPageNumberPagination
+
+    def get_queryset(self):
+        return organization_queryset().order_by('id')
 
     @action(detail=False, methods=["post"], url_path="add")
     def add_organization(self, request):
@@ -553,6 +459,10 @@ class ContactViewSet(viewsets.ModelViewSet):
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
     filter_backends = [DjangoFilterBackend]
+    pagination_class = OptionalPageNumberPagination
+
+    def get_queryset(self):
+        return Contact.objects.select_related('organization').order_by('id')
 
     @action(detail=False, methods=["post"], url_path="add")
     def add_contact(self, request):
@@ -633,21 +543,29 @@ class GetAllViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=["get"], url_path="region")
     def regions(self, request):
-        regions = Region.objects.all()
-        serializer = RegionNameSerializer(regions, many=True)
-        return Response(serializer.data)
+        data = ReferenceDataCache.get_or_build(
+            'regions',
+            lambda: RegionNameSerializer(Region.objects.all(), many=True).data
+        )
+        return Response(data)
 
     @action(detail=False, methods=["get"], url_path="organization_type")
     def organization_types(self, request):
-        org_types = OrganizationType.objects.all()
-        serializer = OrganizationTypeSerializer(org_types, many=True)
-        return Response(serializer.data)
+        data = ReferenceDataCache.get_or_build(
+            'organization_types',
+            lambda: OrganizationTypeSerializer(OrganizationType.objects.all(), many=True).data
+        )
+        return Response(data)
     
     @action(detail=False, methods=["get"], url_path="fed_district")
     def federal_districts(self, request):
-        districts = FederalDistrict.objects.all()
-        serializer = FederalDistrictWithRegionsSerializer(districts, many=True)
-        return Response(serializer.data)
+        data = ReferenceDataCache.get_or_build(
+            'fed_districts',
+            lambda: FederalDistrictWithRegionsSerializer(
+                FederalDistrict.objects.prefetch_related('region'), many=True
+            ).data
+        )
+        return Response(data)
 
 class SingleOrganizationSerializer(serializers.ModelSerializer):
     """Сериалайзер для получения списка организаций"""
@@ -695,7 +613,7 @@ class GetViewSet(viewsets.ViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            org = Organization.objects.get(inn=inn)
+            org = organization_queryset().get(inn=inn)
             serializer = SingleOrganizationSerializer(org)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Organization.DoesNotExist:
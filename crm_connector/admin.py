@@ -1,13 +1,63 @@
 from django.contrib import admin
-from .models import Pipeline, Stage, Deal, Company, Lead, Contact, AtlasApplication, STAGE_TYPE_CHOICES, AtlasStatus, RRStatus, StageRule, AtlasProgram
+from .models import Pipeline, Stage, Deal, Company, Lead, Contact, AtlasApplication, STAGE_TYPE_CHOICES, AtlasStatus, RRStatus, StageRule, AtlasProgram, ImportJob
 from django import forms
 from django.contrib import messages
 from django.utils.html import format_html
 from django.urls import reverse
-from django.db.models import Count, Sum, Q
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, Sum, Q, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.utils.functional import cached_property
 from simple_history.admin import SimpleHistoryAdmin
 
+
+# Ниже этого числа строк точный COUNT(*) достаточно быстрый
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц (сделки, заявки Атласа): для списка без
+    фильтров и поиска берёт оценку числа строк из статистики PostgreSQL
+    (pg_class.reltuples) вместо COUNT(*). С фильтрами, на небольших таблицах
+    и на других СУБД считает точно.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                        [queryset.model._meta.db_table]
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                    return row[0]
+        return super().count
+
+
+def related_count(queryset, field):
+    """Подзапрос с числом связанных строк (queryset.filter(field=внешний pk)) для annotate"""
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class StageListFilter(admin.RelatedFieldListFilter):
+    """Фильтр по этапу: название этапа включает воронку, загружаем их одним запросом"""
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        stages = Stage.objects.select_related('pipeline').order_by(*ordering)
+        return [(stage.pk, str(stage)) for stage in stages]
+
+
 class StageInline(admin.TabularInline):
     model = Stage
     extra = 0
@@ -20,15 +70,23 @@ class PipelineAdmin(SimpleHistoryAdmin):
     list_filter = ('is_active', 'is_main')
     inlines = [StageInline]
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            stage_total=related_count(Stage.objects.all(), 'pipeline'),
+            deal_total=related_count(Deal.objects.all(), 'pipeline'),
+        )
+    
     def stage_count(self, obj):
         """Количество этапов в воронке"""
-        return obj.stages.count()
+        return obj.stage_total
     stage_count.short_description = 'Этапов'
+    stage_count.admin_order_field = 'stage_total'
     
     def deal_count(self, obj):
         """Количество сделок в воронке"""
-        return obj.deals.count()
+        return obj.deal_total
     deal_count.short_description = 'Сделок'
+    deal_count.admin_order_field = 'deal_total'
     
     def last_sync_display(self, obj):
         """Отображение времени последней синхронизации"""
@@ -45,6 +103,10 @@ class StageAdmin(SimpleHistoryAdmin):
     ordering = ('pipeline', 'sort')
     actions = ['set_process_type', 'set_success_type', 'set_failure_type']
     readonly_fields = ('color_display',)
+    list_select_related = ('pipeline',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(deal_total=related_count(Deal.objects.all(), 'stage'))
     
     def colored_type(self, obj):
         """Отображает тип стадии с цветом"""
@@ -62,8 +124,9 @@ class StageAdmin(SimpleHistoryAdmin):
     
     def deal_count(self, obj):
         """Количество сделок на этапе"""
-        return obj.deals.count()
+        return obj.deal_total
     deal_count.short_description = 'Сделок'
+    deal_count.admin_order_field = 'deal_total'
     
     def color_display(self, obj):
         """Отображает цвет этапа в виде цветного квадрата"""
@@ -95,8 +158,11 @@ class StageAdmin(SimpleHistoryAdmin):
 class DealAdmin(SimpleHistoryAdmin):
     list_display = ['title', 'bitrix_id', 'pipeline', 'stage', 'amount', 'is_closed', 'created_at', 'last_sync', 'view_history_link']
     list_display = ['title', 'bitrix_id', 'pipeline', 'stage', 'amount', 'company', 'region', 'created_at', 'last_sync', 'view_history_link']
-    list_filter = ('pipeline', 'stage', 'is_closed', 'created_at')
+    list_filter = ('pipeline', ('stage', StageListFilter), 'is_closed', 'created_at')
     search_fields = ('title', 'bitrix_id')
+    list_select_related = ('pipeline', 'stage__pipeline', 'company')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ('bitrix_id', 'created_at', 'closed_at', 'last_sync', 'details_pretty', 'view_history_link')
     fieldsets = (
         ('Основная информация', {
@@ -156,6 +222,9 @@ class AtlasApplicationAdmin(SimpleHistoryAdmin):
     list_display = ['application_id', 'full_name', 'phone', 'email', 'region', 'deal_link', 'is_synced', 'last_sync', 'history_link']
     list_filter = ['is_synced', 'region', 'created_at', 'last_sync']
     search_fields = ['application_id', 'full_name', 'phone', 'email']
+    list_select_related = ['deal']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ['created_at', 'updated_at', 'last_sync', 'raw_data_formatted', 'history_link', 'JSON_ed_progress', 'generated_application_link', 'signed_application_link']
     
     fieldsets = (
@@ -254,9 +323,10 @@ class RRStatusAdmin(admin.ModelAdmin):
 @admin.register(StageRule)
 class StageRuleAdmin(admin.ModelAdmin):
     list_display = ['__str__', 'pipeline', 'target_stage', 'priority', 'is_active']
-    list_filter = ['pipeline', 'is_active', 'target_stage']
+    list_filter = ['pipeline', 'is_active', ('target_stage', StageListFilter)]
     search_fields = ['description', 'atlas_status__name', 'rr_status__name']
     ordering = ['priority', 'id']
+    list_select_related = ['pipeline', 'target_stage__pipeline', 'atlas_status', 'rr_status']
     
     fieldsets = (
         ('Основные настройки', {
@@ -282,4 +352,11 @@ class StageRuleAdmin(admin.ModelAdmin):
                     kwargs["queryset"] = Stage.objects.filter(pipeline=rule.pipeline)
                 except StageRule.DoesNotExist:
                     pass
-        return super().formfield_for_foreignkey(db_field, request, **kwargs) 
\ No newline at end of file
+        return super().formfield_for_foreignkey(db_field, request, **kwargs) 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'file_name', 'processed_rows', 'total_rows', 'error_count', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    search_fields = ['file_name', 'dedup_key', 'message']
+    list_select_related = ['created_by']
+    readonly_fields = [field.name for field in ImportJob._meta.fields]
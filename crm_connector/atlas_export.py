@@ -0,0 +1,168 @@
+"""
+Потоковое чтение выгрузки платформы Атлас.
+
+Строки первого листа читаются по одной (python-calamine, если установлен,
+иначе openpyxl в режиме read_only) и превращаются в словари заявок только
+по мере обработки. Значения приводятся к типам колонок из atlas_field_mapping.json:
+для строковых колонок числа из Excel становятся строками без «.0»
+(СНИЛС, телефон, номер заявления), пустые ячейки — None.
+"""
+import re
+from datetime import date, datetime
+
+import openpyxl
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+STRING_TYPES = {'string', 'select', 'composite', 'phone', 'email'}
+DATE_TYPES = {'date', 'datetime'}
+
+
+def column_types(field_mapping):
+    """Типы колонок выгрузки: из описаний полей и раздела column_types"""
+    types = {}
+    for column, mapping in (field_mapping or {}).get('field_mapping', {}).items():
+        if not isinstance(mapping, dict) or 'type' not in mapping:
+            continue
+        if mapping['type'] == 'composite':
+            for source_field in mapping.get('source_fields', []):
+                types.setdefault(source_field, 'string')
+        else:
+            types.setdefault(mapping.get('source_field', column), mapping['type'])
+    types.update((field_mapping or {}).get('column_types', {}))
+    return types
+
+
+def coerce_value(value, column_type=None):
+    """Приводит значение ячейки к типу колонки"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.strip()
+    if column_type in STRING_TYPES:
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+    if column_type in DATE_TYPES and isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def parse_application_number(raw):
+    """Порядковый номер из «Номера заявления на РР» (цифры после последнего дефиса)"""
+    if not raw:
+        return 0
+    match = re.search(r"-(\d+)$", str(raw).strip())
+    return int(match.group(1)) if match else 0
+
+
+def normalize_snils_key(raw):
+    return str(raw or '').replace(' ', '').strip()
+
+
+class AtlasExportReader:
+    """Ленивый источник заявок из файла выгрузки"""
+
+    def __init__(self, path, field_mapping=None):
+        self.path = path
+        self.types = column_types(field_mapping)
+        self.total_rows = None
+        self.actual_count = None
+
+    @property
+    def filtered_count(self):
+        """Сколько заявок отброшено как неактуальные (после actual_applications)"""
+        if self.total_rows is None:
+            return 0
+        return self.total_rows - self.actual_count
+
+    def _rows(self):
+        """Кортежи значений строк листа, включая заголовок"""
+        if CalamineWorkbook is not None:
+            workbook = CalamineWorkbook.from_path(self.path)
+            yield from workbook.get_sheet_by_index(0).iter_rows()
+            return
+
+        if str(self.path).lower().endswith('.xls'):
+            # Старый формат openpyxl не читает
+            import pandas as pd
+            df = pd.read_excel(self.path, dtype=object)
+            yield tuple(df.columns)
+            for row in df.itertuples(index=False, name=None):
+                yield tuple(None if pd.isna(value) else value for value in row)
+            return
+
+        workbook = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+    def _records(self):
+        """Пары (номер строки, значения) с описанием колонок из заголовка"""
+        rows = self._rows()
+        header = next(rows, None)
+        if header is None:
+            return
+        self.columns = [
+            (index, str(name).strip())
+            for index, name in enumerate(header)
+            if name is not None and str(name).strip()
+        ]
+        self._column_index = {name: index for index, name in self.columns}
+        for position, row in enumerate(rows):
+            if all(value is None or value == '' for value in row):
+                continue
+            yield position, row
+
+    def _to_application(self, row):
+        size = len(row)
+        return {
+            name: coerce_value(row[index] if index < size else None, self.types.get(name))
+            for index, name in self.columns
+        }
+
+    def __iter__(self):
+        for _, row in self._records():
+            yield self._to_application(row)
+
+    def actual_applications(self):
+        """
+        Заявки, где для каждого СНИЛС оставлена самая свежая (с наибольшим номером
+        заявления на РР, при равенстве — последняя в файле).
+
+        Первый проход выполняется сразу и читает только СНИЛС и номер заявления,
+        чтобы выбрать актуальные строки; возвращается генератор второго прохода.
+        """
+        latest = {}
+        without_snils = 0
+        total = 0
+        for position, row in self._records():
+            total += 1
+            snils = normalize_snils_key(self._cell(row, 'СНИЛС'))
+            if not snils:
+                without_snils += 1
+                continue
+            number = parse_application_number(self._cell(row, 'Номер заявления на РР'))
+            current = latest.get(snils)
+            if current is None or number >= current[0]:
+                latest[snils] = (number, position)
+
+        self.total_rows = total
+        self.actual_count = without_snils + len(latest)
+        return self._iter_actual({position for _, position in latest.values()})
+
+    def _cell(self, row, name):
+        index = self._column_index.get(name)
+        if index is None or index >= len(row):
+            return None
+        return coerce_value(row[index], self.types.get(name))
+
+    def _iter_actual(self, keep_positions):
+        for position, row in self._records():
+            if position not in keep_positions and normalize_snils_key(self._cell(row, 'СНИЛС')):
+                continue
+            yield self._to_application(row)
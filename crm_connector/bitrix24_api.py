@@ -2,7 +2,10 @@ import requests
 from django.conf import settings
 from .models import Pipeline, Stage
 from fast_bitrix24 import Bitrix
+from fast_bitrix24.utils import http_build_query
 import logging
+import multiprocessing
+import time
 import nest_asyncio
 
 # Применяем патч для поддержки вложенных event loops
@@ -11,10 +14,60 @@ nest_asyncio.apply()
 # Добавляем определение логгера
 logger = logging.getLogger(__name__)
 
+def batch_command(method, params=None):
+    """Команда batch в виде строки «метод?параметры», которую ожидает Битрикс24"""
+    return f"{method}?{http_build_query(params or {})}"
+
+
+def batch_result(response, alias):
+    """
+    Результат команды alias из ответа Bitrix24API.call_batch.
+
+    fast_bitrix24 возвращает плоский словарь {alias: результат} (и сам бросает
+    исключение, если хотя бы одна команда завершилась ошибкой); пакет из одной
+    команды call_batch выполняет через call_method и возвращает в виде
+    {'result': {alias: {'result': результат}, 'result_error': {}}}.
+    """
+    if not isinstance(response, dict):
+        return None
+    if alias in response:
+        return response[alias]
+    inner = response.get('result')
+    value = inner.get(alias) if isinstance(inner, dict) else None
+    if isinstance(value, dict) and list(value) == ['result']:
+        value = value['result']
+    return value
+
+
+class BitrixRateLimiter:
+    """
+    Ограничитель частоты запросов к Битрикс24, общий для нескольких процессов.
+
+    fast_bitrix24 ограничивает частоту только внутри своего клиента, поэтому при
+    параллельном импорте процессы занимают очередной слот через разделяемое значение.
+    """
+
+    def __init__(self, requests_per_second=2.0):
+        self.interval = 1.0 / requests_per_second if requests_per_second and requests_per_second > 0 else 0
+        self._next_slot = multiprocessing.Value('d', 0.0)
+
+    def wait(self):
+        """Блокирует до наступления свободного слота"""
+        if not self.interval:
+            return
+        with self._next_slot.get_lock():
+            now = time.monotonic()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
 class Bitrix24API:
     """Класс для работы с API Битрикс24 через библиотеку fast_bitrix24 с настройками из .env"""
     
-    def __init__(self):
+    def __init__(self, rate_limiter=None):
+        self.rate_limiter = rate_limiter
         self.domain = settings.BITRIX24_SETTINGS['DOMAIN']
         self.webhook_code = settings.BITRIX24_SETTINGS['CLIENT_SECRET']
         
@@ -43,6 +96,9 @@ class Bitrix24API:
             except Exception:
                 logger.info("❌ Ошибка при отладке полей")
 
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+
         try:
             # Для методов list используем get_all
             if method.endswith('.list') or method.endswith('.getlist') or method.endswith('.fields'):
@@ -72,10 +128,11 @@ class Bitrix24API:
                 'cmd_name': ['crm.deal.add', {'fields': {...}}],
                 ...
             }
+        Команды-списки перед отправкой превращаются в строки batch_command.
 
         По умолчанию *halt* = False, чтобы при ошибке выполнения одной
         команды остальные продолжали исполняться (аналогично &halt=0 в REST).
-        Возвращает словарь ответа сервера без изменений.
+        Возвращает ответ без изменений; результаты команд читаются batch_result.
         """
         try:
             cmd_count = len(commands)
@@ -107,9 +164,14 @@ class Bitrix24API:
             # ------------------------------------------------------------------
             payload = {
                 'halt': 0 if not halt else 1,
-                'cmd': commands,
+                'cmd': {
+                    alias: batch_command(*cmd) if isinstance(cmd, (list, tuple)) else cmd
+                    for alias, cmd in commands.items()
+                },
             }
 
+            if self.rate_limiter:
+                self.rate_limiter.wait()
             result = self.bitrix.call_batch(payload)
 
             # Распечатываем ошибки, если они есть
@@ -247,67 +309,19 @@ class Bitrix24API:
             print(f"❌ Ошибка при получении этапов для воронки {pipeline_id}: {str(e)}")
             return []
     
-    def sync_pipelines_and_stages(self):
-        """Синхронизирует воронки и их этапы с Битрикс24"""
+    def sync_pipelines_and_stages(self, force=False):
+        """Синхронизирует воронки и их этапы с Битрикс24 (см. pipeline_sync)"""
         try:
-            from django.utils import timezone
-            from .models import Pipeline, Stage
-            
-            # Получаем данные из Битрикс24
-            bitrix_data = self.get_pipelines()
-            
-            if not bitrix_data:
-                print("❌ Не удалось получить данные о воронках из Битрикс24")
-                return {
-                    'success': False,
-                    'pipelines_count': 0,
-                    'stages_count': 0,
-                }
+            from .pipeline_sync import PipelineSync
             
-            # Текущее время для отметки синхронизации
-            current_time = timezone.now()
-            
-            # Счетчики для статистики
-            pipelines_count = 0
-            stages_count = 0
-            
-            # Синхронизируем воронки
-            for pipeline_id, pipeline_data in bitrix_data.items():
-                pipeline, created = Pipeline.objects.update_or_create(
-                    bitrix_id=pipeline_id,
-                    defaults={
-                        'name': pipeline_data['name'],
-                        'sort': pipeline_data['sort'],
-                        'is_active': pipeline_data['is_active'],
-                        'is_main': pipeline_data['is_main'],
-                        'last_sync': current_time
-                    }
-                )
-                
-                pipelines_count += 1
-                
-                # Синхронизируем этапы воронки
-                for stage_data in pipeline_data['stages']:
-                    stage, created = Stage.objects.update_or_create(
-                        bitrix_id=stage_data['id'],
-                        defaults={
-                            'pipeline': pipeline,
-                            'name': stage_data['name'],
-                            'sort': stage_data['sort'],
-                            # Не обновляем тип стадии при синхронизации
-                            # Он должен настраиваться пользователем в админке
-                        }
-                    )
-                    
-                    stages_count += 1
-            
-            print(f"✅ Успешно синхронизировано {pipelines_count} воронок и {stages_count} этапов")
+            result = PipelineSync(self).run(force=force)
             
-            return {
-                'success': True,
-                'pipelines_count': pipelines_count,
-                'stages_count': stages_count,
-            }
+            if result['skipped']:
+                print("✅ Воронки и этапы не изменились с прошлой синхронизации")
+            else:
+                print(f"✅ Успешно синхронизировано {result['pipelines_count']} воронок и {result['stages_count']} этапов")
+            
+            return result
             
         except Exception as e:
             print(f"❌ Ошибка при синхронизации воронок: {str(e)}")
@@ -0,0 +1,153 @@
+"""
+Удаление сделок в Битрикс24 и в локальной базе.
+
+Пакеты по 50 команд crm.deal.delete отправляются параллельно из нескольких
+потоков с общим ограничителем частоты запросов. Если пакет отклонён, его
+сделки удаляются по одной, так что «не найдена» и настоящие ошибки разбираются
+для каждой сделки. Повторно отправляются только команды, завершившиеся
+ошибкой. Сделки, удалённые в Битрикс24 (или уже отсутствующие там), удаляются
+из базы пачкой вместе со связанными заявками Атласа, история удаления пишется
+одним bulk_create.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import router, transaction
+
+from .bitrix24_api import Bitrix24API, BitrixRateLimiter, batch_result
+from .history import bulk_history_delete
+from .models import AtlasApplication, Deal, DealIdentity
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50  # Максимальный размер batch для Битрикс24
+
+
+def is_not_found_error(message):
+    message = str(message).lower()
+    return 'not found' in message or 'не найден' in message
+
+
+def delete_deals_locally(deal_ids, change_reason=''):
+    """Удаляет сделки и их заявки Атласа несколькими запросами на всю пачку, возвращает число сделок"""
+    deal_ids = list(deal_ids)
+    if not deal_ids:
+        return 0
+
+    with transaction.atomic():
+        applications = list(AtlasApplication.objects.filter(deal_id__in=deal_ids))
+        deals = list(Deal.objects.filter(id__in=deal_ids))
+
+        bulk_history_delete(AtlasApplication, applications, change_reason)
+        bulk_history_delete(Deal, deals, change_reason)
+
+        # История уже записана, поэтому удаляем без сборщика и сигналов post_delete
+        # (они создавали бы историческую запись на каждый объект)
+        DealIdentity.objects.filter(deal_id__in=deal_ids).delete()
+        applications_qs = AtlasApplication.objects.filter(id__in=[application.id for application in applications])
+        applications_qs._raw_delete(router.db_for_write(AtlasApplication))
+        deals_qs = Deal.objects.filter(id__in=deal_ids)
+        return deals_qs._raw_delete(router.db_for_write(Deal))
+
+
+class BatchOutcome:
+    def __init__(self):
+        self.deleted = []
+        self.missing = []
+        self.failed = []  # (сделка, описание ошибки)
+
+
+class DealDeletionPipeline:
+    """Удаляет сделки пакетами; run() возвращает словарь со статистикой"""
+
+    def __init__(self, workers=4, max_retries=3, rate_limit=2.0, retry_delay=2.0, stdout=None, change_reason=''):
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.rate_limiter = BitrixRateLimiter(rate_limit)
+        self.stdout = stdout
+        self.change_reason = change_reason
+        self._local = threading.local()
+
+    def _write(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    def _api(self):
+        """Отдельный клиент Битрикс24 на поток, общий ограничитель частоты"""
+        api = getattr(self._local, 'api', None)
+        if api is None:
+            api = Bitrix24API(rate_limiter=self.rate_limiter)
+            self._local.api = api
+        return api
+
+    def run(self, deals):
+        stats = {'deleted': 0, 'missing': 0, 'failed': [], 'batches': 0, 'retries': 0}
+        pending = list(deals)
+        last_errors = []
+        attempt = 0
+
+        while pending:
+            if attempt:
+                if attempt > self.max_retries:
+                    break
+                stats['retries'] += 1
+                self._write(f"Повторная попытка {attempt}/{self.max_retries} для {len(pending)} сделок")
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+            batches = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+            stats['batches'] += len(batches)
+            failed = []
+
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(batches))) as pool:
+                futures = [pool.submit(self._send_batch, batch) for batch in batches]
+                # Запросы к БД выполняются только в основном потоке, по мере готовности пакетов
+                for future in as_completed(futures):
+                    outcome = future.result()
+                    removed_ids = [deal.id for deal in outcome.deleted + outcome.missing]
+                    stats['deleted'] += delete_deals_locally(removed_ids, self.change_reason)
+                    stats['missing'] += len(outcome.missing)
+                    failed.extend(outcome.failed)
+
+            pending = [deal for deal, _ in failed]
+            last_errors = failed
+            attempt += 1
+
+        if pending:
+            for deal, error in last_errors:
+                logger.error(f"Ошибка при удалении сделки {deal.bitrix_id} из Битрикс24: {error}")
+                self._write(f"Не удалось удалить сделку {deal.bitrix_id}: {error}")
+            stats['failed'] = [deal.bitrix_id for deal in pending]
+        return stats
+
+    def _send_batch(self, batch):
+        """Отправляет пакет удалений (выполняется в потоке пула)"""
+        outcome = BatchOutcome()
+        commands = {f"delete_{deal.bitrix_id}": ['crm.deal.delete', {'id': deal.bitrix_id}] for deal in batch}
+
+        try:
+            result = self._api().call_batch(commands)
+        except Exception as e:
+            if len(batch) > 1:
+                # fast_bitrix24 отклоняет весь пакет, если хотя бы одна команда
+                # завершилась ошибкой: разбираем сделки по одной
+                for deal in batch:
+                    single = self._send_batch([deal])
+                    outcome.deleted.extend(single.deleted)
+                    outcome.missing.extend(single.missing)
+                    outcome.failed.extend(single.failed)
+            elif is_not_found_error(e):
+                # Сделка уже удалена из Битрикс24 — удаляем только локально
+                outcome.missing.extend(batch)
+            else:
+                outcome.failed.extend((deal, str(e)) for deal in batch)
+            return outcome
+
+        for deal in batch:
+            if batch_result(result, f"delete_{deal.bitrix_id}"):
+                outcome.deleted.append(deal)
+            else:
+                outcome.failed.append((deal, 'пустой ответ API'))
+        return outcome
@@ -0,0 +1,199 @@
+"""
+Поиск дублированных сделок.
+
+Каждая сделка даёт набор ключей блокировки (СНИЛС, ФИО + телефон, ФИО + email,
+ФИО + СНИЛС, телефон и email при наличии ФИО). Сделки с общим ключом
+объединяются в кластер через систему непересекающихся множеств (union-find),
+поэтому связи учитываются транзитивно: A и B совпали по телефону, B и C — по
+email, значит A, B и C — одна группа. В каждом кластере остаётся самая старая
+сделка (created_at, затем bitrix_id), остальные считаются дубликатами.
+Время работы почти линейное по числу сделок.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.exceptions import ObjectDoesNotExist
+
+from .identity import identity_from_details
+
+# Сделки без даты создания считаются самыми новыми
+_MISSING_DATE = datetime.max.replace(tzinfo=dt_timezone.utc)
+
+# Сколько ID удаляемых сделок показывать в строке отчёта по кластеру
+REPORT_IDS_LIMIT = 20
+
+
+def blocking_keys(name='', phone='', email='', snils=''):
+    """Ключи блокировки по нормализованным данным сделки"""
+    keys = []
+    # СНИЛС - самый надежный критерий (если есть)
+    if snils:
+        keys.append(('snils', snils))
+    if name:
+        if phone:
+            keys.append(('name_phone', name, phone))
+            keys.append(('phone', phone))
+        if email:
+            keys.append(('name_email', name, email))
+            keys.append(('email', email))
+        if snils:
+            keys.append(('name_snils', name, snils))
+    return keys
+
+
+class UnionFind:
+    """Непересекающиеся множества с сжатием путей и объединением по размеру"""
+
+    def __init__(self, size=0):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def add(self):
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return first
+        if self.size[first] < self.size[second]:
+            first, second = second, first
+        self.parent[second] = first
+        self.size[first] += self.size[second]
+        return first
+
+
+def survivor_sort_key(deal):
+    """Порядок выбора сохраняемой сделки: самая старая, при равенстве — меньший bitrix_id"""
+    return (deal.created_at or _MISSING_DATE, deal.bitrix_id)
+
+
+class DuplicateCluster:
+    """Группа сделок одного человека"""
+
+    def __init__(self, deals, key_kinds):
+        ordered = sorted(deals, key=survivor_sort_key)
+        self.survivor = ordered[0]
+        self.duplicates = ordered[1:]
+        self.key_kinds = sorted(key_kinds)
+
+    @property
+    def size(self):
+        return len(self.duplicates) + 1
+
+
+class DedupResult:
+    """Результат поиска: кластеры и сделки к удалению"""
+
+    def __init__(self, clusters, deals_count):
+        self.clusters = sorted(clusters, key=lambda cluster: survivor_sort_key(cluster.survivor))
+        self.deals_count = deals_count
+
+    @property
+    def to_remove(self):
+        return [deal for cluster in self.clusters for deal in cluster.duplicates]
+
+    @property
+    def duplicates_count(self):
+        return sum(len(cluster.duplicates) for cluster in self.clusters)
+
+    def size_histogram(self):
+        """Размер кластера → количество кластеров"""
+        return dict(sorted(Counter(cluster.size for cluster in self.clusters).items()))
+
+    def key_kind_counts(self):
+        """Сколько кластеров связано каждым видом ключа"""
+        counts = Counter()
+        for cluster in self.clusters:
+            counts.update(cluster.key_kinds)
+        return dict(counts.most_common())
+
+    def report_lines(self, limit=None):
+        """Текстовый отчёт для режима --dry-run"""
+        lines = [
+            f"Проверено сделок: {self.deals_count}",
+            f"Кластеров дубликатов: {len(self.clusters)}, сделок к удалению: {self.duplicates_count}",
+        ]
+        if not self.clusters:
+            return lines
+
+        histogram = ', '.join(f"{size} сделок — {count}" for size, count in self.size_histogram().items())
+        lines.append(f"Размеры кластеров: {histogram}")
+        kinds = ', '.join(f"{kind}: {count}" for kind, count in self.key_kind_counts().items())
+        lines.append(f"Ключи совпадения: {kinds}")
+
+        shown = self.clusters if limit is None else self.clusters[:limit]
+        for cluster in shown:
+            removed = ', '.join(str(deal.bitrix_id) for deal in cluster.duplicates[:REPORT_IDS_LIMIT])
+            if len(cluster.duplicates) > REPORT_IDS_LIMIT:
+                removed += f" и ещё {len(cluster.duplicates) - REPORT_IDS_LIMIT}"
+            lines.append(
+                f"  Оставляем сделку {cluster.survivor.bitrix_id} (создана: {cluster.survivor.created_at}), "
+                f"удаляем: {removed} [{', '.join(cluster.key_kinds)}]"
+            )
+        if limit is not None and len(self.clusters) > limit:
+            lines.append(f"  ... и ещё {len(self.clusters) - limit} кластеров")
+        return lines
+
+
+def deal_identity(deal):
+    """(ФИО, телефон, email, СНИЛС) из индекса DealIdentity, для неиндексированной сделки — из details"""
+    try:
+        identity = deal.identity
+        return identity.name, identity.phone, identity.email, identity.snils
+    except ObjectDoesNotExist:
+        values = identity_from_details(deal.details)
+        return values['name'], values['phone'], values['email'], values['snils']
+
+
+def find_duplicate_clusters(deals, identity=deal_identity):
+    """
+    Группирует сделки в кластеры дубликатов.
+
+    identity(deal) возвращает нормализованные (ФИО, телефон, email, СНИЛС);
+    сделки без этих данных в поиске не участвуют.
+    """
+    union_find = UnionFind()
+    items = []
+    first_by_key = {}
+    key_kinds_by_item = defaultdict(set)
+    deals_count = 0
+
+    for deal in deals:
+        deals_count += 1
+        keys = blocking_keys(*identity(deal))
+        if not keys:
+            continue
+
+        item = union_find.add()
+        items.append(deal)
+        for key in keys:
+            other = first_by_key.setdefault(key, item)
+            if other != item:
+                union_find.union(item, other)
+                key_kinds_by_item[item].add(key[0])
+                key_kinds_by_item[other].add(key[0])
+
+    members = defaultdict(list)
+    for item in range(len(items)):
+        members[union_find.find(item)].append(item)
+
+    clusters = []
+    for group in members.values():
+        if len(group) < 2:
+            continue
+        key_kinds = set()
+        for item in group:
+            key_kinds |= key_kinds_by_item[item]
+        clusters.append(DuplicateCluster([items[item] for item in group], key_kinds))
+
+    return DedupResult(clusters, deals_count)
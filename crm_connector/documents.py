@@ -0,0 +1,297 @@
+"""
+Генерация документов слушателей (заявлений) по DOCX-шаблонам.
+
+Шаблоны читаются с диска один раз на процесс и дальше берутся из памяти,
+поэтому заявления можно генерировать сразу для целого потока.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from docxtpl import DocxTemplate
+
+from .models import AtlasApplication, REGION_CHOICES
+
+logger = logging.getLogger(__name__)
+
+MONTHS = {
+    1: "января", 2: "февраля", 3: "марта", 4: "апреля", 5: "мая", 6: "июня",
+    7: "июля", 8: "августа", 9: "сентября", 10: "октября", 11: "ноября", 12: "декабря"
+}
+
+STATEMENT_TEMPLATES = ("PO", "DPO")
+
+
+def get_template_path(template):
+    """Путь к файлу шаблона template_<name>.docx"""
+    return os.path.join(settings.DOCX_TEMPLATE_PATH, f"template_{template}.docx")
+
+
+@lru_cache(maxsize=16)
+def _read_template(path, mtime):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def get_template_bytes(template):
+    """
+    Содержимое шаблона из кеша процесса.
+    Ключ кеша включает время изменения файла, так что обновлённый шаблон подхватится без перезапуска.
+    """
+    path = get_template_path(template)
+    return _read_template(path, os.path.getmtime(path))
+
+
+def render_document(template, context):
+    """Рендерит шаблон в память и возвращает содержимое DOCX"""
+    doc = DocxTemplate(io.BytesIO(get_template_bytes(template)))
+    doc.render(context)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def build_address(data):
+    """Собирает адрес из полей формы (населённый пункт, улица, дом, корпус, квартира)"""
+    address_parts = []
+    if data.get("settlement"):
+        address_parts.append(data["settlement"])
+    if data.get("street"):
+        address_parts.append(data["street"])
+    if data.get("house"):
+        address_parts.append(f"д. {data['house']}")
+    if data.get("building"):
+        address_parts.append(f"корп. {data['building']}")
+    if data.get("apartment"):
+        address_parts.append(f"кв. {data['apartment']}")
+    return ", ".join(address_parts)
+
+
+def get_region_name(code):
+    """Название региона по коду из REGION_CHOICES"""
+    for region_code, region_name in REGION_CHOICES:
+        if code and code in region_code:
+            return region_name
+    return code
+
+
+def get_address_data(listener):
+    """Адресные данные, ранее сохранённые из формы генерации заявления"""
+    return {
+        "snils": str(listener.raw_data.get("СНИЛС", "")) if listener.raw_data else "",
+        "postal_code": listener.form_postal_code,
+        "region": listener.form_region,
+        "settlement": listener.form_settlement,
+        "street": listener.form_street,
+        "house": listener.form_house,
+        "building": listener.form_building,
+        "apartment": listener.form_apartment,
+    }
+
+
+def get_statement_template(program, program_types=None):
+    """
+    Шаблон заявления по программе: DPO для программ повышения квалификации, иначе PO.
+    program_types — заранее загруженный словарь {название программы: тип}, чтобы не делать запрос на каждого слушателя.
+    """
+    if not program:
+        return "PO"
+    if program_types is None:
+        from education_planner.models import EducationProgram
+        program_types = dict(
+            EducationProgram.objects.filter(name=program).values_list('name', 'program_type')[:1]
+        )
+    return "DPO" if program_types.get(program) == "ADV" else "PO"
+
+
+def build_statement_context(listener, data, today=None):
+    """Контекст шаблона заявления по данным слушателя и адресу из формы"""
+    today = today or datetime.today()
+    context = dict(data)
+    context["region"] = get_region_name(context.get("region"))
+    context["fio"] = listener.full_name
+    context["passport_series_number"] = str(listener.raw_data["Серия паспорта"]) + " " + str(listener.raw_data["Номер паспорта"])
+    context["passport_issuer"] = listener.raw_data["Кем выдан паспорт"]
+    context["phone"] = listener.phone
+    context["email"] = listener.email
+    context["today_date"] = today.strftime("%d")
+    context["today_month"] = MONTHS[today.month]
+    context["address"] = build_address(data)
+    return context
+
+
+def get_statement_filename(listener):
+    return f"{listener.full_name}_заявление_на_отправку.docx"
+
+
+def save_generated_application(listener, content, filename):
+    """Записывает заявление в хранилище, заменяя ранее сгенерированный файл"""
+    if listener.generated_application:
+        try:
+            listener.generated_application.delete(save=False)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить старое заявление {listener.application_id}: {e}")
+    listener.generated_application.save(filename, ContentFile(content), save=False)
+    AtlasApplication.objects.filter(pk=listener.pk).update(
+        generated_application=listener.generated_application.name
+    )
+
+
+def select_stream_listeners(program=None, period=None, potok=None, application_ids=None):
+    """
+    Слушатели потока для пакетной генерации.
+    Фильтры совпадают со страницей списка заявок: программа и период в формате "дд.мм.гггг - дд.мм.гггг".
+    """
+    applications = AtlasApplication.objects.exclude(
+        raw_data__contains={'Статус заявки в РР': 'Услуга прекращена'}
+    )
+    if program:
+        applications = applications.filter(raw_data__contains={'Программа обучения': program})
+    if period:
+        dates = period.split(' - ')
+        if len(dates) != 2:
+            raise ValueError(f"Неверный формат периода: {period}")
+        start_date, end_date = dates
+        applications = applications.filter(
+            Q(raw_data__contains={'Начало периода обучения': start_date}) &
+            Q(raw_data__contains={'Окончание периода обучения': end_date})
+        )
+    if potok:
+        applications = applications.filter(potok=potok)
+    if application_ids:
+        applications = applications.filter(application_id__in=application_ids)
+    return applications.order_by('id')
+
+
+def _warm_templates(templates):
+    """Инициализатор процесса-воркера: читает шаблоны один раз до начала рендеринга"""
+    for template in templates:
+        try:
+            get_template_bytes(template)
+        except OSError as e:
+            logger.error(f"Не удалось загрузить шаблон {template}: {e}")
+
+
+def _render_job(job):
+    """Рендеринг одного документа в воркере. Возвращает (ключ, содержимое, ошибка)"""
+    key, template, context = job
+    try:
+        return key, render_document(template, context), None
+    except Exception as e:
+        return key, None, str(e)
+
+
+class BatchStatementGenerator:
+    """
+    Пакетная генерация заявлений для потока слушателей.
+
+    Контексты собираются в основном процессе (там же работа с БД), рендеринг идёт
+    в пуле процессов, готовые документы сразу пишутся в generated_application
+    и/или в ZIP-архив.
+    """
+
+    def __init__(self, workers=None, chunk_size=20, log=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.log = log or logger.info
+        self.stats = {
+            'total': 0,
+            'generated': 0,
+            'skipped': 0,
+            'errors': 0,
+            'elapsed': 0.0,
+            'docs_per_second': 0.0,
+            'error_details': [],
+        }
+
+    def prepare_jobs(self, listeners):
+        """Собирает задания на рендеринг; слушатели без адреса или паспортных данных пропускаются"""
+        from education_planner.models import EducationProgram
+
+        program_types = dict(EducationProgram.objects.values_list('name', 'program_type'))
+        today = datetime.today()
+        jobs = []
+        by_key = {}
+
+        for listener in listeners:
+            self.stats['total'] += 1
+            if not listener.raw_data or not listener.form_settlement:
+                self.stats['skipped'] += 1
+                continue
+            try:
+                template = get_statement_template(listener.raw_data.get('Программа обучения', ''), program_types)
+                context = build_statement_context(listener, get_address_data(listener), today)
+            except KeyError as e:
+                self.stats['skipped'] += 1
+                self.stats['error_details'].append(f"{listener.application_id}: нет поля {e}")
+                continue
+            jobs.append((listener.pk, template, context))
+            by_key[listener.pk] = listener
+
+        return jobs, by_key
+
+    def _render_all(self, jobs):
+        # В демонизированных процессах (воркеры Celery prefork) дочерние процессы создавать нельзя
+        if self.workers <= 1 or multiprocessing.current_process().daemon or len(jobs) < 2:
+            _warm_templates(STATEMENT_TEMPLATES)
+            for job in jobs:
+                yield _render_job(job)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_warm_templates,
+            initargs=(STATEMENT_TEMPLATES,),
+        ) as executor:
+            yield from executor.map(_render_job, jobs, chunksize=self.chunk_size)
+
+    def run(self, listeners, save=True, zip_file=None):
+        """
+        Генерирует заявления для переданных слушателей.
+        save — записывать в AtlasApplication.generated_application,
+        zip_file — путь или файловый объект, куда потоково пишется архив.
+        """
+        started = time.monotonic()
+        jobs, by_key = self.prepare_jobs(listeners)
+        self.log(f"Подготовлено заданий: {len(jobs)}, пропущено: {self.stats['skipped']}")
+
+        archive = zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) if zip_file else None
+        try:
+            for key, content, error in self._render_all(jobs):
+                listener = by_key[key]
+                if error:
+                    self.stats['errors'] += 1
+                    self.stats['error_details'].append(f"{listener.application_id}: {error}")
+                    continue
+
+                filename = get_statement_filename(listener)
+                try:
+                    if save:
+                        save_generated_application(listener, content, filename)
+                    if archive:
+                        archive.writestr(f"{listener.application_id}_{filename}", content)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    self.stats['error_details'].append(f"{listener.application_id}: {e}")
+                    continue
+
+                self.stats['generated'] += 1
+                if self.stats['generated'] % 100 == 0:
+                    self.log(f"Сгенерировано {self.stats['generated']} из {len(jobs)}")
+        finally:
+            if archive:
+                archive.close()
+
+        elapsed = time.monotonic() - started
+        self.stats['elapsed'] = round(elapsed, 2)
+        self.stats['docs_per_second'] = round(self.stats['generated'] / elapsed, 2) if elapsed else 0.0
+        return self.stats
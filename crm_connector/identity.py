@@ -0,0 +1,152 @@
+"""
+Нормализация данных человека для сопоставления заявок и поиска дубликатов.
+
+Одни и те же правила используются при импорте из Атласа, поиске дубликатов
+и в индексе DealIdentity, поэтому значения из разных источников сравнимы.
+"""
+import re
+
+from django.db.models import Q
+
+# Пользовательские поля сделки в Битрикс24
+SNILS_FIELD = 'UF_CRM_1750933149374'
+REGION_FIELD = 'UF_CRM_665E00ABE228D'
+
+PHONE_FIELDS = ['PHONE', 'UF_CRM_PHONE']
+EMAIL_FIELDS = ['EMAIL', 'UF_CRM_EMAIL']
+SNILS_FIELDS = [SNILS_FIELD, 'UF_CRM_SNILS', 'SNILS', 'UF_SNILS']
+
+# Исправления распространённых расхождений в написании русских ФИО
+NAME_CORRECTIONS = {
+    # Варианты написания букв Ё/Е
+    'Ё': 'Е', 'ё': 'е',
+
+    # Варианты окончаний отчеств
+    'Ичь': 'Ич', 'ичь': 'ич',
+    'Ьевич': 'Евич', 'ьевич': 'евич',
+    'Ьевна': 'Евна', 'ьевна': 'евна',
+
+    # Исправление удвоенных букв
+    'Лл': 'Л', 'лл': 'л',
+    'Нн': 'Н', 'нн': 'н',
+    'Мм': 'М', 'мм': 'м',
+}
+
+
+def normalize_name(name):
+    """ФИО в едином виде: «Иванов Иван Иванович», без точек в инициалах"""
+    if not name:
+        return ''
+
+    # Убираем лишние пробелы и приводим к единому регистру
+    name = ' '.join(str(name).strip().split()).title()
+
+    for old, new in NAME_CORRECTIONS.items():
+        name = name.replace(old, new)
+
+    # Убираем точки в сокращениях (И. -> И)
+    name = re.sub(r'\b([А-ЯЁ])\.', r'\1', name)
+
+    # Стандартизируем дефисы в двойных фамилиях и именах
+    name = re.sub(r'\s*[-–—]\s*', '-', name)
+
+    return re.sub(r'\s+', ' ', name).strip()
+
+
+def normalize_phone(phone):
+    """Телефон из 11 цифр, начинающийся с 7"""
+    if not phone:
+        return ''
+    phone = re.sub(r'[^\d]', '', str(phone))
+    if len(phone) == 11 and phone.startswith('8'):
+        phone = '7' + phone[1:]
+    elif len(phone) == 10:
+        phone = '7' + phone
+    return phone
+
+
+def normalize_email(email):
+    if not email:
+        return ''
+    return str(email).lower().strip()
+
+
+def normalize_snils(snils):
+    """11 цифр СНИЛС или пустая строка"""
+    if not snils:
+        return ''
+    digits = re.sub(r'[^\d]', '', str(snils))
+    return digits if len(digits) == 11 else ''
+
+
+def raw_data_snils_q(snils):
+    """
+    Условие поиска заявки Атласа по СНИЛС в raw_data. AtlasExportReader
+    сохраняет СНИЛС строкой, заявки из прежних импортов — числом; ищем оба вида.
+    """
+    number = int(snils)
+    values = {str(number), f'{number:011d}', number}
+    condition = Q()
+    for value in values:
+        condition |= Q(raw_data__СНИЛС=value)
+    return condition
+
+
+def _multifield_value(value):
+    """Первое значение мультиполя Битрикс24 ([{'VALUE': ...}]) или само значение"""
+    if isinstance(value, list):
+        for item in value:
+            item_value = item.get('VALUE') if isinstance(item, dict) else item
+            if item_value:
+                return item_value
+        return ''
+    return value or ''
+
+
+def _first_field(details, fields):
+    for field in fields:
+        value = _multifield_value(details.get(field))
+        if value:
+            return value
+    return ''
+
+
+def extract_name(details):
+    if not details:
+        return ''
+    return details.get('NAME', '') or details.get('TITLE', '')
+
+
+def extract_phone(details):
+    if not details:
+        return ''
+    return str(_first_field(details, PHONE_FIELDS))
+
+
+def extract_email(details):
+    if not details:
+        return ''
+    return str(_first_field(details, EMAIL_FIELDS))
+
+
+def extract_snils(details):
+    if not details:
+        return ''
+    return str(_first_field(details, SNILS_FIELDS))
+
+
+def extract_region(details):
+    if not details:
+        return ''
+    return str(details.get(REGION_FIELD) or '').strip().lower()
+
+
+def identity_from_details(details):
+    """Нормализованные поля сделки для DealIdentity"""
+    return {
+        'name': normalize_name(extract_name(details)),
+        'phone': normalize_phone(extract_phone(details)),
+        'email': normalize_email(extract_email(details)),
+        'snils': normalize_snils(extract_snils(details)),
+        'region': extract_region(details),
+    }
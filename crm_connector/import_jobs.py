@@ -0,0 +1,232 @@
+"""
+Фоновые задачи импорта Excel.
+
+Представление сохраняет загруженный файл в ImportJob и ставит задачу в Celery
+(если брокер недоступен — выполняет её сразу, как и синхронизация воронок).
+Обработчик импорта получает задачу и JobProgress, по ходу работы обновляет
+счётчики, страница опрашивает import_job_status и показывает прогресс.
+Пока по ключу сущности есть активная задача, повторный запуск возвращает её же.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+# Обработчики импорта: тип задачи → функция handler(job, progress), возвращающая словарь результата
+IMPORT_HANDLERS = {
+    ImportJob.Kind.DEALS: 'crm_connector.views.run_deals_import',
+    ImportJob.Kind.NOT_ATLAS: 'crm_connector.views.run_not_atlas_import',
+    ImportJob.Kind.ATLAS: 'crm_connector.views.run_atlas_import',
+    ImportJob.Kind.ATTESTATION: 'crm_connector.views.run_attestation_import',
+    ImportJob.Kind.QUOTAS: 'education_planner.views.run_quota_import',
+    ImportJob.Kind.SUPPLEMENT: 'education_planner.views.run_supplement_import',
+    ImportJob.Kind.CONTACTS: 'contact_management.views.run_contact_import',
+}
+
+# Задача без обновлений прогресса дольше этого времени считается зависшей (воркер упал)
+STALE_AFTER = getattr(settings, 'IMPORT_JOB_STALE_AFTER', 30 * 60)
+
+MAX_STORED_ERRORS = 200
+
+
+class JobProgress:
+    """Счётчики выполняемой задачи; в БД пишутся не чаще раза в SAVE_INTERVAL секунд"""
+
+    SAVE_INTERVAL = 1.0
+
+    def __init__(self, job):
+        self.job = job
+        self.total = job.total_rows
+        self.processed = job.processed_rows
+        self.created = job.created_count
+        self.updated = job.updated_count
+        self.error_count = job.error_count
+        self.errors = list(job.errors or [])
+        self._saved_at = 0.0
+
+    def set_total(self, total):
+        self.total = total
+        self.save(force=True)
+
+    def advance(self, step=1, created=0, updated=0):
+        self.processed += step
+        self.created += created
+        self.updated += updated
+        self.save()
+
+    def set(self, processed, total=None):
+        """Абсолютное значение прогресса (для обработчиков, которые считают сами)"""
+        self.processed = processed
+        if total is not None:
+            self.total = total
+        self.save()
+
+    def error(self, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_STORED_ERRORS:
+            self.errors.append(str(message))
+        self.save()
+
+    def save(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._saved_at < self.SAVE_INTERVAL:
+            return
+        self._saved_at = now
+        ImportJob.objects.filter(pk=self.job.pk).update(
+            total_rows=self.total,
+            processed_rows=self.processed,
+            created_count=self.created,
+            updated_count=self.updated,
+            error_count=self.error_count,
+            errors=self.errors,
+            heartbeat_at=timezone.now(),
+        )
+
+
+def _expire_stale(dedup_key):
+    """Помечает ошибкой активные задачи по ключу, которые давно не обновлялись"""
+    threshold = timezone.now() - timedelta(seconds=STALE_AFTER)
+    stale = ImportJob.objects.filter(dedup_key=dedup_key, status__in=ImportJob.ACTIVE_STATUSES).exclude(
+        heartbeat_at__gte=threshold
+    ).filter(created_at__lt=threshold)
+    stale.update(
+        status=ImportJob.Status.FAILED,
+        message='Задача прервана: нет обновлений прогресса',
+        finished_at=timezone.now(),
+    )
+
+
+def enqueue_import(kind, dedup_key, user=None, uploaded_file=None, params=None, file_name=''):
+    """
+    Создаёт и запускает задачу импорта. Возвращает (задача, создана ли новая):
+    если по dedup_key уже идёт импорт, новая задача не создаётся.
+    """
+    _expire_stale(dedup_key)
+
+    try:
+        with transaction.atomic():
+            job = ImportJob.objects.create(
+                kind=kind,
+                dedup_key=dedup_key,
+                created_by=user if user and user.is_authenticated else None,
+                params=params or {},
+                file_name=file_name or getattr(uploaded_file, 'name', '') or '',
+            )
+    except IntegrityError:
+        active = ImportJob.objects.filter(dedup_key=dedup_key, status__in=ImportJob.ACTIVE_STATUSES).first()
+        if active:
+            return active, False
+        raise
+
+    if uploaded_file is not None:
+        job.file.save(job.file_name or 'import.xlsx', uploaded_file, save=False)
+        job.save(update_fields=['file'])
+
+    start_job(job)
+    job.refresh_from_db()
+    return job, True
+
+
+def start_job(job):
+    """Ставит задачу в очередь Celery, при недоступности брокера выполняет сразу"""
+    from .tasks import run_import_job
+
+    try:
+        async_result = run_import_job.delay(job.pk)
+        ImportJob.objects.filter(pk=job.pk).update(celery_task_id=async_result.id or '')
+    except Exception as celery_error:
+        logger.warning(f"Ошибка Celery: {celery_error}. Выполняем импорт #{job.pk} синхронно.")
+        execute_job(job.pk)
+
+
+def execute_job(job_id):
+    """Выполняет задачу импорта (вызывается из Celery или напрямую)"""
+    claimed = ImportJob.objects.filter(pk=job_id, status=ImportJob.Status.PENDING).update(
+        status=ImportJob.Status.RUNNING,
+        started_at=timezone.now(),
+        heartbeat_at=timezone.now(),
+    )
+    if not claimed:
+        # Задача уже выполняется или завершена (повторная доставка сообщения)
+        return None
+
+    job = ImportJob.objects.get(pk=job_id)
+    progress = JobProgress(job)
+    handler = import_string(IMPORT_HANDLERS[job.kind])
+
+    try:
+        result = handler(job, progress) or {}
+        # Обработчик может сообщить об ошибке без исключения (например, не хватает колонок)
+        status = ImportJob.Status.FAILED if result.get('success') is False else ImportJob.Status.SUCCESS
+        message = result.get('message', '')
+    except Exception as e:
+        logger.exception(f"Ошибка импорта #{job.pk} ({job.kind})")
+        result = {}
+        status = ImportJob.Status.FAILED
+        message = f'Ошибка при импорте: {str(e)}'
+
+    progress.save(force=True)
+    ImportJob.objects.filter(pk=job.pk).update(
+        status=status,
+        message=message,
+        result=result,
+        finished_at=timezone.now(),
+    )
+
+    if job.file:
+        job.file.delete(save=False)
+        ImportJob.objects.filter(pk=job.pk).update(file=None)
+
+    logger.info(
+        f"Импорт #{job.pk} ({job.kind}) завершён со статусом {status}: "
+        f"{progress.processed} строк, ошибок {progress.error_count}"
+    )
+    return status
+
+
+def job_status_payload(job):
+    """Состояние задачи для опроса со страницы"""
+    return {
+        'job_id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'is_active': job.is_active,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'progress': job.progress_percent,
+        'created_count': job.created_count,
+        'updated_count': job.updated_count,
+        'error_count': job.error_count,
+        'errors': job.errors[:10],
+        'message': job.message,
+        'result': job.result if not job.is_active else None,
+        'duration': job.duration,
+        'status_url': reverse('crm_connector:import_job_status', args=[job.pk]),
+    }
+
+
+def get_requested_job(request):
+    """Задача из параметра ?import_job= (только свои задачи, кроме персонала)"""
+    job_id = request.GET.get('import_job')
+    if not job_id or not str(job_id).isdigit():
+        return None
+    jobs = ImportJob.objects.all()
+    if not request.user.is_staff:
+        jobs = jobs.filter(created_by=request.user)
+    return jobs.filter(pk=job_id).first()
+
+
+def redirect_to_job(url_name, job):
+    """Редирект на страницу импорта с блоком прогресса задачи"""
+    return redirect(f"{reverse(url_name)}?import_job={job.pk}")
@@ -0,0 +1,107 @@
+import random
+import time
+from io import StringIO
+
+from django.core.management.base import BaseCommand, OutputWrapper
+from django.utils import timezone
+
+from crm_connector.management.commands.import_atlas_applications import Command as ImportAtlasCommand
+from crm_connector.models import Deal, DealIdentity, Pipeline
+
+BENCHMARK_PIPELINE_ID = 'benchmark-atlas-import'
+
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов', 'Михайлов', 'Новиков']
+FIRST_NAMES = ['Иван', 'Пётр', 'Сергей', 'Алексей', 'Дмитрий', 'Андрей', 'Михаил', 'Николай']
+MIDDLE_NAMES = ['Иванович', 'Петрович', 'Сергеевич', 'Алексеевич', 'Дмитриевич', 'Андреевич']
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер пропускной способности обработки заявок Атласа на синтетической выгрузке '
+        '(режим --dry-run: сопоставление со сделками без запросов к Битрикс24)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Количество заявок в синтетической выгрузке')
+        parser.add_argument('--deals', type=int, default=2000, help='Количество сделок в тестовой воронке')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='Варианты количества процессов')
+        parser.add_argument('--chunk-size', type=int, default=50, help='Количество заявок в одной транзакции')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        pipeline, deals = self.create_deals(options['deals'], rng)
+        try:
+            applications = self.generate_applications(options['rows'], deals, rng)
+            self.stdout.write(f"Синтетическая выгрузка: {len(applications)} заявок, {len(deals)} сделок в воронке")
+
+            for workers in options['workers']:
+                command = ImportAtlasCommand()
+                command.stdout = OutputWrapper(StringIO())
+                command.load_field_mapping()
+                command.pipeline = pipeline
+                command.workers = workers
+                command.chunk_size = options['chunk_size']
+
+                started = time.perf_counter()
+                command.process_applications([dict(app) for app in applications], dry_run=True)
+                elapsed = time.perf_counter() - started
+
+                self.stdout.write(
+                    f"workers={workers}: {elapsed:.2f} с, {len(applications) / elapsed:.1f} заявок/с "
+                    f"(совпадений {command.stats['matched_applications']}, новых {command.stats['new_applications']}, "
+                    f"ошибок {command.stats['errors']})"
+                )
+        finally:
+            Deal.objects.filter(pipeline=pipeline).delete()
+            pipeline.delete()
+
+    def create_deals(self, count, rng):
+        """Тестовая воронка со сделками (удаляется после замера)"""
+        Pipeline.objects.filter(bitrix_id=BENCHMARK_PIPELINE_ID).delete()
+        pipeline = Pipeline.objects.create(bitrix_id=BENCHMARK_PIPELINE_ID, name='Замер импорта Атласа', is_active=False)
+        now = timezone.now()
+
+        deals = []
+        for index in range(count):
+            name = f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(MIDDLE_NAMES)}"
+            phone = f"79{index:09d}"
+            deals.append(Deal(
+                bitrix_id=-(index + 1),
+                title=name,
+                pipeline=pipeline,
+                created_at=now,
+                details={
+                    'NAME': name,
+                    'PHONE': [{'VALUE': phone}],
+                    'EMAIL': [{'VALUE': f"deal{index}@example.com"}],
+                },
+            ))
+        Deal.objects.bulk_create(deals, batch_size=500)
+        DealIdentity.rebuild(Deal.objects.filter(pipeline=pipeline))
+        return pipeline, deals
+
+    def generate_applications(self, count, deals, rng):
+        """Заявки: половина совпадает со сделками по телефону, часть — повторы одного СНИЛС"""
+        applications = []
+        for index in range(count):
+            if deals and index % 2 == 0:
+                deal = rng.choice(deals)
+                last_name, first_name, middle_name = deal.details['NAME'].split()
+                phone = deal.details['PHONE'][0]['VALUE']
+            else:
+                last_name, first_name, middle_name = rng.choice(LAST_NAMES), rng.choice(FIRST_NAMES), rng.choice(MIDDLE_NAMES)
+                phone = f"78{index:09d}"
+            snils_number = index if index % 10 else max(index - 1, 0)
+            applications.append({
+                'ID заявки из РР': f"bench-{index}",
+                'Номер заявления на РР': f"BENCH-{index:04d}",
+                'Фамилия': last_name,
+                'Имя': first_name,
+                'Отчество': middle_name,
+                'Контактная информация (телефон)': phone,
+                'Email': f"app{index}@example.com",
+                'Регион': 'Самарская область',
+                'СНИЛС': f"{snils_number:011d}",
+            })
+        return applications
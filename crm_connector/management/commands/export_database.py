@@ -4,17 +4,20 @@ Django management команда для выгрузки базы данных 
 """
 
 import os
+import io
+import gzip
 import json
 import csv
+import time
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from io import StringIO
 from pathlib import Path
 
 from django.core.management.base import BaseCommand, CommandError
-from django.core.serializers import serialize
+from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
-from django.db import connection
+from django.db import connection, connections
 from django.apps import apps
 
 
@@ -60,8 +63,33 @@ class Command(BaseCommand):
         
         parser.add_argument(
             '--compress',
-            action='store_true',
-            help='Сжать выходные файлы в gzip'
+            nargs='?',
+            const='gzip',
+            choices=['gzip', 'zstd'],
+            default=None,
+            help='Сжать выходные файлы: gzip (по умолчанию) или zstd (нужен пакет zstandard)'
+        )
+        
+        parser.add_argument(
+            '--json-format',
+            type=str,
+            choices=['json', 'jsonl'],
+            default='json',
+            help='json — массив в формате фикстур Django (для loaddata), jsonl — JSON Lines'
+        )
+        
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Количество записей, читаемых из БД за один раз'
+        )
+        
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Количество процессов для параллельного экспорта моделей'
         )
 
     def handle(self, *args, **options):
@@ -73,6 +101,12 @@ class Command(BaseCommand):
         filename_prefix = options['filename_prefix']
         export_format = options['format']
         
+        if options['compress'] == 'zstd':
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                raise CommandError('Для сжатия zstd установите пакет zstandard')
+        
         self.stdout.write(
             self.style.SUCCESS(f'Начинаем экспорт базы данных в формате: {export_format}')
         )
@@ -156,20 +190,15 @@ class Command(BaseCommand):
                 'pg_dump не найден. Убедитесь, что PostgreSQL клиент установлен и доступен в PATH'
             )
 
-    def _export_json(self, output_dir, filename_prefix, options):
-        """Экспорт в формате JSON"""
-        
-        filename = f'{filename_prefix}.json'
-        output_path = output_dir / filename
+    def _get_models_to_export(self, options):
+        """Метки моделей для экспорта, включая промежуточные таблицы ManyToMany"""
         
-        # Получаем модели для экспорта
         models_to_export = []
         
-        # Добавляем модели из указанных приложений
         for app_name in options['apps']:
             try:
                 app = apps.get_app_config(app_name)
-                models_to_export.extend(app.get_models())
+                models_to_export.extend(app.get_models(include_auto_created=True))
             except LookupError:
                 self.stderr.write(f'Приложение {app_name} не найдено')
                 continue
@@ -178,132 +207,95 @@ class Command(BaseCommand):
         if options['include_auth']:
             try:
                 auth_app = apps.get_app_config('auth')
-                models_to_export.extend(auth_app.get_models())
+                models_to_export.extend(auth_app.get_models(include_auto_created=True))
             except LookupError:
                 pass
         
-        self.stdout.write(f'Экспортируем {len(models_to_export)} моделей в JSON: {output_path}')
-        
-        export_data = []
-        
-        for model in models_to_export:
-            try:
-                # Получаем все объекты модели
-                queryset = model.objects.all()
-                count = queryset.count()
-                
-                if count > 0:
-                    # Сериализуем данные
-                    model_data = serialize('json', queryset)
-                    model_objects = json.loads(model_data)
-                    
-                    export_data.extend(model_objects)
-                    
-                    self.stdout.write(f'  {model._meta.label}: {count} записей')
-                
-            except Exception as e:
-                self.stderr.write(f'Ошибка при экспорте модели {model._meta.label}: {str(e)}')
-                continue
-        
-        # Сохраняем JSON файл
-        try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, ensure_ascii=False, indent=2)
-            
-            self.stdout.write(
-                self.style.SUCCESS(f'JSON экспорт создан: {output_path}')
-            )
-            
-            # Выводим статистику
-            file_size = output_path.stat().st_size / (1024 * 1024)  # в MB
-            self.stdout.write(f'Размер файла: {file_size:.2f} MB')
-            self.stdout.write(f'Всего объектов: {len(export_data)}')
-            
-        except Exception as e:
-            raise CommandError(f'Ошибка при записи JSON файла: {str(e)}')
+        return [model._meta.label for model in models_to_export]
 
-    def _export_csv(self, output_dir, filename_prefix, options):
-        """Экспорт в формате CSV (отдельные файлы для каждой модели)"""
-        
-        csv_dir = output_dir / f'{filename_prefix}_csv'
-        csv_dir.mkdir(exist_ok=True)
-        
-        # Получаем модели для экспорта
-        models_to_export = []
-        
-        for app_name in options['apps']:
-            try:
-                app = apps.get_app_config(app_name)
-                models_to_export.extend(app.get_models())
-            except LookupError:
-                self.stderr.write(f'Приложение {app_name} не найдено')
-                continue
-        
-        if options['include_auth']:
-            try:
-                auth_app = apps.get_app_config('auth')
-                models_to_export.extend(auth_app.get_models())
-            except LookupError:
-                pass
+    def _export_models(self, export_format, target_dir, options):
+        """
+        Потоковый экспорт моделей: каждая модель пишется в отдельный файл
+        порциями по chunk_size записей, при workers > 1 — параллельно в пуле процессов
+        """
+        
+        labels = self._get_models_to_export(options)
+        compress = options['compress']
+        chunk_size = options['chunk_size']
+        workers = max(1, options['workers'])
+        
+        jobs = [
+            (label, export_format, str(target_dir), compress, chunk_size)
+            for label in labels
+        ]
         
-        self.stdout.write(f'Экспортируем {len(models_to_export)} моделей в CSV: {csv_dir}')
+        self.stdout.write(
+            f'Экспортируем {len(labels)} моделей в {export_format.upper()}: {target_dir} '
+            f'(процессов: {workers}, порция: {chunk_size})'
+        )
         
-        total_files = 0
+        started = time.monotonic()
         total_records = 0
+        total_files = 0
         
-        for model in models_to_export:
-            try:
-                queryset = model.objects.all()
-                count = queryset.count()
-                
-                if count == 0:
+        if workers == 1:
+            results = (export_model(*job) for job in jobs)
+        else:
+            # Дочерние процессы не должны наследовать открытое соединение с БД
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+            futures = [executor.submit(export_model, *job) for job in jobs]
+            results = (future.result() for future in as_completed(futures))
+        
+        try:
+            for done, result in enumerate(results, start=1):
+                if result['error']:
+                    self.stderr.write(f'Ошибка при экспорте модели {result["label"]}: {result["error"]}')
                     continue
                 
-                # Имя файла для модели
-                model_name = f'{model._meta.app_label}_{model._meta.model_name}'
-                csv_filename = f'{model_name}.csv'
-                csv_path = csv_dir / csv_filename
-                
-                # Получаем поля модели
-                fields = [field.name for field in model._meta.fields]
-                
-                # Записываем CSV файл
-                with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile)
-                    
-                    # Записываем заголовки
-                    writer.writerow(fields)
-                    
-                    # Записываем данные
-                    for obj in queryset:
-                        row = []
-                        for field_name in fields:
-                            try:
-                                value = getattr(obj, field_name)
-                                # Обрабатываем специальные типы данных
-                                if value is None:
-                                    row.append('')
-                                elif isinstance(value, datetime):
-                                    row.append(value.isoformat())
-                                else:
-                                    row.append(str(value))
-                            except Exception:
-                                row.append('')
-                        writer.writerow(row)
+                if result['count'] == 0:
+                    continue
                 
-                self.stdout.write(f'  {model_name}: {count} записей → {csv_filename}')
+                total_records += result['count']
                 total_files += 1
-                total_records += count
-                
-            except Exception as e:
-                self.stderr.write(f'Ошибка при экспорте модели {model._meta.label}: {str(e)}')
-                continue
+                rate = result['count'] / result['elapsed'] if result['elapsed'] else 0
+                self.stdout.write(
+                    f'  [{done}/{len(jobs)}] {result["label"]}: {result["count"]} записей '
+                    f'→ {Path(result["path"]).name} ({rate:.0f} зап/с)'
+                )
+        finally:
+            if workers > 1:
+                executor.shutdown()
+        
+        elapsed = time.monotonic() - started
+        total_size = sum(f.stat().st_size for f in Path(target_dir).iterdir() if f.is_file()) / (1024 * 1024)
         
         self.stdout.write(
-            self.style.SUCCESS(f'CSV экспорт создан: {csv_dir}')
+            self.style.SUCCESS(f'{export_format.upper()} экспорт создан: {target_dir}')
         )
         self.stdout.write(f'Создано файлов: {total_files}')
         self.stdout.write(f'Всего записей: {total_records}')
+        self.stdout.write(f'Размер: {total_size:.2f} MB')
+        self.stdout.write(
+            f'Время: {elapsed:.1f} с, скорость: {total_records / elapsed if elapsed else 0:.0f} зап/с'
+        )
+
+    def _export_json(self, output_dir, filename_prefix, options):
+        """Экспорт в формате JSON (фикстуры Django) или JSON Lines, отдельный файл на модель"""
+        
+        export_format = options['json_format']
+        json_dir = output_dir / f'{filename_prefix}_{export_format}'
+        json_dir.mkdir(exist_ok=True)
+        
+        self._export_models(export_format, json_dir, options)
+
+    def _export_csv(self, output_dir, filename_prefix, options):
+        """Экспорт в формате CSV (отдельные файлы для каждой модели)"""
+        
+        csv_dir = output_dir / f'{filename_prefix}_csv'
+        csv_dir.mkdir(exist_ok=True)
+        
+        self._export_models('csv', csv_dir, options)
 
     def _get_database_info(self):
         """Получает информацию о базе данных"""
@@ -325,3 +317,100 @@ class Command(BaseCommand):
             'table_stats': table_stats
         }
 
+
+
+def _init_worker():
+    """Инициализация процесса-воркера: Django и собственное соединение с БД"""
+    import django
+    
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+
+def _open_output(path, compress):
+    """Открывает файл на запись в текстовом режиме с опциональным сжатием gzip/zstd"""
+    
+    if compress == 'gzip':
+        path = f'{path}.gz'
+        return gzip.open(path, 'wt', encoding='utf-8', newline=''), path
+    
+    if compress == 'zstd':
+        import zstandard
+        
+        path = f'{path}.zst'
+        writer = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+        return io.TextIOWrapper(writer, encoding='utf-8', newline=''), path
+    
+    return open(path, 'w', encoding='utf-8', newline=''), path
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, cls=DjangoJSONEncoder)
+    return str(value)
+
+
+def export_model(label, export_format, target_dir, compress=None, chunk_size=2000):
+    """
+    Потоково выгружает одну модель в файл.
+    Строки читаются через values_list(...).iterator(chunk_size), поэтому память не растёт с размером таблицы.
+    Формат json совместим с loaddata (поток массива в формате фикстур), jsonl — по объекту на строку.
+    """
+    
+    started = time.monotonic()
+    result = {'label': label, 'count': 0, 'path': None, 'elapsed': 0.0, 'error': None}
+    
+    try:
+        model = apps.get_model(label)
+        fields = model._meta.concrete_fields
+        pk_attname = model._meta.pk.attname
+        attnames = [field.attname for field in fields]
+        
+        queryset = model._base_manager.order_by('pk').values_list(*attnames)
+        if not queryset.exists():
+            return result
+        
+        extension = {'json': 'json', 'jsonl': 'jsonl', 'csv': 'csv'}[export_format]
+        base_path = os.path.join(target_dir, f'{model._meta.app_label}_{model._meta.model_name}.{extension}')
+        output, result['path'] = _open_output(base_path, compress)
+        
+        model_label = model._meta.label_lower
+        pk_index = attnames.index(pk_attname)
+        # В фикстурах внешние ключи записываются по имени поля, а не по attname (pipeline, а не pipeline_id)
+        field_names = [(index, field.name) for index, field in enumerate(fields) if field.attname != pk_attname]
+        
+        with output:
+            if export_format == 'csv':
+                writer = csv.writer(output)
+                writer.writerow(attnames)
+                for row in queryset.iterator(chunk_size=chunk_size):
+                    writer.writerow([_csv_value(value) for value in row])
+                    result['count'] += 1
+            else:
+                if export_format == 'json':
+                    output.write('[\n')
+                for row in queryset.iterator(chunk_size=chunk_size):
+                    record = json.dumps({
+                        'model': model_label,
+                        'pk': row[pk_index],
+                        'fields': {name: row[index] for index, name in field_names},
+                    }, ensure_ascii=False, cls=DjangoJSONEncoder)
+                    
+                    if export_format == 'json':
+                        output.write(record if result['count'] == 0 else ',\n' + record)
+                    else:
+                        output.write(record + '\n')
+                    result['count'] += 1
+                if export_format == 'json':
+                    output.write('\n]\n')
+    
+    except Exception as e:
+        result['error'] = str(e)
+    
+    result['elapsed'] = time.monotonic() - started
+    return result
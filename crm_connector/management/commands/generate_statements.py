@@ -0,0 +1,56 @@
+"""
+Пакетная генерация заявлений для потока слушателей
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from crm_connector.documents import BatchStatementGenerator, select_stream_listeners
+
+
+class Command(BaseCommand):
+    help = 'Генерирует заявления для всех слушателей потока (программа, период или поток)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--program', type=str, help='Программа обучения (как в выгрузке Атласа)')
+        parser.add_argument('--period', type=str, help='Период обучения в формате "дд.мм.гггг - дд.мм.гггг"')
+        parser.add_argument('--potok', type=str, help='Поток')
+        parser.add_argument('--ids', type=str, nargs='*', help='Номера заявок (application_id)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Количество процессов для рендеринга (по умолчанию по числу ядер)')
+        parser.add_argument('--zip', type=str, dest='zip_path', help='Сохранить документы в ZIP-архив по указанному пути')
+        parser.add_argument('--no-save', action='store_true',
+                            help='Не записывать документы в заявки (только архив)')
+
+    def handle(self, *args, **options):
+        if options['no_save'] and not options['zip_path']:
+            raise CommandError('С опцией --no-save нужно указать --zip, иначе документы никуда не сохранятся')
+
+        if not any([options['program'], options['period'], options['potok'], options['ids']]):
+            raise CommandError('Укажите хотя бы один фильтр: --program, --period, --potok или --ids')
+
+        try:
+            listeners = select_stream_listeners(
+                program=options['program'],
+                period=options['period'],
+                potok=options['potok'],
+                application_ids=options['ids'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        generator = BatchStatementGenerator(workers=options['workers'], log=self.stdout.write)
+        self.stdout.write(f'Генерация заявлений, процессов: {generator.workers}')
+
+        stats = generator.run(listeners, save=not options['no_save'], zip_file=options['zip_path'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Сгенерировано: {stats['generated']} из {stats['total']} "
+            f"за {stats['elapsed']} с ({stats['docs_per_second']} док/с)"
+        ))
+        if stats['skipped']:
+            self.stdout.write(self.style.WARNING(f"Пропущено (нет адреса или паспортных данных): {stats['skipped']}"))
+        if stats['errors']:
+            self.stdout.write(self.style.ERROR(f"Ошибок: {stats['errors']}"))
+        for detail in stats['error_details'][:20]:
+            self.stdout.write(f"  - {detail}")
+        if options['zip_path']:
+            self.stdout.write(f"Архив: {options['zip_path']}")
@@ -1,15 +1,25 @@
 import os
 import json
+import hashlib
+from io import StringIO
+from itertools import islice
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
 import pandas as pd
 from datetime import datetime
-from django.core.management.base import BaseCommand
-from django.db import transaction, models
+import django
+from django.core.management.base import BaseCommand, OutputWrapper
+from django.db import connections, transaction, models
 from django.utils import timezone
-from crm_connector.models import Deal, Pipeline, Stage, AtlasApplication, StageRule
-from crm_connector.bitrix24_api import Bitrix24API
+from crm_connector import identity as identity_rules
+from crm_connector.models import Deal, DealIdentity, Pipeline, Stage, AtlasApplication, StageRule
+from crm_connector.atlas_export import AtlasExportReader, parse_application_number
+from crm_connector.deal_deletion import DealDeletionPipeline
+from crm_connector.dedup import find_duplicate_clusters
+from crm_connector.history import SyncHistoryRecorder
+from crm_connector.bitrix24_api import Bitrix24API, BitrixRateLimiter
 from education_planner.cache_utils import AtlasDataCache
 import logging
-import re
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +32,16 @@ class Command(BaseCommand):
         self.api = None
         self.field_mapping = None
         self.pipeline = None
+        # Вызывается как progress_callback(обработано, всего) при запуске из фоновой задачи импорта
+        self.progress_callback = None
+        # Параллельная обработка заявок (--workers) и размер пачки для транзакций
+        self.workers = 1
+        self.chunk_size = 50
+        self.rate_limit = 2.0
+        self.delete_workers = 4
+        self.verbosity = 1
+        # История изменений сделок и заявок пишется пачками, с ID запуска импорта
+        self.history = SyncHistoryRecorder()
         # Кэш для порядковых номеров статусов
         self._status_order_cache = {"atlas": {}, "rr": {}}
         self.stats = {
@@ -62,11 +82,40 @@ class Command(BaseCommand):
             action='store_true',
             help='Не удалять дублированные сделки'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Количество процессов для обработки заявок (не использовать внутри воркера Celery)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=50,
+            help='Количество заявок в одной транзакции'
+        )
+        parser.add_argument(
+            '--rate-limit',
+            type=float,
+            default=2.0,
+            help='Общий для всех процессов лимит запросов к Битрикс24 в секунду'
+        )
+        parser.add_argument(
+            '--delete-workers',
+            type=int,
+            default=4,
+            help='Количество параллельных пакетов удаления дубликатов в Битрикс24'
+        )
     
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Начинаем импорт заявок из Атласа...'))
         
         # Инициализация
+        self.workers = max(1, options['workers'])
+        self.chunk_size = max(1, options['chunk_size'])
+        self.rate_limit = options['rate_limit']
+        self.delete_workers = options['delete_workers']
+        self.verbosity = options['verbosity']
         self.api = Bitrix24API()
         self.load_field_mapping()
         
@@ -117,16 +166,18 @@ class Command(BaseCommand):
             self.stdout.write("Синхронизируем воронки...")
             # Синхронизируем воронки
             pipelines_data = self.api.get_all('crm.category.list', {'entityTypeId': 2})
-            for p_data in pipelines_data:
-                Pipeline.objects.update_or_create(
-                    bitrix_id=p_data['ID'],
-                    defaults={
-                        'name': p_data['NAME'],
-                        'sort': int(p_data.get('SORT', 0)),
-                        'is_main': p_data.get('IS_DEFAULT', 'N') == 'Y',
-                        'last_sync': timezone.now()
-                    }
-                )
+            with SyncHistoryRecorder(self.history.run_id) as history:
+                for p_data in pipelines_data:
+                    history.update_or_create(
+                        Pipeline,
+                        bitrix_id=p_data['ID'],
+                        defaults={
+                            'name': p_data['NAME'],
+                            'sort': int(p_data.get('SORT', 0)),
+                            'is_main': p_data.get('IS_DEFAULT', 'N') == 'Y',
+                            'last_sync': timezone.now()
+                        }
+                    )
             
             # Пробуем снова найти воронку
             self.pipeline = Pipeline.objects.get(name=pipeline_name)
@@ -141,27 +192,29 @@ class Command(BaseCommand):
         existing_deal_ids = set()
         
         with transaction.atomic():
-            for deal_data in deals_data:
-                existing_deal_ids.add(int(deal_data['ID']))
+            with SyncHistoryRecorder(self.history.run_id) as history:
+                for deal_data in deals_data:
+                    existing_deal_ids.add(int(deal_data['ID']))
                 
-                # Обновляем или создаем сделку
-                deal, created = Deal.objects.update_or_create(
-                    bitrix_id=deal_data['ID'],
-                    defaults={
-                        'title': deal_data.get('TITLE', ''),
-                        'pipeline': self.pipeline,
-                        'stage': self._get_or_create_stage(deal_data.get('STAGE_ID')),
-                        'amount': float(deal_data.get('OPPORTUNITY', 0) or 0),
-                        'created_at': self._parse_datetime(deal_data.get('DATE_CREATE')),
-                        'closed_at': self._parse_datetime(deal_data.get('CLOSEDATE')),
-                        'is_closed': deal_data.get('CLOSED', 'N') == 'Y',
-                        'details': deal_data,
-                        'last_sync': timezone.now()
-                    }
-                )
+                    # Обновляем или создаем сделку
+                    deal, created = history.update_or_create(
+                        Deal,
+                        bitrix_id=deal_data['ID'],
+                        defaults={
+                            'title': deal_data.get('TITLE', ''),
+                            'pipeline': self.pipeline,
+                            'stage': self._get_or_create_stage(deal_data.get('STAGE_ID')),
+                            'amount': float(deal_data.get('OPPORTUNITY', 0) or 0),
+                            'created_at': self._parse_datetime(deal_data.get('DATE_CREATE')),
+                            'closed_at': self._parse_datetime(deal_data.get('CLOSEDATE')),
+                            'is_closed': deal_data.get('CLOSED', 'N') == 'Y',
+                            'details': deal_data,
+                            'last_sync': timezone.now()
+                        }
+                    )
                 
-                if not created:
-                    self.stats['updated_deals'] += 1
+                    if not created:
+                        self.stats['updated_deals'] += 1
             
             # Удаляем сделки, которых нет в Битрикс24
             if not no_delete:
@@ -192,241 +245,51 @@ class Command(BaseCommand):
             self.stdout.write("Воронка не определена, пропускаем поиск дубликатов")
             return
             
-        # Получаем все сделки из воронки
-        deals = Deal.objects.filter(pipeline=self.pipeline).order_by('created_at', 'bitrix_id')
+        # Кандидаты в дубликаты отбираются GROUP BY по индексу DealIdentity
+        DealIdentity.fill_missing(self.pipeline)
+        deals = DealIdentity.duplicate_candidates(self.pipeline).order_by('created_at', 'bitrix_id')
         
-        # Группируем сделки по ключам для поиска дубликатов
-        deal_groups = {}
+        result = find_duplicate_clusters(deals.iterator(chunk_size=2000))
         
-        for deal in deals:
-            # Безопасно работаем с деталями сделки
-            deal_details = deal.details or {}
-            
-            # Извлекаем и нормализуем данные
-            deal_name = deal_details.get('NAME', '') or deal_details.get('TITLE', '')
-            deal_phone = self.extract_phone_from_deal(deal_details)
-            deal_email = self.extract_email_from_deal(deal_details)
-            deal_snils = self.extract_snils_from_deal(deal_details)
-            
-            name_norm = self.normalize_name(deal_name)
-            phone_norm = self.normalize_phone(deal_phone)
-            email_norm = self.normalize_email(deal_email)
-            snils_norm = self.normalize_snils(deal_snils)
-            
-            # Пропускаем сделки без основных данных
-            if not name_norm and not phone_norm and not email_norm and not snils_norm:
-                continue
-                
-            # Создаем ключи для группировки
-            duplicate_keys = []
-            
-            # СНИЛС - самый надежный критерий (если есть)
-            if snils_norm:
-                duplicate_keys.append(('snils', snils_norm))
-            
-            # Ключ по ФИО + телефон
-            if name_norm and phone_norm:
-                duplicate_keys.append(('name_phone', name_norm, phone_norm))
-                
-            # Ключ по ФИО + email  
-            if name_norm and email_norm:
-                duplicate_keys.append(('name_email', name_norm, email_norm))
-                
-            # Ключ по ФИО + СНИЛС
-            if name_norm and snils_norm:
-                duplicate_keys.append(('name_snils', name_norm, snils_norm))
-                
-            # Ключ по телефону (если есть и ФИО)
-            if phone_norm and name_norm:
-                duplicate_keys.append(('phone', phone_norm))
-                
-            # Ключ по email (если есть и ФИО)
-            if email_norm and name_norm:
-                duplicate_keys.append(('email', email_norm))
-            
-            # Добавляем сделку в группы по всем подходящим ключам
-            for key in duplicate_keys:
-                if key not in deal_groups:
-                    deal_groups[key] = []
-                deal_groups[key].append(deal)
-        
-        # Находим группы с дубликатами
-        duplicates_to_remove = []
+        if not result.clusters:
+            self.stdout.write("Дублированных сделок не найдено")
+            return
         
-        for key, group_deals in deal_groups.items():
-            if len(group_deals) > 1:
-                # Сортируем по дате создания (самые старые первыми)
-                sorted_deals = sorted(group_deals, key=lambda d: (
-                    d.created_at or timezone.now(),
-                    d.bitrix_id
-                ))
-                
-                # Оставляем самую старую, остальные помечаем для удаления
-                keep_deal = sorted_deals[0]
-                remove_deals = sorted_deals[1:]
-                
-                self.stdout.write(f"Найдена группа дубликатов по ключу {key[0]}: "
-                                f"оставляем сделку {keep_deal.bitrix_id}, "
-                                f"удаляем {len(remove_deals)} дубликатов")
-                
-                for deal in remove_deals:
-                    if deal not in duplicates_to_remove:  # Избегаем повторных добавлений
-                        duplicates_to_remove.append(deal)
+        for line in result.report_lines(limit=None if dry_run else 50):
+            self.stdout.write(line)
         
         # Удаляем дубликаты
-        if duplicates_to_remove:
-            self.stdout.write(f"Найдено {len(duplicates_to_remove)} дублированных сделок для удаления")
-            
-            if not dry_run:
-                # Удаляем через batch API для эффективности
-                self._delete_deals_in_batches(duplicates_to_remove)
-                        
-                self.stdout.write(f"Удалено {self.stats['duplicate_deals_removed']} дублированных сделок")
-            else:
-                self.stdout.write("ТЕСТОВЫЙ РЕЖИМ: дубликаты не удалены")
-                for deal in duplicates_to_remove:
-                    self.stdout.write(f"  → Будет удалена сделка {deal.bitrix_id}")
+        duplicates_to_remove = result.to_remove
+        self.stdout.write(f"Найдено {len(duplicates_to_remove)} дублированных сделок для удаления")
+        
+        if not dry_run:
+            # Удаляем через batch API для эффективности
+            self._delete_deals_in_batches(duplicates_to_remove)
+            self.stdout.write(f"Удалено {self.stats['duplicate_deals_removed']} дублированных сделок")
         else:
-            self.stdout.write("Дублированных сделок не найдено")
+            self.stdout.write("ТЕСТОВЫЙ РЕЖИМ: дубликаты не удалены")
     
     def _delete_deals_in_batches(self, deals_to_delete):
-        """
-        Удаляет сделки пакетами через Битрикс24 API для повышения эффективности
-        """
-        batch_size = 50  # Максимальный размер batch для Битрикс24
-        
-        for i in range(0, len(deals_to_delete), batch_size):
-            batch = deals_to_delete[i:i + batch_size]
-            
-            # Подготавливаем команды для batch удаления
-            batch_commands = {}
-            for j, deal in enumerate(batch):
-                cmd_key = f"delete_{deal.bitrix_id}"
-                batch_commands[cmd_key] = [
-                    'crm.deal.delete',
-                    {'id': deal.bitrix_id}
-                ]
-            
-            self.stdout.write(f"Удаляем пакет сделок из Битрикс24 ({len(batch)} шт.): {[d.bitrix_id for d in batch]}")
-            
-            try:
-                # Выполняем batch удаление в Битрикс24
-                result = self.api.call_batch(batch_commands)
-                
-                # Проверяем результаты и удаляем успешные сделки из локальной базы
-                if result and 'result' in result:
-                    batch_results = result['result']
-                    errors = result['result'].get('result_error', {})
-                    
-                    for j, deal in enumerate(batch):
-                        cmd_key = f"delete_{deal.bitrix_id}"
-                        
-                        # Проверяем есть ли ошибка для этой команды
-                        if cmd_key in errors and errors[cmd_key]:
-                            error_info = errors[cmd_key]
-                            error_desc = error_info.get('error_description', '') if isinstance(error_info, dict) else str(error_info)
-                            
-                            # Если сделка не найдена - это не критичная ошибка, сделка уже удалена
-                            if 'not found' in error_desc.lower() or 'не найден' in error_desc.lower():
-                                self.stdout.write(f"⚠️ Сделка {deal.bitrix_id} уже удалена из Битрикс24")
-                                # Удаляем из локальной базы
-                                self._remove_deal_locally(deal)
-                            else:
-                                logger.error(f"Ошибка при удалении сделки {deal.bitrix_id} из Битрикс24: {error_info}")
-                                self.stdout.write(self.style.ERROR(f"Не удалось удалить сделку {deal.bitrix_id}: {error_desc}"))
-                            continue
-                        
-                        # Если нет ошибки, удаляем локально
-                        self._remove_deal_locally(deal)
-                
-                else:
-                    logger.error(f"Неожиданный ответ batch API: {result}")
-                    self.stdout.write(self.style.ERROR("Ошибка batch удаления: неожиданный ответ API"))
-                    
-                    # Пробуем удалить по одной сделке
-                    for deal in batch:
-                        self._delete_single_deal(deal)
-                        
-            except Exception as e:
-                logger.error(f"Критическая ошибка при batch удалении: {e}")
-                self.stdout.write(self.style.ERROR(f"Ошибка batch удаления: {e}"))
-                
-                # Пробуем удалить по одной сделке
-                for deal in batch:
-                    self._delete_single_deal(deal)
-    
-    def _remove_deal_locally(self, deal):
-        """
-        Удаляет сделку из локальной базы данных
-        """
-        try:
-            # Удаляем связанные AtlasApplication записи
-            AtlasApplication.objects.filter(deal=deal).delete()
-            
-            # Удаляем из локальной базы
-            deal.delete()
-            
-            self.stats['duplicate_deals_removed'] += 1
-            self.stdout.write(f"✅ Удалена дублированная сделка {deal.bitrix_id}")
-            
-        except Exception as e:
-            logger.error(f"Ошибка при удалении сделки {deal.bitrix_id} из локальной базы: {e}")
-            self.stdout.write(self.style.ERROR(f"Ошибка при локальном удалении сделки {deal.bitrix_id}: {e}"))
+        """Удаляет сделки в Битрикс24 параллельными пакетами с повтором ошибок, затем пачкой локально"""
+        result = DealDeletionPipeline(
+            workers=self.delete_workers,
+            rate_limit=self.rate_limit,
+            stdout=self.stdout,
+            change_reason='Удаление дубликата',
+        ).run(deals_to_delete)
+
+        self.stats['duplicate_deals_removed'] += result['deleted']
+        self.stats['errors'] += len(result['failed'])
+        if result['missing']:
+            self.stdout.write(f"⚠️ {result['missing']} сделок уже были удалены из Битрикс24")
     
-    def _delete_single_deal(self, deal):
+    def load_excel_data(self, excel_file):
         """
-        Удаляет одну сделку через обычный API (fallback для batch)
+        Открывает выгрузку для потокового чтения: строки читаются из файла
+        по мере обработки, типы колонок берутся из маппинга полей.
         """
-        try:
-            self.stdout.write(f"Удаляем сделку {deal.bitrix_id} по отдельности...")
-            
-            # Удаляем из Битрикс24 через обычный API
-            result = self.api.call_method('crm.deal.delete', {'id': deal.bitrix_id})
-            
-            if result:
-                self._remove_deal_locally(deal)
-            else:
-                logger.error(f"API вернул пустой результат при удалении сделки {deal.bitrix_id}")
-                self.stdout.write(self.style.ERROR(f"Не удалось удалить сделку {deal.bitrix_id}: пустой ответ API"))
-                
-        except Exception as e:
-            error_msg = str(e)
-            
-            # Если сделка не найдена - это не критичная ошибка
-            if 'not found' in error_msg.lower() or 'не найден' in error_msg.lower():
-                self.stdout.write(f"⚠️ Сделка {deal.bitrix_id} уже удалена из Битрикс24")
-                self._remove_deal_locally(deal)
-            else:
-                logger.error(f"Ошибка при удалении сделки {deal.bitrix_id}: {e}")
-                self.stdout.write(self.style.ERROR(f"Не удалось удалить сделку {deal.bitrix_id}: {e}"))
-    
-    def load_excel_data(self, excel_file):
-        """Загружает данные из Excel файла"""
         self.stdout.write(f"Загружаем данные из файла {excel_file}...")
-        
-        try:
-            df = pd.read_excel(excel_file)
-            self.stdout.write(f"Загружено {len(df)} строк")
-            
-            # Преобразуем DataFrame в список словарей
-            applications = []
-            for index, row in df.iterrows():
-                app_data = {}
-                for col in df.columns:
-                    value = row[col]
-                    # Обработка NaN значений
-                    if pd.isna(value):
-                        app_data[col] = None
-                    else:
-                        app_data[col] = str(value).strip() if isinstance(value, str) else value
-                
-                applications.append(app_data)
-            
-            return applications
-            
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Ошибка при загрузке Excel файла: {e}"))
-            raise
+        return AtlasExportReader(excel_file, self.field_mapping)
     
     def process_applications(self, applications_data, dry_run=False):
         """Обрабатывает заявки: сопоставляет, обновляет, создает новые"""
@@ -437,75 +300,187 @@ class Command(BaseCommand):
         #  с максимальным номером заявления на РР (актуальную)
         # ------------------------------------------------------------------
 
-        applications_data = self._filter_actual_applications(applications_data)
+        # Сопоставление идёт по индексу DealIdentity: добавляем в него сделки, созданные в обход сигнала
+        DealIdentity.fill_missing(self.pipeline)
 
-        for app_data in applications_data:
-            # 0. Быстрая проверка по уникальному application_id
-            application_uid = str(app_data.get('ID заявки из РР', '')).strip()
-            matched_deal = None
-            if application_uid:
-                try:
-                    atlas_rec = AtlasApplication.objects.select_related('deal').get(application_id=application_uid)
-                    matched_deal = atlas_rec.deal  # может быть None, если ранее не было сделки
-                except AtlasApplication.DoesNotExist:
-                    matched_deal = None
+        if isinstance(applications_data, AtlasExportReader):
+            reader = applications_data
+            applications_data = reader.actual_applications()
+            total = reader.actual_count
+            self.stdout.write(f"Загружено {reader.total_rows} строк")
+            if reader.filtered_count:
+                self.stdout.write(f"Отфильтровано {reader.filtered_count} неактуальных заявок (дубликаты по СНИЛС)")
+        else:
+            applications_data = self._filter_actual_applications(applications_data)
+            total = len(applications_data)
+
+        if self.workers > 1 and total > 1:
+            self.process_in_shards(list(applications_data), dry_run)
+            return
+
+        processed = 0
+
+        def on_chunk(count):
+            nonlocal processed
+            processed += count
+            if self.progress_callback:
+                self.progress_callback(processed, total)
+
+        self.process_shard(applications_data, dry_run, on_chunk)
+
+    def process_shard(self, applications, dry_run=False, on_chunk=None):
+        """
+        Обрабатывает заявки (список или генератор) по порядку. Изменения в БД фиксируются транзакцией
+        на каждые chunk_size заявок, ошибка заявки откатывает только её саму.
+        После фиксации пачки вызывается on_chunk(количество заявок в пачке).
+        """
+        applications = iter(applications)
+        while True:
+            chunk = list(islice(applications, self.chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                for app_data in chunk:
+                    self.process_application(app_data, dry_run)
+                self.history.flush()
+            if on_chunk:
+                on_chunk(len(chunk))
+
+    def process_in_shards(self, applications, dry_run=False):
+        """
+        Параллельная обработка: заявки делятся на шарды по стабильному ключу
+        (СНИЛС, телефон, email, ФИО), так что дубликаты одного человека
+        обрабатываются последовательно в одном процессе.
+        """
+        shards = [[] for _ in range(self.workers)]
+        for app_data in applications:
+            shards[self.shard_index(app_data, self.workers)].append(app_data)
+        shards = [shard for shard in shards if shard]
+
+        self.stdout.write(
+            f"Параллельная обработка {len(applications)} заявок: {len(shards)} процессов, "
+            f"не более {self.rate_limit} запросов к Битрикс24 в секунду"
+        )
+
+        rate_limiter = BitrixRateLimiter(self.rate_limit)
+        processed = multiprocessing.Value('i', 0)
+
+        # Дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+
+        with ProcessPoolExecutor(
+            max_workers=len(shards),
+            initializer=_init_shard_worker,
+            initargs=(rate_limiter, processed),
+        ) as pool:
+            futures = {
+                pool.submit(
+                    _process_shard, shard, self.pipeline.pk, self.field_mapping, dry_run, self.chunk_size, self.verbosity,
+                    self.history.run_id
+                ): len(shard)
+                for shard in shards
+            }
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=1)
+                if self.progress_callback:
+                    self.progress_callback(processed.value, len(applications))
+
+        for future, shard_size in futures.items():
             try:
-                # Извлекаем основные поля для сопоставления
-                # Составляем ФИО из отдельных полей
-                full_name = self.get_full_name(app_data)
-                phone = self.normalize_phone(app_data.get('Контактная информация (телефон)', ''))
-                email = self.normalize_email(app_data.get('Email', ''))
-                region = app_data.get('Регион', '')
-                
-                # Пропускаем пустые записи
-                if not full_name:
-                    continue
-                
-                # Если по UID ничего не нашли, дополнительно проверяем существующие записи AtlasApplication
-                if not matched_deal and (full_name or phone or email):
-                    existing_atlas_apps = AtlasApplication.objects.filter(
-                        models.Q(full_name=full_name) |
-                        models.Q(phone=phone) if phone else models.Q() |
-                        models.Q(email=email) if email else models.Q()
-                    ).select_related('deal')
-                    
-                    if existing_atlas_apps.exists():
-                        # Находим наиболее подходящую из существующих записей
-                        for atlas_app in existing_atlas_apps:
-                            if atlas_app.deal:  # Если есть связанная сделка
-                                matched_deal = atlas_app.deal
-                                self.stdout.write(f"Найдена существующая запись AtlasApplication для {full_name}: сделка {atlas_app.deal.bitrix_id}")
-                                break
-                
-                # Если по UID и по AtlasApplication ничего не нашли, ищем совпадение по правилам
-                if not matched_deal:
-                    matched_deal = self.find_matching_deal(full_name, phone, email, region)
-                
-                if matched_deal:
-                    self.stats['matched_applications'] += 1
-                    if not dry_run:
-                        # Проверяем, является ли это обновлением существующей заявки или новой заявкой
-                        should_update = self.should_update_deal(matched_deal, app_data)
-                        if should_update:
-                            self.update_existing_deal(matched_deal, app_data)
-                        else:
-                            self.stdout.write(f"⚠️  Найдена новая заявка для {full_name}, но сделка {matched_deal.bitrix_id} уже существует. "
-                                            f"Программа: {app_data.get('Направление обучения', 'Не указано')}. "
-                                            f"Рассмотрите создание отдельной сделки.")
-                            # Можно добавить логику создания новой сделки для другой программы
-                            # или записи в лог для ручной обработки
-                            self.stats['new_applications'] += 1
-                            self.create_new_deal(app_data)
-                else:
-                    self.stats['new_applications'] += 1
-                    if not dry_run:
-                        self.create_new_deal(app_data)
-                        
+                shard_stats = future.result()
             except Exception as e:
                 self.stats['errors'] += 1
-                # Логируем стек для диагностики
-                logger.exception("Ошибка при обработке заявки (application_id=%s, full_name=%s): %s", app_data.get('ID заявки из РР'), app_data.get('ФИО'), e)
-                self.stdout.write(self.style.ERROR(f"Ошибка: {e}"))
+                logger.exception("Ошибка обработки шарда из %s заявок: %s", shard_size, e)
+                self.stdout.write(self.style.ERROR(f"Ошибка обработки шарда ({shard_size} заявок): {e}"))
+                continue
+            for key, value in shard_stats.items():
+                self.stats[key] = self.stats.get(key, 0) + value
+
+    def shard_index(self, app_data, shards_count):
+        """Номер шарда заявки; не зависит от PYTHONHASHSEED и порядка строк в файле"""
+        key = (
+            self.normalize_snils(app_data.get('СНИЛС', ''))
+            or self.normalize_phone(app_data.get('Контактная информация (телефон)', ''))
+            or self.normalize_email(app_data.get('Email', ''))
+            or self.get_full_name(app_data)
+            or str(app_data.get('ID заявки из РР', ''))
+        )
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % shards_count
+
+    def process_application(self, app_data, dry_run=False):
+        """Сопоставляет одну заявку со сделками и обновляет или создаёт сделку"""
+        try:
+            with transaction.atomic():
+                self._process_application(app_data, dry_run)
+        except Exception as e:
+            self.stats['errors'] += 1
+            # Логируем стек для диагностики
+            logger.exception("Ошибка при обработке заявки (application_id=%s, full_name=%s): %s", app_data.get('ID заявки из РР'), app_data.get('ФИО'), e)
+            self.stdout.write(self.style.ERROR(f"Ошибка: {e}"))
+
+    def _process_application(self, app_data, dry_run):
+        # 0. Быстрая проверка по уникальному application_id
+        application_uid = str(app_data.get('ID заявки из РР', '')).strip()
+        matched_deal = None
+        if application_uid:
+            try:
+                atlas_rec = AtlasApplication.objects.select_related('deal').get(application_id=application_uid)
+                matched_deal = atlas_rec.deal  # может быть None, если ранее не было сделки
+            except AtlasApplication.DoesNotExist:
+                matched_deal = None
+
+        # Извлекаем основные поля для сопоставления
+        # Составляем ФИО из отдельных полей
+        full_name = self.get_full_name(app_data)
+        phone = self.normalize_phone(app_data.get('Контактная информация (телефон)', ''))
+        email = self.normalize_email(app_data.get('Email', ''))
+        region = app_data.get('Регион', '')
+
+        # Пропускаем пустые записи
+        if not full_name:
+            return
+
+        # Если по UID ничего не нашли, дополнительно проверяем существующие записи AtlasApplication
+        if not matched_deal and (full_name or phone or email):
+            existing_atlas_apps = AtlasApplication.objects.filter(
+                models.Q(full_name=full_name) |
+                models.Q(phone=phone) if phone else models.Q() |
+                models.Q(email=email) if email else models.Q()
+            ).select_related('deal')
+
+            if existing_atlas_apps.exists():
+                # Находим наиболее подходящую из существующих записей
+                for atlas_app in existing_atlas_apps:
+                    if atlas_app.deal:  # Если есть связанная сделка
+                        matched_deal = atlas_app.deal
+                        self.stdout.write(f"Найдена существующая запись AtlasApplication для {full_name}: сделка {atlas_app.deal.bitrix_id}")
+                        break
+
+        # Если по UID и по AtlasApplication ничего не нашли, ищем совпадение по правилам
+        if not matched_deal:
+            matched_deal = self.find_matching_deal(full_name, phone, email, region)
+
+        if matched_deal:
+            self.stats['matched_applications'] += 1
+            if not dry_run:
+                # Проверяем, является ли это обновлением существующей заявки или новой заявкой
+                should_update = self.should_update_deal(matched_deal, app_data)
+                if should_update:
+                    self.update_existing_deal(matched_deal, app_data)
+                else:
+                    self.stdout.write(f"⚠️  Найдена новая заявка для {full_name}, но сделка {matched_deal.bitrix_id} уже существует. "
+                                    f"Программа: {app_data.get('Направление обучения', 'Не указано')}. "
+                                    f"Рассмотрите создание отдельной сделки.")
+                    # Можно добавить логику создания новой сделки для другой программы
+                    # или записи в лог для ручной обработки
+                    self.stats['new_applications'] += 1
+                    self.create_new_deal(app_data)
+        else:
+            self.stats['new_applications'] += 1
+            if not dry_run:
+                self.create_new_deal(app_data)
     
     def find_matching_deal(self, full_name, phone, email, region):
         """
@@ -513,42 +488,35 @@ class Command(BaseCommand):
         1) Если совпадает ФИО и любое другое поле
         2) Если совпадает номер или почта
         3) При нескольких совпадениях берем с максимальным количеством совпадений
+
+        Кандидаты выбираются запросом к индексу DealIdentity по ФИО, телефону и email.
         """
-        candidates = []
-        
-        # Получаем все сделки из воронки
-        deals = Deal.objects.filter(pipeline=self.pipeline)
-        
-        # Получаем ID кастомного поля региона из маппинга (если есть)
-        region_field_id = self.field_mapping['field_mapping'].get('Регион', {}).get('bitrix_field', '')
+        lookup = models.Q()
+        if full_name:
+            lookup |= models.Q(name=full_name)
+        if phone:
+            lookup |= models.Q(phone=phone)
+        if email:
+            lookup |= models.Q(email=email)
+        if not lookup:
+            return None
 
-        for deal in deals:
+        identities = list(
+            DealIdentity.objects.filter(pipeline=self.pipeline).filter(lookup)
+            .select_related('deal').order_by('deal_id')
+        )
+        region_norm = str(region or '').strip().lower()
+
+        candidates = []
+        for identity in identities:
             match_score = 0
             matches = []
 
-            # Безопасно работаем с деталями сделки (могут быть None)
-            deal_details = deal.details or {}
-
-            # Извлекаем данные из сделки
-            deal_name = deal_details.get('NAME', '') or deal_details.get('TITLE', '')
-            deal_phone = self.extract_phone_from_deal(deal_details)
-            deal_email = self.extract_email_from_deal(deal_details)
-            # Регион может быть в кастомном поле
-            if region_field_id:
-                deal_region = deal_details.get(region_field_id, '')
-            else:
-                deal_region = ''
-            
-            # Нормализуем данные сделки
-            deal_name_norm = self.normalize_name(deal_name)
-            deal_phone_norm = self.normalize_phone(deal_phone)
-            deal_email_norm = self.normalize_email(deal_email)
-            
             # Проверяем совпадения
-            name_match = deal_name_norm and full_name and deal_name_norm == full_name
-            phone_match = deal_phone_norm and phone and deal_phone_norm == phone
-            email_match = deal_email_norm and email and deal_email_norm == email
-            region_match = deal_region and region and deal_region.lower() == region.lower()
+            name_match = bool(full_name) and identity.name == full_name
+            phone_match = bool(phone) and identity.phone == phone
+            email_match = bool(email) and identity.email == email
+            region_match = bool(region_norm) and identity.region == region_norm
 
             if name_match:
                 match_score += 2  # ФИО важнее
@@ -565,10 +533,10 @@ class Command(BaseCommand):
             
             # Правило 1: ФИО + любое другое поле
             if name_match and len(matches) > 1:
-                candidates.append((deal, match_score, matches))
+                candidates.append((identity.deal, match_score, matches))
             # Правило 2: Телефон или email
             elif phone_match or email_match:
-                candidates.append((deal, match_score, matches))
+                candidates.append((identity.deal, match_score, matches))
         
         # Если нашли кандидатов по строгим правилам – выбираем с максимальным score
         if candidates:
@@ -582,31 +550,25 @@ class Command(BaseCommand):
             return best_match[0]
 
         # Фолбэк: ищем сделки с полностью совпавшим ФИО
-        name_matches = [
-            d for d in deals
-            if self.normalize_name((d.details or {}).get('NAME', '') or (d.details or {}).get('TITLE', '')) == full_name
-        ]
+        name_matches = [identity for identity in identities if full_name and identity.name == full_name]
         
         if len(name_matches) == 1:
-            self.stdout.write(f"Фолбэк-совпадение по ФИО для {full_name}: сделка {name_matches[0].bitrix_id}")
-            return name_matches[0]
+            self.stdout.write(f"Фолбэк-совпадение по ФИО для {full_name}: сделка {name_matches[0].deal.bitrix_id}")
+            return name_matches[0].deal
         elif len(name_matches) > 1:
             # Если найдено несколько дублей, выбираем наиболее подходящую
             self.stdout.write(f"Найдено {len(name_matches)} дублей для {full_name}, выбираем наилучший")
             
             # Сортируем по приоритету: сначала с телефоном/email, затем по дате создания
-            def sort_key(deal):
-                details = deal.details or {}
-                has_phone = bool(self.extract_phone_from_deal(details))
-                has_email = bool(self.extract_email_from_deal(details))
+            def sort_key(identity):
                 # Чем больше данных, тем выше приоритет
-                data_score = (2 if has_phone else 0) + (2 if has_email else 0)
+                data_score = (2 if identity.phone else 0) + (2 if identity.email else 0)
                 # Также учитываем дату последней синхронизации (более свежие сделки предпочтительнее)
-                sync_time = deal.last_sync or deal.created_at or timezone.now()
+                sync_time = identity.deal.last_sync or identity.deal.created_at or timezone.now()
                 return (-data_score, -sync_time.timestamp())  # Сортировка по убыванию
             
             name_matches.sort(key=sort_key)
-            selected_deal = name_matches[0]
+            selected_deal = name_matches[0].deal
             
             self.stdout.write(f"Выбрана сделка {selected_deal.bitrix_id} как наиболее подходящая")
             return selected_deal
@@ -685,12 +647,13 @@ class Command(BaseCommand):
             
             if result:
                 self.stats['updated_applications'] += 1
-                # Обновляем локальную запись
+                # Обновляем локальную запись (служебное поле, без записи истории)
                 deal.last_sync = timezone.now()
-                deal.save()
+                Deal.objects.filter(pk=deal.pk).update(last_sync=deal.last_sync)
                 
                 # Создаем или обновляем запись AtlasApplication
-                AtlasApplication.objects.update_or_create(
+                self.history.update_or_create(
+                    AtlasApplication,
                     application_id=app_data.get('ID заявки из РР', f"atlas_{deal.bitrix_id}"),
                     defaults={
                         'full_name': self.get_full_name(app_data),
@@ -771,7 +734,8 @@ class Command(BaseCommand):
             )
 
             # Создаем или обновляем запись AtlasApplication
-            AtlasApplication.objects.update_or_create(
+            self.history.update_or_create(
+                AtlasApplication,
                 application_id=app_data.get('ID заявки из РР', f"atlas_new_{deal_id}"),
                 defaults={
                     'full_name': self.get_full_name(app_data),
@@ -958,111 +922,19 @@ class Command(BaseCommand):
     
     def normalize_name(self, name):
         """Нормализует ФИО для более точного сопоставления"""
-        if not name:
-            return ''
-        
-        # Убираем лишние пробелы и приводим к единому регистру
-        name = ' '.join(name.strip().split()).title()
-        
-        # Исправляем распространенные ошибки в русских именах
-        corrections = {
-            # Варианты написания букв Ё/Е
-            'Ё': 'Е', 'ё': 'е',
-            
-            # Варианты окончаний отчеств
-            'Ичь': 'Ич', 'ичь': 'ич',
-            'Ьевич': 'Евич', 'ьевич': 'евич',
-            'Ьевна': 'Евна', 'ьевна': 'евна',
-            
-            # Исправление удвоенных букв
-            'Лл': 'Л', 'лл': 'л',
-            'Нн': 'Н', 'нн': 'н',
-            'Мм': 'М', 'мм': 'м',
-        }
-        
-        for old, new in corrections.items():
-            name = name.replace(old, new)
-        
-        # Убираем точки в сокращениях (И. -> И)
-        name = re.sub(r'\b([А-ЯЁ])\.', r'\1', name)
-        
-        # Стандартизируем дефисы в двойных фамилиях и именах
-        name = re.sub(r'\s*[-–—]\s*', '-', name)
-        
-        # Убираем лишние пробелы после замен
-        name = re.sub(r'\s+', ' ', name).strip()
-        
-        return name
+        return identity_rules.normalize_name(name)
     
     def normalize_phone(self, phone):
         """Нормализует телефон"""
-        if not phone:
-            return ''
-        # Удаляем все символы кроме цифр
-        phone = re.sub(r'[^\d]', '', str(phone))
-        # Приводим к единому формату
-        if len(phone) == 11 and phone.startswith('8'):
-            phone = '7' + phone[1:]
-        elif len(phone) == 10:
-            phone = '7' + phone
-        return phone
+        return identity_rules.normalize_phone(phone)
     
     def normalize_email(self, email):
         """Нормализует email"""
-        if not email:
-            return ''
-        return str(email).lower().strip()
+        return identity_rules.normalize_email(email)
     
     def normalize_snils(self, snils):
         """Нормализует СНИЛС для сравнения"""
-        if not snils:
-            return ''
-        
-        # Оставляем только цифры
-        digits = re.sub(r'[^\d]', '', str(snils))
-        
-        # СНИЛС должен быть 11 цифр
-        if len(digits) == 11:
-            return digits
-        
-        return ''
-    
-    def extract_phone_from_deal(self, deal_details):
-        """Извлекает телефон из данных сделки"""
-        if not deal_details:
-            return ''
-        phone = deal_details.get('PHONE')
-        if phone and isinstance(phone, list) and len(phone) > 0:
-            return phone[0].get('VALUE', '')
-        return ''
-    
-    def extract_email_from_deal(self, deal_details):
-        """Извлекает email из данных сделки"""
-        if not deal_details:
-            return ''
-        email = deal_details.get('EMAIL')
-        if email and isinstance(email, list) and len(email) > 0:
-            return email[0].get('VALUE', '')
-        return ''
-    
-    def extract_snils_from_deal(self, deal_details):
-        """Извлекает СНИЛС из данных сделки"""
-        if not deal_details:
-            return ''
-        
-        # СНИЛС хранится в кастомном поле UF_CRM_1750933149374
-        snils_field = 'UF_CRM_1750933149374'
-        snils = deal_details.get(snils_field, '')
-        
-        # Также проверяем альтернативные поля на случай изменений
-        if not snils:
-            alternative_fields = ['UF_CRM_SNILS', 'SNILS', 'UF_SNILS']
-            for field in alternative_fields:
-                snils = deal_details.get(field, '')
-                if snils:
-                    break
-        
-        return str(snils) if snils else ''
+        return identity_rules.normalize_snils(snils)
     
     def _get_or_create_stage(self, stage_id):
         """Получает или создает этап"""
@@ -1156,19 +1028,6 @@ class Command(BaseCommand):
           • чем больше число после последнего дефиса, тем заявка новее.
         """
 
-        def parse_app_number(raw: str) -> int:
-            if not raw:
-                return 0
-            raw = str(raw).strip()
-            # Берём цифры после последнего дефиса
-            m = re.search(r"-(\d+)$", raw)
-            if m:
-                try:
-                    return int(m.group(1))
-                except ValueError:
-                    return 0
-            return 0
-
         by_snils = {}
         for app in applications:
             snils_raw = str(app.get('СНИЛС', '') or '').replace(' ', '').strip()
@@ -1183,8 +1042,8 @@ class Command(BaseCommand):
                 by_snils[snils_raw] = app
             else:
                 # Сравниваем номера заявлений
-                cur_num = parse_app_number(current.get('Номер заявления на РР', ''))
-                new_num = parse_app_number(app.get('Номер заявления на РР', ''))
+                cur_num = parse_application_number(current.get('Номер заявления на РР', ''))
+                new_num = parse_application_number(app.get('Номер заявления на РР', ''))
                 if new_num >= cur_num:
                     by_snils[snils_raw] = app
 
@@ -1192,4 +1051,44 @@ class Command(BaseCommand):
         diff = len(applications) - len(filtered)
         if diff > 0:
             self.stdout.write(f"Отфильтровано {diff} неактуальных заявок (дубликаты по СНИЛС)")
-        return filtered 
\ No newline at end of file
+        return filtered
+
+
+# ----------------------------------------------------------------------
+#  Параллельный режим (--workers): функции, выполняемые в дочерних процессах
+# ----------------------------------------------------------------------
+
+_shard_rate_limiter = None
+_shard_processed = None
+
+
+def _init_shard_worker(rate_limiter, processed):
+    """Инициализация процесса пула: Django и общие с родителем лимитер и счётчик"""
+    global _shard_rate_limiter, _shard_processed
+    django.setup()
+    _shard_rate_limiter = rate_limiter
+    _shard_processed = processed
+
+
+def _process_shard(applications, pipeline_id, field_mapping, dry_run, chunk_size, verbosity=1, sync_run_id=None):
+    """Обрабатывает шард заявок в отдельном процессе, возвращает счётчики stats"""
+    command = Command()
+    if verbosity < 2:
+        # Построчный вывод нескольких процессов перемешивается; ошибки остаются в логе
+        command.stdout = OutputWrapper(StringIO())
+    command.field_mapping = field_mapping
+    command.pipeline = Pipeline.objects.get(pk=pipeline_id)
+    command.chunk_size = chunk_size
+    command.history = SyncHistoryRecorder(sync_run_id)
+    if not dry_run:
+        command.api = Bitrix24API(rate_limiter=_shard_rate_limiter)
+
+    def on_chunk(count):
+        with _shard_processed.get_lock():
+            _shard_processed.value += count
+
+    try:
+        command.process_shard(applications, dry_run, on_chunk)
+    finally:
+        connections.close_all()
+    return command.stats
@@ -0,0 +1,67 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from crm_connector.history import SYNC_REASON_PREFIX
+from crm_connector.models import AtlasApplication, Deal, Pipeline, Stage
+
+HISTORY_MODELS = {
+    'deal': Deal,
+    'pipeline': Pipeline,
+    'stage': Stage,
+    'atlasapplication': AtlasApplication,
+}
+
+
+class Command(BaseCommand):
+    help = 'Удаляет старые исторические записи, оставляя последние версии каждого объекта'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=180,
+                            help='Удалять записи старше указанного количества дней (по умолчанию 180)')
+        parser.add_argument('--keep', type=int, default=5,
+                            help='Сколько последних версий каждого объекта сохранять независимо от возраста (по умолчанию 5)')
+        parser.add_argument('--sync-only', action='store_true',
+                            help='Удалять только записи, созданные синхронизацией')
+        parser.add_argument('--models', nargs='+', choices=sorted(HISTORY_MODELS),
+                            help='Модели для очистки (по умолчанию все)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Количество записей, удаляемых одним запросом')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Не удалять записи, только показать, сколько будет удалено')
+
+    def handle(self, *args, **options):
+        cutoff_date = timezone.now() - datetime.timedelta(days=options['days'])
+        keep = max(options['keep'], 1)
+        total = 0
+
+        for name in options['models'] or sorted(HISTORY_MODELS):
+            history_model = HISTORY_MODELS[name].history.model
+
+            # Номер версии объекта, начиная с самой свежей
+            ranked = history_model.objects.annotate(
+                version=Window(RowNumber(), partition_by=[F('id')], order_by=F('history_date').desc())
+            ).filter(version__gt=keep, history_date__lt=cutoff_date)
+            if options['sync_only']:
+                ranked = ranked.filter(history_change_reason__startswith=SYNC_REASON_PREFIX)
+
+            history_ids = list(ranked.values_list('history_id', flat=True))
+            if options['dry_run']:
+                self.stdout.write(f'{name}: будет удалено {len(history_ids)} записей')
+                total += len(history_ids)
+                continue
+
+            deleted = 0
+            for start in range(0, len(history_ids), options['batch_size']):
+                batch = history_ids[start:start + options['batch_size']]
+                deleted += history_model.objects.filter(history_id__in=batch).delete()[0]
+            self.stdout.write(f'{name}: удалено {deleted} записей')
+            total += deleted
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Будет удалено {total} исторических записей. Используйте команду без --dry-run для фактического удаления.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Удалено {total} исторических записей'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from crm_connector.models import Deal, DealIdentity, Pipeline
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает нормализованные данные сделок (DealIdentity) для сопоставления заявок и поиска дубликатов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pipeline-name',
+            type=str,
+            help='Только сделки указанной воронки'
+        )
+        parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            help='Только сделки, которых ещё нет в индексе'
+        )
+
+    def handle(self, *args, **options):
+        deals = Deal.objects.all()
+
+        if options['pipeline_name']:
+            try:
+                pipeline = Pipeline.objects.get(name=options['pipeline_name'])
+            except Pipeline.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f"Воронка '{options['pipeline_name']}' не найдена!"))
+                return
+            deals = deals.filter(pipeline=pipeline)
+
+        if options['missing_only']:
+            deals = deals.filter(identity__isnull=True)
+
+        count = DealIdentity.rebuild(deals.only('id', 'pipeline_id', 'details').iterator(chunk_size=2000))
+        self.stdout.write(self.style.SUCCESS(f"Обновлено записей: {count}"))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from crm_connector.bitrix24_api import Bitrix24API
+from crm_connector.history import SyncHistoryRecorder
 from crm_connector.models import Deal, Pipeline, Stage
 import datetime
 import json
@@ -60,67 +61,69 @@ class Command(BaseCommand):
         pipelines = {p.bitrix_id: p for p in Pipeline.objects.all()}
         stages = {s.bitrix_id: s for s in Stage.objects.all()}
         
-        for deal_data in deals:
-            try:
-                # Конвертация строки времени в datetime
-                created_at = datetime.datetime.strptime(
-                    deal_data['DATE_CREATE'], '%Y-%m-%dT%H:%M:%S%z'
-                )
-                
-                closed_at = None
-                if deal_data.get('CLOSEDATE'):
-                    closed_at = datetime.datetime.strptime(
-                        deal_data['CLOSEDATE'], '%Y-%m-%dT%H:%M:%S%z'
+        with SyncHistoryRecorder() as history:
+            for deal_data in deals:
+                try:
+                    # Конвертация строки времени в datetime
+                    created_at = datetime.datetime.strptime(
+                        deal_data['DATE_CREATE'], '%Y-%m-%dT%H:%M:%S%z'
                     )
                 
-                # Получаем воронку и этап
-                pipeline_id = str(deal_data.get('CATEGORY_ID', '0'))
-                stage_id = deal_data.get('STAGE_ID', '')
+                    closed_at = None
+                    if deal_data.get('CLOSEDATE'):
+                        closed_at = datetime.datetime.strptime(
+                            deal_data['CLOSEDATE'], '%Y-%m-%dT%H:%M:%S%z'
+                        )
                 
-                pipeline = pipelines.get(pipeline_id)
-                stage = stages.get(stage_id)
+                    # Получаем воронку и этап
+                    pipeline_id = str(deal_data.get('CATEGORY_ID', '0'))
+                    stage_id = deal_data.get('STAGE_ID', '')
                 
-                # Проверяем, существует ли уже сделка
-                deal_exists = Deal.objects.filter(bitrix_id=deal_data['ID']).exists()
+                    pipeline = pipelines.get(pipeline_id)
+                    stage = stages.get(stage_id)
                 
-                # Безопасное преобразование в int с обработкой None
-                try:
-                    category_id = int(pipeline_id) if pipeline_id else 0
-                except (ValueError, TypeError):
-                    category_id = 0
+                    # Проверяем, существует ли уже сделка
+                    deal_exists = Deal.objects.filter(bitrix_id=deal_data['ID']).exists()
+                
+                    # Безопасное преобразование в int с обработкой None
+                    try:
+                        category_id = int(pipeline_id) if pipeline_id else 0
+                    except (ValueError, TypeError):
+                        category_id = 0
                     
-                try:
-                    probability = int(deal_data.get('PROBABILITY', 0)) if deal_data.get('PROBABILITY') is not None else 0
-                except (ValueError, TypeError):
-                    probability = 0
+                    try:
+                        probability = int(deal_data.get('PROBABILITY', 0)) if deal_data.get('PROBABILITY') is not None else 0
+                    except (ValueError, TypeError):
+                        probability = 0
                     
-                try:
-                    amount = float(deal_data.get('OPPORTUNITY', 0)) if deal_data.get('OPPORTUNITY') is not None else 0
-                except (ValueError, TypeError):
-                    amount = 0
+                    try:
+                        amount = float(deal_data.get('OPPORTUNITY', 0)) if deal_data.get('OPPORTUNITY') is not None else 0
+                    except (ValueError, TypeError):
+                        amount = 0
                 
-                # Сохраняем сделку
-                deal, created = Deal.objects.update_or_create(
-                    bitrix_id=deal_data['ID'],
-                    defaults={
-                        'title': deal_data['TITLE'],
-                        'pipeline': pipeline,
-                        'stage': stage,
-                        'amount': amount,
-                        'created_at': created_at,
-                        'closed_at': closed_at,
-                        'responsible_id': deal_data.get('ASSIGNED_BY_ID'),
-                        'category_id': category_id,
-                        'is_closed': deal_data.get('CLOSED') == 'Y',
-                        'is_new': not deal_exists,
-                        'probability': probability,
-                        'details': deal_data,
-                        'last_sync': current_time
-                    }
-                )
+                    # Сохраняем сделку
+                    deal, created = history.update_or_create(
+                        Deal,
+                        bitrix_id=deal_data['ID'],
+                        defaults={
+                            'title': deal_data['TITLE'],
+                            'pipeline': pipeline,
+                            'stage': stage,
+                            'amount': amount,
+                            'created_at': created_at,
+                            'closed_at': closed_at,
+                            'responsible_id': deal_data.get('ASSIGNED_BY_ID'),
+                            'category_id': category_id,
+                            'is_closed': deal_data.get('CLOSED') == 'Y',
+                            'is_new': not deal_exists,
+                            'probability': probability,
+                            'details': deal_data,
+                            'last_sync': current_time
+                        }
+                    )
                 
-                synced_count += 1
-            except Exception as e:
-                print(f"Ошибка при обработке сделки {deal_data.get('ID')}: {str(e)}")
+                    synced_count += 1
+                except Exception as e:
+                    print(f"Ошибка при обработке сделки {deal_data.get('ID')}: {str(e)}")
         
         return synced_count 
\ No newline at end of file
@@ -4,6 +4,13 @@ from crm_connector.bitrix24_api import Bitrix24API
 class Command(BaseCommand):
     help = 'Синхронизирует воронки продаж и их этапы с Битрикс24'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Сравнить данные с базой, даже если ответ Битрикс24 не изменился с прошлого запуска'
+        )
+
     def handle(self, *args, **options):
         self.stdout.write('Начинаем синхронизацию воронок продаж с Битрикс24...')
         
@@ -15,10 +22,16 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR('Не удалось подключиться к API Битрикс24'))
                 return
                 
-            result = api.sync_pipelines_and_stages()
+            result = api.sync_pipelines_and_stages(force=options['force'])
             
-            self.stdout.write(self.style.SUCCESS(
-                f'Успешно синхронизировано {result["pipelines_count"]} воронок и {result["stages_count"]} этапов!'
-            ))
+            if not result['success']:
+                self.stdout.write(self.style.ERROR(f'Ошибка при синхронизации: {result.get("error", "")}'))
+            elif result['skipped']:
+                self.stdout.write(self.style.SUCCESS('Воронки и этапы не изменились с прошлой синхронизации'))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Успешно синхронизировано {result["pipelines_count"]} воронок и {result["stages_count"]} этапов '
+                    f'(создано: {result["created"]}, изменено: {result["updated"]})!'
+                ))
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Ошибка при синхронизации: {str(e)}')) 
\ No newline at end of file
+            self.stdout.write(self.style.ERROR(f'Ошибка при синхронизации: {str(e)}'))
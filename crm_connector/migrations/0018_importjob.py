@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_connector', '0017_atlasapplication_form_apartment_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('deals', 'Сделки из Excel (РОИВ)'), ('not_atlas', 'Сделки не из Атласа'), ('atlas', 'Заявки из Атласа'), ('attestation', 'Прогресс аттестации'), ('quotas', 'Квоты'), ('supplement', 'Дополнительное соглашение'), ('contacts', 'Контакты и организации')], max_length=20, verbose_name='Тип импорта')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('success', 'Завершён'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('dedup_key', models.CharField(max_length=255, verbose_name='Ключ сущности')),
+                ('file', models.FileField(blank=True, null=True, upload_to='import_jobs/%Y/%m/', verbose_name='Файл')),
+                ('file_name', models.CharField(blank=True, max_length=255, verbose_name='Имя файла')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры импорта')),
+                ('celery_task_id', models.CharField(blank=True, max_length=255, verbose_name='ID задачи Celery')),
+                ('total_rows', models.PositiveIntegerField(default=0, verbose_name='Всего строк')),
+                ('processed_rows', models.PositiveIntegerField(default=0, verbose_name='Обработано строк')),
+                ('created_count', models.PositiveIntegerField(default=0, verbose_name='Создано')),
+                ('updated_count', models.PositiveIntegerField(default=0, verbose_name='Обновлено')),
+                ('error_count', models.PositiveIntegerField(default=0, verbose_name='Ошибок')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки')),
+                ('message', models.TextField(blank=True, verbose_name='Итог')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='Результат')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начат')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершён')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='Последнее обновление прогресса')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Запустил')),
+            ],
+            options={
+                'verbose_name': 'Задача импорта',
+                'verbose_name_plural': 'Задачи импорта',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_by', '-created_at'], name='crm_connect_created_b192a5_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('dedup_key',), name='unique_active_import_job')],
+            },
+        ),
+    ]
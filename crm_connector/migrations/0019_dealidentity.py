@@ -0,0 +1,138 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:17
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Правила нормализации скопированы из crm_connector.identity на момент
+# миграции, чтобы заполнение индекса не зависело от текущего кода приложения
+
+SNILS_FIELD = 'UF_CRM_1750933149374'
+REGION_FIELD = 'UF_CRM_665E00ABE228D'
+
+PHONE_FIELDS = ['PHONE', 'UF_CRM_PHONE']
+EMAIL_FIELDS = ['EMAIL', 'UF_CRM_EMAIL']
+SNILS_FIELDS = [SNILS_FIELD, 'UF_CRM_SNILS', 'SNILS', 'UF_SNILS']
+
+NAME_CORRECTIONS = {
+    'Ё': 'Е', 'ё': 'е',
+    'Ичь': 'Ич', 'ичь': 'ич',
+    'Ьевич': 'Евич', 'ьевич': 'евич',
+    'Ьевна': 'Евна', 'ьевна': 'евна',
+    'Лл': 'Л', 'лл': 'л',
+    'Нн': 'Н', 'нн': 'н',
+    'Мм': 'М', 'мм': 'м',
+}
+
+
+def normalize_name(name):
+    if not name:
+        return ''
+    name = ' '.join(str(name).strip().split()).title()
+    for old, new in NAME_CORRECTIONS.items():
+        name = name.replace(old, new)
+    name = re.sub(r'\b([А-ЯЁ])\.', r'\1', name)
+    name = re.sub(r'\s*[-–—]\s*', '-', name)
+    return re.sub(r'\s+', ' ', name).strip()
+
+
+def normalize_phone(phone):
+    if not phone:
+        return ''
+    phone = re.sub(r'[^\d]', '', str(phone))
+    if len(phone) == 11 and phone.startswith('8'):
+        phone = '7' + phone[1:]
+    elif len(phone) == 10:
+        phone = '7' + phone
+    return phone
+
+
+def normalize_email(email):
+    if not email:
+        return ''
+    return str(email).lower().strip()
+
+
+def normalize_snils(snils):
+    if not snils:
+        return ''
+    digits = re.sub(r'[^\d]', '', str(snils))
+    return digits if len(digits) == 11 else ''
+
+
+def multifield_value(value):
+    if isinstance(value, list):
+        for item in value:
+            item_value = item.get('VALUE') if isinstance(item, dict) else item
+            if item_value:
+                return item_value
+        return ''
+    return value or ''
+
+
+def first_field(details, fields):
+    for field in fields:
+        value = multifield_value(details.get(field))
+        if value:
+            return value
+    return ''
+
+
+def identity_from_details(details):
+    details = details or {}
+    return {
+        'name': normalize_name(details.get('NAME', '') or details.get('TITLE', '')),
+        'phone': normalize_phone(str(first_field(details, PHONE_FIELDS))),
+        'email': normalize_email(str(first_field(details, EMAIL_FIELDS))),
+        'snils': normalize_snils(str(first_field(details, SNILS_FIELDS))),
+        'region': str(details.get(REGION_FIELD) or '').strip().lower(),
+    }
+
+
+def fill_deal_identities(apps, schema_editor):
+    Deal = apps.get_model('crm_connector', 'Deal')
+    DealIdentity = apps.get_model('crm_connector', 'DealIdentity')
+
+    batch = []
+    for deal in Deal.objects.only('id', 'pipeline_id', 'details').iterator(chunk_size=2000):
+        values = identity_from_details(deal.details)
+        values['name'] = values['name'][:500]
+        values['phone'] = values['phone'][:20]
+        values['email'] = values['email'][:254]
+        values['region'] = values['region'][:255]
+        batch.append(DealIdentity(deal_id=deal.pk, pipeline_id=deal.pipeline_id, **values))
+        if len(batch) >= 2000:
+            DealIdentity.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        DealIdentity.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_connector', '0018_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DealIdentity',
+            fields=[
+                ('deal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='identity', serialize=False, to='crm_connector.deal')),
+                ('name', models.CharField(blank=True, default='', max_length=500, verbose_name='ФИО')),
+                ('phone', models.CharField(blank=True, default='', max_length=20, verbose_name='Телефон')),
+                ('email', models.CharField(blank=True, default='', max_length=254, verbose_name='Email')),
+                ('snils', models.CharField(blank=True, default='', max_length=11, verbose_name='СНИЛС')),
+                ('region', models.CharField(blank=True, default='', max_length=255, verbose_name='Регион')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('pipeline', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='crm_connector.pipeline')),
+            ],
+            options={
+                'verbose_name': 'Данные для сопоставления сделки',
+                'verbose_name_plural': 'Данные для сопоставления сделок',
+                'indexes': [models.Index(fields=['pipeline', 'snils'], name='crm_connect_pipelin_238cdb_idx'), models.Index(fields=['pipeline', 'phone'], name='crm_connect_pipelin_c3d968_idx'), models.Index(fields=['pipeline', 'email'], name='crm_connect_pipelin_69f77b_idx'), models.Index(fields=['pipeline', 'name'], name='crm_connect_pipelin_27cdc0_idx')],
+            },
+        ),
+        migrations.RunPython(fill_deal_identities, migrations.RunPython.noop),
+    ]
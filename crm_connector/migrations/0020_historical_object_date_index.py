@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_connector', '0019_dealidentity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicalatlasapplication',
+            index=models.Index(fields=['id', 'history_date', 'history_id'], name='crm_connect_id_955c5f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historicaldeal',
+            index=models.Index(fields=['id', 'history_date', 'history_id'], name='crm_connect_id_3fadce_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historicalpipeline',
+            index=models.Index(fields=['id', 'history_date', 'history_id'], name='crm_connect_id_d0b0a8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historicalstage',
+            index=models.Index(fields=['id', 'history_date', 'history_id'], name='crm_connect_id_affc7e_idx'),
+        ),
+    ]
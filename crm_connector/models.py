@@ -1,8 +1,12 @@
 from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 import json
 from django.db.models import JSONField
-from simple_history.models import HistoricalRecords
+
+from .history import IndexedHistoricalRecords
+from .identity import identity_from_details, normalize_email, normalize_name, normalize_phone
 
 # Добавляем константы для типов стадий
 STAGE_TYPE_PROCESS = 'process'
@@ -151,7 +155,7 @@ class Pipeline(models.Model):
     last_sync = models.DateTimeField(null=True)  # Время последней синхронизации
     
     # История изменений
-    history = HistoricalRecords()
+    history = IndexedHistoricalRecords()
     
     def __str__(self):
         status = "активна" if self.is_active else "неактивна"
@@ -192,7 +196,7 @@ class Stage(models.Model):
     type = models.CharField(max_length=20, choices=STAGE_TYPE_CHOICES, default=STAGE_TYPE_PROCESS)
     
     # История изменений
-    history = HistoricalRecords()
+    history = IndexedHistoricalRecords()
     
     # Автоматически устанавливаем цвет на основе типа стадии
     def save(self, *args, **kwargs):
@@ -268,7 +272,7 @@ class Deal(models.Model):
     details = JSONField(null=True, blank=True)
     
     # История изменений
-    history = HistoricalRecords()
+    history = IndexedHistoricalRecords()
     
     class Meta:
         verbose_name = 'Сделка'
@@ -318,6 +322,115 @@ class Deal(models.Model):
             self.last_sync = timezone.now()
         super().save(*args, **kwargs)
 
+class DealIdentity(models.Model):
+    """
+    Нормализованные ФИО, телефон, email, СНИЛС и регион сделки.
+
+    Обновляется при каждом сохранении сделки (сигнал post_save ниже), поэтому
+    сопоставление заявок и поиск дубликатов идут индексированными запросами,
+    а не разбором Deal.details в Python. Для сделок, созданных через
+    bulk_create, индекс заполняется командой rebuild_deal_identities.
+    """
+    deal = models.OneToOneField(Deal, on_delete=models.CASCADE, primary_key=True, related_name='identity')
+    pipeline = models.ForeignKey(Pipeline, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    name = models.CharField(max_length=500, blank=True, default='', verbose_name="ФИО")
+    phone = models.CharField(max_length=20, blank=True, default='', verbose_name="Телефон")
+    email = models.CharField(max_length=254, blank=True, default='', verbose_name="Email")
+    snils = models.CharField(max_length=11, blank=True, default='', verbose_name="СНИЛС")
+    region = models.CharField(max_length=255, blank=True, default='', verbose_name="Регион")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    IDENTITY_FIELDS = ['pipeline', 'name', 'phone', 'email', 'snils', 'region', 'updated_at']
+
+    class Meta:
+        verbose_name = 'Данные для сопоставления сделки'
+        verbose_name_plural = 'Данные для сопоставления сделок'
+        indexes = [
+            models.Index(fields=['pipeline', 'snils']),
+            models.Index(fields=['pipeline', 'phone']),
+            models.Index(fields=['pipeline', 'email']),
+            models.Index(fields=['pipeline', 'name']),
+        ]
+
+    def __str__(self):
+        return f"{self.name or '—'} ({self.deal_id})"
+
+    @classmethod
+    def from_deal(cls, deal):
+        values = identity_from_details(deal.details)
+        values['name'] = values['name'][:500]
+        values['phone'] = values['phone'][:20]
+        values['email'] = values['email'][:254]
+        values['region'] = values['region'][:255]
+        return cls(deal_id=deal.pk, pipeline_id=deal.pipeline_id, updated_at=timezone.now(), **values)
+
+    @classmethod
+    def rebuild(cls, deals, batch_size=1000):
+        """Пересчитывает записи для сделок (одним upsert на пачку), возвращает количество"""
+        count = 0
+        batch = []
+        for deal in deals:
+            batch.append(cls.from_deal(deal))
+            if len(batch) >= batch_size:
+                count += cls._upsert(batch)
+                batch = []
+        if batch:
+            count += cls._upsert(batch)
+        return count
+
+    @classmethod
+    def fill_missing(cls, pipeline):
+        """Создаёт записи для сделок воронки, ещё не попавших в индекс"""
+        return cls.rebuild(
+            Deal.objects.filter(pipeline=pipeline, identity__isnull=True)
+            .only('id', 'pipeline_id', 'details')
+            .iterator(chunk_size=2000)
+        )
+
+    @classmethod
+    def _upsert(cls, identities):
+        cls.objects.bulk_create(
+            identities,
+            update_conflicts=True,
+            unique_fields=['deal'],
+            update_fields=cls.IDENTITY_FIELDS,
+        )
+        return len(identities)
+
+    @classmethod
+    def duplicate_groups(cls, pipeline, field):
+        """Значения поля, встречающиеся у нескольких сделок воронки (GROUP BY ... HAVING)"""
+        identities = cls.objects.filter(pipeline=pipeline).exclude(**{field: ''})
+        if field in ('phone', 'email'):
+            # Совпадение телефона или email считается дублем только при известном ФИО
+            identities = identities.exclude(name='')
+        return (
+            identities.values(field)
+            .annotate(deals_count=models.Count('deal'))
+            .filter(deals_count__gt=1)
+            .values(field)
+        )
+
+    @classmethod
+    def duplicate_candidates(cls, pipeline):
+        """Сделки воронки, у которых СНИЛС, телефон или email совпадает с другой сделкой"""
+        condition = models.Q()
+        for field in ('snils', 'phone', 'email'):
+            field_condition = models.Q(**{f'identity__{field}__in': cls.duplicate_groups(pipeline, field)})
+            if field in ('phone', 'email'):
+                field_condition &= ~models.Q(identity__name='')
+            condition |= field_condition
+        return Deal.objects.filter(pipeline=pipeline).filter(condition).select_related('identity')
+
+
+@receiver(post_save, sender=Deal)
+def update_deal_identity(sender, instance, raw=False, **kwargs):
+    """Поддерживает DealIdentity в актуальном состоянии при синхронизации сделок"""
+    if raw:
+        return
+    DealIdentity._upsert([DealIdentity.from_deal(instance)])
+
+
 class Contact(models.Model):
     """Модель для хранения контактов из Битрикс24"""
     bitrix_id = models.IntegerField(unique=True)
@@ -392,7 +505,7 @@ class AtlasApplication(models.Model):
     last_sync = models.DateTimeField(null=True, blank=True)
     
     # История изменений
-    history = HistoricalRecords()
+    history = IndexedHistoricalRecords()
     
     class Meta:
         verbose_name = "Заявка из Атласа"
@@ -408,29 +521,15 @@ class AtlasApplication(models.Model):
     
     def normalize_phone(self):
         """Нормализует номер телефона"""
-        if not self.phone:
-            return None
-        # Удаляем все символы кроме цифр
-        phone = ''.join(filter(str.isdigit, self.phone))
-        # Приводим к единому формату
-        if len(phone) == 11 and phone.startswith('8'):
-            phone = '7' + phone[1:]
-        elif len(phone) == 10:
-            phone = '7' + phone
-        return phone
+        return normalize_phone(self.phone) or None
     
     def normalize_email(self):
         """Нормализует email"""
-        if not self.email:
-            return None
-        return self.email.lower().strip()
+        return normalize_email(self.email) or None
     
     def normalize_full_name(self):
         """Нормализует ФИО"""
-        if not self.full_name:
-            return None
-        # Убираем лишние пробелы и приводим к единому регистру
-        return ' '.join(self.full_name.strip().split()).title()
+        return normalize_name(self.full_name) or None
 
 
 class AtlasStatus(models.Model):
@@ -539,4 +638,88 @@ class StageRule(models.Model):
                 return rule.target_stage
         
         # Если ни одно правило не подошло, возвращаем None
-        return None 
\ No newline at end of file
+        return None 
+
+class ImportJob(models.Model):
+    """Фоновая задача импорта файла Excel с прогрессом выполнения"""
+
+    class Kind(models.TextChoices):
+        DEALS = 'deals', 'Сделки из Excel (РОИВ)'
+        NOT_ATLAS = 'not_atlas', 'Сделки не из Атласа'
+        ATLAS = 'atlas', 'Заявки из Атласа'
+        ATTESTATION = 'attestation', 'Прогресс аттестации'
+        QUOTAS = 'quotas', 'Квоты'
+        SUPPLEMENT = 'supplement', 'Дополнительное соглашение'
+        CONTACTS = 'contacts', 'Контакты и организации'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        SUCCESS = 'success', 'Завершён'
+        FAILED = 'failed', 'Ошибка'
+
+    ACTIVE_STATUSES = (Status.PENDING, Status.RUNNING)
+
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name="Тип импорта")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING, verbose_name="Статус")
+    # Ключ сущности, которую меняет импорт: одновременно по ключу может идти только одна задача
+    dedup_key = models.CharField(max_length=255, verbose_name="Ключ сущности")
+    file = models.FileField(upload_to='import_jobs/%Y/%m/', blank=True, null=True, verbose_name="Файл")
+    file_name = models.CharField(max_length=255, blank=True, verbose_name="Имя файла")
+    params = JSONField(default=dict, blank=True, verbose_name="Параметры импорта")
+    created_by = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='import_jobs', verbose_name="Запустил")
+    celery_task_id = models.CharField(max_length=255, blank=True, verbose_name="ID задачи Celery")
+
+    # Прогресс и результат
+    total_rows = models.PositiveIntegerField(default=0, verbose_name="Всего строк")
+    processed_rows = models.PositiveIntegerField(default=0, verbose_name="Обработано строк")
+    created_count = models.PositiveIntegerField(default=0, verbose_name="Создано")
+    updated_count = models.PositiveIntegerField(default=0, verbose_name="Обновлено")
+    error_count = models.PositiveIntegerField(default=0, verbose_name="Ошибок")
+    errors = JSONField(default=list, blank=True, verbose_name="Ошибки")
+    message = models.TextField(blank=True, verbose_name="Итог")
+    result = JSONField(default=dict, blank=True, verbose_name="Результат")
+
+    # Временные метки
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начат")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершён")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Последнее обновление прогресса")
+
+    class Meta:
+        verbose_name = "Задача импорта"
+        verbose_name_plural = "Задачи импорта"
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_import_job'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['created_by', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    @property
+    def progress_percent(self):
+        if self.status == self.Status.SUCCESS:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(100, int(self.processed_rows * 100 / self.total_rows))
+
+    @property
+    def duration(self):
+        """Длительность выполнения в секундах"""
+        if not self.started_at:
+            return None
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
@@ -0,0 +1,237 @@
+"""
+Синхронизация воронок и этапов сделок с Битрикс24.
+
+Воронки читаются одним crm.dealcategory.list, этапы всех воронок — одним
+batch-вызовом crm.status.list (по команде на воронку; если пакет отклонён,
+этапы запрашиваются по воронкам отдельно). Ответ приводится
+к компактному виду и сравнивается с текущими строками в памяти: новые
+и изменённые воронки и этапы записываются bulk_create с update_conflicts
+по bitrix_id, история — bulk_history_create с причиной «sync:<ID запуска>».
+Хеш ответа хранится в кеше: если он не изменился с прошлого запуска,
+сравнение и запись пропускаются, обновляется только last_sync воронок.
+
+Тип этапа задаётся по семантике только при создании — дальше он
+настраивается в админке, и синхронизация его не перезаписывает.
+"""
+import hashlib
+import json
+import logging
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .bitrix24_api import batch_result
+from .history import changed_fields, history_enabled, new_sync_run_id, sync_change_reason
+from .models import (
+    STAGE_TYPE_COLORS, STAGE_TYPE_FAILURE, STAGE_TYPE_PROCESS, STAGE_TYPE_SUCCESS,
+    Pipeline, Stage,
+)
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_HASH_CACHE_KEY = 'crm_connector:pipelines_payload_hash'
+# Раз в сутки ответ сравнивается с базой, даже если он не менялся
+PIPELINE_HASH_CACHE_TIMEOUT = 86400
+
+# Битрикс24 принимает не больше 50 команд в одном batch
+BATCH_LIMIT = 50
+
+MAIN_PIPELINE_ID = '0'
+MAIN_PIPELINE = {'name': 'Заявки (граждане)', 'sort': 100, 'is_active': True, 'is_main': True}
+
+PIPELINE_FIELDS = ['name', 'sort', 'is_active', 'is_main']
+STAGE_FIELDS = ['name', 'sort', 'pipeline']
+
+SEMANTIC_STAGE_TYPES = {'S': STAGE_TYPE_SUCCESS, 'F': STAGE_TYPE_FAILURE}
+
+
+def stage_entity_id(pipeline_id):
+    """ENTITY_ID справочника этапов воронки для crm.status.list"""
+    return 'DEAL_STAGE' if pipeline_id == MAIN_PIPELINE_ID else f'DEAL_STAGE_{pipeline_id}'
+
+
+def payload_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def _cached_hash():
+    try:
+        return cache.get(PIPELINE_HASH_CACHE_KEY)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать хеш воронок из кеша: {e}")
+        return None
+
+
+def _store_hash(value):
+    try:
+        cache.set(PIPELINE_HASH_CACHE_KEY, value, PIPELINE_HASH_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить хеш воронок в кеш: {e}")
+
+
+def _upsert(model, objs, update_fields):
+    if objs:
+        model.objects.bulk_create(
+            objs, update_conflicts=True, unique_fields=['bitrix_id'], update_fields=update_fields,
+        )
+
+
+def _fill_pks(model, objs):
+    """Идентификаторы созданных записей, если база не вернула их из bulk_create"""
+    missing = [obj for obj in objs if obj.pk is None]
+    if missing:
+        pks = dict(model.objects.filter(bitrix_id__in=[obj.bitrix_id for obj in missing]).values_list('bitrix_id', 'pk'))
+        for obj in missing:
+            obj.pk = pks[obj.bitrix_id]
+
+
+class PipelineSync:
+    """
+    Синхронизация воронок и этапов. run() возвращает словарь со счётчиками
+    в формате, который ожидают задача, представления и команда sync_pipelines.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.run_id = new_sync_run_id()
+        self.stats = Counter()
+
+    def fetch(self):
+        """{'pipelines': {id: поля}, 'stages': {id воронки: [этапы]}} из Битрикс24"""
+        pipelines = {MAIN_PIPELINE_ID: dict(MAIN_PIPELINE)}
+        for category in self.api.get_all('crm.dealcategory.list') or []:
+            pipeline_id = str(category.get('ID') or '')
+            if pipeline_id:
+                pipelines[pipeline_id] = {
+                    'name': category.get('NAME') or f'Воронка {pipeline_id}',
+                    'sort': int(category.get('SORT') or 500),
+                    'is_active': category.get('IS_LOCKED', 'N') != 'Y',
+                    'is_main': False,
+                }
+
+        results = {}
+        pipeline_ids = list(pipelines)
+        for start in range(0, len(pipeline_ids), BATCH_LIMIT):
+            results.update(self._fetch_stages(pipeline_ids[start:start + BATCH_LIMIT]))
+
+        stages = {
+            pipeline_id: [
+                {
+                    'bitrix_id': str(status['STATUS_ID']),
+                    'name': status.get('NAME', ''),
+                    'sort': int(status.get('SORT') or 0),
+                    'semantics': status.get('SEMANTICS') or '',
+                }
+                for status in results[pipeline_id]
+                if status.get('STATUS_ID')
+            ]
+            for pipeline_id in pipelines
+        }
+        return {'pipelines': pipelines, 'stages': stages}
+
+    def _fetch_stages(self, pipeline_ids):
+        """
+        {id воронки: этапы} одним batch-запросом; если пакет отклонён
+        (fast_bitrix24 бросает исключение при ошибке любой команды),
+        этапы запрашиваются по каждой воронке отдельно.
+        """
+        commands = {
+            f'stages_{pipeline_id}': ['crm.status.list', {'filter': {'ENTITY_ID': stage_entity_id(pipeline_id)}}]
+            for pipeline_id in pipeline_ids
+        }
+        try:
+            response = self.api.call_batch(commands)
+            return {
+                pipeline_id: batch_result(response, f'stages_{pipeline_id}') or []
+                for pipeline_id in pipeline_ids
+            }
+        except Exception as e:
+            logger.warning(f"Batch-запрос этапов не выполнен ({e}), запрашиваем этапы по воронкам")
+
+        return {
+            pipeline_id: self.api.get_all('crm.status.list', {'filter': {'ENTITY_ID': stage_entity_id(pipeline_id)}}) or []
+            for pipeline_id in pipeline_ids
+        }
+
+    def run(self, force=False):
+        payload = self.fetch()
+        digest = payload_hash(payload)
+        now = timezone.now()
+        skipped = not force and digest == _cached_hash()
+
+        if not skipped:
+            with transaction.atomic():
+                self._apply(payload, now)
+        Pipeline.objects.filter(bitrix_id__in=list(payload['pipelines'])).update(last_sync=now)
+        if not skipped:
+            transaction.on_commit(lambda: _store_hash(digest))
+
+        result = {
+            'success': True,
+            'skipped': skipped,
+            'changed': bool(self.stats['created'] or self.stats['updated']),
+            'pipelines_count': len(payload['pipelines']),
+            'stages_count': sum(len(stages) for stages in payload['stages'].values()),
+            **{key: self.stats[key] for key in ('created', 'updated', 'unchanged')},
+        }
+        logger.info(f"Синхронизация воронок {self.run_id}: {result}")
+        return result
+
+    def _diff(self, model, existing, incoming, build):
+        """Новые и изменённые объекты по словарю {bitrix_id: значения полей}"""
+        created, updated = [], []
+        for bitrix_id, values in incoming.items():
+            obj = existing.get(bitrix_id)
+            if obj is None:
+                created.append(build(bitrix_id, values))
+            elif changed_fields(obj, values):
+                for name, value in values.items():
+                    setattr(obj, model._meta.get_field(name).attname, value)
+                updated.append(obj)
+            else:
+                self.stats['unchanged'] += 1
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(updated)
+        return created, updated
+
+    def _apply(self, payload, now):
+        # Воронки
+        pipelines = {pipeline.bitrix_id: pipeline for pipeline in Pipeline.objects.all()}
+        new_pipelines, changed_pipelines = self._diff(
+            Pipeline, pipelines, payload['pipelines'],
+            lambda bitrix_id, values: Pipeline(bitrix_id=bitrix_id, last_sync=now, **values),
+        )
+        _upsert(Pipeline, new_pipelines + changed_pipelines, PIPELINE_FIELDS + ['last_updated'])
+        _fill_pks(Pipeline, new_pipelines)
+        pipelines.update((pipeline.bitrix_id, pipeline) for pipeline in new_pipelines)
+
+        # Этапы: воронка передаётся идентификатором, тип и цвет — только для новых
+        incoming = {
+            stage['bitrix_id']: {'name': stage['name'], 'sort': stage['sort'], 'pipeline': pipelines[pipeline_id].pk}
+            for pipeline_id, stages in payload['stages'].items()
+            for stage in stages
+        }
+        semantics = {stage['bitrix_id']: stage['semantics'] for stages in payload['stages'].values() for stage in stages}
+
+        def build_stage(bitrix_id, values):
+            stage_type = SEMANTIC_STAGE_TYPES.get(semantics[bitrix_id], STAGE_TYPE_PROCESS)
+            return Stage(
+                bitrix_id=bitrix_id, name=values['name'], sort=values['sort'], pipeline_id=values['pipeline'],
+                type=stage_type, color=STAGE_TYPE_COLORS[stage_type],
+            )
+
+        stages = {stage.bitrix_id: stage for stage in Stage.objects.all()}
+        new_stages, changed_stages = self._diff(Stage, stages, incoming, build_stage)
+        _upsert(Stage, new_stages + changed_stages, STAGE_FIELDS)
+        _fill_pks(Stage, new_stages)
+
+        if history_enabled():
+            change_reason = sync_change_reason(self.run_id)
+            for model, objs, update in (
+                (Pipeline, new_pipelines, False), (Pipeline, changed_pipelines, True),
+                (Stage, new_stages, False), (Stage, changed_stages, True),
+            ):
+                if objs:
+                    model.history.bulk_history_create(objs, update=update, default_change_reason=change_reason)
@@ -3,6 +3,8 @@ from django.utils import timezone
 from datetime import datetime
 import pytz
 from .bitrix24_api import Bitrix24API
+from .history import SyncHistoryRecorder
+from .pipeline_sync import PipelineSync
 from .models import Lead, Deal, Contact, Pipeline, Stage
 import logging
 
@@ -43,30 +45,32 @@ def sync_deals():
     current_time = timezone.now()
     synced_count = 0
     
-    for deal_data in deals:
-        # Конвертация строки времени в datetime
-        created_at = datetime.strptime(
-            deal_data['DATE_CREATE'], '%Y-%m-%dT%H:%M:%S%z'
-        )
-        
-        closed_at = None
-        if deal_data.get('CLOSEDATE'):
-            closed_at = datetime.strptime(
-                deal_data['CLOSEDATE'], '%Y-%m-%dT%H:%M:%S%z'
+    with SyncHistoryRecorder() as history:
+        for deal_data in deals:
+            # Конвертация строки времени в datetime
+            created_at = datetime.strptime(
+                deal_data['DATE_CREATE'], '%Y-%m-%dT%H:%M:%S%z'
             )
         
-        deal, created = Deal.objects.update_or_create(
-            bitrix_id=deal_data['ID'],
-            defaults={
-                'title': deal_data['TITLE'],
-                'stage': deal_data['STAGE_ID'],
-                'amount': deal_data.get('OPPORTUNITY', 0),
-                'created_at': created_at,
-                'closed_at': closed_at,
-                'last_sync': current_time
-            }
-        )
-        synced_count += 1
+            closed_at = None
+            if deal_data.get('CLOSEDATE'):
+                closed_at = datetime.strptime(
+                    deal_data['CLOSEDATE'], '%Y-%m-%dT%H:%M:%S%z'
+                )
+        
+            deal, created = history.update_or_create(
+                Deal,
+                bitrix_id=deal_data['ID'],
+                defaults={
+                    'title': deal_data['TITLE'],
+                    'stage': deal_data['STAGE_ID'],
+                    'amount': deal_data.get('OPPORTUNITY', 0),
+                    'created_at': created_at,
+                    'closed_at': closed_at,
+                    'last_sync': current_time
+                }
+            )
+            synced_count += 1
     
     return f"Синхронизировано {synced_count} сделок"
 
@@ -99,58 +103,7 @@ def sync_contacts():
 def sync_pipelines_task():
     """Задача для синхронизации воронок из Битрикс24"""
     try:
-        # Получаем API-клиент
-        api = Bitrix24API()
-        
-        # Получаем данные о воронках
-        pipelines_data = api.get_all('crm.pipeline.list')
-        
-        for pipeline_data in pipelines_data:
-            pipeline_id = pipeline_data.get('ID')
-            
-            # Создаем или обновляем воронку
-            pipeline, created = Pipeline.objects.update_or_create(
-                id=pipeline_id,
-                defaults={
-                    'name': pipeline_data.get('NAME', ''),
-                    'sort': int(pipeline_data.get('SORT', 0)),
-                    'is_main': pipeline_data.get('IS_MAIN', 'N') == 'Y'
-                }
-            )
-            
-            # Получаем этапы для этой воронки
-            stages_data = api.get_all('crm.status.list', {
-                'filter': {'ENTITY_ID': f'DEAL_STAGE_{pipeline_id}'}
-            })
-            
-            for stage_data in stages_data:
-                stage_id = stage_data.get('STATUS_ID')
-                
-                # Определяем тип этапа на основе имени или других параметров
-                name = stage_data.get('NAME', '')
-                semantic_info = stage_data.get('SEMANTICS', '')
-                
-                # По умолчанию этап в процессе
-                stage_type = 'process'
-                
-                # Определяем тип этапа по семантике или имени
-                if semantic_info == 'S':
-                    stage_type = 'success'
-                elif semantic_info == 'F':
-                    stage_type = 'failure'
-                
-                # Создаем или обновляем этап
-                Stage.objects.update_or_create(
-                    id=stage_id,
-                    defaults={
-                        'pipeline': pipeline,
-                        'name': name,
-                        'sort': int(stage_data.get('SORT', 0)),
-                        'type': stage_type,
-                        'color': stage_data.get('COLOR', '')
-                    }
-                )
-        
+        PipelineSync(Bitrix24API()).run()
         return True
     
     except Exception as e:
@@ -178,67 +131,93 @@ def sync_deals_full():
     
     synced_count = 0
     
-    for deal_data in deals:
-        try:
-            # Конвертация строки времени в datetime
-            created_at = datetime.strptime(
-                deal_data['DATE_CREATE'], '%Y-%m-%dT%H:%M:%S%z'
-            )
-            
-            closed_at = None
-            if deal_data.get('CLOSEDATE'):
-                closed_at = datetime.strptime(
-                    deal_data['CLOSEDATE'], '%Y-%m-%dT%H:%M:%S%z'
+    with SyncHistoryRecorder() as history:
+        for deal_data in deals:
+            try:
+                # Конвертация строки времени в datetime
+                created_at = datetime.strptime(
+                    deal_data['DATE_CREATE'], '%Y-%m-%dT%H:%M:%S%z'
                 )
             
-            # Получаем воронку и этап
-            pipeline_id = str(deal_data.get('CATEGORY_ID', '0'))
-            stage_id = deal_data.get('STAGE_ID', '')
+                closed_at = None
+                if deal_data.get('CLOSEDATE'):
+                    closed_at = datetime.strptime(
+                        deal_data['CLOSEDATE'], '%Y-%m-%dT%H:%M:%S%z'
+                    )
             
-            pipeline = pipelines.get(pipeline_id)
-            stage = stages.get(stage_id)
+                # Получаем воронку и этап
+                pipeline_id = str(deal_data.get('CATEGORY_ID', '0'))
+                stage_id = deal_data.get('STAGE_ID', '')
             
-            # Проверяем, существует ли уже сделка
-            deal_exists = Deal.objects.filter(bitrix_id=deal_data['ID']).exists()
+                pipeline = pipelines.get(pipeline_id)
+                stage = stages.get(stage_id)
             
-            # Безопасное преобразование в int с обработкой None
-            try:
-                category_id = int(pipeline_id) if pipeline_id else 0
-            except (ValueError, TypeError):
-                category_id = 0
+                # Проверяем, существует ли уже сделка
+                deal_exists = Deal.objects.filter(bitrix_id=deal_data['ID']).exists()
+            
+                # Безопасное преобразование в int с обработкой None
+                try:
+                    category_id = int(pipeline_id) if pipeline_id else 0
+                except (ValueError, TypeError):
+                    category_id = 0
                 
-            try:
-                probability = int(deal_data.get('PROBABILITY', 0)) if deal_data.get('PROBABILITY') is not None else 0
-            except (ValueError, TypeError):
-                probability = 0
+                try:
+                    probability = int(deal_data.get('PROBABILITY', 0)) if deal_data.get('PROBABILITY') is not None else 0
+                except (ValueError, TypeError):
+                    probability = 0
                 
-            try:
-                amount = float(deal_data.get('OPPORTUNITY', 0)) if deal_data.get('OPPORTUNITY') is not None else 0
-            except (ValueError, TypeError):
-                amount = 0
+                try:
+                    amount = float(deal_data.get('OPPORTUNITY', 0)) if deal_data.get('OPPORTUNITY') is not None else 0
+                except (ValueError, TypeError):
+                    amount = 0
             
-            # Сохраняем сделку
-            deal, created = Deal.objects.update_or_create(
-                bitrix_id=deal_data['ID'],
-                defaults={
-                    'title': deal_data['TITLE'],
-                    'pipeline': pipeline,
-                    'stage': stage,
-                    'amount': amount,
-                    'created_at': created_at,
-                    'closed_at': closed_at,
-                    'responsible_id': deal_data.get('ASSIGNED_BY_ID'),
-                    'category_id': category_id,
-                    'is_closed': deal_data.get('CLOSED') == 'Y',
-                    'is_new': not deal_exists,
-                    'probability': probability,
-                    'details': deal_data,
-                    'last_sync': current_time
-                }
-            )
+                # Сохраняем сделку
+                deal, created = history.update_or_create(
+                    Deal,
+                    bitrix_id=deal_data['ID'],
+                    defaults={
+                        'title': deal_data['TITLE'],
+                        'pipeline': pipeline,
+                        'stage': stage,
+                        'amount': amount,
+                        'created_at': created_at,
+                        'closed_at': closed_at,
+                        'responsible_id': deal_data.get('ASSIGNED_BY_ID'),
+                        'category_id': category_id,
+                        'is_closed': deal_data.get('CLOSED') == 'Y',
+                        'is_new': not deal_exists,
+                        'probability': probability,
+                        'details': deal_data,
+                        'last_sync': current_time
+                    }
+                )
             
-            synced_count += 1
-        except Exception as e:
-            print(f"Ошибка при обработке сделки {deal_data.get('ID')}: {str(e)}")
+                synced_count += 1
+            except Exception as e:
+                print(f"Ошибка при обработке сделки {deal_data.get('ID')}: {str(e)}")
     
-    return f"Синхронизировано {synced_count} сделок" 
\ No newline at end of file
+    return f"Синхронизировано {synced_count} сделок" 
+
+@shared_task
+def generate_statements_task(program=None, period=None, potok=None, application_ids=None, zip_path=None):
+    """Пакетная генерация заявлений для потока слушателей"""
+    from .documents import BatchStatementGenerator, select_stream_listeners
+
+    listeners = select_stream_listeners(program=program, period=period, potok=potok, application_ids=application_ids)
+    generator = BatchStatementGenerator()
+    stats = generator.run(listeners, save=True, zip_file=zip_path)
+
+    logger.info(
+        f"Генерация заявлений: {stats['generated']} из {stats['total']}, "
+        f"пропущено {stats['skipped']}, ошибок {stats['errors']}, "
+        f"{stats['docs_per_second']} док/с"
+    )
+    return stats
+
+
+@shared_task
+def run_import_job(job_id):
+    """Выполнение фоновой задачи импорта Excel (ImportJob)"""
+    from .import_jobs import execute_job
+
+    return execute_job(job_id)
@@ -0,0 +1,116 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from .bitrix24_api import Bitrix24API
+from .models import STAGE_TYPE_PROCESS, STAGE_TYPE_SUCCESS, Pipeline, Stage
+from .pipeline_sync import PipelineSync
+
+
+class FakeBitrix:
+    """Клиент fast_bitrix24 с форматом ответов библиотеки: call_batch возвращает
+    плоский словарь {alias: результат} и бросает исключение при ошибке команды"""
+
+    def __init__(self, categories, stages, fail_batch=False):
+        self.categories = categories
+        self.stages = stages
+        self.fail_batch = fail_batch
+        self.batches = []
+        self.get_all_calls = []
+
+    def _statuses(self, entity_id):
+        return [dict(status) for status in self.stages.get(entity_id, [])]
+
+    def get_all(self, method, params=None):
+        self.get_all_calls.append(method)
+        if method == 'crm.dealcategory.list':
+            return [dict(category) for category in self.categories]
+        if method == 'crm.status.list':
+            return self._statuses(params['filter']['ENTITY_ID'])
+        raise AssertionError(method)
+
+    def call_batch(self, payload):
+        self.batches.append(payload['cmd'])
+        if self.fail_batch:
+            raise Exception("[{'error': 'QUERY_LIMIT_EXCEEDED'}]")
+        result = {}
+        for alias, command in payload['cmd'].items():
+            method, _, query = command.partition('?')
+            assert method == 'crm.status.list', command
+            entity_id = query.split('filter[ENTITY_ID]=')[1].split('&')[0]
+            result[alias] = self._statuses(entity_id)
+        return result
+
+
+class PipelineSyncTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.stages = {
+            'DEAL_STAGE': [
+                {'STATUS_ID': 'NEW', 'NAME': 'Новая', 'SORT': '10'},
+                {'STATUS_ID': 'WON', 'NAME': 'Успех', 'SORT': '20', 'SEMANTICS': 'S'},
+            ],
+            'DEAL_STAGE_5': [{'STATUS_ID': 'C5:NEW', 'NAME': 'Новая', 'SORT': '10'}],
+            'DEAL_STAGE_7': [{'STATUS_ID': 'C7:LOSE', 'NAME': 'Провал', 'SORT': '30', 'SEMANTICS': 'F'}],
+        }
+        self.categories = [{'ID': '5', 'NAME': 'Юрлица', 'SORT': '200'}, {'ID': '7', 'NAME': 'Партнёры', 'SORT': '300'}]
+
+    def sync(self, bitrix, force=False):
+        def init(api, rate_limiter=None):
+            api.rate_limiter = rate_limiter
+            api.bitrix = bitrix
+
+        # Хеш ответа сохраняется в on_commit
+        with mock.patch.object(Bitrix24API, '__init__', init), self.captureOnCommitCallbacks(execute=True):
+            return PipelineSync(Bitrix24API()).run(force=force)
+
+    def test_stages_from_flat_batch_response(self):
+        bitrix = FakeBitrix(self.categories, self.stages)
+        result = self.sync(bitrix)
+
+        self.assertEqual(len(bitrix.batches), 1)
+        self.assertTrue(all(isinstance(command, str) for command in bitrix.batches[0].values()))
+        self.assertEqual((result['pipelines_count'], result['stages_count'], result['created']), (3, 4, 7))
+        self.assertEqual(Stage.objects.get(bitrix_id='WON').type, STAGE_TYPE_SUCCESS)
+        self.assertEqual(Stage.objects.get(bitrix_id='C7:LOSE').pipeline.bitrix_id, '7')
+
+    def test_unchanged_payload_is_skipped(self):
+        self.sync(FakeBitrix(self.categories, self.stages))
+        history_count = Stage.history.count()
+
+        result = self.sync(FakeBitrix(self.categories, self.stages))
+        self.assertTrue(result['skipped'])
+
+        result = self.sync(FakeBitrix(self.categories, self.stages), force=True)
+        self.assertEqual((result['created'], result['updated'], result['unchanged']), (0, 0, 7))
+        self.assertEqual(Stage.history.count(), history_count)
+
+    def test_changed_stage_keeps_admin_type(self):
+        self.sync(FakeBitrix(self.categories, self.stages))
+        Stage.objects.filter(bitrix_id='WON').update(type=STAGE_TYPE_PROCESS)
+
+        self.stages['DEAL_STAGE'][1]['NAME'] = 'Выиграна'
+        result = self.sync(FakeBitrix(self.categories, self.stages))
+
+        stage = Stage.objects.get(bitrix_id='WON')
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual((stage.name, stage.type), ('Выиграна', STAGE_TYPE_PROCESS))
+
+    def test_rejected_batch_falls_back_to_single_calls(self):
+        bitrix = FakeBitrix(self.categories, self.stages, fail_batch=True)
+        result = self.sync(bitrix)
+
+        self.assertEqual(bitrix.get_all_calls.count('crm.status.list'), 3)
+        self.assertEqual(result['stages_count'], 4)
+        self.assertEqual(Stage.objects.count(), 4)
+
+    def test_single_pipeline_uses_single_command_path(self):
+        bitrix = FakeBitrix([], self.stages)
+        result = self.sync(bitrix)
+
+        self.assertEqual(bitrix.batches, [])
+        self.assertEqual(result['stages_count'], 2)
+        self.assertEqual(Pipeline.objects.get().bitrix_id, '0')
+        self.assertEqual(Stage.objects.get(bitrix_id='WON').type, STAGE_TYPE_SUCCESS)
@@ -23,6 +23,7 @@ urlpatterns = [
     path('crm/atlas-dashboard/', views.atlas_dashboard, name='crm_atlas_dashboard'),
     path('history/<str:model>/<int:pk>/', ObjectHistoryView.as_view(), name='object_history'),
     path('import-not-atlas/', views.import_not_atlas, name="import_not_atlas"),
+    path('import-jobs/<int:job_id>/', views.import_job_status, name="import_job_status"),
     path('attestation-progress', views.attestation_progress, name="attestation_progress"),
     path('lead-dashboard', views.lead_dashboard, name="lead-dashboard"),
     path('attestation-stats', views.attestation_stats, name="attestation-stats"),
@@ -9,16 +9,20 @@ from rest_framework import viewsets
 import openpyxl
 from .tasks import sync_leads, sync_deals, sync_contacts, sync_pipelines_task
 from .bitrix24_api import Bitrix24API
+from .history import SyncHistoryRecorder, history_changes
+from .pipeline_sync import PipelineSync
 from django.views.decorators.csrf import csrf_protect
-from .models import Lead, Deal, Contact, Pipeline, Stage, AtlasApplication, StageRule, Company, AtlasProgram, REGION_CHOICES, EDUCATION_PROGRAMM
+from .models import Lead, Deal, Contact, Pipeline, Stage, AtlasApplication, StageRule, Company, AtlasProgram, ImportJob, REGION_CHOICES, EDUCATION_PROGRAMM
+from .identity import raw_data_snils_q
 from django.db.models import Count, Sum, F, ExpressionWrapper, Avg, DurationField, Q
 from django.contrib import messages
 import logging
 import re
 import pandas as pd
 from .forms import ExcelImportForm, AtlasLeadImportForm, LeadImportForm, DocumentForm, SignedApplicationForm
+from .import_jobs import enqueue_import, get_requested_job, job_status_payload, redirect_to_job
+from .documents import build_statement_context, get_statement_filename, get_statement_template, render_document, save_generated_application
 from datetime import datetime, timedelta
-from docxtpl import DocxTemplate
 from dal import autocomplete
 
 logger = logging.getLogger(__name__)
@@ -110,62 +114,8 @@ def sync_pipelines(request):
 def sync_pipelines_directly(api):
     """Синхронная версия функции для синхронизации воронок"""
     try:
-        # Получаем данные о воронках
-        pipelines_data = api.get_all('crm.pipeline.list')
-        pipelines_count = 0
-        stages_count = 0
-        
-        for pipeline_data in pipelines_data:
-            pipeline_id = pipeline_data.get('ID')
-            
-            # Создаем или обновляем воронку
-            pipeline, created = Pipeline.objects.update_or_create(
-                bitrix_id=pipeline_id,
-                defaults={
-                    'name': pipeline_data.get('NAME', ''),
-                    'sort': int(pipeline_data.get('SORT', 0)),
-                    'is_main': pipeline_data.get('IS_MAIN', 'N') == 'Y',
-                    'last_sync': timezone.now(),
-                    'is_active': True
-                }
-            )
-            pipelines_count += 1
-            
-            # Получаем этапы для этой воронки
-            stages_data = api.get_all('crm.status.list', {
-                'filter': {'ENTITY_ID': f'DEAL_STAGE_{pipeline_id}'}
-            })
-            
-            for stage_data in stages_data:
-                stage_id = stage_data.get('STATUS_ID')
-                
-                # Определяем тип этапа
-                name = stage_data.get('NAME', '')
-                semantic_info = stage_data.get('SEMANTICS', '')
-                
-                # По умолчанию этап в процессе
-                stage_type = 'process'
-                
-                # Определяем тип этапа по семантике или имени
-                if semantic_info == 'S':
-                    stage_type = 'success'
-                elif semantic_info == 'F':
-                    stage_type = 'failure'
-                
-                # Создаем или обновляем этап
-                Stage.objects.update_or_create(
-                    bitrix_id=stage_id,
-                    defaults={
-                        'pipeline': pipeline,
-                        'name': name,
-                        'sort': int(stage_data.get('SORT', 0)),
-                        'type': stage_type,
-                        'color': stage_data.get('COLOR', '')
-                    }
-                )
-                stages_count += 1
-        
-        return f"{pipelines_count} воронок и {stages_count} этапов"
+        result = PipelineSync(api).run()
+        return f"{result['pipelines_count']} воронок и {result['stages_count']} этапов"
     
     except Exception as e:
         logger.error(f"Ошибка при синхронизации воронок напрямую: {str(e)}")
@@ -183,30 +133,32 @@ def sync_deals_directly(api):
         pipelines = {p.bitrix_id: p for p in Pipeline.objects.all()}
         stages = {s.bitrix_id: s for s in Stage.objects.all()}
         
-        for deal_data in deals:
-            try:
-                # Обработка сделки
-                pipeline_id = str(deal_data.get('CATEGORY_ID', '0'))
-                stage_id = deal_data.get('STAGE_ID', '')
+        with SyncHistoryRecorder() as history:
+            for deal_data in deals:
+                try:
+                    # Обработка сделки
+                    pipeline_id = str(deal_data.get('CATEGORY_ID', '0'))
+                    stage_id = deal_data.get('STAGE_ID', '')
                 
-                pipeline = pipelines.get(pipeline_id)
-                stage = stages.get(stage_id)
+                    pipeline = pipelines.get(pipeline_id)
+                    stage = stages.get(stage_id)
                 
-                # Создаем или обновляем сделку
-                Deal.objects.update_or_create(
-                    bitrix_id=deal_data['ID'],
-                    defaults={
-                        'title': deal_data['TITLE'],
-                        'pipeline': pipeline,
-                        'stage': stage,
-                        'amount': float(deal_data.get('OPPORTUNITY', 0) or 0),
-                        'last_sync': current_time,
-                        'details': deal_data
-                    }
-                )
-                synced_count += 1
-            except Exception as deal_error:
-                logger.error(f"Ошибка при обработке сделки {deal_data.get('ID')}: {str(deal_error)}")
+                    # Создаем или обновляем сделку
+                    history.update_or_create(
+                        Deal,
+                        bitrix_id=deal_data['ID'],
+                        defaults={
+                            'title': deal_data['TITLE'],
+                            'pipeline': pipeline,
+                            'stage': stage,
+                            'amount': float(deal_data.get('OPPORTUNITY', 0) or 0),
+                            'last_sync': current_time,
+                            'details': deal_data
+                        }
+                    )
+                    synced_count += 1
+                except Exception as deal_error:
+                    logger.error(f"Ошибка при обработке сделки {deal_data.get('ID')}: {str(deal_error)}")
         
         return synced_count
     
@@ -489,11 +441,6 @@ def import_deals_from_excel(request):
         
         # Выводим отладочную информацию
         logger.debug(f"Получено {len(industries)} отраслей, {len(company_types)} типов компаний, {len(pipeline_stages)} стадий воронки")
-        
-        # Создаем словарь соответствия названий стадий их ID
-        global_stages_map = {}
-        for stage_id, stage_name in pipeline_stages:
-            global_stages_map[stage_name] = stage_id
             
     except Exception as e:
         logger.error(f"Ошибка при получении справочников из Битрикс24: {str(e)}")
@@ -501,7 +448,6 @@ def import_deals_from_excel(request):
         industries = []
         company_types = []
         pipeline_stages = []
-        global_stages_map = {}
     
     if request.method == 'POST':
         # Передаем справочники в форму
@@ -514,155 +460,22 @@ def import_deals_from_excel(request):
         
         if form.is_valid():
             try:
-                excel_file = request.FILES['excel_file']
-                business_sphere = form.cleaned_data['business_sphere']
-                organization_type = form.cleaned_data['organization_type']
-                
-                # Чтение Excel-файла
-                df = pd.read_excel(excel_file)
-                
-                # Счетчики для статистики
-                contacts_created = 0
-                contacts_existing = 0
-                companies_created = 0
-                companies_existing = 0
-                deals_created = 0
-                errors = 0
-                
-                # При обработке каждой строки Excel используем словарь соответствия стадий
-                for index, row in df.iterrows():
-                    try:
-                        # Получаем данные из строки
-                        organization_name = str(row.get('Название организации', '')).strip()
-                        organization_type_from_excel = str(row.get('Вид организации', '')).strip()
-                        deal_stage = str(row.get('Стадия сделки', '')).strip()
-                        region = str(row.get('Регион', '')).strip()
-                        manager_name = str(row.get('ФИО руководителя организации', '')).strip()
-                        manager_position = str(row.get('Должность руководителя', '')).strip()
-                        input_number = str(row.get('Входной номер', '')).strip()
-                        input_type = str(row.get('Тип входного номера', '')).strip()
-                        education_direction = str(row.get('Направление обучения', '')).strip()
-                        education_program = str(row.get('Программа обучения', '')).strip()
-                        contact_name = str(row.get('ФИО Контактного лица', '')).strip()
-                        contact_phone = str(row.get('Телефон Контактного лица', '')).strip()
-                        contact_email = str(row.get('Почта Контактного лица', '')).strip()
-                        lists_received = str(row.get('Фактически получено списков', '')).strip()
-                        
-                        # Если нет названия организации, пропускаем строку
-                        if not organization_name:
-                            continue
-                        
-                        # 1. Создаем или находим контакт
-                        contact_data = {
-                            'NAME': contact_name.split()[0] if contact_name and len(contact_name.split()) > 0 else '',
-                            'LAST_NAME': ' '.join(contact_name.split()[1:]) if contact_name and len(contact_name.split()) > 1 else '',
-                            'TYPE_ID': 'CURATOR',  # Тип контакта по умолчанию "куратор"
-                            'PHONE': [{'VALUE': contact_phone, 'VALUE_TYPE': 'WORK'}] if contact_phone else [],
-                            'EMAIL': [{'VALUE': contact_email, 'VALUE_TYPE': 'WORK'}] if contact_email else [],
-                            'COMMENTS': f'Регион: {region}' if region else '',
-                        }
-                        
-                        # Проверяем, существует ли контакт
-                        existing_contact = None
-                        if contact_email:
-                            existing_contacts = api.find_contact_by_email(contact_email)
-                            if existing_contacts:
-                                existing_contact = existing_contacts[0]
-                        
-                        if not existing_contact and contact_phone:
-                            existing_contacts = api.find_contact_by_phone(contact_phone)
-                            if existing_contacts:
-                                existing_contact = existing_contacts[0]
-                        
-                        contact_id = None
-                        if existing_contact:
-                            contact_id = existing_contact['ID']
-                            # Обновляем существующий контакт
-                            api.update_contact(contact_id, contact_data)
-                            contacts_existing += 1
-                        else:
-                            # Создаем новый контакт
-                            contact_result = api.add_contact(contact_data)
-                            contact_id = contact_result
-                            contacts_created += 1
-                        
-                        # 2. Создаем или находим компанию
-                        company_data = {
-                            'TITLE': organization_name,
-                            'COMPANY_TYPE': organization_type,  # Тип организации из формы
-                            'INDUSTRY': business_sphere,  # Сфера деятельности из формы
-                            'COMMENTS': f'Вид организации: {organization_type_from_excel}\nРегион: {region}',
-                            'ADDRESS': region,
-                            'OPENED': 'Y',
-                            'ASSIGNED_BY_ID': request.user.id  # ID текущего пользователя как ответственного
-                        }
-                        
-                        # Проверяем, существует ли компания
-                        existing_companies = api.find_company_by_name(organization_name)
-                        company_id = None
-                        
-                        if existing_companies:
-                            company_id = existing_companies[0]['ID']
-                            # Обновляем существующую компанию
-                            api.update_company(company_id, company_data)
-                            companies_existing += 1
-                        else:
-                            # Создаем новую компанию
-                            company_result = api.add_company(company_data)
-                            company_id = company_result
-                            companies_created += 1
-                        
-                        # 3. Создаем сделку
-                        deal_data = {
-                            'TITLE': f"Заявка от {organization_name}",
-                            'CATEGORY_ID': str(bitrix_pipeline_id),
-                            'STAGE_ID': map_stage_to_bitrix_id(deal_stage, global_stages_map),
-                            'COMPANY_ID': company_id,
-                            'CONTACT_ID': contact_id,  # Основной контакт сделки
-                            'OPENED': 'Y',
-                            'ASSIGNED_BY_ID': request.user.id,  # ID текущего пользователя как ответственного
-                            'COMMENTS': f"""
-                            Руководитель: {manager_name}
-                            Должность: {manager_position}
-                            Входной номер: {input_number}
-                            Тип входного номера: {input_type}
-                            Направление обучения: {education_direction}
-                            Программа обучения: {education_program}
-                            Фактически получено списков: {lists_received}
-                            """,
-                            'BEGINDATE': timezone.now().strftime('%Y-%m-%d'),
-                            'REGION': region,
-                            # Добавляем пользовательские поля
-                            'UF_CRM_EDUCATION_DIRECTION': education_direction,
-                            'UF_CRM_EDUCATION_PROGRAM': education_program,
-                            'UF_CRM_INPUT_NUMBER': input_number,
-                            'UF_CRM_INPUT_TYPE': input_type,
-                            'UF_CRM_LISTS_RECEIVED': lists_received
-                        }
-                        
-                        # Создаем сделку
-                        deal_result = api.add_deal(deal_data)
-                        
-                        if deal_result:
-                            deals_created += 1
-                        
-                    except Exception as e:
-                        errors += 1
-                        logger.error(f"Ошибка при обработке строки {index+1}: {str(e)}")
-                
-                # Формируем сообщение с результатами
-                result_message = f"""
-                Импорт завершен. Результаты:
-                - Создано новых контактов: {contacts_created}
-                - Обновлено существующих контактов: {contacts_existing}
-                - Создано новых организаций: {companies_created}
-                - Обновлено существующих организаций: {companies_existing}
-                - Создано сделок: {deals_created}
-                - Ошибок: {errors}
-                """
-                
-                messages.success(request, result_message)
-                return redirect('crm_connector:pipelines_dashboard')
+                # Файл обрабатывается в фоновой задаче, страница показывает прогресс
+                job, created = enqueue_import(
+                    ImportJob.Kind.DEALS,
+                    dedup_key=f'bitrix_pipeline:{bitrix_pipeline_id}',
+                    user=request.user,
+                    uploaded_file=request.FILES['excel_file'],
+                    params={
+                        'pipeline_id': bitrix_pipeline_id,
+                        'business_sphere': form.cleaned_data['business_sphere'],
+                        'organization_type': form.cleaned_data['organization_type'],
+                        'assigned_by_id': request.user.id,
+                    },
+                )
+                if not created:
+                    messages.warning(request, f'Импорт в эту воронку уже выполняется (задача #{job.pk}). Дождитесь его завершения.')
+                return redirect_to_job('crm_connector:import_deals', job)
                 
             except Exception as e:
                 messages.error(request, f'Ошибка при импорте: {str(e)}')
@@ -674,9 +487,186 @@ def import_deals_from_excel(request):
     # Передаем в шаблон актуальные стадии воронки для информации пользователю
     return render(request, 'crm_connector/import_deals.html', {
         'form': form,
-        'pipeline_stages': pipeline_stages
+        'pipeline_stages': pipeline_stages,
+        'import_job': get_requested_job(request),
     })
 
+def run_deals_import(job, progress):
+    """Импорт сделок РОИВ из Excel в Битрикс24 (обработчик ImportJob)"""
+    params = job.params
+    bitrix_pipeline_id = params['pipeline_id']
+    business_sphere = params.get('business_sphere')
+    organization_type = params.get('organization_type')
+    assigned_by_id = params.get('assigned_by_id')
+    
+    api = Bitrix24API()
+    
+    # Создаем словарь соответствия названий стадий их ID
+    global_stages_map = {}
+    try:
+        for stage_id, stage_name in api.get_pipeline_stages(bitrix_pipeline_id):
+            global_stages_map[stage_name] = stage_id
+    except Exception as e:
+        logger.error(f"Ошибка при получении стадий воронки из Битрикс24: {str(e)}")
+    
+    # Чтение Excel-файла
+    with job.file.open('rb') as excel_file:
+        df = pd.read_excel(excel_file)
+    progress.set_total(len(df))
+    
+    # Счетчики для статистики
+    contacts_created = 0
+    contacts_existing = 0
+    companies_created = 0
+    companies_existing = 0
+    deals_created = 0
+    errors = 0
+    
+    # При обработке каждой строки Excel используем словарь соответствия стадий
+    for index, row in df.iterrows():
+        progress.advance()
+        try:
+            # Получаем данные из строки
+            organization_name = str(row.get('Название организации', '')).strip()
+            organization_type_from_excel = str(row.get('Вид организации', '')).strip()
+            deal_stage = str(row.get('Стадия сделки', '')).strip()
+            region = str(row.get('Регион', '')).strip()
+            manager_name = str(row.get('ФИО руководителя организации', '')).strip()
+            manager_position = str(row.get('Должность руководителя', '')).strip()
+            input_number = str(row.get('Входной номер', '')).strip()
+            input_type = str(row.get('Тип входного номера', '')).strip()
+            education_direction = str(row.get('Направление обучения', '')).strip()
+            education_program = str(row.get('Программа обучения', '')).strip()
+            contact_name = str(row.get('ФИО Контактного лица', '')).strip()
+            contact_phone = str(row.get('Телефон Контактного лица', '')).strip()
+            contact_email = str(row.get('Почта Контактного лица', '')).strip()
+            lists_received = str(row.get('Фактически получено списков', '')).strip()
+            
+            # Если нет названия организации, пропускаем строку
+            if not organization_name:
+                continue
+            
+            # 1. Создаем или находим контакт
+            contact_data = {
+                'NAME': contact_name.split()[0] if contact_name and len(contact_name.split()) > 0 else '',
+                'LAST_NAME': ' '.join(contact_name.split()[1:]) if contact_name and len(contact_name.split()) > 1 else '',
+                'TYPE_ID': 'CURATOR',  # Тип контакта по умолчанию "куратор"
+                'PHONE': [{'VALUE': contact_phone, 'VALUE_TYPE': 'WORK'}] if contact_phone else [],
+                'EMAIL': [{'VALUE': contact_email, 'VALUE_TYPE': 'WORK'}] if contact_email else [],
+                'COMMENTS': f'Регион: {region}' if region else '',
+            }
+            
+            # Проверяем, существует ли контакт
+            existing_contact = None
+            if contact_email:
+                existing_contacts = api.find_contact_by_email(contact_email)
+                if existing_contacts:
+                    existing_contact = existing_contacts[0]
+            
+            if not existing_contact and contact_phone:
+                existing_contacts = api.find_contact_by_phone(contact_phone)
+                if existing_contacts:
+                    existing_contact = existing_contacts[0]
+            
+            contact_id = None
+            if existing_contact:
+                contact_id = existing_contact['ID']
+                # Обновляем существующий контакт
+                api.update_contact(contact_id, contact_data)
+                contacts_existing += 1
+            else:
+                # Создаем новый контакт
+                contact_result = api.add_contact(contact_data)
+                contact_id = contact_result
+                contacts_created += 1
+            
+            # 2. Создаем или находим компанию
+            company_data = {
+                'TITLE': organization_name,
+                'COMPANY_TYPE': organization_type,  # Тип организации из формы
+                'INDUSTRY': business_sphere,  # Сфера деятельности из формы
+                'COMMENTS': f'Вид организации: {organization_type_from_excel}\nРегион: {region}',
+                'ADDRESS': region,
+                'OPENED': 'Y',
+                'ASSIGNED_BY_ID': assigned_by_id  # ID пользователя, запустившего импорт, как ответственного
+            }
+            
+            # Проверяем, существует ли компания
+            existing_companies = api.find_company_by_name(organization_name)
+            company_id = None
+            
+            if existing_companies:
+                company_id = existing_companies[0]['ID']
+                # Обновляем существующую компанию
+                api.update_company(company_id, company_data)
+                companies_existing += 1
+            else:
+                # Создаем новую компанию
+                company_result = api.add_company(company_data)
+                company_id = company_result
+                companies_created += 1
+            
+            # 3. Создаем сделку
+            deal_data = {
+                'TITLE': f"Заявка от {organization_name}",
+                'CATEGORY_ID': str(bitrix_pipeline_id),
+                'STAGE_ID': map_stage_to_bitrix_id(deal_stage, global_stages_map),
+                'COMPANY_ID': company_id,
+                'CONTACT_ID': contact_id,  # Основной контакт сделки
+                'OPENED': 'Y',
+                'ASSIGNED_BY_ID': assigned_by_id,  # ID пользователя, запустившего импорт, как ответственного
+                'COMMENTS': f"""
+                Руководитель: {manager_name}
+                Должность: {manager_position}
+                Входной номер: {input_number}
+                Тип входного номера: {input_type}
+                Направление обучения: {education_direction}
+                Программа обучения: {education_program}
+                Фактически получено списков: {lists_received}
+                """,
+                'BEGINDATE': timezone.now().strftime('%Y-%m-%d'),
+                'REGION': region,
+                # Добавляем пользовательские поля
+                'UF_CRM_EDUCATION_DIRECTION': education_direction,
+                'UF_CRM_EDUCATION_PROGRAM': education_program,
+                'UF_CRM_INPUT_NUMBER': input_number,
+                'UF_CRM_INPUT_TYPE': input_type,
+                'UF_CRM_LISTS_RECEIVED': lists_received
+            }
+            
+            # Создаем сделку
+            deal_result = api.add_deal(deal_data)
+            
+            if deal_result:
+                deals_created += 1
+            
+        except Exception as e:
+            errors += 1
+            logger.error(f"Ошибка при обработке строки {index+1}: {str(e)}")
+            progress.error(f"Строка {index+1}: {str(e)}")
+    
+    progress.created = deals_created
+    progress.updated = contacts_existing + companies_existing
+    
+    # Формируем сообщение с результатами
+    result_message = f"""Импорт завершен. Результаты:
+- Создано новых контактов: {contacts_created}
+- Обновлено существующих контактов: {contacts_existing}
+- Создано новых организаций: {companies_created}
+- Обновлено существующих организаций: {companies_existing}
+- Создано сделок: {deals_created}
+- Ошибок: {errors}"""
+    
+    return {
+        'message': result_message,
+        'contacts_created': contacts_created,
+        'contacts_existing': contacts_existing,
+        'companies_created': companies_created,
+        'companies_existing': companies_existing,
+        'deals_created': deals_created,
+        'errors': errors,
+    }
+
 def map_stage_to_bitrix_id(stage_name, stages_map=None):
     """Преобразует текстовое название стадии в ID стадии Битрикс24"""
     # Используем переданный словарь стадий, если он есть
@@ -704,7 +694,6 @@ def import_atlas_applications(request):
         messages.warning(request, 'Для импорта данных необходимо войти в систему.')
         return redirect(f'{settings.LOGIN_URL}?next={request.path}')
     
-    import_summary = None  # Сюда поместим итоговый текст результатов импорта
     stage_result = None
 
     # Определяем формы по умолчанию
@@ -755,33 +744,19 @@ def import_atlas_applications(request):
 
             if excel_form.is_valid():
                 try:
-                    excel_file = request.FILES['excel_file']
                     pipeline_name = excel_form.cleaned_data.get('pipeline_name', 'Заявки (граждане)')
 
-                    # Сохраняем файл временно
-                    import tempfile, os as _os
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-                        for chunk in excel_file.chunks():
-                            tmp_file.write(chunk)
-                        tmp_file_path = tmp_file.name
-
-                    try:
-                        from django.core.management import call_command
-                        from io import StringIO
-                        out = StringIO()
-                        call_command('import_atlas_applications', tmp_file_path, f'--pipeline-name={pipeline_name}', stdout=out)
-                        result_output = out.getvalue().split('\n')
-                        keywords = ['Обновлено сделок', 'Удалено', 'Найдено совпадений', 'Новых заявок', 'Обновлено существующих сделок', 'Создано новых сделок', 'Ошибок:']
-                        important_lines = [l.strip() for l in result_output if any(k in l for k in keywords) and l.strip()]
-                        import_summary = '\n'.join(important_lines) if important_lines else '\n'.join(result_output)
-                    finally:
-                        _os.unlink(tmp_file_path)
-
-                    # после импорта сбрасываем форму
-                    excel_form = ExcelImportForm(initial={'pipeline_name': pipeline_name})
-                    for optional_field in ('business_sphere', 'organization_type'):
-                        if optional_field in excel_form.fields:
-                            excel_form.fields[optional_field].required = False
+                    # Файл обрабатывается в фоновой задаче, страница показывает прогресс
+                    job, created = enqueue_import(
+                        ImportJob.Kind.ATLAS,
+                        dedup_key=f'atlas_pipeline:{pipeline_name}',
+                        user=request.user,
+                        uploaded_file=request.FILES['excel_file'],
+                        params={'pipeline_name': pipeline_name},
+                    )
+                    if not created:
+                        messages.warning(request, f'Импорт в воронку «{pipeline_name}» уже выполняется (задача #{job.pk}).')
+                    return redirect_to_job('crm_connector:import_atlas_applications', job)
                 except Exception as e:
                     logger.error(f"Ошибка при импорте заявок из Атласа: {str(e)}")
                     messages.error(request, f'Ошибка при импорте: {str(e)}')
@@ -798,12 +773,37 @@ def import_atlas_applications(request):
         'total_applications': AtlasApplication.objects.count(),
         'synced_applications': AtlasApplication.objects.filter(is_synced=True).count(),
         'pending_applications': AtlasApplication.objects.filter(is_synced=False).count(),
-        'import_summary': import_summary,
         'stage_result': stage_result,
+        'import_job': get_requested_job(request),
     }
     
     return render(request, 'crm_connector/import_atlas_applications.html', context)
 
+def run_atlas_import(job, progress):
+    """Импорт выгрузки Атласа командой import_atlas_applications (обработчик ImportJob)"""
+    from django.core.management import call_command
+    from io import StringIO
+    from .management.commands.import_atlas_applications import Command as ImportAtlasCommand
+
+    pipeline_name = job.params.get('pipeline_name', 'Заявки (граждане)')
+    out = StringIO()
+    command = ImportAtlasCommand()
+    command.progress_callback = lambda processed, total: progress.set(processed, total)
+    call_command(command, job.file.path, f'--pipeline-name={pipeline_name}', stdout=out)
+
+    stats = command.stats
+    progress.created = stats['created_deals'] + stats['new_applications']
+    progress.updated = stats['updated_applications']
+    progress.error_count = stats['errors']
+
+    result_output = out.getvalue().split('\n')
+    keywords = ['Обновлено сделок', 'Удалено', 'Найдено совпадений', 'Новых заявок', 'Обновлено существующих сделок', 'Создано новых сделок', 'Ошибок:']
+    important_lines = [l.strip() for l in result_output if any(k in l for k in keywords) and l.strip()]
+    return {
+        'message': '\n'.join(important_lines) if important_lines else '\n'.join(result_output),
+        'stats': stats,
+    }
+
 def import_not_atlas(request):
     if not request.user.is_authenticated:
         messages.warning(request, 'Для импорта данных необходимо войти в систему.')
@@ -812,126 +812,171 @@ def import_not_atlas(request):
         form = LeadImportForm(request.POST, request.FILES)
         if form.is_valid():
             excel_file = form.cleaned_data['excel_file']
-            edcuationdirection = form.cleaned_data['training']
 
             try:
-                wb = openpyxl.load_workbook(excel_file)
-                ws = wb.active
+                openpyxl.load_workbook(excel_file, read_only=True).close()
+                excel_file.seek(0)
             except Exception as e:
                 messages.error(request, f'Ошибка при открытии файла: {e}')
                 return render(request, 'crm_connector/import_lids.html', {'form': form})
 
-            missing_company_rows = []
-            missing_name_rows = []
-            missing_phone_rows = []
-
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                ExcelPhone = row[3]
-                contact_name = row[2]
-                contact_phone = row[3]
-                contact_email = row[4]
-                CompanyStringList = str(row[1]).split() # Тут убрать лишние пробелы надо
-                company_name = ' '.join(CompanyStringList)   # Поэтому эти две строки существуют
-                # Проверка обязательных полей
-                if not row[1] and row[0] != None:
-                    missing_company_rows.append(int(row[0])) # Собираем номера полей, где нет компании
-                    continue
-                if contact_name is None and row[0] != None:
-                    missing_name_rows.append(int(row[0])) # Собираем номера полей, где нет ФИО
-                    continue
-                if not row[3] and row[0] != None:
-                    missing_phone_rows.append(int(row[0])) # Собираем номера полей, где нет телефона
-                    continue
-                # Проверка эмейла на вшивость
-                pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-                if re.match(pattern, str(row[4])):
-                    contact_email = row[4]
-                else:
-                    contact_email = ''
-                # Проверка телефона на вшивость
-                if isinstance(ExcelPhone, float):
-                    if ExcelPhone.is_integer():
-                        ExcelPhone = str(int(ExcelPhone))
-                    else:
-                        ExcelPhone = str(ExcelPhone)
-                else:
-                    ExcelPhone = str(ExcelPhone).strip()
-                ExcelPhone = re.sub(r'\D','',ExcelPhone)
-                if ExcelPhone.startswith('7'):
-                    ExcelPhone = '8' + ExcelPhone[1:]
-                
-                # Создаем лид с status=0 и текущим временем создания
-                api = Bitrix24API()
-                contact_data = {
-                    'NAME': contact_name.split()[0] if contact_name and len(contact_name.split()) > 0 else '',
-                    'LAST_NAME': ' '.join(contact_name.split()[1:]) if contact_name and len(contact_name.split()) > 1 else '',
-                    'TYPE_ID': 'CURATOR',  # Тип контакта по умолчанию "куратор"
-                    'PHONE': [{'VALUE': contact_phone, 'VALUE_TYPE': 'WORK'}] if contact_phone else [],
-                    'EMAIL': [{'VALUE': contact_email, 'VALUE_TYPE': 'WORK'}] if contact_email else []
-                }
-
-                # Проверяем, существует ли контакт
-                existing_contact = None
-                if contact_email:
-                    existing_contacts = api.find_contact_by_email(contact_email)
-                    if existing_contacts:
-                        existing_contact = existing_contacts
-
-                if not existing_contact and contact_phone:
-                    existing_contacts = api.find_contact_by_phone(contact_phone)
-                    if existing_contacts:
-                        existing_contact = existing_contacts
-
-                contact_id = None
-                if existing_contact:
-                    contact_id = existing_contact['ID']
-                    # Обновляем существующий контакт
-                    api.update_contact(contact_id, contact_data)
-                else:
-                    # Создаем новый контакт
-                    contact_result = api.add_contact(contact_data)
-                    contact_id = contact_result
-
-                # 2. Создаем или находим компанию
-                company_data = {
-                    'TITLE': company_name,
-                    'OPENED': 'Y',
-                    }
-                            
-                        # Проверяем, существует ли компания
-                existing_companies = api.find_company_by_name(company_name)
-                company_id = None
-                            
-                if existing_companies:
-                    company_id = existing_companies['ID']
-                                # Обновляем существующую компанию
-                    api.update_company(company_id, company_data)
-                else:
-                                # Создаем новую компанию
-                    company_result = api.add_company(company_data)
-                    company_id = company_result
-
-                lead_data = {
-                        'TITLE': company_name,
-                        'CATEGORY_ID': '11',
-                        'COMPANY_ID': company_id,
-                        'CONTACT_ID': contact_id,
-                        # Указание направления обучения
-                        'UF_CRM_1741091080288': edcuationdirection
-                    }
-                api.add_deal(lead_data)
-            messages.success(request, 'Сделки успешно импортированы')
-            if missing_company_rows:
-                messages.warning(request, f'Пропущены строки из-за неуказанной компании: {",".join(map(str, missing_company_rows))}')
-            if missing_name_rows:
-                messages.warning(request, f'Пропущены строки из-за неуказанного ФИО: {",".join(map(str, missing_name_rows))}')
-            if missing_phone_rows:
-                messages.warning(request, f'Пропущены строки из-за неуказанного телефона: {",".join(map(str, missing_phone_rows))}')
+            # Сделки создаются в той же воронке (CATEGORY_ID 11), что и при импорте РОИВ
+            job, created = enqueue_import(
+                ImportJob.Kind.NOT_ATLAS,
+                dedup_key='bitrix_pipeline:11',
+                user=request.user,
+                uploaded_file=excel_file,
+                params={'training': form.cleaned_data['training']},
+            )
+            if not created:
+                messages.warning(request, f'Импорт в эту воронку уже выполняется (задача #{job.pk}).')
+            return redirect_to_job('crm_connector:import_not_atlas', job)
             
     else:
         form = LeadImportForm()
 
-    return render(request, 'crm_connector/import_not_atlas.html', {'form': form})
+    return render(request, 'crm_connector/import_not_atlas.html', {'form': form, 'import_job': get_requested_job(request)})
+
+def run_not_atlas_import(job, progress):
+    """Импорт сделок не из Атласа в Битрикс24 (обработчик ImportJob)"""
+    edcuationdirection = job.params.get('training')
+    api = Bitrix24API()
+
+    from io import BytesIO
+
+    # read_only-книга читает строки из файла лениво, поэтому загружаем его в память целиком
+    with job.file.open('rb') as excel_file:
+        wb = openpyxl.load_workbook(BytesIO(excel_file.read()), read_only=True)
+    ws = wb.active
+    progress.set_total(max((ws.max_row or 1) - 1, 0))
+
+    missing_company_rows = []
+    missing_name_rows = []
+    missing_phone_rows = []
+
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        progress.advance()
+        ExcelPhone = row[3]
+        contact_name = row[2]
+        contact_phone = row[3]
+        contact_email = row[4]
+        CompanyStringList = str(row[1]).split() # Тут убрать лишние пробелы надо
+        company_name = ' '.join(CompanyStringList)   # Поэтому эти две строки существуют
+        # Проверка обязательных полей
+        if not row[1] and row[0] != None:
+            missing_company_rows.append(int(row[0])) # Собираем номера полей, где нет компании
+            continue
+        if contact_name is None and row[0] != None:
+            missing_name_rows.append(int(row[0])) # Собираем номера полей, где нет ФИО
+            continue
+        if not row[3] and row[0] != None:
+            missing_phone_rows.append(int(row[0])) # Собираем номера полей, где нет телефона
+            continue
+        # Проверка эмейла на вшивость
+        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+        if re.match(pattern, str(row[4])):
+            contact_email = row[4]
+        else:
+            contact_email = ''
+        # Проверка телефона на вшивость
+        if isinstance(ExcelPhone, float):
+            if ExcelPhone.is_integer():
+                ExcelPhone = str(int(ExcelPhone))
+            else:
+                ExcelPhone = str(ExcelPhone)
+        else:
+            ExcelPhone = str(ExcelPhone).strip()
+        ExcelPhone = re.sub(r'\D','',ExcelPhone)
+        if ExcelPhone.startswith('7'):
+            ExcelPhone = '8' + ExcelPhone[1:]
+        
+        # Создаем лид с status=0 и текущим временем создания
+        contact_data = {
+            'NAME': contact_name.split()[0] if contact_name and len(contact_name.split()) > 0 else '',
+            'LAST_NAME': ' '.join(contact_name.split()[1:]) if contact_name and len(contact_name.split()) > 1 else '',
+            'TYPE_ID': 'CURATOR',  # Тип контакта по умолчанию "куратор"
+            'PHONE': [{'VALUE': contact_phone, 'VALUE_TYPE': 'WORK'}] if contact_phone else [],
+            'EMAIL': [{'VALUE': contact_email, 'VALUE_TYPE': 'WORK'}] if contact_email else []
+        }
+
+        # Проверяем, существует ли контакт
+        existing_contact = None
+        if contact_email:
+            existing_contacts = api.find_contact_by_email(contact_email)
+            if existing_contacts:
+                existing_contact = existing_contacts
+
+        if not existing_contact and contact_phone:
+            existing_contacts = api.find_contact_by_phone(contact_phone)
+            if existing_contacts:
+                existing_contact = existing_contacts
+
+        contact_id = None
+        if existing_contact:
+            contact_id = existing_contact['ID']
+            # Обновляем существующий контакт
+            api.update_contact(contact_id, contact_data)
+        else:
+            # Создаем новый контакт
+            contact_result = api.add_contact(contact_data)
+            contact_id = contact_result
+
+        # 2. Создаем или находим компанию
+        company_data = {
+            'TITLE': company_name,
+            'OPENED': 'Y',
+            }
+                    
+                # Проверяем, существует ли компания
+        existing_companies = api.find_company_by_name(company_name)
+        company_id = None
+                    
+        if existing_companies:
+            company_id = existing_companies['ID']
+                        # Обновляем существующую компанию
+            api.update_company(company_id, company_data)
+        else:
+                        # Создаем новую компанию
+            company_result = api.add_company(company_data)
+            company_id = company_result
+
+        lead_data = {
+                'TITLE': company_name,
+                'CATEGORY_ID': '11',
+                'COMPANY_ID': company_id,
+                'CONTACT_ID': contact_id,
+                # Указание направления обучения
+                'UF_CRM_1741091080288': edcuationdirection
+            }
+        if api.add_deal(lead_data):
+            progress.created += 1
+    wb.close()
+
+    warnings = []
+    if missing_company_rows:
+        warnings.append(f'Пропущены строки из-за неуказанной компании: {",".join(map(str, missing_company_rows))}')
+    if missing_name_rows:
+        warnings.append(f'Пропущены строки из-за неуказанного ФИО: {",".join(map(str, missing_name_rows))}')
+    if missing_phone_rows:
+        warnings.append(f'Пропущены строки из-за неуказанного телефона: {",".join(map(str, missing_phone_rows))}')
+    for warning in warnings:
+        progress.error(warning)
+
+    return {'message': 'Сделки успешно импортированы', 'warnings': warnings}
+
+def import_job_status(request, job_id):
+    """Состояние фоновой задачи импорта (опрашивается страницами импорта)"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'message': 'Необходимо войти в систему'}, status=401)
+
+    jobs = ImportJob.objects.all()
+    if not request.user.is_staff:
+        jobs = jobs.filter(created_by=request.user)
+    job = jobs.filter(pk=job_id).first()
+    if not job:
+        return JsonResponse({'success': False, 'message': 'Задача импорта не найдена'}, status=404)
+
+    return JsonResponse({'success': True, **job_status_payload(job)})
 
 from django.views.generic import ListView
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -941,56 +986,89 @@ from .forms import StageCheckForm
 import json, os
 
 class ObjectHistoryView(LoginRequiredMixin, ListView):
-    """Представление для просмотра истории изменений объекта"""
+    """
+    Представление для просмотра истории изменений объекта.
+
+    Страницы читаются по ключу (history_date, history_id): ?before=<history_id>
+    — более старые записи, ?after=<history_id> — более новые. Изменения между
+    версиями считаются history_changes по уже загруженной странице.
+    """
     template_name = 'crm_connector/history_view.html'
     context_object_name = 'history'
-    paginate_by = 50
-    
+    page_size = 50
+
+    model_map = {
+        'deal': Deal,
+        'pipeline': Pipeline,
+        'stage': Stage,
+        'atlasapplication': AtlasApplication,
+    }
+
     def get_object(self):
         """Получает объект для которого показывается история"""
-        model_name = self.kwargs['model']
-        pk = self.kwargs['pk']
-        
-        model_map = {
-            'deal': Deal,
-            'pipeline': Pipeline,
-            'stage': Stage,
-            'atlasapplication': AtlasApplication,
-        }
-        
-        model_class = model_map.get(model_name.lower())
-        if not model_class:
-            raise Http404("Модель не найдена")
-            
-        return get_object_or_404(model_class, pk=pk)
-    
+        if not hasattr(self, '_object'):
+            model_class = self.model_map.get(self.kwargs['model'].lower())
+            if not model_class:
+                raise Http404("Модель не найдена")
+            self._object = get_object_or_404(model_class, pk=self.kwargs['pk'])
+        return self._object
+
+    def _cursor(self, name):
+        """(history_date, history_id) записи из параметра name или None"""
+        value = self.request.GET.get(name, '')
+        if not value.isdigit():
+            return None
+        history_date = self.get_object().history.filter(history_id=value).values_list(
+            'history_date', flat=True
+        ).first()
+        return (history_date, int(value)) if history_date else None
+
+    @staticmethod
+    def _older_than(cursor):
+        history_date, history_id = cursor
+        return Q(history_date__lt=history_date) | Q(history_date=history_date, history_id__lt=history_id)
+
+    @staticmethod
+    def _newer_than(cursor):
+        history_date, history_id = cursor
+        return Q(history_date__gt=history_date) | Q(history_date=history_date, history_id__gt=history_id)
+
     def get_queryset(self):
-        """Возвращает историю изменений для объекта"""
-        obj = self.get_object()
-        return obj.history.all()
-    
+        """Страница истории объекта (от новых к старым) с вычисленными изменениями"""
+        history = self.get_object().history.select_related('history_user')
+        after = self._cursor('after')
+
+        if after:
+            rows = list(history.filter(self._newer_than(after)).order_by('history_date', 'history_id')[:self.page_size + 1])
+            self.has_newer = len(rows) > self.page_size
+            records = rows[:self.page_size][::-1]
+            previous = history.filter(self._older_than(
+                (records[-1].history_date, records[-1].history_id) if records else after
+            )).first()
+        else:
+            before = self._cursor('before')
+            if before:
+                history = history.filter(self._older_than(before))
+            # Лишняя запись показывает, есть ли следующая страница, и нужна для изменений последней записи
+            rows = list(history[:self.page_size + 1])
+            self.has_newer = before is not None
+            records = rows[:self.page_size]
+            previous = rows[self.page_size] if len(rows) > self.page_size else None
+
+        self.has_older = previous is not None
+        return history_changes(records, previous)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         obj = self.get_object()
-        
+        records = context['history']
+
         context['object'] = obj
         context['model_name'] = obj.__class__.__name__.lower()
         context['model_verbose_name'] = obj.__class__._meta.verbose_name
-        
-        # Получаем поля модели для отображения в деталях
-        excluded_fields = ['history_id', 'history_date', 'history_change_reason', 
-                          'history_user', 'history_type', 'history_object']
-        fields = []
-        
-        for field in obj._meta.fields:
-            if field.name not in excluded_fields:
-                fields.append({
-                    'name': field.name,
-                    'verbose_name': field.verbose_name
-                })
-        
-        context['fields'] = fields
-        
+        context['changelist_url'] = reverse(f"admin:crm_connector_{context['model_name']}_changelist")
+        context['newer_cursor'] = records[0].history_id if records and self.has_newer else None
+        context['older_cursor'] = records[-1].history_id if records and self.has_older else None
         return context
 
 def lead_dashboard(request):
@@ -1484,82 +1562,16 @@ def attestation_progress(request):
     if request.method == 'POST':
         form = AtlasLeadImportForm(request.POST, request.FILES)
         if form.is_valid():
-            failed_to_find = 0
-            file = form.cleaned_data['excel_file']
-            # Читаем Excel с пропуском первых 2 строк (номеруем с 0)
-            df = pd.read_excel(file, header=None, engine='openpyxl')
-            header_row = df.iloc[0]
-            listeners_updated = 0
-            listeners_created = 0
-            for _, row in df.iterrows():
-                if _ < 2:  # пропускаем первые 3 строки
-                    continue
-                name = row.iloc[1]
-                program = row.iloc[0]
-                email = row.iloc[2]
-                last_active = row.iloc[5]
-                potok = row.iloc[7]
-                col_index = 11
-                test_count = 0
-                progress = {}
-                progress.setdefault('attestation', '')
-                progress.setdefault('statistic', {})
-                while col_index + 4 < len(row):
-                    header_value = str(header_row.iloc[col_index]).lower()
-                    topic_theory = row.iloc[col_index]       # теория (не нужна)
-                    topic_testing = row.iloc[col_index + 1]  # тестирование (надо)
-                    topic_practice = row.iloc[col_index + 2] # практика (не нужна)
-                    topic_start = row.iloc[col_index + 3]    # дата старта (не нужна)
-                    topic_end = row.iloc[col_index + 4]      # дата окончания (не нужна)
-                    if "аттестация" in header_value:
-                        progress['attestation'] += f"{topic_testing},"
-                        if topic_testing > 60:
-                            test_count +=1
-                    progress['statistic'].setdefault(header_value[:3], {})
-                    if str(topic_theory) != 'nan':
-                        progress['statistic'][header_value[:3]].setdefault('theory', str(topic_theory))
-                    if str(topic_practice) != 'nan':
-                        progress['statistic'][header_value[:3]].setdefault('practice', str(topic_practice))
-                    if str(topic_testing) != 'nan':
-                        progress['statistic'][header_value[:3]].setdefault('test', str(topic_testing))
-                    col_index += 5
-                progress['attestation'] += f"{test_count}"
-
-                if isinstance(last_active, str):
-                    last_active = datetime.strptime(last_active, "%d.%m.%Y")
-                elif isinstance(last_active, pd.Timestamp):
-                    last_active = last_active.to_pydatetime()
-                if isinstance(last_active, str):
-                    dt = datetime.strptime(last_active, "%d.%m.%Y")
-                    last_active = timezone.make_aware(dt, timezone.get_current_timezone())
-                try:
-                    app = AtlasApplication.objects.filter(email=email).first()
-                    try:
-                        if app.raw_data.get("Программа обучения"):
-                            app.program = app.raw_data.get("Программа обучения")
-                        else:
-                            app.program = program
-                    except:
-                        app.program = program
-                    if app.program == program:
-                        app.last_sync = timezone.now()
-                        app.potok = potok
-                        app.last_active = last_active
-                        if app.education_progress:
-                            listeners_updated +=1
-                        else:
-                            listeners_created +=1
-                        print(f"Email: {email}")
-                        print(f"Progress: {progress}")
-                        print(f"Attestation data: {progress.get('attestation', 'НЕТ ДАННЫХ')}")
-                        app.JSON_ed_progress = progress
-                        app.save()
-                except:
-                    failed_to_find +=1
-                    pass
-            messages.error(request,f'Не удалось найти: {failed_to_find}', extra_tags='false')
-            messages.success(request, f'Создано: {listeners_created}', extra_tags='succ')
-            messages.success(request, f'Обновлено: {listeners_updated}', extra_tags='succ')
+            # Файл обрабатывается в фоновой задаче, страница показывает прогресс
+            job, created = enqueue_import(
+                ImportJob.Kind.ATTESTATION,
+                dedup_key='atlas_progress',
+                user=request.user,
+                uploaded_file=form.cleaned_data['excel_file'],
+            )
+            if not created:
+                messages.warning(request, f'Загрузка прогресса уже выполняется (задача #{job.pk}).')
+            return redirect_to_job('crm_connector:attestation_progress', job)
                             
     
     else:
@@ -1659,11 +1671,100 @@ def attestation_progress(request):
     'selected_program': selected_program,
     'selected_potok': selected_potok,
     'total_applications': total_applications,
-    'applications_with_progress': applications_with_progress
+    'applications_with_progress': applications_with_progress,
+    'import_job': get_requested_job(request),
     }
     # return JsonResponse({'result': context})
     return render(request, 'crm_connector/attestation-progress.html', context)
 
+def run_attestation_import(job, job_progress):
+    """Загрузка прогресса слушателей из выгрузки Атласа (обработчик ImportJob)"""
+    failed_to_find = 0
+    # Читаем Excel с пропуском первых 2 строк (номеруем с 0)
+    with job.file.open('rb') as file:
+        df = pd.read_excel(file, header=None, engine='openpyxl')
+    job_progress.set_total(max(len(df) - 2, 0))
+    header_row = df.iloc[0]
+    listeners_updated = 0
+    listeners_created = 0
+    for _, row in df.iterrows():
+        if _ < 2:  # пропускаем первые 3 строки
+            continue
+        job_progress.advance()
+        name = row.iloc[1]
+        program = row.iloc[0]
+        email = row.iloc[2]
+        last_active = row.iloc[5]
+        potok = row.iloc[7]
+        col_index = 11
+        test_count = 0
+        progress = {}
+        progress.setdefault('attestation', '')
+        progress.setdefault('statistic', {})
+        while col_index + 4 < len(row):
+            header_value = str(header_row.iloc[col_index]).lower()
+            topic_theory = row.iloc[col_index]       # теория (не нужна)
+            topic_testing = row.iloc[col_index + 1]  # тестирование (надо)
+            topic_practice = row.iloc[col_index + 2] # практика (не нужна)
+            topic_start = row.iloc[col_index + 3]    # дата старта (не нужна)
+            topic_end = row.iloc[col_index + 4]      # дата окончания (не нужна)
+            if "аттестация" in header_value:
+                progress['attestation'] += f"{topic_testing},"
+                if topic_testing > 60:
+                    test_count +=1
+            progress['statistic'].setdefault(header_value[:3], {})
+            if str(topic_theory) != 'nan':
+                progress['statistic'][header_value[:3]].setdefault('theory', str(topic_theory))
+            if str(topic_practice) != 'nan':
+                progress['statistic'][header_value[:3]].setdefault('practice', str(topic_practice))
+            if str(topic_testing) != 'nan':
+                progress['statistic'][header_value[:3]].setdefault('test', str(topic_testing))
+            col_index += 5
+        progress['attestation'] += f"{test_count}"
+
+        if isinstance(last_active, str):
+            last_active = datetime.strptime(last_active, "%d.%m.%Y")
+        elif isinstance(last_active, pd.Timestamp):
+            last_active = last_active.to_pydatetime()
+        if isinstance(last_active, str):
+            dt = datetime.strptime(last_active, "%d.%m.%Y")
+            last_active = timezone.make_aware(dt, timezone.get_current_timezone())
+        try:
+            app = AtlasApplication.objects.filter(email=email).first()
+            try:
+                if app.raw_data.get("Программа обучения"):
+                    app.program = app.raw_data.get("Программа обучения")
+                else:
+                    app.program = program
+            except:
+                app.program = program
+            if app.program == program:
+                app.last_sync = timezone.now()
+                app.potok = potok
+                app.last_active = last_active
+                if app.education_progress:
+                    listeners_updated +=1
+                else:
+                    listeners_created +=1
+                print(f"Email: {email}")
+                print(f"Progress: {progress}")
+                print(f"Attestation data: {progress.get('attestation', 'НЕТ ДАННЫХ')}")
+                app.JSON_ed_progress = progress
+                app.save()
+        except:
+            failed_to_find +=1
+            pass
+    job_progress.created = listeners_created
+    job_progress.updated = listeners_updated
+    if failed_to_find:
+        job_progress.error(f'Не удалось найти: {failed_to_find}')
+    return {
+        'message': f'Создано: {listeners_created}, обновлено: {listeners_updated}, не удалось найти: {failed_to_find}',
+        'created': listeners_created,
+        'updated': listeners_updated,
+        'failed_to_find': failed_to_find,
+    }
+
 def attestation_stats(request):
     if not request.user.is_authenticated:
         messages.warning(request, 'Для импорта данных необходимо войти в систему.')
@@ -1824,11 +1925,10 @@ class RegionAutocomplete(autocomplete.Select2ListView):
         return [(key, value) for key, value in REGION_CHOICES]
 
 def contract_generation(request):
-    import tempfile
+    import io
     import os
     import logging
     from django.contrib import messages
-    from django.core.files import File
     from education_planner.models import EducationProgram
     
     logger = logging.getLogger(__name__)
@@ -1868,7 +1968,7 @@ def contract_generation(request):
                     snils = upload_form.cleaned_data['snils']
                     signed_file = upload_form.cleaned_data['signed_application']
                     
-                    listener = AtlasApplication.objects.filter(raw_data__СНИЛС=int(snils)).first()
+                    listener = AtlasApplication.objects.filter(raw_data_snils_q(snils)).first()
                     if not listener:
                         messages.error(request, "Заявка с указанным СНИЛС не найдена")
                     else:
@@ -1926,7 +2026,7 @@ def contract_generation(request):
             if form.is_valid():
                 try:
                     context = form.cleaned_data
-                    listener = AtlasApplication.objects.filter(raw_data__СНИЛС=int(context["snils"])).first()
+                    listener = AtlasApplication.objects.filter(raw_data_snils_q(context["snils"])).first()
                     
                     if not listener:
                         raise AttributeError("Не удалось найти заявку с указанным СНИЛС")
@@ -1935,25 +2035,7 @@ def contract_generation(request):
                     program = listener.raw_data.get('Программа обучения', '') if listener.raw_data else ''
                     
                     # Определяем тип шаблона по программе
-                    template = "PO"  # По умолчанию ПО
-                    if program:
-                        program_data = EducationProgram.objects.filter(name=program).first()
-                        if program_data and program_data.program_type == "ADV":
-                            template = "DPO"
-                    
-                    # Формируем адрес
-                    address_parts = []
-                    if context.get("settlement"):
-                        address_parts.append(context["settlement"])
-                    if context.get("street"):
-                        address_parts.append(context["street"])
-                    if context.get("house"):
-                        address_parts.append(f"д. {context['house']}")
-                    if context.get("building"):
-                        address_parts.append(f"корп. {context['building']}")
-                    if context.get("apartment"):
-                        address_parts.append(f"кв. {context['apartment']}")
-                    address = ", ".join(address_parts)
+                    template = get_statement_template(program)
                     
                     # Сохраняем данные формы в модель
                     listener.form_postal_code = context.get("postal_code")
@@ -1965,44 +2047,12 @@ def contract_generation(request):
                     listener.form_apartment = context.get("apartment")
                     listener.save()
                     
-                    # Подготовка контекста для шаблона
-                    for i, a in REGION_CHOICES:
-                        if context["region"] in i:
-                            context["region"] = a
+                    # Подготовка контекста и генерация документа из закешированного шаблона
+                    context = build_statement_context(listener, context)
+                    content = render_document(template, context)
                     
-                    context["fio"] = listener.full_name
-                    context["passport_series_number"] = str(listener.raw_data["Серия паспорта"]) + " " + str(listener.raw_data["Номер паспорта"])
-                    context["passport_issuer"] = listener.raw_data["Кем выдан паспорт"]
-                    context["phone"] = listener.phone
-                    context["email"] = listener.email
-                    context["today_date"] = datetime.today().strftime("%d")
-                    context["today_month"] = months[datetime.today().month]
-                    context["address"] = address
-                    
-                    # Генерация документа
-                    doc = DocxTemplate(settings.DOCX_TEMPLATE_PATH + f"/template_{template}.docx")
-                    doc.render(context)
-                    tmp_docx = tempfile.NamedTemporaryFile(delete=False, suffix=".docx")
-                    doc.save(tmp_docx.name)
-                    tmp_docx.close()
-                    
-                    filename = f"{context['fio']}_заявление_на_отправку.docx"
-                    
-                    # Удаляем старый файл, если есть
-                    if listener.generated_application:
-                        try:
-                            if os.path.isfile(listener.generated_application.path):
-                                os.remove(listener.generated_application.path)
-                        except:
-                            pass
-                    
-                    # Сохраняем файл в модель
-                    with open(tmp_docx.name, 'rb') as f:
-                        listener.generated_application.save(filename, File(f), save=True)
-                    listener.save()
-                    
-                    # Удаляем временный файл
-                    os.unlink(tmp_docx.name)
+                    # Сохраняем файл в модель (старый файл заменяется)
+                    save_generated_application(listener, content, get_statement_filename(listener))
                     
                     messages.success(request,  "Заявление успешно сгенерировано! Документ будет автоматически скачан. Распечатайте его, подпишите и загрузите скан на вкладке 'Загрузка скана'.")
                     active_tab = 'upload'
@@ -2028,7 +2078,7 @@ def contract_generation(request):
                 try:
                     context = gen_form.cleaned_data
                     context.setdefault('template', request.POST['template'])
-                    listener = AtlasApplication.objects.filter(raw_data__СНИЛС=int(context["snils"])).first()
+                    listener = AtlasApplication.objects.filter(raw_data_snils_q(context["snils"])).first()
                     
                     if not listener:
                         raise AttributeError("Не удалось найти заявку с указанным СНИЛС")
@@ -2099,12 +2149,8 @@ def contract_generation(request):
                     context["today_month"] = months[datetime.today().month]
                     context["address"] = address
                     # Генерация документа
-                    doc = DocxTemplate(settings.DOCX_TEMPLATE_PATH + f"/template_{template}.docx")
-                    doc.render(context)
-                    tmp_docx = tempfile.NamedTemporaryFile(delete=False, suffix=".docx")
-                    doc.save(tmp_docx.name)
-                    tmp_docx.seek(0)
-                    response = FileResponse(open(tmp_docx.name, "rb"), as_attachment=True, filename=f"{template_type[template]}_{context["fio"]}_{datetime.today().strftime("%Y-%m-%d %H:%M:%S")}.docx")
+                    content = render_document(template, context)
+                    response = FileResponse(io.BytesIO(content), as_attachment=True, filename=f"{template_type[template]}_{context["fio"]}_{datetime.today().strftime("%Y-%m-%d %H:%M:%S")}.docx")
                     return response
                 except AttributeError as e:
                     messages.error(request, f"Ошибка: {e}")
@@ -2121,7 +2167,7 @@ def contract_generation(request):
     
     if snils_value: 
         try:
-            listener = AtlasApplication.objects.filter(raw_data__СНИЛС=int(snils_value)).first()
+            listener = AtlasApplication.objects.filter(raw_data_snils_q(snils_value)).first()
             if listener and listener.generated_application:
                 from django.urls import reverse
                 generated_file_url = reverse('crm_connector:download_generated_application', args=[snils_value])
@@ -2145,7 +2191,7 @@ def download_generated_application(request, snils):
     from django.contrib import messages
     
     try:
-        listener = AtlasApplication.objects.filter(raw_data__СНИЛС=int(snils)).first()
+        listener = AtlasApplication.objects.filter(raw_data_snils_q(snils)).first()
         
         if not listener:
             raise Http404("Заявка с указанным СНИЛС не найдена")
@@ -2392,10 +2438,17 @@ def applications_list(request):
     
     return render(request, 'crm_connector/applications_list.html', context)
 
+import hashlib
 import django_filters
+from django.db.models import Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import serializers
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import TokenAuthentication
+from rest_framework.response import Response
 from rest_framework import viewsets
 
 
@@ -2437,9 +2490,31 @@ def api_guide(request):
     return render(request, "crm_connector/api_form.html", context=context)
 
 class ListenerProgressSerializer(serializers.ModelSerializer):
+    """
+    Прогресс слушателя. Параметр fields=application_id,full_name ограничивает набор полей в ответе.
+    """
     class Meta:
         model = AtlasApplication
-        fields = ['application_id', 'full_name', 'potok', 'program', 'JSON_ed_progress']
+        fields = ['application_id', 'full_name', 'potok', 'program', 'JSON_ed_progress', 'updated_at']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = get_requested_fields(self.context.get('request'))
+        if requested:
+            for field_name in set(self.fields) - requested:
+                self.fields.pop(field_name)
+
+
+def get_requested_fields(request):
+    """Набор полей из параметра fields= (только допустимые поля сериализатора)"""
+    if request is None:
+        return None
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    return requested & set(ListenerProgressSerializer.Meta.fields) or None
+
 
 class ListenerProgressFilter(django_filters.FilterSet):
     application_id = django_filters.CharFilter(field_name='application_id', lookup_expr='exact')
@@ -2454,11 +2529,39 @@ class ListenerProgressFilter(django_filters.FilterSet):
     program = django_filters.CharFilter(field_name='program', lookup_expr='exact')
     program__contains = django_filters.CharFilter(field_name='program', lookup_expr='contains')
 
+    since = django_filters.IsoDateTimeFilter(field_name='updated_at', lookup_expr='gt')
+
     class Meta:
         model = AtlasApplication
         fields = [] 
 
+
+class ListenerProgressPagination(CursorPagination):
+    """
+    Курсорная пагинация по (updated_at, id).
+    Включается, если клиент передал page_size или cursor — без них API отдаёт список целиком, как раньше.
+    """
+    ordering = ('updated_at', 'id')
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 5000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not view.force_pagination and not (
+            self.page_size_query_param in request.query_params or self.cursor_query_param in request.query_params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
 class ListenerProgressViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Прогресс слушателей для внешних LMS.
+
+    Параметры: фильтры ListenerProgressFilter, fields= (поля ответа), page_size/cursor (пагинация).
+    Ответы списка помечаются ETag и Last-Modified — при неизменных данных возвращается 304.
+    /changes/?since=<ISO-дата> отдаёт только заявки, изменённые после указанного момента.
+    """
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
     filterset_class = ListenerProgressFilter
@@ -2466,3 +2569,50 @@ class ListenerProgressViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ListenerProgressSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['application_id', 'potok', 'program']
+    pagination_class = ListenerProgressPagination
+    force_pagination = False
+
+    def get_queryset(self):
+        # raw_data и прочие тяжёлые поля не нужны для ответа
+        fields = get_requested_fields(self.request) or set(ListenerProgressSerializer.Meta.fields)
+        return AtlasApplication.objects.only('id', 'updated_at', *fields).order_by('updated_at', 'id')
+
+    def _conditional_list(self, request, queryset):
+        """Список с поддержкой If-None-Match / If-Modified-Since"""
+        state = queryset.aggregate(last_modified=Max('updated_at'), total=Count('id'))
+        last_modified = state['last_modified']
+        etag_source = f"{request.get_full_path()}|{state['total']}|{last_modified.isoformat() if last_modified else ''}"
+        etag = f'"{hashlib.md5(etag_source.encode()).hexdigest()}"'
+
+        not_modified = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+        if not_modified is not None:
+            return not_modified
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        else:
+            response = Response(self.get_serializer(queryset, many=True).data)
+
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        if hasattr(response, 'data') and isinstance(response.data, dict) and last_modified:
+            # Значение для следующего запроса /changes/?since=...
+            response.data['sync_token'] = last_modified.isoformat()
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional_list(request, self.filter_queryset(self.get_queryset()))
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """Инкрементальная выгрузка: заявки, изменённые после since (всегда с пагинацией)"""
+        if not request.query_params.get('since'):
+            return Response({'error': 'Параметр since обязателен (ISO 8601, например 2025-01-31T12:00:00+03:00)'}, status=400)
+        self.force_pagination = True
+        return self._conditional_list(request, self.filter_queryset(self.get_queryset()))
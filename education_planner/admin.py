@@ -29,6 +29,7 @@ class ProgramSectionAdmin(admin.ModelAdmin):
     list_filter = ('program', 'created_at')
     search_fields = ('name', 'description', 'program__name')
     readonly_fields = ('created_at', 'updated_at')
+    list_select_related = ('program',)
     inlines = [TopicsInline]
 
 class RegionAlternativeNames(admin.TabularInline):
@@ -128,6 +129,7 @@ class SupplementAdmin(admin.ModelAdmin):
     list_filter = ('status', 'signing_date', 'created_at', 'agreement')
     search_fields = ('number', 'agreement__number', 'agreement__name', 'description')
     readonly_fields = ('created_at', 'updated_at')
+    list_select_related = ('agreement',)
     inlines = [QuotaChangeInline]
     
     fieldsets = (
@@ -163,6 +165,7 @@ class ROIVAdmin(admin.ModelAdmin):
     list_filter = ('is_active', 'created_at')
     search_fields = ('name', 'region__name')
     readonly_fields = ('created_at', 'updated_at')
+    list_select_related = ('region',)
     filter_horizontal = ('prof_activity',)
 
 
@@ -185,6 +188,7 @@ class Requirement(admin.TabularInline):
 @admin.register(ProgramRequirements)
 class ProgramRequirementsAdmin(admin.ModelAdmin):
     list_display = ('name', 'study_form', 'DOT')
+    list_select_related = ('name',)
     inlines = [Requirement]
 
 @admin.register(FederalOperator)
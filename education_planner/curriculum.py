@@ -0,0 +1,322 @@
+"""
+Снимок учебного плана программы для таблиц УТП и проверки требований.
+
+Разделы и темы загружаются двумя запросами (Prefetch), суммы часов считаются
+за один проход. Снимок неизменяемый (кортежи) и кешируется по ключу
+из id программы и её updated_at; изменение разделов и тем обновляет
+updated_at программы (см. сигналы в models.py), так что старый снимок
+просто перестаёт использоваться.
+"""
+import logging
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .models import ProgramSection, ProgramTopics
+
+logger = logging.getLogger(__name__)
+
+CURRICULUM_CACHE_PREFIX = 'curriculum:'
+CURRICULUM_CACHE_TIMEOUT = 86400  # сутки: ключ меняется вместе с updated_at программы
+
+HOURS_FIELDS = (
+    'lecture_hours', 'practice_hours', 'selfstudy_hours',
+    'consultation_hours', 'dot_hours', 'workload',
+)
+
+
+class HoursTotals(namedtuple('HoursTotals', HOURS_FIELDS + ('contact_hours',))):
+    """Суммы часов по разделам программы (без итоговой аттестации)"""
+    __slots__ = ()
+
+    def as_dict(self):
+        return dict(self._asdict())
+
+
+class CurriculumTopic(namedtuple('CurriculumTopic', ('id', 'name') + HOURS_FIELDS + ('attestation_form',))):
+    __slots__ = ()
+
+    @property
+    def contact_hours(self):
+        return self.lecture_hours + self.practice_hours
+
+
+class CurriculumSection(namedtuple('CurriculumSection', ('id', 'name') + HOURS_FIELDS + ('attestation_form', 'topics'))):
+    __slots__ = ()
+
+    @property
+    def contact_hours(self):
+        return self.lecture_hours + self.practice_hours
+
+
+class CurriculumSnapshot(namedtuple('CurriculumSnapshot', ('program_id', 'updated_at', 'final_attestation', 'sections', 'totals'))):
+    """Разделы с темами по порядку и суммы часов"""
+    __slots__ = ()
+
+
+def _hours(obj):
+    return {field: getattr(obj, field) or 0 for field in HOURS_FIELDS}
+
+
+def build_curriculum_snapshot(program):
+    """Загружает разделы и темы программы (два запроса) и считает суммы часов"""
+    sections_qs = ProgramSection.objects.filter(program=program).order_by('order').prefetch_related(
+        Prefetch('topics', queryset=ProgramTopics.objects.order_by('order'))
+    )
+
+    sections = []
+    sums = dict.fromkeys(HOURS_FIELDS, 0)
+    for section in sections_qs:
+        topics = tuple(
+            CurriculumTopic(id=topic.pk, name=topic.name, attestation_form=topic.attestation_form or '', **_hours(topic))
+            for topic in section.topics.all()
+        )
+        hours = _hours(section)
+        for field in HOURS_FIELDS:
+            sums[field] += hours[field]
+        sections.append(CurriculumSection(
+            id=section.pk, name=section.name, attestation_form=section.attestation_form or '', topics=topics, **hours
+        ))
+
+    return CurriculumSnapshot(
+        program_id=program.pk,
+        updated_at=program.updated_at,
+        final_attestation=program.final_attestation or 0,
+        sections=tuple(sections),
+        totals=HoursTotals(contact_hours=sums['lecture_hours'] + sums['practice_hours'], **sums),
+    )
+
+
+def curriculum_cache_key(program):
+    stamp = program.updated_at.timestamp() if program.updated_at else 0
+    return f'{CURRICULUM_CACHE_PREFIX}{program.pk}:{stamp}'
+
+
+def load_curriculum(program):
+    """Снимок учебного плана из кеша или из базы"""
+    key = curriculum_cache_key(program)
+    try:
+        snapshot = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать учебный план из кеша: {e}")
+        snapshot = None
+    if snapshot is not None:
+        return snapshot
+
+    snapshot = build_curriculum_snapshot(program)
+    try:
+        cache.set(key, snapshot, CURRICULUM_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить учебный план в кеш: {e}")
+    return snapshot
+
+
+def build_utp_table(program, curriculum=None):
+    """
+    Формирует данные для тела таблицы УТП, включая темы разделов.
+    Возвращает список списков (строки таблицы, колонки 1-8).
+    """
+    curriculum = curriculum or load_curriculum(program)
+    rows = []
+
+    for section in curriculum.sections:
+        # --- Строка раздела ---
+        section_row = [
+            section.name,                                     # 1 - Наименование
+            section.workload,                                 # 2 - Итого
+            section.contact_hours,                            # 3 - Всего контактной работы
+            section.lecture_hours,                             # 4 - Лекции
+            section.practice_hours,                             # 5 - Практические занятия
+            0,                                                  # 6 - с использованием ДОТ (пока не заполняем)
+            section.selfstudy_hours,                            # 7 - Самостоятельная работа
+            section.attestation_form                            # 8 - Форма аттестации
+        ]
+        rows.append(section_row)
+
+        # --- Темы раздела ---
+        for topic in section.topics:
+            # Общая трудоёмкость темы (если поле workload не заполнено, вычисляем вручную)
+            workload_topic = topic.workload or (
+                topic.lecture_hours +
+                topic.practice_hours +
+                topic.selfstudy_hours +
+                topic.consultation_hours
+            )
+            topic_row = [
+                f"    {topic.name}",                          # отступ для тем
+                workload_topic,                                 # 2 - Итого по теме
+                topic.contact_hours,                            # 3 - Контактная работа
+                topic.lecture_hours,                            # 4 - Лекции
+                topic.practice_hours,                            # 5 - Практика
+                0,                                               # 6 - ДОТ
+                topic.selfstudy_hours,                           # 7 - СР
+                topic.attestation_form                           # 8 - Форма аттестации
+            ]
+            rows.append(topic_row)
+
+    # --- Итоговая аттестация ---
+    final_att = curriculum.final_attestation
+    rows.append([
+        'Итоговая аттестация',
+        final_att,
+        final_att,          # вся итоговая аттестация считается контактной работой
+        0,
+        final_att,
+        0,
+        0,
+        'Итоговая аттестация'
+    ])
+
+    # --- Общий итог по программе ---
+    totals = curriculum.totals
+    rows.append([
+        'Всего академических часов',
+        totals.workload + final_att,
+        totals.contact_hours + final_att,
+        totals.lecture_hours,
+        totals.practice_hours + final_att,
+        0,
+        totals.selfstudy_hours,
+        ''
+    ])
+
+    return rows
+
+
+def build_tgu_table(program, curriculum=None):
+    """Таблица для шаблона ТГУ"""
+    curriculum = curriculum or load_curriculum(program)
+    rows = []
+    roman_numerals = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X']
+
+    for sec_idx, section in enumerate(curriculum.sections, start=1):
+        roman = roman_numerals[sec_idx-1] if sec_idx <= len(roman_numerals) else str(sec_idx)
+        total_sec = section.workload
+        dot_sec = section.dot_hours
+        rows.append([
+            roman,                                          # 1 – № п/п
+            section.name,                                   # 2 – Наименование
+            total_sec,                                       # 3 – Всего, ч.
+            f"{dot_sec} ({dot_sec/total_sec*100:.0f}%)" if total_sec else '0 (0%)',  # 4 – ДОТ, ч/%
+            section.lecture_hours,                           # 5 – Лекции всего
+            0,                                                # 6 – Лекции ДОТ
+            0,                                                # 7 – Лаб. всего
+            0,                                                # 8 – Лаб. ДОТ
+            section.practice_hours,                           # 9 – Практика всего
+            0,                                                # 10 – Практика ДОТ
+            section.selfstudy_hours,                          # 11 – СРС
+            section.attestation_form                          # 12 – Форма контроля
+        ])
+
+        for top_idx, topic in enumerate(section.topics, start=1):
+            total_topic = topic.workload
+            dot_topic = topic.dot_hours
+            rows.append([
+                f"{sec_idx}.{top_idx}",
+                f"    {topic.name}",
+                total_topic,
+                f"{dot_topic} ({dot_topic/total_topic*100:.0f}%)" if total_topic else '0 (0%)',
+                topic.lecture_hours,
+                0,
+                0,
+                0,
+                topic.practice_hours,
+                0,
+                topic.selfstudy_hours,
+                topic.attestation_form
+            ])
+
+    # Итоговая аттестация
+    final_att = curriculum.final_attestation
+    rows.append([
+        '*',
+        'Итоговая аттестация',
+        final_att,
+        '0 (0%)',
+        0,
+        0,
+        0,
+        0,
+        final_att,
+        0,
+        0,
+        'Итоговая аттестация'
+    ])
+
+    # Общий итог
+    totals = curriculum.totals
+    total_workload = totals.workload + final_att
+
+    rows.append([
+        '',
+        'Итого',
+        total_workload,
+        f"{totals.dot_hours} ({totals.dot_hours/total_workload*100:.0f}%)" if total_workload else '0 (0%)',
+        totals.lecture_hours,
+        0,
+        0,
+        0,
+        totals.practice_hours + final_att,
+        0,
+        totals.selfstudy_hours,
+        ''
+    ])
+
+    return rows
+
+
+def build_appendix3_table(program, curriculum=None):
+    """Таблица для шаблона ИРПО"""
+    curriculum = curriculum or load_curriculum(program)
+    rows = []
+
+    for section in curriculum.sections:
+        rows.append([
+            section.name,                                    # 1 – Наименование
+            section.workload,                                 # 2 – Всего, час.
+            section.lecture_hours,                            # 3 – ТЗ (лекции)
+            section.practice_hours,                           # 4 – ПЗ (практика)
+            section.selfstudy_hours,                          # 5 – СР
+            section.consultation_hours,                       # 6 – К (консультации)
+            section.dot_hours,                                # 7 – ДОТ
+            section.attestation_form                          # 8 – Форма аттестации
+        ])
+
+        for topic in section.topics:
+            rows.append([
+                f"    {topic.name}",
+                topic.workload,
+                topic.lecture_hours,
+                topic.practice_hours,
+                topic.selfstudy_hours,
+                topic.consultation_hours,
+                topic.dot_hours,
+                topic.attestation_form
+            ])
+
+    final_att = curriculum.final_attestation
+    rows.append([
+        'Итоговая аттестация',
+        final_att,
+        0,
+        final_att,
+        0,
+        0,
+        0,
+        'Итоговая аттестация'
+    ])
+
+    totals = curriculum.totals
+    rows.append([
+        'Всего ак. часов',
+        totals.workload + final_att,
+        totals.lecture_hours,
+        totals.practice_hours + final_att,
+        totals.selfstudy_hours,
+        totals.consultation_hours,
+        totals.dot_hours,
+        'х'
+    ])
+
+    return rows
@@ -0,0 +1,282 @@
+"""
+XLSX-документы учебного плана (УТП, УТП ТГУ, Приложение 3 ИРПО).
+
+Для каждого вида документа один раз на процесс собирается шаблон: шапка,
+объединения ячеек, ширина колонок и именованные стили. Шаблон хранится
+в памяти байтами; при генерации он загружается, заполняется строками
+таблицы (ячейкам назначается общий именованный стиль, без создания
+Alignment/Font на каждую ячейку) и сохраняется. Готовые файлы кешируются
+по (id программы, вид документа, updated_at программы).
+"""
+import io
+import logging
+import re
+import zipfile
+from functools import lru_cache
+
+import openpyxl
+from django.core.cache import cache
+from openpyxl.styles import Alignment, Font, NamedStyle
+from openpyxl.utils import get_column_letter
+
+from .curriculum import build_appendix3_table, build_tgu_table, build_utp_table, load_curriculum
+
+logger = logging.getLogger(__name__)
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+CURRICULUM_XLSX_CACHE_PREFIX = 'curriculum_xlsx:'
+CURRICULUM_XLSX_CACHE_TIMEOUT = 86400
+
+HEADER_STYLE = 'curriculum_header'
+BODY_STYLE = 'curriculum_body'
+INFO_TITLE_STYLE = 'curriculum_info_title'
+INFO_BOLD_STYLE = 'curriculum_info_bold'
+
+# Excel запрещает в названии листа символы \ / ? * [ ] : и ограничивает его 31 символом
+SHEET_TITLE_INVALID_CHARS = re.compile(r'[\\/?*\[\]:]')
+SHEET_TITLE_MAX_LENGTH = 31
+
+# Документ по федеральному оператору договора (EduAgreement.FederalOperator)
+DOCUMENT_BY_OPERATOR = {
+    'VNII': 'standard',
+    'IRPO': 'appendix3',
+}
+
+APPENDIX3_INFO_ROWS = [
+    ["Приложение 3 к Заявке"],
+    [],
+    ["Учебный план образовательной программы"],
+    [],
+    ["Наименование организации", ""],
+    ["Вид, подвид программы", ""],
+    ["Наименование программы", ""],
+    ["Код категории программы", ""],  # можно заполнить из дополнительного поля, если есть
+]
+APPENDIX3_HEADER_ROW = len(APPENDIX3_INFO_ROWS) + 2  # после информационной части и пустой строки
+
+
+def _named_styles():
+    header = NamedStyle(name=HEADER_STYLE)
+    header.font = Font(bold=True)
+    header.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+
+    body = NamedStyle(name=BODY_STYLE)
+    body.font = Font(name='Calibri', size=11)
+    body.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+
+    info_title = NamedStyle(name=INFO_TITLE_STYLE)
+    info_title.font = Font(bold=True, size=14)
+
+    info_bold = NamedStyle(name=INFO_BOLD_STYLE)
+    info_bold.font = Font(bold=True)
+    return [header, body, info_title, info_bold]
+
+
+def _write_headers(ws, headers, start_row=1):
+    for r_idx, row_data in enumerate(headers, start=start_row):
+        for c_idx, value in enumerate(row_data, start=1):
+            cell = ws.cell(row=r_idx, column=c_idx, value=value)
+            cell.style = HEADER_STYLE
+
+
+def _layout_standard(ws):
+    headers = [
+        ['Наименование разделов (модулей), тем, видов аттестации', 'Трудоемкость, ак. час', '', '', '', '', '', 'Формы аттестации'],
+        ['', 'Итого', 'Виды занятий контактной работы, в т.ч.', '', '', 'В том числе с использованием ДОТ (из ст.3)', 'СР', ''],
+        ['', '', 'Всего контактной работы', 'Л', 'ПЗ, ЛР', '', '', ''],
+        ['1', '2', '3', '4', '5', '6', '7', '8']
+    ]
+    _write_headers(ws, headers)
+    ws.merge_cells(start_row=1, start_column=1, end_row=3, end_column=1)  # A1:A3
+    ws.merge_cells(start_row=1, start_column=2, end_row=1, end_column=7)  # B1:G1 (Трудоемкость)
+    ws.merge_cells(start_row=1, start_column=8, end_row=3, end_column=8)  # H1:H3 (Формы аттестации)
+    ws.merge_cells(start_row=2, start_column=2, end_row=3, end_column=2)  # B2:B3 (Итого)
+    ws.merge_cells(start_row=2, start_column=3, end_row=2, end_column=5)  # C2:E2 (Виды занятий)
+    ws.merge_cells(start_row=2, start_column=6, end_row=3, end_column=6)  # F2:F3 (ДОТ)
+    ws.merge_cells(start_row=2, start_column=7, end_row=3, end_column=7)  # G2:G3 (СР)
+    for col in range(1, 9):
+        ws.column_dimensions[get_column_letter(col)].width = 18
+
+
+def _layout_appendix3(ws):
+    for r_idx, row_data in enumerate(APPENDIX3_INFO_ROWS, start=1):
+        for c_idx, value in enumerate(row_data, start=1):
+            cell = ws.cell(row=r_idx, column=c_idx, value=value)
+            if r_idx == 1:
+                cell.style = INFO_TITLE_STYLE
+            elif r_idx == 3:
+                cell.style = INFO_BOLD_STYLE
+
+    start_row = APPENDIX3_HEADER_ROW
+    headers = [
+        ["Наименование разделов (модулей), тем", "Общая трудоемкость, (час.)", "", "", "", "", "", "Форма аттестации"],
+        ["", "Всего, час.", "в т.ч. по видам занятий, час.", "", "", "", "из них, с применением ДОТ, час.", ""],
+        ["", "", "ТЗ[1]", "ПЗ[2]", "СР[3]", "К[4]", "", ""],
+        ['1', '2', '3', '4', '5', '6', '7', '8']
+    ]
+    _write_headers(ws, headers, start_row)
+    ws.merge_cells(start_row=start_row, start_column=1, end_row=start_row+2, end_column=1)  # "Наименование разделов (модулей), тем"
+    ws.merge_cells(start_row=start_row, start_column=2, end_row=start_row, end_column=7)  # "Общая трудоемкость"
+    ws.merge_cells(start_row=start_row+1, start_column=2, end_row=start_row+2, end_column=2)  # "Всего, час."
+    ws.merge_cells(start_row=start_row+1, start_column=3, end_row=start_row+1, end_column=6)  # "в т.ч. по видам занятий"
+    ws.merge_cells(start_row=start_row+1, start_column=7, end_row=start_row+2, end_column=7)  # из них ДОТ
+    ws.merge_cells(start_row=start_row, start_column=8, end_row=start_row+2, end_column=8)  # Форма аттестации
+    for col in range(1, 9):
+        ws.column_dimensions[get_column_letter(col)].width = 20
+
+
+def _layout_tgu(ws):
+    headers = [
+        # 1-я строка
+        ['№', 'Наименование дисциплин (модулей, курсов), разделов, тем',
+         'Срок освоения / трудоемкость', '',
+         'Контактные часы, в.т.ч. с применением ДОТ', '', '', '', '', '',
+         'СРС, ч.', 'Формы контроля'],
+        # 2-я строка
+        ['', '', '', '', 'лекции', '', 'лабораторные работы', '',
+         'практические и семинарские занятия', '', '', ''],
+        # 3-я строка
+        ['п/п', '', 'Всего, ч.', 'из них с ДОТ, ч / (%)',
+         'Всего, ч', 'из них с ДОТ, ч',
+         'Всего, ч', 'из них с ДОТ, ч',
+         'Всего, ч', 'из них с ДОТ, ч',
+         '', '']
+    ]
+    _write_headers(ws, headers)
+    ws.merge_cells(start_row=1, start_column=1, end_row=2, end_column=1)   # №
+    ws.merge_cells(start_row=1, start_column=2, end_row=3, end_column=2)   # Наименование дисциплин (модулей, курсов), разделов, тем
+    ws.merge_cells(start_row=1, start_column=3, end_row=2, end_column=4)   # Срок освоения / трудоемкость
+    ws.merge_cells(start_row=1, start_column=5, end_row=1, end_column=10)  # Контактные часы ...
+    ws.merge_cells(start_row=2, start_column=5, end_row=2, end_column=6)   # Лекции
+    ws.merge_cells(start_row=2, start_column=7, end_row=2, end_column=8)   # Лабораторные работы
+    ws.merge_cells(start_row=2, start_column=9, end_row=2, end_column=10)  # Практические и семинарские занятия
+    ws.merge_cells(start_row=1, start_column=11, end_row=3, end_column=11)  # СРС, ч
+    ws.merge_cells(start_row=1, start_column=12, end_row=3, end_column=12)  # Формы контроля
+    for col in range(1, 13):
+        ws.column_dimensions[get_column_letter(col)].width = 16
+
+
+class CurriculumDocument:
+    """Вид документа: разметка шаблона, построитель строк таблицы, имя файла и листа"""
+
+    def __init__(self, code, layout, body_start_row, rows, filename, sheet_title, info_cells=None):
+        self.code = code
+        self.layout = layout
+        self.body_start_row = body_start_row
+        self.rows = rows              # rows(program, curriculum) -> список строк таблицы
+        self.filename = filename      # шаблон имени файла, подставляется program
+        self.sheet_title = sheet_title
+        self.info_cells = info_cells  # info_cells(program) -> {(строка, колонка): значение}
+
+
+def safe_sheet_title(title):
+    """Название листа, допустимое в Excel (без запрещённых символов, не длиннее 31 символа)"""
+    title = SHEET_TITLE_INVALID_CHARS.sub(' ', title)
+    title = ' '.join(title.split())[:SHEET_TITLE_MAX_LENGTH].strip(" '")
+    return title or 'Лист1'
+
+
+def _appendix3_info(program):
+    return {
+        (6, 2): program.get_program_type_display(),
+        (7, 2): program.name,
+    }
+
+
+DOCUMENTS = {
+    'standard': CurriculumDocument(
+        'standard', _layout_standard, 5, build_utp_table,
+        filename='program_{program.id}_utp.xlsx', sheet_title='УТП_{program.name}'
+    ),
+    'tgu': CurriculumDocument(
+        'tgu', _layout_tgu, 4, build_tgu_table,
+        filename='TGU_{program.id}.xlsx', sheet_title='УТП_ТГУ'
+    ),
+    'appendix3': CurriculumDocument(
+        'appendix3', _layout_appendix3, APPENDIX3_HEADER_ROW + 4, build_appendix3_table,
+        filename='Appendix3_{program.id}.xlsx', sheet_title='Приложение 3', info_cells=_appendix3_info
+    ),
+}
+
+DOCUMENT_TYPES = tuple(DOCUMENTS)
+
+
+def get_document(document_type):
+    if document_type not in DOCUMENTS:
+        raise ValueError(f"Неизвестный вид документа: {document_type}")
+    return DOCUMENTS[document_type]
+
+
+@lru_cache(maxsize=None)
+def template_bytes(document_type):
+    """Шаблон документа (шапка, объединения, стили) — собирается один раз на процесс"""
+    document = get_document(document_type)
+    wb = openpyxl.Workbook()
+    for style in _named_styles():
+        wb.add_named_style(style)
+    document.layout(wb.active)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def _render(program, document, curriculum):
+    wb = openpyxl.load_workbook(io.BytesIO(template_bytes(document.code)))
+    ws = wb.active
+    ws.title = safe_sheet_title(document.sheet_title.format(program=program))
+    if document.info_cells:
+        for (row, column), value in document.info_cells(program).items():
+            ws.cell(row=row, column=column, value=value)
+
+    for r_idx, row_data in enumerate(document.rows(program, curriculum), start=document.body_start_row):
+        for c_idx, value in enumerate(row_data, start=1):
+            cell = ws.cell(row=r_idx, column=c_idx, value=value)
+            cell.style = BODY_STYLE
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def document_cache_key(program, document_type):
+    stamp = program.updated_at.timestamp() if program.updated_at else 0
+    return f'{CURRICULUM_XLSX_CACHE_PREFIX}{program.pk}:{document_type}:{stamp}'
+
+
+def render_curriculum_xlsx(program, document_type, curriculum=None):
+    """Содержимое XLSX-файла документа программы (из кеша или сгенерированное)"""
+    document = get_document(document_type)
+    key = document_cache_key(program, document_type)
+    try:
+        content = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать документ из кеша: {e}")
+        content = None
+    if content is not None:
+        return content
+
+    content = _render(program, document, curriculum or load_curriculum(program))
+    try:
+        cache.set(key, content, CURRICULUM_XLSX_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить документ в кеш: {e}")
+    return content
+
+
+def curriculum_filename(program, document_type):
+    return get_document(document_type).filename.format(program=program)
+
+
+def document_type_for_agreement(agreement):
+    return DOCUMENT_BY_OPERATOR.get(agreement.federal_operator, 'standard')
+
+
+def curricula_zip(programs, document_type, zip_file):
+    """Пишет в zip_file (путь или файловый объект) учебные планы программ, возвращает их количество"""
+    count = 0
+    with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for program in programs:
+            archive.writestr(curriculum_filename(program, document_type), render_curriculum_xlsx(program, document_type))
+            count += 1
+    return count
@@ -0,0 +1,182 @@
+"""
+Сохранение учебного плана из формы program_details.
+
+Формы разделов и тем сравниваются с загруженными записями: новые записи
+создаются bulk_create, изменённые (по changed_data формы или по новой
+позиции) обновляются bulk_update, удалённые удаляются пачкой — всё в одной
+транзакции. Порядок назначается по позиции формы в формсете в два этапа:
+записи, меняющие позицию, сначала сдвигаются за ORDER_OFFSET, затем
+получают итоговые номера, так что unique_together (program, order) и
+(section, order) не нарушаются на промежуточных шагах. Часы разделов
+с темами пересчитываются одним агрегирующим запросом по всей программе.
+"""
+from collections import defaultdict
+
+from django.db import router, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .curriculum import HOURS_FIELDS
+from .models import ProgramSection, ProgramTopics
+
+# Сдвиг позиций на первом этапе перестановки (больше любого реального номера)
+ORDER_OFFSET = 100000
+
+
+def _model_changes(form):
+    """Изменённые поля модели (без служебных temp_id/section_temp и order)"""
+    return [name for name in form.changed_data if name in form._meta.fields and name != 'order']
+
+
+def _raw_delete(queryset):
+    # Других ссылок на разделы и темы нет; сигналы post_delete только обновляют
+    # updated_at программы, а это делает save_curriculum один раз в конце
+    return queryset._raw_delete(router.db_for_write(queryset.model))
+
+
+def _reserve_positions(model, pks):
+    """Первый этап перестановки: освобождает текущие позиции записей"""
+    if pks:
+        model.objects.filter(pk__in=pks).update(order=F('order') + ORDER_OFFSET)
+
+
+def section_hours(program):
+    """Суммы часов тем по разделам программы одним запросом"""
+    rows = ProgramTopics.objects.filter(section__program=program).values('section').annotate(
+        **{f'total_{field}': Sum(field) for field in HOURS_FIELDS}
+    ).order_by()
+    return {row['section']: {field: row[f'total_{field}'] or 0 for field in HOURS_FIELDS} for row in rows}
+
+
+def save_curriculum(program, section_formset, topics_formset):
+    """
+    Сохраняет валидные формсеты разделов и тем программы и пересчитывает
+    academic_hours. Возвращает словарь со счётчиками изменений.
+    """
+    stats = {
+        'sections_created': 0, 'sections_updated': 0, 'sections_deleted': 0,
+        'topics_created': 0, 'topics_updated': 0, 'topics_deleted': 0,
+    }
+    now = timezone.now()
+
+    with transaction.atomic():
+        # 1. Разделы в порядке формсета; ключи для привязки тем — temp_id и id раздела
+        sections = []  # (форма, раздел)
+        section_index = {}
+        deleted_section_ids = set()
+        for form in section_formset:
+            if form.cleaned_data.get('DELETE'):
+                if form.instance.pk:
+                    deleted_section_ids.add(form.instance.pk)
+                continue
+            if not form.instance.pk and not form.has_changed():
+                continue
+            section = form.save(commit=False)
+            section.program = program
+            temp_id = form.cleaned_data.get('temp_id')
+            if temp_id:
+                section_index[temp_id] = len(sections)
+            if section.pk:
+                section_index[str(section.pk)] = len(sections)
+            sections.append((form, section))
+
+        # 2. Темы по разделам; тема без раздела (или в удаляемом разделе) удаляется
+        topics_by_section = defaultdict(list)
+        deleted_topic_ids = set()
+        for form in topics_formset:
+            if form.cleaned_data.get('DELETE'):
+                if form.instance.pk:
+                    deleted_topic_ids.add(form.instance.pk)
+                continue
+            if not form.instance.pk and not form.has_changed():
+                continue
+            index = section_index.get(form.cleaned_data.get('section_temp'))
+            if index is None:
+                if form.instance.pk:
+                    deleted_topic_ids.add(form.instance.pk)
+                continue
+            topics_by_section[index].append(form)
+
+        # 3. Удаление (темы, перенесённые из удаляемого раздела в другой, сохраняются)
+        if deleted_topic_ids or deleted_section_ids:
+            kept_topic_ids = [form.instance.pk for forms in topics_by_section.values() for form in forms if form.instance.pk]
+            stats['topics_deleted'] = _raw_delete(ProgramTopics.objects.filter(
+                Q(pk__in=deleted_topic_ids) | Q(section_id__in=deleted_section_ids)
+            ).exclude(pk__in=kept_topic_ids))
+        if deleted_section_ids:
+            stats['sections_deleted'] = _raw_delete(ProgramSection.objects.filter(pk__in=deleted_section_ids))
+
+        # 4. Итоговые позиции; записи, которые их меняют, сначала сдвигаются
+        dirty_sections = set()
+        moved_section_ids = []
+        for position, (form, section) in enumerate(sections, start=1):
+            if section.pk:
+                if form.initial.get('order') != position:
+                    moved_section_ids.append(section.pk)
+                    dirty_sections.add(position - 1)
+                elif _model_changes(form):
+                    dirty_sections.add(position - 1)
+            section.order = position
+
+        topics = []  # (тема, изменена ли)
+        moved_topic_ids = []
+        for index, forms in topics_by_section.items():
+            section = sections[index][1]
+            for position, form in enumerate(forms, start=1):
+                topic = form.save(commit=False)
+                moved = topic.pk and (topic.section_id != section.pk or form.initial.get('order') != position)
+                if moved:
+                    moved_topic_ids.append(topic.pk)
+                topic.section = section
+                topic.order = position
+                topics.append((topic, bool(moved or _model_changes(form))))
+
+        _reserve_positions(ProgramSection, moved_section_ids)
+        _reserve_positions(ProgramTopics, moved_topic_ids)
+
+        # 5. Новые разделы (нужны их id для тем), затем темы
+        new_sections = [section for _, section in sections if not section.pk]
+        if new_sections:
+            ProgramSection.objects.bulk_create(new_sections)
+            stats['sections_created'] = len(new_sections)
+
+        new_topics = [topic for topic, _ in topics if not topic.pk]
+        changed_topics = [topic for topic, changed in topics if topic.pk and changed]
+        for topic in changed_topics:
+            topic.updated_at = now
+        if new_topics:
+            ProgramTopics.objects.bulk_create(new_topics)
+            stats['topics_created'] = len(new_topics)
+        if changed_topics:
+            ProgramTopics.objects.bulk_update(
+                changed_topics, topics_formset.form._meta.fields + ['section', 'updated_at']
+            )
+            stats['topics_updated'] = len(changed_topics)
+
+        # 6. Часы разделов с темами — из агрегата; разделы без тем сохраняют значения формы
+        created_ids = {section.pk for section in new_sections}
+        hours = section_hours(program)
+        for index, (form, section) in enumerate(sections):
+            totals = hours.get(section.pk)
+            if totals is None:
+                continue
+            stored = vars(section) if section.pk in created_ids else form.initial
+            if any(stored.get(field) != value for field, value in totals.items()):
+                dirty_sections.add(index)
+            for field, value in totals.items():
+                setattr(section, field, value)
+
+        changed_sections = [sections[index][1] for index in sorted(dirty_sections)]
+        for section in changed_sections:
+            section.updated_at = now
+        if changed_sections:
+            ProgramSection.objects.bulk_update(
+                changed_sections, section_formset.form._meta.fields + ['updated_at']
+            )
+            stats['sections_updated'] = len([section for section in changed_sections if section.pk not in created_ids])
+
+        # 7. Общая трудоёмкость; save обновляет updated_at программы (ключ кеша снимка)
+        program.academic_hours = sum(section.workload or 0 for _, section in sections) + (program.final_attestation or 0)
+        program.save(update_fields=['academic_hours', 'updated_at'])
+
+    return stats
@@ -0,0 +1,207 @@
+"""
+Пакетное изменение потребностей РОИВ из сводной таблицы квот.
+
+Операции create/update/delete проверяются по заранее загруженным квотам,
+РОИВ и потребностям (по одному запросу на таблицу) и применяются в одной
+транзакции: bulk_create для новых потребностей, bulk_update для изменённых,
+записи DemandHistory создаются одним bulk_create. Кеш не сбрасывается:
+кешируемые функции сводки (cache_atlas_data) возвращают заявки Атласа,
+которые от потребностей не зависят, а потребности читаются из базы.
+"""
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ROIV, Demand, DemandHistory, Quota
+
+MAX_OPERATIONS = 500
+
+UPDATE_FIELDS = ['quantity', 'document_link', 'comment', 'status', 'updated_at']
+
+
+class DemandOperationError(Exception):
+    pass
+
+
+def parse_quantity(value):
+    try:
+        quantity = int(value)
+    except (ValueError, TypeError):
+        raise DemandOperationError('Некорректное количество мест')
+    if quantity <= 0:
+        raise DemandOperationError('Количество мест должно быть положительным числом')
+    return quantity
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%d.%m.%Y').date()
+    except (ValueError, TypeError):
+        raise DemandOperationError(f'Некорректная дата: {value} (ожидается ДД.ММ.ГГГГ)')
+
+
+def quantity_change_history(demand, old_quantity, user):
+    """Запись истории об изменении количества (как в Demand.save)"""
+    if demand.quantity > old_quantity:
+        action = DemandHistory.ActionType.INCREASED
+        comment = f'Увеличение с {old_quantity} до {demand.quantity} мест'
+    else:
+        action = DemandHistory.ActionType.DECREASED
+        comment = f'Уменьшение с {old_quantity} до {demand.quantity} мест'
+    return DemandHistory(
+        demand=demand,
+        action=action,
+        quantity_before=old_quantity,
+        quantity_after=demand.quantity,
+        user=user,
+        comment=comment
+    )
+
+
+class DemandBatch:
+    """
+    Применяет список операций над потребностями. Ошибочные операции
+    пропускаются и попадают в results с success=False, остальные применяются.
+
+    Операции — словари в формате manage_demand:
+    {'action': 'create', 'quota_id', 'roiv_id', 'quantity', 'document_link', 'comment', 'start_date', 'end_date'}
+    {'action': 'update', 'demand_id', 'quantity', 'document_link', 'comment', 'status'}
+    {'action': 'delete', 'demand_id'}
+    """
+
+    def __init__(self, user=None):
+        self.user = user
+        self.results = []
+        self._created = []
+        self._changed = {}
+        self._history = []
+
+    def _load(self, operations):
+        quota_ids = {op.get('quota_id') for op in operations if op.get('action') == 'create'}
+        roiv_ids = {op.get('roiv_id') for op in operations if op.get('action') == 'create'}
+        demand_ids = {op.get('demand_id') for op in operations if op.get('action') in ('update', 'delete')}
+        self.quotas = Quota.objects.only('id').in_bulk(_ids(quota_ids))
+        self.roivs = ROIV.objects.only('id', 'region_id').in_bulk(_ids(roiv_ids))
+        self.demands = Demand.objects.in_bulk(_ids(demand_ids))
+
+    def run(self, operations):
+        if len(operations) > MAX_OPERATIONS:
+            raise DemandOperationError(f'Слишком много операций за один запрос (максимум {MAX_OPERATIONS})')
+        for index, op in enumerate(operations):
+            if not isinstance(op, dict):
+                raise DemandOperationError(f'Операция {index} должна быть объектом')
+        self._load(operations)
+
+        for index, op in enumerate(operations):
+            action = op.get('action')
+            handler = getattr(self, f'_{action}', None) if action in ('create', 'update', 'delete') else None
+            try:
+                if handler is None:
+                    raise DemandOperationError(f'Неизвестное действие: {action}')
+                demand, message = handler(op)
+            except DemandOperationError as e:
+                self.results.append({'index': index, 'success': False, 'message': str(e)})
+                continue
+            self.results.append({'index': index, 'success': True, 'demand': demand, 'message': message})
+
+        self._save()
+
+        for result in self.results:
+            if 'demand' in result:
+                result['demand_id'] = result.pop('demand').pk
+        return self.results
+
+    def _demand(self, op):
+        demand = self.demands.get(_id(op.get('demand_id')))
+        if demand is None:
+            raise DemandOperationError(f"Потребность {op.get('demand_id')} не найдена")
+        return demand
+
+    def _create(self, op):
+        quota = self.quotas.get(_id(op.get('quota_id')))
+        if quota is None:
+            raise DemandOperationError(f"Квота {op.get('quota_id')} не найдена")
+        roiv = self.roivs.get(_id(op.get('roiv_id')))
+        if roiv is None:
+            raise DemandOperationError(f"РОИВ {op.get('roiv_id')} не найден")
+
+        demand = Demand(
+            quota_id=quota.pk,
+            roiv_id=roiv.pk,
+            region_id=roiv.region_id,  # Автоматически заполняется из РОИВ
+            quantity=parse_quantity(op.get('quantity')),
+            document_link=op.get('document_link', ''),
+            comment=op.get('comment', ''),
+            start_date=parse_date(op.get('start_date')),
+            end_date=parse_date(op.get('end_date')),
+            created_by=self.user
+        )
+        self._created.append(demand)
+        self._history.append(DemandHistory(
+            demand=demand,
+            action=DemandHistory.ActionType.CREATED,
+            quantity_before=0,
+            quantity_after=demand.quantity,
+            user=self.user,
+            comment=f'Создана потребность на {demand.quantity} мест'
+        ))
+        return demand, 'Потребность успешно создана'
+
+    def _update(self, op):
+        demand = self._demand(op)
+        quantity = parse_quantity(op['quantity']) if 'quantity' in op else demand.quantity
+        status = op.get('status', demand.status)
+        if status not in Demand.DemandStatus.values:
+            raise DemandOperationError(f'Некорректный статус: {status}')
+
+        old_quantity = demand.quantity
+        demand.quantity = quantity
+        demand.document_link = op.get('document_link', demand.document_link)
+        demand.comment = op.get('comment', demand.comment)
+        demand.status = status
+        self._changed[demand.pk] = demand
+        if old_quantity != demand.quantity:
+            self._history.append(quantity_change_history(demand, old_quantity, self.user))
+        return demand, 'Потребность успешно обновлена'
+
+    def _delete(self, op):
+        demand = self._demand(op)
+        demand.status = Demand.DemandStatus.CANCELLED
+        self._changed[demand.pk] = demand
+        self._history.append(DemandHistory(
+            demand=demand,
+            action=DemandHistory.ActionType.CANCELLED,
+            quantity_before=demand.quantity,
+            quantity_after=0,
+            user=self.user,
+            comment='Потребность отменена'
+        ))
+        return demand, 'Потребность отменена'
+
+    def _save(self):
+        now = timezone.now()
+        changed = list(self._changed.values())
+        for demand in changed:
+            demand.updated_at = now
+
+        with transaction.atomic():
+            if self._created:
+                Demand.objects.bulk_create(self._created)
+            if changed:
+                Demand.objects.bulk_update(changed, UPDATE_FIELDS)
+            if self._history:
+                DemandHistory.objects.bulk_create(self._history)
+
+
+def _id(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _ids(values):
+    return [pk for pk in map(_id, values) if pk is not None]
@@ -1,4 +1,5 @@
 from django import forms
+from django.core.exceptions import ValidationError
 from .models import EducationProgram, ProgramSection, ProgramTopics
 
 class EducationProgramForm(forms.ModelForm):
@@ -19,7 +20,20 @@ class EducationProgramForm(forms.ModelForm):
             'DOT': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
 
-class ProgramSectionForm(forms.ModelForm):
+class CurriculumOrderMixin:
+    """
+    Порядок разделов и тем назначается при сохранении по позиции формы
+    (save_curriculum), поэтому присланный order не сверяется с базой
+    """
+    def validate_unique(self):
+        exclude = self._get_validation_exclusions()
+        exclude.add('order')
+        try:
+            self.instance.validate_unique(exclude=exclude)
+        except ValidationError as e:
+            self._update_errors(e)
+
+class ProgramSectionForm(CurriculumOrderMixin, forms.ModelForm):
     temp_id = forms.CharField(widget=forms.HiddenInput(), required=False)
     class Meta:
         model = ProgramSection
@@ -40,7 +54,7 @@ class ProgramSectionForm(forms.ModelForm):
             'DELETE': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
 
-class ProgramTopicsForm(forms.ModelForm):
+class ProgramTopicsForm(CurriculumOrderMixin, forms.ModelForm):
     section_temp = forms.CharField(widget=forms.HiddenInput(), required=False)
     class Meta:
         model = ProgramTopics
@@ -0,0 +1,135 @@
+"""
+Хранилище промежуточных данных двухшагового импорта Excel (анализ → импорт).
+
+Разобранный лист сохраняется на диск под случайным токеном, в сессии остаётся
+только токен. Если установлен pyarrow, таблица пишется в Feather и читается
+через memory map; иначе используется pickle pandas. Старые файлы удаляются по TTL.
+"""
+import json
+import logging
+import os
+import re
+import time
+import uuid
+
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR = getattr(settings, 'IMPORT_STAGING_DIR', os.path.join(settings.BASE_DIR, 'import_staging'))
+STAGING_TTL = getattr(settings, 'IMPORT_STAGING_TTL', 6 * 3600)
+
+TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+
+class StagedImportNotFound(Exception):
+    """Данные по токену не найдены или устарели"""
+
+
+def _paths(token):
+    if not token or not TOKEN_RE.match(str(token)):
+        raise StagedImportNotFound('Некорректный токен импорта')
+    base = os.path.join(STAGING_DIR, token)
+    return f'{base}.json', f'{base}.feather', f'{base}.pkl'
+
+
+def stage_dataframe(df, kind, meta=None):
+    """Сохраняет DataFrame и метаданные, возвращает токен"""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    cleanup_expired()
+
+    token = uuid.uuid4().hex
+    meta_path, feather_path, pickle_path = _paths(token)
+
+    data_format = 'pickle'
+    if feather is not None:
+        try:
+            feather.write_feather(df.reset_index(drop=True), feather_path, compression='uncompressed')
+            data_format = 'feather'
+        except Exception as e:
+            # Колонки со смешанными типами Arrow не сериализует
+            logger.info(f"Feather недоступен для импорта {token}, используем pickle: {e}")
+            if os.path.exists(feather_path):
+                os.remove(feather_path)
+
+    if data_format == 'pickle':
+        df.to_pickle(pickle_path)
+
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'kind': kind,
+            'format': data_format,
+            'created': time.time(),
+            'meta': meta or {},
+        }, f, ensure_ascii=False)
+
+    return token
+
+
+def _read_info(token, kind):
+    meta_path = _paths(token)[0]
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        raise StagedImportNotFound('Данные файла не найдены. Повторите анализ файла.')
+
+    if info.get('kind') != kind or time.time() - info.get('created', 0) > STAGING_TTL:
+        raise StagedImportNotFound('Данные файла устарели. Повторите анализ файла.')
+    return info
+
+
+def get_staged_meta(token, kind):
+    """Метаданные импорта без чтения таблицы (проверка токена перед постановкой задачи)"""
+    return _read_info(token, kind).get('meta', {})
+
+
+def load_staged(token, kind):
+    """Возвращает (DataFrame, метаданные) по токену"""
+    meta_path, feather_path, pickle_path = _paths(token)
+    info = _read_info(token, kind)
+
+    if info['format'] == 'feather':
+        df = feather.read_table(feather_path, memory_map=True).to_pandas()
+    else:
+        df = pd.read_pickle(pickle_path)
+    return df, info.get('meta', {})
+
+
+def discard_staged(token):
+    """Удаляет данные импорта (после успешного импорта)"""
+    try:
+        paths = _paths(token)
+    except StagedImportNotFound:
+        return
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def cleanup_expired(ttl=None):
+    """Удаляет файлы старше TTL, возвращает количество удалённых импортов"""
+    ttl = STAGING_TTL if ttl is None else ttl
+    if not os.path.isdir(STAGING_DIR):
+        return 0
+
+    removed = 0
+    now = time.time()
+    for filename in os.listdir(STAGING_DIR):
+        path = os.path.join(STAGING_DIR, filename)
+        try:
+            if filename.endswith('.json') and now - os.path.getmtime(path) > ttl:
+                discard_staged(filename[:-len('.json')])
+                removed += 1
+            elif not filename.endswith('.json') and now - os.path.getmtime(path) > ttl * 2:
+                # Осиротевшие файлы данных без метаданных
+                os.remove(path)
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from education_planner.models import EducationProgram
+from education_planner.requirement_rules import check_programs
+
+
+class Command(BaseCommand):
+    help = 'Проверяет все программы каталога на соответствие требованиям федеральных операторов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--violations-only',
+            action='store_true',
+            help='Показывать только программы с нарушениями'
+        )
+        parser.add_argument(
+            '--operator',
+            type=str,
+            help='Проверять требования только указанного федерального оператора'
+        )
+
+    def handle(self, *args, **options):
+        programs = list(EducationProgram.objects.order_by('name'))
+        results = check_programs(programs)
+
+        checked = 0
+        with_violations = 0
+        for program in programs:
+            violations = []
+            for operator_name, forms in results[program.pk].items():
+                if options['operator'] and operator_name != options['operator']:
+                    continue
+                for dot_results in forms.values():
+                    for result in dot_results.values():
+                        violations.extend(f"{operator_name}: {message}" for message in result['violations'])
+            checked += 1
+
+            if violations:
+                with_violations += 1
+                self.stdout.write(self.style.WARNING(f"{program.name} ({program.get_study_form_display()}, id={program.pk})"))
+                for violation in violations:
+                    self.stdout.write(f"  - {violation}")
+            elif not options['violations_only']:
+                self.stdout.write(f"{program.name}: требования выполнены")
+
+        style = self.style.WARNING if with_violations else self.style.SUCCESS
+        self.stdout.write(style(f"Проверено программ: {checked}, с нарушениями: {with_violations}"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from education_planner.import_staging import cleanup_expired, STAGING_DIR, STAGING_TTL
+
+
+class Command(BaseCommand):
+    help = 'Удаление устаревших промежуточных файлов импорта Excel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl',
+            type=int,
+            default=STAGING_TTL,
+            help=f'Возраст файлов в секундах, после которого они удаляются (по умолчанию {STAGING_TTL})'
+        )
+
+    def handle(self, *args, **options):
+        removed = cleanup_expired(options['ttl'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено импортов: {removed} (каталог {STAGING_DIR})'))
@@ -1,8 +1,9 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 class ProfActivity(models.Model):
@@ -99,37 +100,22 @@ class ProgramSection(models.Model):
 
     def update_hours_from_topics(self):
             """Пересчитывает часы секции на основе связанных топиков"""
-            total_lecture = self.topics.aggregate(
-                lecture_total=models.Sum('lecture_hours')
-            )['lecture_total'] or 0
-            
-            total_practice = self.topics.aggregate(
-                practice_total=models.Sum('practice_hours')
-            )['practice_total'] or 0
-            
-            total_selfstudy = self.topics.aggregate(
-                selfstudy_total=models.Sum('selfstudy_hours')
-            )['selfstudy_total'] or 0
-            
-            total_consultation = self.topics.aggregate(
-                consultation_total=models.Sum('consultation_hours')
-            )['consultation_total'] or 0
-            
-            total_dot = self.topics.aggregate(
-                dot_total=models.Sum('dot_hours')
-            )['dot_total'] or 0
-            
-            total_workload = self.topics.aggregate(
-                workload_total=models.Sum('workload')
-            )['workload_total'] or 0
+            totals = self.topics.aggregate(
+                lecture_total=models.Sum('lecture_hours'),
+                practice_total=models.Sum('practice_hours'),
+                selfstudy_total=models.Sum('selfstudy_hours'),
+                consultation_total=models.Sum('consultation_hours'),
+                dot_total=models.Sum('dot_hours'),
+                workload_total=models.Sum('workload'),
+            )
             
             # Обновляем поля секции
-            self.lecture_hours = total_lecture
-            self.practice_hours = total_practice
-            self.selfstudy_hours = total_selfstudy
-            self.consultation_hours = total_consultation
-            self.dot_hours = total_dot
-            self.workload = total_workload
+            self.lecture_hours = totals['lecture_total'] or 0
+            self.practice_hours = totals['practice_total'] or 0
+            self.selfstudy_hours = totals['selfstudy_total'] or 0
+            self.consultation_hours = totals['consultation_total'] or 0
+            self.dot_hours = totals['dot_total'] or 0
+            self.workload = totals['workload_total'] or 0
             
             self.save(update_fields=[
                 'lecture_hours', 'practice_hours', 'selfstudy_hours',
@@ -175,6 +161,16 @@ def update_section_hours_on_topic_save(sender, instance, **kwargs):
     if instance.section:
         instance.section.update_hours_from_topics()
 
+@receiver([post_save, post_delete], sender=ProgramSection)
+def touch_program_on_section_change(sender, instance, **kwargs):
+    """Обновляет updated_at программы: по нему кешируется снимок учебного плана"""
+    EducationProgram.objects.filter(pk=instance.program_id).update(updated_at=timezone.now())
+
+@receiver(post_delete, sender=ProgramTopics)
+def touch_program_on_topic_delete(sender, instance, **kwargs):
+    """Сохранение темы обновляет раздел (и программу) через update_hours_from_topics, удаление — нет"""
+    EducationProgram.objects.filter(sections=instance.section_id).update(updated_at=timezone.now())
+
 class Region(models.Model):
     """Модель для хранения регионов реализации программ"""
     name = models.CharField(_('Название региона'), max_length=255, unique=True)
@@ -203,6 +199,69 @@ class RegionAltNames(models.Model):
         return self.name
 
 
+class EduAgreementQuerySet(models.QuerySet):
+    """Договоры с итогами по актуальным квотам, посчитанными в SQL"""
+
+    def with_totals(self):
+        """
+        Аннотирует договоры одним запросом:
+        quota_source — откуда берутся действующие квоты ('supplement', 'agreement', 'none'),
+        active_quota_places, active_quota_cost, active_quota_count — итоги по ним,
+        latest_supplement_number, latest_supplement_date — последнее подписанное допсоглашение.
+        """
+        signed_supplements = Supplement.objects.filter(
+            agreement=models.OuterRef('pk'),
+            status=Supplement.SupplementStatus.SIGNED
+        ).order_by('-signing_date', '-created_at')
+        active_quotas = Quota.objects.filter(
+            agreement=models.OuterRef('pk'),
+            is_active=True
+        ).order_by().values('agreement')
+
+        def active_quota_total(aggregate, output_field):
+            subquery = models.Subquery(
+                active_quotas.annotate(total=aggregate).values('total'),
+                output_field=output_field
+            )
+            return models.Case(
+                models.When(quota_source='none', then=models.Value(0)),
+                default=Coalesce(subquery, models.Value(0)),
+                output_field=output_field
+            )
+
+        money = models.DecimalField(max_digits=14, decimal_places=2)
+        return self.annotate(
+            quota_source=models.Case(
+                models.When(models.Exists(signed_supplements), then=models.Value('supplement')),
+                models.When(
+                    status__in=[EduAgreement.AgreementStatus.SIGNED, EduAgreement.AgreementStatus.COMPLETED],
+                    then=models.Value('agreement')
+                ),
+                default=models.Value('none'),
+                output_field=models.CharField()
+            ),
+            latest_supplement_number=models.Subquery(signed_supplements.values('number')[:1]),
+            latest_supplement_date=models.Subquery(signed_supplements.values('signing_date')[:1]),
+        ).annotate(
+            active_quota_places=active_quota_total(models.Sum('quantity'), models.IntegerField()),
+            active_quota_cost=active_quota_total(
+                models.Sum(models.F('quantity') * models.F('cost_per_quota'), output_field=money),
+                money
+            ),
+            active_quota_count=active_quota_total(models.Count('id'), models.IntegerField()),
+        )
+
+    def with_active_quotas(self):
+        """Предзагружает активные квоты в атрибут active_quotas (используется get_actual_quotas)"""
+        return self.prefetch_related(
+            models.Prefetch(
+                'quotas',
+                queryset=Quota.objects.filter(is_active=True).select_related('education_program').prefetch_related('regions'),
+                to_attr='active_quotas'
+            )
+        )
+
+
 class EduAgreement(models.Model):
     """Модель для хранения договоров на обучение с федеральными операторами"""
     
@@ -235,6 +294,8 @@ class EduAgreement(models.Model):
     notes = models.TextField(_('Примечания'), blank=True)
     created_at = models.DateTimeField(_('Дата создания'), auto_now_add=True)
     updated_at = models.DateTimeField(_('Дата обновления'), auto_now=True)
+
+    objects = EduAgreementQuerySet.as_manager()
     
     class Meta:
         verbose_name = _('Договор на обучение')
@@ -249,6 +310,10 @@ class EduAgreement(models.Model):
         Возвращает актуальные квоты с учетом дополнительных соглашений.
         Приоритет: последнее подписанное дополнительное соглашение > основной договор (если подписан/выполнен)
         """
+        if hasattr(self, 'quota_source') and hasattr(self, 'active_quotas'):
+            # Договор загружен через with_totals().with_active_quotas()
+            return self.active_quotas if self.quota_source != 'none' else []
+
         # Ищем последнее подписанное дополнительное соглашение
         signed_supplements = self.supplements.filter(
             status=Supplement.SupplementStatus.SIGNED
@@ -269,10 +334,14 @@ class EduAgreement(models.Model):
     
     def get_total_quota_places(self):
         """Возвращает общее количество мест по всем квотам"""
+        if hasattr(self, 'active_quota_places'):
+            return self.active_quota_places
         return sum(getattr(quota, 'actual_quantity', quota.quantity) for quota in self.get_actual_quotas())
     
     def get_total_agreement_cost(self):
         """Возвращает общую стоимость всех квот по договору"""
+        if hasattr(self, 'active_quota_cost'):
+            return self.active_quota_cost
         return sum(quota.total_cost for quota in self.get_actual_quotas())
     
     def get_formatted_total_cost(self):
@@ -281,6 +350,9 @@ class EduAgreement(models.Model):
     
     def get_quota_status_info(self):
         """Возвращает информацию о статусе квот (какие действуют и почему)"""
+        if hasattr(self, 'quota_source'):
+            return self._quota_status_info_from_annotations()
+
         signed_supplements = self.supplements.filter(
             status=Supplement.SupplementStatus.SIGNED
         ).order_by('-signing_date', '-created_at')
@@ -303,6 +375,23 @@ class EduAgreement(models.Model):
                 'message': 'Квоты не действуют (договор не подписан, нет подписанных дополнительных соглашений)'
             }
 
+    def _quota_status_info_from_annotations(self):
+        """get_quota_status_info для договора из with_totals() (без объекта допсоглашения)"""
+        if self.quota_source == 'supplement':
+            return {
+                'source': 'supplement',
+                'message': f'Действуют квоты по дополнительному соглашению №{self.latest_supplement_number} от {self.latest_supplement_date or "без даты"}'
+            }
+        if self.quota_source == 'agreement':
+            return {
+                'source': 'agreement',
+                'message': f'Действуют квоты основного договора №{self.number}'
+            }
+        return {
+            'source': 'none',
+            'message': 'Квоты не действуют (договор не подписан, нет подписанных дополнительных соглашений)'
+        }
+
 
 class Quota(models.Model):
     """Модель для хранения квот по договорам"""
@@ -656,9 +745,7 @@ class Demand(models.Model):
         
         if not is_new:
             # Получаем старое значение количества
-            old_demand = Demand.objects.filter(pk=self.pk).first()
-            if old_demand:
-                old_quantity = old_demand.quantity
+            old_quantity = Demand.objects.filter(pk=self.pk).values_list('quantity', flat=True).first()
         
         super().save(*args, **kwargs)
         
@@ -863,4 +950,13 @@ class Requirement(models.Model):
     right_num_type = models.CharField(choices=HoursType.choices, verbose_name='Требуемое количество от')
 
     def __str__(self):
-        return str(self.pk)
\ No newline at end of file
+        return str(self.pk)
+
+
+@receiver([post_save, post_delete], sender=FederalOperator)
+@receiver([post_save, post_delete], sender=ProgramRequirements)
+@receiver([post_save, post_delete], sender=Requirement)
+def invalidate_requirement_rules(sender, instance, **kwargs):
+    """Сбрасывает скомпилированные требования при их изменении"""
+    from .requirement_rules import invalidate_rule_sets
+    invalidate_rule_sets()
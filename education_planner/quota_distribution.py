@@ -0,0 +1,78 @@
+"""
+Распределение квоты между регионами.
+
+Строка квоты блокируется (select_for_update), так что два планировщика,
+распределяющие одну квоту, выполняются по очереди. Все распределения
+записываются одним bulk_create с update_conflicts по ключу (quota, region),
+распределения по регионам, которых нет в запросе, удаляются одним запросом.
+Сумма выделенных мест проверяется агрегатом в базе уже после записи;
+превышение откатывает транзакцию.
+"""
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Quota, QuotaDistribution, Region
+
+
+class QuotaDistributionError(Exception):
+    pass
+
+
+def parse_distributions(distributions):
+    """[{'region_id', 'quantity'}, ...] -> {id региона: количество}"""
+    if not isinstance(distributions, list):
+        raise QuotaDistributionError('Ожидается список распределений')
+
+    allocated = {}
+    for dist in distributions:
+        try:
+            region_id = int(dist['region_id'])
+            quantity = int(dist['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise QuotaDistributionError(f'Некорректное распределение: {dist}')
+        if quantity < 0:
+            raise QuotaDistributionError('Количество мест не может быть отрицательным')
+        if region_id in allocated:
+            raise QuotaDistributionError(f'Регион {region_id} указан несколько раз')
+        allocated[region_id] = quantity
+    return allocated
+
+
+def save_quota_distribution(quota_id, distributions):
+    """
+    Заменяет распределение квоты переданным. Возвращает заблокированную
+    и обновлённую квоту; при ошибке ничего не меняет.
+    """
+    allocated = parse_distributions(distributions)
+    regions = Region.objects.in_bulk(list(allocated))
+    missing = sorted(set(allocated) - set(regions))
+    if missing:
+        raise QuotaDistributionError(f"Регионы не найдены: {', '.join(map(str, missing))}")
+
+    with transaction.atomic():
+        try:
+            quota = Quota.objects.select_for_update().get(pk=quota_id)
+        except (Quota.DoesNotExist, ValueError, TypeError):
+            raise QuotaDistributionError(f'Квота {quota_id} не найдена')
+
+        quota.distributions.exclude(region_id__in=list(allocated)).delete()
+        if allocated:
+            now = timezone.now()
+            QuotaDistribution.objects.bulk_create(
+                [
+                    QuotaDistribution(quota=quota, region_id=region_id, allocated_quantity=quantity, updated_at=now)
+                    for region_id, quantity in allocated.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['quota', 'region'],
+                update_fields=['allocated_quantity', 'updated_at'],
+            )
+
+        # Проверяем сумму в базе: включает всё, что записано под блокировкой квоты
+        total_allocated = quota.distributions.aggregate(total=Sum('allocated_quantity'))['total'] or 0
+        if total_allocated > quota.quantity:
+            raise QuotaDistributionError(
+                f'Сумма распределений ({total_allocated}) превышает квоту ({quota.quantity})'
+            )
+    return quota
@@ -0,0 +1,435 @@
+"""
+Пакетный импорт квот из Excel (шаблон квот и файл дополнительного соглашения).
+
+Таблица чистится целиком средствами pandas, договоры и программы загружаются
+одним запросом, регионы разрешаются в памяти через RegionResolver.
+Квоты и связи квота–регион создаются через bulk_create в одной транзакции.
+Результат — отчёт со счётчиками, ошибками по строкам и списком созданных квот.
+"""
+import re
+
+import pandas as pd
+from django.db import transaction
+
+from .models import EduAgreement, EducationProgram, Quota, Region
+from .region_resolver import RegionResolver
+
+BATCH_SIZE = 500
+
+QUOTA_REQUIRED_COLUMNS = [
+    'договор_номер', 'программа_название', 'программа_тип', 'программа_часы',
+    'программа_форма', 'регионы', 'количество', 'стоимость_за_заявку'
+]
+
+DATE_FORMATS = ['%d.%m.%Y', '%Y-%m-%d', '%d/%m/%Y']
+
+PROGRAM_TYPE_CHOICES = {
+    'дпо пк': EducationProgram.ProgramType.ADVANCED,
+    'повышение квалификации': EducationProgram.ProgramType.ADVANCED,
+    'профессиональная переподготовка': EducationProgram.ProgramType.PROFESSIONAL_RE,
+    'профессиональное обучение': EducationProgram.ProgramType.PROFESSIONAL,
+    'программы профессионального обучения': EducationProgram.ProgramType.PROFESSIONAL,
+}
+
+STUDY_FORM_CHOICES = {
+    'очная': EducationProgram.StudyForm.FULL_TIME,
+    'заочная': EducationProgram.StudyForm.DISTANCE,
+    'очно-заочная': EducationProgram.StudyForm.PART_TIME,
+    'дистанционная': EducationProgram.StudyForm.DISTANCE,
+}
+
+
+def clean_text_series(series):
+    """Векторный аналог clean_text_data: пустые значения → '', пробельные символы схлопываются"""
+    return (
+        series.where(series.notna(), '')
+        .astype(str)
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+
+
+def parse_number_series(series):
+    """Числа из колонки: пробелы, валюта и десятичная запятая допускаются, остальное → NaN"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    text = (
+        clean_text_series(series)
+        .str.replace(r'\s', '', regex=True)
+        .str.replace(',', '.', regex=False)
+        .str.replace(r'[^\d.\-]', '', regex=True)
+    )
+    return pd.to_numeric(text, errors='coerce')
+
+
+def parse_date_series(series):
+    """
+    Даты из колонки: ячейки-даты Excel берутся как есть, строки разбираются
+    по DATE_FORMATS. Возвращает (даты, маска непустых нераспознанных значений).
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        parsed = series
+    else:
+        is_date = series.map(lambda value: hasattr(value, 'year'))
+        parsed = pd.to_datetime(series.where(is_date), errors='coerce')
+        text = clean_text_series(series.where(~is_date))
+        for date_format in DATE_FORMATS:
+            parsed = parsed.fillna(pd.to_datetime(text, format=date_format, errors='coerce'))
+    invalid = parsed.isna() & (clean_text_series(series.astype(object)) != '')
+    return parsed.dt.date.astype(object).where(parsed.notna(), None), invalid
+
+
+def split_region_names(regions_text):
+    """Названия регионов из ячейки: через запятую, без пояснений в скобках"""
+    names = []
+    for name in regions_text.split(','):
+        cleaned_name = re.sub(r'\([^)]*\)', '', name)
+        cleaned_name = re.sub(r'\s+', ' ', cleaned_name).strip()
+        if cleaned_name:
+            names.append((name.strip(), cleaned_name))
+    return names
+
+
+class QuotaBulkImporter:
+    """
+    Общий движок импорта квот.
+
+    region_mappings — выбор пользователя для нераспознанных регионов
+    ({'название': {'action': 'map'|'create'|'skip', ...}}), create_regions —
+    старая логика с автоматическим созданием регионов. В строгом режиме (шаблон
+    квот) проблемные строки считаются ошибками, в нестрогом (доп. соглашение)
+    — молча пропускаются и попадают только в skipped.
+    """
+
+    def __init__(self, region_mappings=None, create_regions=False, dry_run=False, region_resolver=None,
+                 progress=None):
+        self.region_mappings = region_mappings or {}
+        # progress(обработано, всего) вызывается после каждой пачки строк
+        self.progress = progress
+        self.create_regions = create_regions
+        self.dry_run = dry_run
+        self.region_resolver = region_resolver or RegionResolver()
+        self._region_cache = {}
+        self.report = {
+            'dry_run': dry_run,
+            'total_rows': 0,
+            'created_count': 0,
+            'error_count': 0,
+            'skipped_count': 0,
+            'errors': [],
+            'warnings': [],
+            'skipped': [],
+            'created_programs': [],
+            'created_regions': [],
+            'quotas': [],
+        }
+
+    # --- Подготовка таблиц ---
+
+    def prepare_quota_frame(self, df):
+        """Шаблон квот (колонки QUOTA_REQUIRED_COLUMNS + необязательные даты)"""
+        frame = pd.DataFrame(index=df.index)
+        frame['row'] = df.index + 2
+        frame['agreement_number'] = clean_text_series(df['договор_номер'])
+        frame['program_name'] = clean_text_series(df['программа_название'])
+        frame['program_type'] = clean_text_series(df['программа_тип']).str.lower()
+        frame['study_form'] = clean_text_series(df['программа_форма']).str.lower()
+        frame['hours'] = parse_number_series(df['программа_часы'])
+        frame['regions_text'] = clean_text_series(df['регионы'])
+        frame['quantity'] = parse_number_series(df['количество'])
+        frame['cost'] = parse_number_series(df['стоимость_за_заявку'])
+        self._add_dates(frame, df, 'дата_начала', 'дата_окончания')
+        return frame
+
+    def prepare_supplement_frame(self, df, agreement):
+        """Файл дополнительного соглашения; для ВНИИ регионы и даты не учитываются"""
+        frame = pd.DataFrame(index=df.index)
+        frame['row'] = df.index + 2
+        frame['agreement_number'] = agreement.number
+        frame['program_name'] = clean_text_series(df['Программа обучения'])
+        frame['program_type'] = ''
+        frame['study_form'] = self._optional_text(df, 'Форма обучения').str.lower()
+        frame['hours'] = pd.to_numeric(
+            self._optional_text(df, 'Длительность').str.extract(r'(\d+)', expand=False),
+            errors='coerce'
+        )
+        frame['regions_text'] = self._optional_text(df, 'Регионы реализации')
+        frame['quantity'] = parse_number_series(df['Количество мест'])
+        frame['cost'] = parse_number_series(df['Стоимость за заявку']) if 'Стоимость за заявку' in df.columns else 0.0
+        self._add_dates(frame, df, 'Дата начала', 'Дата окончания')
+
+        if agreement.federal_operator == 'VNII':
+            frame['regions_text'] = ''
+            frame['start_date'] = None
+            frame['end_date'] = None
+            frame['start_date_invalid'] = False
+            frame['end_date_invalid'] = False
+        return frame
+
+    @staticmethod
+    def _optional_text(df, column):
+        if column in df.columns:
+            return clean_text_series(df[column])
+        return pd.Series('', index=df.index)
+
+    @staticmethod
+    def _add_dates(frame, df, start_column, end_column):
+        for column, target in ((start_column, 'start_date'), (end_column, 'end_date')):
+            if column in df.columns:
+                frame[target], frame[f'{target}_invalid'] = parse_date_series(df[column])
+            else:
+                frame[target] = None
+                frame[f'{target}_invalid'] = False
+
+    # --- Импорт ---
+
+    def import_quotas(self, df):
+        """Импорт из шаблона квот, каждая проблемная строка — ошибка"""
+        return self.run(self.prepare_quota_frame(df), strict=True)
+
+    def import_supplement(self, df, agreement):
+        """Импорт квот доп. соглашения к agreement, проблемные строки пропускаются"""
+        return self.run(
+            self.prepare_supplement_frame(df, agreement),
+            strict=False,
+            agreements={agreement.number: agreement},
+            program_description='Автоматически создана при анализе доп. соглашения',
+        )
+
+
+    def run(self, frame, strict=True, agreements=None,
+            program_description='Автоматически создана при импорте квот'):
+        """Создаёт квоты по подготовленной таблице, возвращает отчёт"""
+        self.strict = strict
+        self.program_description = program_description
+        self.report['total_rows'] = len(frame)
+
+        if agreements is None:
+            numbers = set(frame['agreement_number']) - {''}
+            agreements = {agreement.number: agreement for agreement in EduAgreement.objects.filter(number__in=numbers)}
+        self._agreements = agreements
+        self._load_programs(frame)
+
+        with transaction.atomic():
+            planned = []
+            for position, row in enumerate(frame.itertuples(index=False), 1):
+                plan = self._plan_row(row)
+                if plan:
+                    planned.append(plan)
+                if self.progress and (position % BATCH_SIZE == 0 or position == len(frame)):
+                    self.progress(position, len(frame))
+
+            # Новые программы — одним запросом, до квот, чтобы у них появились id
+            EducationProgram.objects.bulk_create(self._new_programs, batch_size=BATCH_SIZE)
+
+            quotas = [
+                Quota(
+                    agreement=plan['agreement'],
+                    education_program=plan['program'],
+                    quantity=plan['quantity'],
+                    cost_per_quota=plan['cost'],
+                    start_date=plan['start_date'],
+                    end_date=plan['end_date'],
+                    is_active=True,
+                )
+                for plan in planned
+            ]
+            Quota.objects.bulk_create(quotas, batch_size=BATCH_SIZE)
+
+            through = Quota.regions.through
+            through.objects.bulk_create(
+                [
+                    through(quota_id=quota.id, region_id=region.id)
+                    for quota, plan in zip(quotas, planned)
+                    for region in plan['regions']
+                ],
+                batch_size=BATCH_SIZE,
+            )
+
+            self.report['created_count'] = len(quotas)
+            self.report['quotas'] = [
+                {
+                    'id': quota.id,
+                    'row': plan['row'],
+                    'agreement': plan['agreement'].number,
+                    'program': plan['program'].name,
+                    'regions': [region.name for region in plan['regions']],
+                    'quantity': plan['quantity'],
+                }
+                for quota, plan in zip(quotas, planned)
+            ]
+
+            if self.dry_run:
+                # Программы, регионы и квоты откатываются, остаётся только отчёт
+                transaction.set_rollback(True)
+
+        return self.report
+
+    def _reject(self, row, message):
+        """Строка не импортируется: ошибка в строгом режиме, пропуск — в нестрогом"""
+        message = f'Строка {row.row}: {message}'
+        if self.strict:
+            self.report['errors'].append(message)
+            self.report['error_count'] += 1
+        else:
+            self.report['skipped'].append(message)
+            self.report['skipped_count'] += 1
+        return None
+
+    def _warn(self, row, message):
+        self.report['warnings'].append(f'Строка {row.row}: {message}')
+
+    def _plan_row(self, row):
+        """Проверяет строку и возвращает данные будущей квоты или None"""
+        if not row.agreement_number or not row.program_name:
+            return self._reject(row, 'Отсутствуют обязательные данные')
+
+        agreement = self._agreements.get(row.agreement_number)
+        if not agreement:
+            return self._reject(row, f'Договор {row.agreement_number} не найден')
+
+        # Для ВНИИ регионы не обязательны
+        regions_required = agreement.federal_operator != 'VNII'
+        if regions_required and not row.regions_text:
+            return self._reject(row, 'Отсутствуют обязательные данные')
+
+        if pd.isna(row.hours) or row.hours <= 0:
+            return self._reject(row, 'Не указана длительность программы')
+
+        if pd.isna(row.quantity) or row.quantity < 0 or (not self.strict and row.quantity == 0):
+            return self._reject(row, 'Неверное количество мест')
+
+        if pd.isna(row.cost):
+            if self.strict:
+                return self._reject(row, 'Неверная стоимость за заявку')
+            cost = 0
+        else:
+            cost = round(float(row.cost), 2)
+
+        regions = self._resolve_regions(row)
+        if regions_required and not regions:
+            return self._reject(row, 'Не найдено ни одного региона')
+
+        if row.start_date_invalid:
+            self._warn(row, 'Неверный формат даты начала')
+        if row.end_date_invalid:
+            self._warn(row, 'Неверный формат даты окончания')
+        if row.start_date and row.end_date and row.start_date > row.end_date:
+            return self._reject(row, 'Дата начала не может быть позже даты окончания')
+
+        return {
+            'row': row.row,
+            'agreement': agreement,
+            'program': self._find_program(row),
+            'regions': regions,
+            'quantity': int(row.quantity),
+            'cost': cost,
+            'start_date': row.start_date,
+            'end_date': row.end_date,
+        }
+
+    # --- Программы ---
+
+    def _load_programs(self, frame):
+        """Программы со встречающимися в файле длительностями — одним запросом"""
+        hours = {int(value) for value in frame['hours'].dropna() if value > 0}
+        self._programs_by_hours = {}
+        self._program_cache = {}
+        self._new_programs = []
+        for program in EducationProgram.objects.filter(academic_hours__in=hours).order_by('name'):
+            self._programs_by_hours.setdefault(program.academic_hours, []).append(program)
+
+    def _find_program(self, row):
+        """
+        Первая по алфавиту программа той же длительности, название которой
+        содержит название из файла (как name__icontains), иначе — новая программа.
+        """
+        hours = int(row.hours)
+        key = (row.program_name.lower(), hours)
+        if key in self._program_cache:
+            return self._program_cache[key]
+
+        candidates = self._programs_by_hours.setdefault(hours, [])
+        program = next((p for p in candidates if key[0] in p.name.lower()), None)
+        if program is None:
+            program = EducationProgram(
+                name=row.program_name,
+                program_type=PROGRAM_TYPE_CHOICES.get(row.program_type, EducationProgram.ProgramType.ADVANCED),
+                academic_hours=hours,
+                study_form=STUDY_FORM_CHOICES.get(row.study_form, EducationProgram.StudyForm.FULL_TIME),
+                description=self.program_description,
+            )
+            self._new_programs.append(program)
+            candidates.append(program)
+            candidates.sort(key=lambda p: p.name)
+            self.report['created_programs'].append(f'Строка {row.row}: Создана программа "{program.name}"')
+
+        self._program_cache[key] = program
+        return program
+
+    # --- Регионы ---
+
+    def _resolve_regions(self, row):
+        regions = []
+        for raw_name, region_name in split_region_names(row.regions_text):
+            if region_name not in self._region_cache:
+                self._region_cache[region_name] = self._resolve_region(raw_name, region_name)
+            region, message = self._region_cache[region_name]
+            if message:
+                self._warn(row, message)
+            if region and region not in regions:
+                regions.append(region)
+        return regions
+
+    def _resolve_region(self, raw_name, region_name):
+        """Возвращает (регион или None, сообщение для отчёта или None)"""
+        mapping = self.region_mappings.get(region_name) or self.region_mappings.get(raw_name)
+        if mapping:
+            return self._apply_mapping(mapping)
+
+        if self.create_regions:
+            region, message = self.region_resolver.find_or_create(region_name)
+            if region and message:
+                self.report['created_regions'].append(region.name)
+            return region, message
+
+        region, match_type = self.region_resolver.resolve(region_name)
+        if region:
+            return region, None
+        return None, f'Регион "{region_name}" не найден и не настроен'
+
+    def _apply_mapping(self, mapping):
+        """Выбор пользователя для нераспознанного региона"""
+        action = mapping.get('action')
+
+        if action == 'map':
+            if 'region_id' in mapping:
+                region = self.region_resolver.get_by_id(mapping['region_id'])
+                if region:
+                    return region, None
+                return None, f'Выбранный регион (ID: {mapping["region_id"]}) не найден'
+            region, match_type = self.region_resolver.resolve(mapping.get('target_region'))
+            if region:
+                return region, None
+            return None, f'Выбранный регион "{mapping.get("target_region")}" не найден'
+
+        if action == 'create':
+            new_region_name = mapping['new_name']
+            existing_region = self.region_resolver.get_exact(new_region_name)
+            if existing_region:
+                return existing_region, None
+            try:
+                with transaction.atomic():
+                    new_region = Region.objects.create(
+                        name=new_region_name,
+                        code=new_region_name[:10].upper().replace(' ', '_').replace('-', '_'),
+                        is_active=True
+                    )
+            except Exception as e:
+                return None, f'Ошибка создания региона "{new_region_name}": {str(e)}'
+            self.region_resolver.add(new_region)
+            self.report['created_regions'].append(new_region.name)
+            return new_region, None
+
+        # action == 'skip'
+        return None, None
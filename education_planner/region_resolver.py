@@ -0,0 +1,218 @@
+"""
+Сопоставление названий регионов из файлов импорта с регионами в базе.
+
+Регионы и их псевдонимы (RegionAltNames) загружаются один раз на импорт,
+дальше все поиски идут в памяти без запросов к БД.
+"""
+import re
+from collections import defaultdict
+
+from .models import Region, RegionAltNames
+
+# Ключевые слова (города, сокращения) → стандартное название региона
+REGION_KEYWORDS = {
+    'москва': 'Москва',
+    'московская': 'Московская область',
+    'спб': 'Санкт-Петербург',
+    'санкт-петербург': 'Санкт-Петербург',
+    'ленинградская': 'Ленинградская область',
+    'екатеринбург': 'Свердловская область',
+    'новосибирск': 'Новосибирская область',
+    'казань': 'Республика Татарстан',
+    'нижний новгород': 'Нижегородская область',
+    'челябинск': 'Челябинская область',
+    'омск': 'Омская область',
+    'самара': 'Самарская область',
+    'ростов': 'Ростовская область',
+    'уфа': 'Республика Башкортостан',
+    'красноярск': 'Красноярский край',
+    'воронеж': 'Воронежская область',
+    'пермь': 'Пермский край',
+    'волгоград': 'Волгоградская область',
+}
+
+
+def normalize_region_name(name):
+    """Нормализованное название: нижний регистр, ё → е, одиночные пробелы"""
+    if not name:
+        return ''
+    name = str(name).lower().replace('ё', 'е')
+    return re.sub(r'\s+', ' ', name).strip()
+
+
+def _tokens(name):
+    return set(re.findall(r'[\w-]+', name))
+
+
+def _trigrams(name):
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class RegionResolver:
+    """
+    Индексы регионов в памяти.
+
+    Порядок поиска тот же, что был в find_region_without_creating:
+    точное совпадение (теперь включая псевдонимы) → регион содержит название →
+    регион содержит первое слово → ключевые слова. Для ненайденных названий
+    suggest() возвращает похожие регионы, отсортированные по сходству триграмм.
+    """
+
+    def __init__(self):
+        self.regions = []
+        self._by_id = {}
+        self._names = []
+        self._exact = {}
+        self._aliases = {}
+        self._tokens = defaultdict(set)
+        self._trigrams = defaultdict(set)
+        self._cache = {}
+        self.load()
+
+    def load(self):
+        """Загружает регионы и псевдонимы (два запроса)"""
+        self.regions = list(Region.objects.order_by('name'))
+        self._by_id = {region.id: region for region in self.regions}
+        self._names = [(normalize_region_name(region.name), region) for region in self.regions]
+
+        self._exact = {}
+        self._aliases = {}
+        self._tokens = defaultdict(set)
+        self._trigrams = defaultdict(set)
+        self._cache = {}
+
+        for normalized, region in self._names:
+            self._index(normalized, region)
+            self._exact.setdefault(normalized, region)
+
+        for alias, region_id in RegionAltNames.objects.values_list('name', 'region_id'):
+            region = self._by_id.get(region_id)
+            if region:
+                normalized = normalize_region_name(alias)
+                self._aliases.setdefault(normalized, region)
+                self._index(normalized, region)
+
+    def _index(self, normalized, region):
+        for token in _tokens(normalized):
+            self._tokens[token].add(region.id)
+        for trigram in _trigrams(normalized):
+            self._trigrams[trigram].add(region.id)
+
+    def add(self, region):
+        """Добавляет в индексы регион, созданный во время импорта"""
+        normalized = normalize_region_name(region.name)
+        self.regions.append(region)
+        self.regions.sort(key=lambda r: r.name)
+        self._by_id[region.id] = region
+        self._names = [(normalize_region_name(r.name), r) for r in self.regions]
+        self._exact.setdefault(normalized, region)
+        self._index(normalized, region)
+        self._cache = {}
+
+    def get_by_id(self, region_id):
+        try:
+            return self._by_id.get(int(region_id))
+        except (TypeError, ValueError):
+            return None
+
+    def get_exact(self, region_name):
+        """Регион с точно таким названием (без учёта регистра) или None"""
+        return self._exact.get(normalize_region_name(region_name))
+
+    def _first_containing(self, fragment):
+        """Первый по алфавиту регион, название которого содержит fragment (аналог name__icontains)"""
+        for normalized, region in self._names:
+            if fragment in normalized:
+                return region
+        return None
+
+    def resolve(self, region_name):
+        """Возвращает (регион или None, тип совпадения)"""
+        normalized = normalize_region_name(region_name)
+        if not normalized:
+            return None, 'empty_name'
+
+        if normalized in self._cache:
+            return self._cache[normalized]
+
+        result = self._resolve(normalized)
+        self._cache[normalized] = result
+        return result
+
+    def _resolve(self, normalized):
+        if normalized in self._exact:
+            return self._exact[normalized], 'exact_match'
+
+        if normalized in self._aliases:
+            return self._aliases[normalized], 'alias_match'
+
+        region = self._first_containing(normalized)
+        if region:
+            return region, 'partial_match'
+
+        region = self._first_containing(normalized.split()[0])
+        if region:
+            return region, 'reverse_match'
+
+        for keyword, standard_name in REGION_KEYWORDS.items():
+            if keyword in normalized:
+                region = self._first_containing(normalize_region_name(standard_name))
+                if region:
+                    return region, 'keyword_match'
+
+        return None, 'not_found'
+
+    def suggest(self, region_name, limit=5):
+        """Похожие регионы для ненайденного названия, от наиболее похожего"""
+        normalized = normalize_region_name(region_name)
+        if not normalized:
+            return []
+
+        query_trigrams = _trigrams(normalized)
+        query_tokens = _tokens(normalized)
+        scores = defaultdict(float)
+
+        for trigram in query_trigrams:
+            for region_id in self._trigrams.get(trigram, ()):
+                scores[region_id] += 1
+
+        for region_id in list(scores):
+            region_trigrams = _trigrams(normalize_region_name(self._by_id[region_id].name))
+            # Коэффициент Жаккара по триграммам + бонус за общие слова
+            union = len(query_trigrams | region_trigrams) or 1
+            scores[region_id] = scores[region_id] / union
+            token_hits = sum(1 for token in query_tokens if token in self._tokens and region_id in self._tokens[token])
+            scores[region_id] += 0.5 * token_hits / (len(query_tokens) or 1)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self._by_id[item[0]].name))
+        return [self._by_id[region_id] for region_id, score in ranked[:limit] if score > 0.1]
+
+    def find_or_create(self, region_name):
+        """
+        Поиск региона, при неудаче — создание (старая логика импорта с автосозданием).
+        Возвращает (регион или None, сообщение или None).
+        """
+        normalized = normalize_region_name(region_name)
+        if not normalized:
+            return None, 'Пустое название региона'
+
+        region, _ = self.resolve(region_name)
+        if region:
+            return region, None
+
+        for keyword, standard_name in REGION_KEYWORDS.items():
+            if keyword in normalized:
+                region = self._create(standard_name, standard_name[:10].upper().replace(' ', '_'))
+                return region, f'Создан регион "{standard_name}" на основе "{region_name}"'
+
+        try:
+            region = self._create(region_name, region_name[:10].upper().replace(' ', '_').replace('-', '_'))
+            return region, f'Создан новый регион "{region_name}"'
+        except Exception as e:
+            return None, f'Ошибка создания региона "{region_name}": {str(e)}'
+
+    def _create(self, name, code):
+        region = Region.objects.create(name=name, code=code, is_active=True)
+        self.add(region)
+        return region
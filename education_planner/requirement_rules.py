@@ -0,0 +1,215 @@
+"""
+Проверка программ на соответствие требованиям федеральных операторов.
+
+Требования компилируются один раз: группируются по (форма обучения, ДОТ),
+для каждой группы строятся массивы индексов часов, процентов и знаков.
+Скомпилированные наборы хранятся в кеше и сбрасываются при изменении
+требований (сигналы в models.py). Проверка программы — одно векторное
+вычисление по всем правилам группы; check_programs проверяет сразу
+все программы каталога матрицей часов.
+"""
+import logging
+from collections import defaultdict, namedtuple
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .models import EducationProgram, ProgramRequirements, ProgramSection, Requirement
+
+logger = logging.getLogger(__name__)
+
+REQUIREMENT_RULES_CACHE_KEY = 'requirement_rules:compiled'
+REQUIREMENT_RULES_CACHE_TIMEOUT = 86400
+
+HOURS_TYPES = tuple(Requirement.HoursType.values)
+HOURS_LABELS = dict(Requirement.HoursType.choices)
+HOURS_INDEX = {hours_type: index for index, hours_type in enumerate(HOURS_TYPES)}
+
+OPERATOR_SIGNS = {'more': '>=', 'less': '<=', 'equal': '≠'}
+
+# Правила одной группы (форма обучения, ДОТ) в виде параллельных массивов
+RuleSet = namedtuple('RuleSet', [
+    'operator_order', 'requirement_ids', 'operator_names', 'operators',
+    'left_types', 'right_types', 'left_index', 'right_index', 'percents',
+])
+
+
+def compile_rule_sets():
+    """Все группы требований (два запроса), сгруппированные по (форма обучения, ДОТ)"""
+    grouped = defaultdict(list)
+    operator_order = defaultdict(list)
+    groups = ProgramRequirements.objects.select_related('name').prefetch_related('requirement')
+    for group in groups:
+        key = (group.study_form or 'FT', group.DOT)
+        # Оператор попадает в результат, даже если у группы нет правил
+        if group.name.name not in operator_order[key]:
+            operator_order[key].append(group.name.name)
+        for requirement in group.requirement.all():
+            if requirement.left_num_type not in HOURS_INDEX or requirement.right_num_type not in HOURS_INDEX:
+                logger.warning(f"Требование {requirement.pk}: неизвестный тип часов, пропущено")
+                continue
+            grouped[key].append(requirement)
+
+    rule_sets = {}
+    for key, names in operator_order.items():
+        rules = grouped[key]
+        rule_sets[key] = RuleSet(
+            operator_order=tuple(names),
+            requirement_ids=tuple(rule.pk for rule in rules),
+            operator_names=tuple(rule.related_to.name.name for rule in rules),
+            operators=np.array([rule.operator for rule in rules], dtype=object),
+            left_types=tuple(rule.left_num_type for rule in rules),
+            right_types=tuple(rule.right_num_type for rule in rules),
+            left_index=np.array([HOURS_INDEX[rule.left_num_type] for rule in rules], dtype=np.intp),
+            right_index=np.array([HOURS_INDEX[rule.right_num_type] for rule in rules], dtype=np.intp),
+            percents=np.array([rule.left_num_value for rule in rules], dtype=np.float64),
+        )
+    return rule_sets
+
+
+def get_rule_sets():
+    """Скомпилированные требования из кеша"""
+    try:
+        rule_sets = cache.get(REQUIREMENT_RULES_CACHE_KEY)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать требования из кеша: {e}")
+        rule_sets = None
+    if rule_sets is None:
+        rule_sets = compile_rule_sets()
+        try:
+            cache.set(REQUIREMENT_RULES_CACHE_KEY, rule_sets, REQUIREMENT_RULES_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить требования в кеш: {e}")
+    return rule_sets
+
+
+def invalidate_rule_sets():
+    try:
+        cache.delete(REQUIREMENT_RULES_CACHE_KEY)
+    except Exception as e:
+        logger.warning(f"Не удалось сбросить кеш требований: {e}")
+
+
+def hours_vector(total_hours):
+    """Словарь часов программы -> вектор в порядке HOURS_TYPES"""
+    return np.array([total_hours.get(hours_type, 0) for hours_type in HOURS_TYPES], dtype=np.float64)
+
+
+def evaluate_rule_set(rule_set, hours):
+    """
+    Проверяет матрицу часов (программы × типы часов) по всем правилам набора.
+    Возвращает (левые, правые, требуемые значения, нарушения) — матрицы программы × правила.
+    """
+    hours = np.atleast_2d(hours)
+    left = hours[:, rule_set.left_index]
+    right = hours[:, rule_set.right_index]
+    required = right / 100 * rule_set.percents
+    violated = (
+        ((rule_set.operators == 'more') & (left > required)) |
+        ((rule_set.operators == 'less') & (left < required)) |
+        ((rule_set.operators == 'equal') & (left != required))
+    )
+    return left, right, required, violated
+
+
+def _number(value):
+    """Часы хранятся целыми: выводим без дробной части, как раньше"""
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def _build_report(rule_set, study_form, dot_key, left, right, required, violated):
+    """Результат в формате check_for_requirements для одной программы"""
+    requirements = {
+        operator_name: {study_form: {dot_key: {'status': 'success', 'violations': [], 'checks': []}}}
+        for operator_name in rule_set.operator_order
+    }
+    for index, requirement_id in enumerate(rule_set.requirement_ids):
+        result = requirements[rule_set.operator_names[index]][study_form][dot_key]
+        left_type = rule_set.left_types[index]
+        right_type = rule_set.right_types[index]
+        operator = str(rule_set.operators[index])
+        percent = int(rule_set.percents[index])
+        left_hours = _number(left[index])
+        right_hours = _number(right[index])
+        required_value = float(required[index])
+
+        check_result = {
+            'requirement_id': requirement_id,
+            'left_type': HOURS_LABELS[left_type],
+            'left_value': left_hours,
+            'left_percent': percent,
+            'right_type': HOURS_LABELS[right_type],
+            'right_value': right_hours,
+            'required_value': required_value,
+            'operator': operator,
+            'status': 'success',
+            'message': '',
+            'types': HOURS_LABELS
+        }
+        if violated[index]:
+            check_result['status'] = 'danger'
+            check_result['message'] = (
+                f"{left_hours} {left_type} {OPERATOR_SIGNS.get(operator, operator)} {required_value:.1f} "
+                f"({percent}%) от {right_hours} {right_type}"
+            )
+            result['status'] = 'danger'
+            result['violations'].append(check_result['message'])
+        result['checks'].append(check_result)
+    return requirements
+
+
+def check_program(program, total_hours):
+    """Проверяет одну программу по её суммам часов (словарь тип часов -> значение)"""
+    study_form = program.study_form or 'FT'
+    rule_set = get_rule_sets().get((study_form, program.DOT))
+    if rule_set is None:
+        return {}
+
+    left, right, required, violated = evaluate_rule_set(rule_set, hours_vector(total_hours))
+    dot_key = 'DOT' if program.DOT else 'nDOT'
+    return _build_report(rule_set, study_form, dot_key, left[0], right[0], required[0], violated[0])
+
+
+def program_hours(programs):
+    """Суммы часов по разделам для программ одним агрегирующим запросом"""
+    fields = [hours_type for hours_type in HOURS_TYPES if hours_type != 'contact_hours']
+    rows = ProgramSection.objects.filter(program__in=programs).values('program').annotate(
+        **{f'total_{field}': Sum(field) for field in fields}
+    ).order_by()
+    totals = {}
+    for row in rows:
+        hours = {field: row[f'total_{field}'] or 0 for field in fields}
+        hours['contact_hours'] = hours['lecture_hours'] + hours['practice_hours']
+        totals[row['program']] = hours
+    return totals
+
+
+def check_programs(programs=None):
+    """
+    Проверяет все программы (или переданный queryset) сразу: по одной матрице
+    часов на каждую группу (форма обучения, ДОТ). Возвращает {id программы: результат}.
+    """
+    programs = list(programs if programs is not None else EducationProgram.objects.all())
+    totals = program_hours(programs)
+    rule_sets = get_rule_sets()
+
+    by_group = defaultdict(list)
+    for program in programs:
+        by_group[(program.study_form or 'FT', program.DOT)].append(program)
+
+    results = {}
+    for (study_form, dot), group_programs in by_group.items():
+        rule_set = rule_sets.get((study_form, dot))
+        if rule_set is None:
+            results.update((program.pk, {}) for program in group_programs)
+            continue
+
+        hours = np.vstack([hours_vector(totals.get(program.pk, {})) for program in group_programs])
+        left, right, required, violated = evaluate_rule_set(rule_set, hours)
+        dot_key = 'DOT' if dot else 'nDOT'
+        for row, program in enumerate(group_programs):
+            results[program.pk] = _build_report(
+                rule_set, study_form, dot_key, left[row], right[row], required[row], violated[row]
+            )
+    return results
@@ -1,3 +1,32 @@
+import io
+import zipfile
+
+import openpyxl
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from .curriculum_documents import DOCUMENT_TYPES, curricula_zip, curriculum_filename
+from .models import EducationProgram
+
+
+class CurriculaZipTestCase(TestCase):
+    """Название программы не должно ломать генерацию архива учебных планов"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_program_name_with_invalid_sheet_characters(self):
+        program = EducationProgram.objects.create(
+            name='Оператор ЭВМ/ПК: основы работы [базовый курс] с ДОТ?'
+        )
+        self.assertGreater(len(program.name), 31)
+
+        for document_type in DOCUMENT_TYPES:
+            buffer = io.BytesIO()
+            self.assertEqual(curricula_zip([program], document_type, buffer), 1)
+
+            with zipfile.ZipFile(buffer) as archive:
+                content = archive.read(curriculum_filename(program, document_type))
+            title = openpyxl.load_workbook(io.BytesIO(content)).active.title
+            self.assertLessEqual(len(title), 31)
+            self.assertFalse(set(title) & set('\\/?*[]:'))
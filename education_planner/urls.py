@@ -13,6 +13,7 @@ urlpatterns = [
     path('agreements/<int:pk>/', views.agreement_detail, name='agreement_detail'),
     path('agreements/create/', views.create_agreement, name='create_agreement'),
     path('agreements/<int:pk>/delete/', views.delete_agreement, name='delete_agreement'),
+    path('agreements/<int:pk>/curricula.zip', views.agreement_curricula_zip, name='agreement_curricula_zip'),
     path('agreements/<int:pk>/supplement-quotas/', views.get_supplement_quotas, name='get_supplement_quotas'),
     
     # Маршруты для управления квотами
@@ -42,5 +43,6 @@ urlpatterns = [
     path('manage-roiv/', views.manage_roiv, name='manage_roiv'),
     path('manage-alternative-quota/', views.manage_alternative_quota, name='manage_alternative_quota'),
     path('manage-demand/', views.manage_demand, name='manage_demand'),
+    path('manage-demand/batch/', views.manage_demands_batch, name='manage_demands_batch'),
     path('distribute-quota/', views.distribute_quota, name='distribute_quota'),
 ] 
\ No newline at end of file
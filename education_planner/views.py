@@ -14,9 +14,23 @@ from django.core.files.base import ContentFile
 from .forms import EducationProgramForm, ProgramSectionFormSet, ProgramTopicsFormSet
 from .models import (
     EducationProgram, EduAgreement, Quota, Supplement, QuotaChange, Region, ROIV,
-    Demand, DemandHistory, QuotaDistribution, AlternativeQuota, ProgramRequirements, ProgramSection, ProgramTopics, Requirement
+    Demand, DemandHistory, QuotaDistribution, AlternativeQuota, ProgramSection, ProgramTopics
 )
 from .cache_utils import cache_atlas_data, AtlasDataCache
+from .curriculum import load_curriculum, build_utp_table, build_tgu_table, build_appendix3_table
+from .curriculum_save import save_curriculum
+from .demand_batch import DemandBatch, DemandOperationError
+from .quota_distribution import QuotaDistributionError, save_quota_distribution
+from .curriculum_documents import (
+    XLSX_CONTENT_TYPE, DOCUMENT_TYPES, render_curriculum_xlsx, curriculum_filename, curricula_zip,
+    document_type_for_agreement
+)
+from .requirement_rules import check_program
+from .region_resolver import RegionResolver
+from .import_staging import stage_dataframe, load_staged, get_staged_meta, discard_staged, StagedImportNotFound
+from crm_connector.import_jobs import enqueue_import, job_status_payload
+from crm_connector.models import ImportJob
+from .quota_import import QuotaBulkImporter, QUOTA_REQUIRED_COLUMNS
 import json
 import pandas as pd
 import re
@@ -86,131 +100,29 @@ def clean_text_data(text):
     return text
 
 
-def find_region_without_creating(region_name_input):
-    """Поиск региона по названию БЕЗ автоматического создания"""
+def find_region_without_creating(region_name_input, resolver=None):
+    """
+    Поиск региона по названию БЕЗ автоматического создания.
+    При импорте передавайте один RegionResolver на весь файл, чтобы не читать регионы из БД на каждое название.
+    """
     region_name = clean_text_data(region_name_input)
     
     if not region_name:
         return None, 'empty_name'
     
-    # Сначала точный поиск
-    region = Region.objects.filter(name__iexact=region_name).first()
-    if region:
-        return region, 'exact_match'
-    
-    # Поиск по частичному совпадению
-    region = Region.objects.filter(name__icontains=region_name).first()
-    if region:
-        return region, 'partial_match'
-    
-    # Поиск в обратную сторону (может регион содержит введенное название)
-    region = Region.objects.filter(name__icontains=region_name.split()[0] if region_name.split() else region_name).first()
-    if region:
-        return region, 'reverse_match'
-    
-    # Если не найден, пытаемся определить по ключевым словам
-    region_mapping = {
-        'москва': 'Москва',
-        'московская': 'Московская область',
-        'спб': 'Санкт-Петербург',
-        'санкт-петербург': 'Санкт-Петербург',
-        'ленинградская': 'Ленинградская область',
-        'екатеринбург': 'Свердловская область',
-        'новосибирск': 'Новосибирская область',
-        'казань': 'Республика Татарстан',
-        'нижний новгород': 'Нижегородская область',
-        'челябинск': 'Челябинская область',
-        'омск': 'Омская область',
-        'самара': 'Самарская область',
-        'ростов': 'Ростовская область',
-        'уфа': 'Республика Башкортостан',
-        'красноярск': 'Красноярский край',
-        'воронеж': 'Воронежская область',
-        'пермь': 'Пермский край',
-        'волгоград': 'Волгоградская область',
-    }
-    
-    region_lower = region_name.lower()
-    for key, standard_name in region_mapping.items():
-        if key in region_lower:
-            # Ищем стандартное название
-            region = Region.objects.filter(name__icontains=standard_name).first()
-            if region:
-                return region, 'keyword_match'
-    
-    # Если ничего не подошло, возвращаем None с типом ошибки
-    return None, 'not_found'
+    resolver = resolver or RegionResolver()
+    return resolver.resolve(region_name)
 
 
-def find_or_create_region(region_name_input):
+def find_or_create_region(region_name_input, resolver=None):
     """Поиск региона по названию или создание псевдонима (старая функция для совместимости)"""
     region_name = clean_text_data(region_name_input)
     
     if not region_name:
         return None, f'Пустое название региона'
     
-    # Сначала точный поиск
-    region = Region.objects.filter(name__iexact=region_name).first()
-    if region:
-        return region, None
-    
-    # Поиск по частичному совпадению
-    region = Region.objects.filter(name__icontains=region_name).first()
-    if region:
-        return region, None
-    
-    # Поиск в обратную сторону (может регион содержит введенное название)
-    region = Region.objects.filter(name__icontains=region_name.split()[0] if region_name.split() else region_name).first()
-    if region:
-        return region, None
-    
-    # Если не найден, пытаемся определить по ключевым словам
-    region_mapping = {
-        'москва': 'Москва',
-        'московская': 'Московская область',
-        'спб': 'Санкт-Петербург',
-        'санкт-петербург': 'Санкт-Петербург',
-        'ленинградская': 'Ленинградская область',
-        'екатеринбург': 'Свердловская область',
-        'новосибирск': 'Новосибирская область',
-        'казань': 'Республика Татарстан',
-        'нижний новгород': 'Нижегородская область',
-        'челябинск': 'Челябинская область',
-        'омск': 'Омская область',
-        'самара': 'Самарская область',
-        'ростов': 'Ростовская область',
-        'уфа': 'Республика Башкортостан',
-        'красноярск': 'Красноярский край',
-        'воронеж': 'Воронежская область',
-        'пермь': 'Пермский край',
-        'волгоград': 'Волгоградская область',
-    }
-    
-    region_lower = region_name.lower()
-    for key, standard_name in region_mapping.items():
-        if key in region_lower:
-            # Ищем стандартное название
-            region = Region.objects.filter(name__icontains=standard_name).first()
-            if region:
-                return region, None
-            # Если стандартного тоже нет, создаем новый
-            region = Region.objects.create(
-                name=standard_name,
-                code=standard_name[:10].upper().replace(' ', '_'),
-                is_active=True
-            )
-            return region, f'Создан регион "{standard_name}" на основе "{region_name}"'
-    
-    # Если ничего не подошло, создаем новый регион
-    try:
-        region = Region.objects.create(
-            name=region_name,
-            code=region_name[:10].upper().replace(' ', '_').replace('-', '_'),
-            is_active=True
-        )
-        return region, f'Создан новый регион "{region_name}"'
-    except Exception as e:
-        return None, f'Ошибка создания региона "{region_name}": {str(e)}'
+    resolver = resolver or RegionResolver()
+    return resolver.find_or_create(region_name)
 
 @login_required
 def program_list(request):
@@ -313,657 +225,27 @@ def create_program(request):
     }
     return render(request, 'education_planner/program_details.html', context)
 
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Font
-from openpyxl.utils import get_column_letter
 import time
 
-def build_utp_table(program):
-    """
-    Формирует данные для тела таблицы УТП, включая темы разделов.
-    Возвращает список списков (строки таблицы, колонки 1-8).
-    """
-    rows = []
-    sections = program.sections.all().order_by('order')
-
-    for section in sections:
-        # --- Строка раздела ---
-        section_row = [
-            section.name,                                     # 1 - Наименование
-            section.workload,                                 # 2 - Итого
-            section.lecture_hours + section.practice_hours,   # 3 - Всего контактной работы
-            section.lecture_hours,                             # 4 - Лекции
-            section.practice_hours,                             # 5 - Практические занятия
-            0,                                                  # 6 - с использованием ДОТ (пока не заполняем)
-            section.selfstudy_hours,                            # 7 - Самостоятельная работа
-            section.attestation_form or ''                      # 8 - Форма аттестации
-        ]
-        rows.append(section_row)
-
-        # --- Темы раздела ---
-        topics = section.topics.all().order_by('order')
-        for topic in topics:
-            # Контактные часы темы (лекции + практика)
-            contact_topic = (topic.lecture_hours or 0) + (topic.practice_hours or 0)
-            # Общая трудоёмкость темы (если поле workload не заполнено, вычисляем вручную)
-            workload_topic = topic.workload or (
-                (topic.lecture_hours or 0) +
-                (topic.practice_hours or 0) +
-                (topic.selfstudy_hours or 0) +
-                (topic.consultation_hours or 0)
-            )
-            topic_row = [
-                f"    {topic.name}",                          # отступ для тем
-                workload_topic,                                 # 2 - Итого по теме
-                contact_topic,                                  # 3 - Контактная работа
-                topic.lecture_hours or 0,                       # 4 - Лекции
-                topic.practice_hours or 0,                       # 5 - Практика
-                0,                                               # 6 - ДОТ
-                topic.selfstudy_hours or 0,                      # 7 - СР
-                topic.attestation_form or ''                     # 8 - Форма аттестации
-            ]
-            rows.append(topic_row)
-
-    # --- Итоговая аттестация ---
-    final_att = program.final_attestation or 0
-    rows.append([
-        'Итоговая аттестация',
-        final_att,
-        final_att,          # вся итоговая аттестация считается контактной работой
-        0,
-        final_att,
-        0,
-        0,
-        'Итоговая аттестация'
-    ])
-
-    # --- Общий итог по программе ---
-    total_workload = sum(s.workload for s in sections) + final_att
-    total_contact = sum(s.lecture_hours + s.practice_hours for s in sections) + final_att
-    total_lecture = sum(s.lecture_hours for s in sections)
-    total_practice = sum(s.practice_hours for s in sections) + final_att
-    total_selfstudy = sum(s.selfstudy_hours for s in sections)
-
-    rows.append([
-        'Всего академических часов',
-        total_workload,
-        total_contact,
-        total_lecture,
-        total_practice,
-        0,
-        total_selfstudy,
-        ''
-    ])
-
-    return rows
-
-def build_tgu_table(program):
-    """Таблица для шаблона ТГУ"""
-    rows = []
-    sections = program.sections.all().order_by('order')
-    roman_numerals = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X']
-
-    for sec_idx, section in enumerate(sections, start=1):
-        roman = roman_numerals[sec_idx-1] if sec_idx <= len(roman_numerals) else str(sec_idx)
-        total_sec = section.workload or 0
-        dot_sec = section.dot_hours or 0
-        rows.append([
-            roman,                                          # 1 – № п/п
-            section.name,                                   # 2 – Наименование
-            total_sec,                                       # 3 – Всего, ч.
-            f"{dot_sec} ({dot_sec/total_sec*100:.0f}%)" if total_sec else '0 (0%)',  # 4 – ДОТ, ч/%
-            section.lecture_hours or 0,                      # 5 – Лекции всего
-            0,                                                # 6 – Лекции ДОТ
-            0,                                                # 7 – Лаб. всего
-            0,                                                # 8 – Лаб. ДОТ
-            section.practice_hours or 0,                      # 9 – Практика всего
-            0,                                                # 10 – Практика ДОТ
-            section.selfstudy_hours or 0,                     # 11 – СРС
-            section.attestation_form or ''                    # 12 – Форма контроля
-        ])
-
-        for top_idx, topic in enumerate(section.topics.all().order_by('order'), start=1):
-            total_topic = topic.workload or 0
-            dot_topic = topic.dot_hours or 0
-            rows.append([
-                f"{sec_idx}.{top_idx}",
-                f"    {topic.name}",
-                total_topic,
-                f"{dot_topic} ({dot_topic/total_topic*100:.0f}%)" if total_topic else '0 (0%)',
-                topic.lecture_hours or 0,
-                0,
-                0,
-                0,
-                topic.practice_hours or 0,
-                0,
-                topic.selfstudy_hours or 0,
-                topic.attestation_form or ''
-            ])
-
-    # Итоговая аттестация
-    final_att = program.final_attestation or 0
-    rows.append([
-        '*',
-        'Итоговая аттестация',
-        final_att,
-        '0 (0%)',
-        0,
-        0,
-        0,
-        0,
-        final_att,
-        0,
-        0,
-        'Итоговая аттестация'
-    ])
-
-    # Общий итог
-    total_workload = sum(s.workload for s in sections) + final_att
-    total_lecture = sum(s.lecture_hours for s in sections)
-    total_practice = sum(s.practice_hours for s in sections) + final_att
-    total_selfstudy = sum(s.selfstudy_hours for s in sections)
-    total_dot = sum(s.dot_hours for s in sections)
-
-    rows.append([
-        '',
-        'Итого',
-        total_workload,
-        f"{total_dot} ({total_dot/total_workload*100:.0f}%)" if total_workload else '0 (0%)',
-        total_lecture,
-        0,
-        0,
-        0,
-        total_practice,
-        0,
-        total_selfstudy,
-        ''
-    ])
-
-    return rows
-
-def build_appendix3_table(program):
-    """Таблица для шаблона ИРПО"""
-    rows = []
-    sections = program.sections.all().order_by('order')
-
-    for section in sections:
-        rows.append([
-            section.name,                                    # 1 – Наименование
-            section.workload or 0,                            # 2 – Всего, час.
-            section.lecture_hours or 0,                        # 3 – ТЗ (лекции)
-            section.practice_hours or 0,                       # 4 – ПЗ (практика)
-            section.selfstudy_hours or 0,                      # 5 – СР
-            section.consultation_hours or 0,                   # 6 – К (консультации)
-            section.dot_hours or 0,                            # 7 – ДОТ
-            section.attestation_form or ''                     # 8 – Форма аттестации
-        ])
-
-        for topic in section.topics.all().order_by('order'):
-            rows.append([
-                f"    {topic.name}",
-                topic.workload or 0,
-                topic.lecture_hours or 0,
-                topic.practice_hours or 0,
-                topic.selfstudy_hours or 0,
-                topic.consultation_hours or 0,
-                topic.dot_hours or 0,
-                topic.attestation_form or ''
-            ])
-
-    final_att = program.final_attestation or 0
-    rows.append([
-        'Итоговая аттестация',
-        final_att,
-        0,
-        final_att,
-        0,
-        0,
-        0,
-        'Итоговая аттестация'
-    ])
-
-    total_workload = sum(s.workload for s in sections) + final_att
-    total_tz = sum(s.lecture_hours for s in sections)
-    total_pz = sum(s.practice_hours for s in sections) + final_att
-    total_sr = sum(s.selfstudy_hours for s in sections)
-    total_k = sum(s.consultation_hours for s in sections)
-    total_dot = sum(s.dot_hours for s in sections)
-
-    rows.append([
-        'Всего ак. часов',
-        total_workload,
-        total_tz,
-        total_pz,
-        total_sr,
-        total_k,
-        total_dot,
-        'х'
-    ])
-
-    return rows
-
-def generate_utp_xlsx(program):
-    """
-    Создаёт XLSX-файл с полным УТП по шаблону.
-    Возвращает объект Workbook.
-    """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"УТП_{program.name}"
-
-    # Заголовки (4 строки)
-    headers = [
-        ['Наименование разделов (модулей), тем, видов аттестации', 'Трудоемкость, ак. час', '', '', '', '', '', 'Формы аттестации'],
-        ['', 'Итого', 'Виды занятий контактной работы, в т.ч.', '', '', 'В том числе с использованием ДОТ (из ст.3)', 'СР', ''],
-        ['', '', 'Всего контактной работы', 'Л', 'ПЗ, ЛР', '', '', ''],
-        ['1', '2', '3', '4', '5', '6', '7', '8']
-    ]
-
-    # Записываем заголовки
-    for r_idx, row_data in enumerate(headers, start=1):
-        for c_idx, value in enumerate(row_data, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=value)
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            cell.font = Font(bold=True)
-
-    # Объединение ячеек в шапке
-    ws.merge_cells(start_row=1, start_column=1, end_row=3, end_column=1)# A1:A3
-    ws.merge_cells(start_row=1, start_column=2, end_row=1, end_column=7)# B1:G1 (Трудоемкость)
-    ws.merge_cells(start_row=1, start_column=8, end_row=3, end_column=8)# H1:H3 (Формы аттестации)
-    ws.merge_cells(start_row=2, start_column=2, end_row=3, end_column=2)# B2:B3 (Итого)
-    ws.merge_cells(start_row=2, start_column=3, end_row=2, end_column=5)# C2:E2 (Виды занятий)
-    ws.merge_cells(start_row=2, start_column=6, end_row=3, end_column=6)# F2:F3 (ДОТ)
-    ws.merge_cells(start_row=2, start_column=7, end_row=3, end_column=7)# G2:G3 (СР)
-
-    # Получаем данные тела таблицы
-    table_rows = build_utp_table(program)
-
-    # Записываем строки тела, начиная с 5-й строки
-    for r_idx, row_data in enumerate(table_rows, start=5):
-        for c_idx, value in enumerate(row_data, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=value)
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-    # Автоподбор ширины колонок
-    for col in range(1, 9):
-        column_letter = get_column_letter(col)
-        ws.column_dimensions[column_letter].width = 18
-
-    return wb
-
-def generate_appendix3_xlsx(program):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Приложение 3"
-
-    # === Информационная часть ===
-    info_rows = [
-        ["Приложение 3 к Заявке"],
-        [],
-        ["Учебный план образовательной программы"],
-        [],
-        ["Наименование организации", ""],
-        ["Вид, подвид программы", program.get_program_type_display()],
-        ["Наименование программы", program.name],
-        ["Код категории программы", ""],  # можно заполнить из дополнительного поля, если есть
-    ]
-    for r_idx, row_data in enumerate(info_rows, start=1):
-        for c_idx, value in enumerate(row_data, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=value)
-            cell.font = Font(bold=True) if r_idx in (1,3) else Font()
-            if r_idx == 1:
-                cell.font = Font(bold=True, size=14)
-
-    # === Заголовки таблицы ===
-    headers = [
-        ["Наименование разделов (модулей), тем", "Общая трудоемкость, (час.)", "", "", "", "", "", "Форма аттестации"],
-        ["", "Всего, час.", "в т.ч. по видам занятий, час.", "", "", "", "из них, с применением ДОТ, час.", ""],
-        ["", "", "ТЗ[1]", "ПЗ[2]", "СР[3]", "К[4]", "", ""],
-        ['1', '2', '3', '4', '5', '6', '7', '8']
-    ]
-    # Объединение ячеек шапки
-    start_row = len(info_rows) + 2  # после информационной части и пустой строки
-    for r_idx, row in enumerate(headers, start=start_row):
-        for c_idx, val in enumerate(row, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=val)
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            cell.font = Font(bold=True)
-    ws.merge_cells(start_row=start_row, start_column=1, end_row=start_row+2, end_column=1)  # "Наименование разделов (модулей), тем"
-    ws.merge_cells(start_row=start_row, start_column=2, end_row=start_row, end_column=7)  # "Общая трудоемкость"
-    ws.merge_cells(start_row=start_row+1, start_column=2, end_row=start_row+2, end_column=2)  # "Всего, час."
-    ws.merge_cells(start_row=start_row+1, start_column=3, end_row=start_row+1, end_column=6)  # "в т.ч. по видам занятий"
-    ws.merge_cells(start_row=start_row+2, start_column=3, end_row=start_row+2, end_column=3)  # ТЗ
-    ws.merge_cells(start_row=start_row+2, start_column=4, end_row=start_row+2, end_column=4)  # ПЗ
-    ws.merge_cells(start_row=start_row+2, start_column=5, end_row=start_row+2, end_column=5)  # СР
-    ws.merge_cells(start_row=start_row+2, start_column=6, end_row=start_row+2, end_column=6)  # К
-    ws.merge_cells(start_row=start_row+1, start_column=7, end_row=start_row+2, end_column=7)  # из них ДОТ
-    ws.merge_cells(start_row=start_row, start_column=8, end_row=start_row+2, end_column=8)  # Форма аттестации
-
-    # === Данные таблицы ===
-    data_rows = []
-    sections = program.sections.all().order_by('order')
-    for section in sections:
-        # Строка раздела
-        data_rows.append([
-            section.name,
-            section.workload,
-            section.lecture_hours,
-            section.practice_hours,
-            section.selfstudy_hours,
-            section.consultation_hours,
-            section.dot_hours,
-            section.attestation_form or ''
-        ])
-        # Темы раздела
-        for topic in section.topics.all().order_by('order'):
-            data_rows.append([
-                f"    {topic.name}",
-                topic.workload,
-                topic.lecture_hours,
-                topic.practice_hours,
-                topic.selfstudy_hours,
-                topic.consultation_hours,
-                topic.dot_hours,
-                topic.attestation_form or ''
-            ])
-
-    # Итоговая аттестация
-    final_att = program.final_attestation or 0
-    data_rows.append([
-        "Итоговая аттестация",
-        final_att,
-        0,  # ТЗ
-        final_att,  # ПЗ (можно считать, что вся ИА – практическая)
-        0,
-        0,
-        0,
-        "Итоговая аттестация"
-    ])
-
-    # Итог по программе
-    total_workload = sum(s.workload for s in sections) + final_att
-    total_tz = sum(s.lecture_hours for s in sections)
-    total_pz = sum(s.practice_hours for s in sections) + final_att
-    total_sr = sum(s.selfstudy_hours for s in sections)
-    total_k = sum(s.consultation_hours for s in sections)
-    total_dot = sum(s.dot_hours for s in sections)
-
-    data_rows.append([
-        "Всего ак. часов",
-        total_workload,
-        total_tz,
-        total_pz,
-        total_sr,
-        total_k,
-        total_dot,
-        "х"
-    ])
-
-    # Проценты (опционально, можно добавить как комментарий или отдельными строками)
-    # Сноски уже есть в шаблоне, их можно не дублировать, либо добавить текстом ниже.
-
-    # Запись данных
-    for r_idx, row_data in enumerate(data_rows, start=start_row+4):
-        for c_idx, value in enumerate(row_data, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=value)
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-    # Настройка ширины колонок
-    for col in range(1, 9):
-        ws.column_dimensions[get_column_letter(col)].width = 20
-
-    return wb
-
-def generate_tgu_utp_xlsx(program):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"УТП_ТГУ"
-
-    # ---------- Шапка ----------
-    headers = [
-        # 1-я строка
-        ['№', 'Наименование дисциплин (модулей, курсов), разделов, тем',
-         'Срок освоения / трудоемкость', '',
-         'Контактные часы, в.т.ч. с применением ДОТ', '', '', '', '', '',
-         'СРС, ч.', 'Формы контроля'],
-        # 2-я строка
-        ['', '', '', '', 'лекции', '', 'лабораторные работы', '',
-         'практические и семинарские занятия', '', '', ''],
-        # 3-я строка
-        ['п/п', '', 'Всего, ч.', 'из них с ДОТ, ч / (%)',
-         'Всего, ч', 'из них с ДОТ, ч',
-         'Всего, ч', 'из них с ДОТ, ч',
-         'Всего, ч', 'из них с ДОТ, ч',
-         '', '']
-    ]
-
-    # Запись заголовков
-    for r_idx, row in enumerate(headers, start=1):
-        for c_idx, val in enumerate(row, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=val)
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            cell.font = Font(bold=True)
-
-    # ---------- Объединение ячеек в шапке ----------
-    ws.merge_cells(start_row=1, start_column=1, end_row=2, end_column=1)   # №
-    ws.merge_cells(start_row=1, start_column=2, end_row=3, end_column=2)   # Наименование дисциплин (модулей, курсов), разделов, тем
-    ws.merge_cells(start_row=1, start_column=3, end_row=2, end_column=4)   # Срок освоения / трудоемкость
-    ws.merge_cells(start_row=1, start_column=5, end_row=1, end_column=10)  # Контактные часы ...
-    ws.merge_cells(start_row=2, start_column=5, end_row=2, end_column=6)   # Лекции
-    ws.merge_cells(start_row=2, start_column=7, end_row=2, end_column=8)   # Лабораторные работы
-    ws.merge_cells(start_row=2, start_column=9, end_row=2, end_column=10)  # Практические и семинарские занятия
-    ws.merge_cells(start_row=1, start_column=11, end_row=3, end_column=11)  # СРС, ч
-    ws.merge_cells(start_row=1, start_column=12, end_row=3, end_column=12)  # Формы контроля
-    # ---------- Сбор данных тела таблицы ----------
-    data_rows = []
-    sections = program.sections.all().order_by('order')
-    roman_numerals = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X']
-
-    for sec_idx, section in enumerate(sections, start=1):
-        roman = roman_numerals[sec_idx-1] if sec_idx <= len(roman_numerals) else str(sec_idx)
-        total_sec = section.workload or 0
-        dot_sec = section.dot_hours or 0
-        data_rows.append([
-            roman,
-            section.name,
-            total_sec,
-            f"{dot_sec} ({dot_sec/total_sec*100:.0f}%)" if total_sec else '0 (0%)',
-            section.lecture_hours or 0,
-            0,
-            0,
-            0,
-            section.practice_hours or 0,
-            0,
-            section.selfstudy_hours or 0,
-            section.attestation_form or ''
-        ])
-
-        for top_idx, topic in enumerate(section.topics.all().order_by('order'), start=1):
-            total_topic = topic.workload or 0
-            dot_topic = topic.dot_hours or 0
-            data_rows.append([
-                f"{sec_idx}.{top_idx}",
-                f"    {topic.name}",
-                total_topic,
-                f"{dot_topic} ({dot_topic/total_topic*100:.0f}%)" if total_topic else '0 (0%)',
-                topic.lecture_hours or 0,
-                0,
-                0,
-                0,
-                topic.practice_hours or 0,
-                0,
-                topic.selfstudy_hours or 0,
-                topic.attestation_form or ''
-            ])
-
-    # Итоговая аттестация
-    final_att = program.final_attestation or 0
-    data_rows.append([
-        '*',
-        'Итоговая аттестация',
-        final_att,
-        '0 (0%)',
-        0,
-        0,
-        0,
-        0,
-        final_att,
-        0,
-        0,
-        'Итоговая аттестация'
-    ])
-
-    # Итого по программе
-    total_workload = sum(s.workload for s in sections) + final_att
-    total_lecture = sum(s.lecture_hours for s in sections)
-    total_practice = sum(s.practice_hours for s in sections) + final_att
-    total_selfstudy = sum(s.selfstudy_hours for s in sections)
-    total_dot = sum(s.dot_hours for s in sections)
-
-    data_rows.append([
-        '',
-        'Итого',
-        total_workload,
-        f"{total_dot} ({total_dot/total_workload*100:.0f}%)" if total_workload else '0 (0%)',
-        total_lecture,
-        0,
-        0,
-        0,
-        total_practice,
-        0,
-        total_selfstudy,
-        ''
-    ])
-
-    # Запись данных
-    for r_idx, row_data in enumerate(data_rows, start=4):
-        for c_idx, value in enumerate(row_data, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=value)
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-    # Автоширина колонок
-    for col in range(1, 13):
-        ws.column_dimensions[get_column_letter(col)].width = 16
-
-    return wb
-
-def _check_single_requirement(requirement, total_hours, program):
-    """Проверяет одно конкретное требование"""
-    types = {
-        choice[0]: choice[1] 
-        for choice in Requirement.HoursType.choices
-    }
-    left_hours = total_hours.get(requirement.left_num_type, 0)
-    right_hours = total_hours.get(requirement.right_num_type, 0)
-    
-    # Применяем процент (left_num_value это процент от right_num_type)
-    required_value = right_hours / 100 * requirement.left_num_value
-    
-    check_result = {
-        'requirement_id': requirement.pk,
-        'left_type': types[requirement.left_num_type],
-        'left_value': left_hours,
-        'left_percent': requirement.left_num_value,
-        'right_type': types[requirement.right_num_type],
-        'right_value': right_hours,
-        'required_value': required_value,
-        'operator': requirement.operator,
-        'status': 'success',
-        'message': '',
-        'types': types
-    }
-    
-    # Проверяем условие
-    if requirement.operator == 'more':
-        if left_hours > required_value:
-            check_result['status'] = 'danger'
-            check_result['message'] = f"{left_hours} {requirement.left_num_type} >= {required_value:.1f} ({requirement.left_num_value}%) от {right_hours} {requirement.right_num_type}"
-    elif requirement.operator == 'less':
-        if left_hours < required_value:
-            check_result['status'] = 'danger'
-            check_result['message'] = f"{left_hours} {requirement.left_num_type} <= {required_value:.1f} ({requirement.left_num_value}%) от {right_hours} {requirement.right_num_type}"
-    elif requirement.operator == 'equal':
-        if left_hours != required_value:
-            check_result['status'] = 'danger'
-            check_result['message'] = f"{left_hours} {requirement.left_num_type} ≠ {required_value:.1f} ({requirement.left_num_value}%) от {right_hours} {requirement.right_num_type}"
-    return check_result
-
-def check_for_requirements(program):
+def check_for_requirements(program, curriculum=None):
     """Проверяет соответствие программы требованиям федеральных операторов"""
-    sections = program.sections.all()
-    
-    # Подсчет часов программы
-    total_hours = {
-        'lecture_hours': sum(s.lecture_hours for s in sections),
-        'practice_hours': sum(s.practice_hours for s in sections),
-        'selfstudy_hours': sum(s.selfstudy_hours for s in sections),
-        'dot_hours': sum(s.dot_hours for s in sections),
-        'consultation_hours': sum(s.consultation_hours for s in sections),
-        'workload': sum(s.workload for s in sections),
-        'contact_hours': sum(s.lecture_hours + s.practice_hours for s in sections)
-    }
-    
-    # Группируем требования по оператору, форме обучения и DOT
-    requirements = {}
-    
-    for req_group in ProgramRequirements.objects.select_related('name').prefetch_related('requirement').all():
-        operator_name = req_group.name.name
-        study_form = req_group.study_form or 'FT'
-        dot_key = 'DOT' if req_group.DOT else 'nDOT'
-        
-        # Пропускаем несовместимые требования
-        if study_form != program.study_form:
-            continue
-        if req_group.DOT != program.DOT:
-            continue
-            
-        requirements.setdefault(operator_name, {})
-        requirements[operator_name].setdefault(study_form, {})
-        requirements[operator_name][study_form].setdefault(dot_key, {
-            'status': 'success',
-            'violations': [],
-            'checks': []
-        })
-        
-        result = requirements[operator_name][study_form][dot_key]
-        
-        # Проверяем каждое требование группы
-        for requirement in req_group.requirement.all():
-            check_result = _check_single_requirement(requirement, total_hours, program)
-            result['checks'].append(check_result)
-            
-            if check_result['status'] == 'danger':
-                result['status'] = 'danger'
-                result['violations'].append(check_result['message'])
-    
-    return requirements
+    # Часы программы по разделам (без итоговой аттестации)
+    total_hours = (curriculum or load_curriculum(program)).totals.as_dict()
+    return check_program(program, total_hours)
 
 @login_required
 def program_details(request, pk):
     program = get_object_or_404(EducationProgram, pk=pk)
 
-    # Экспорт в XLSX (без изменений)
+    # Экспорт в XLSX (готовые файлы кешируются по updated_at программы)
     export_format = request.GET.get('export')
-    if export_format:
-        filename = f"program_{program.id}_utp"
-        wb = None
-        if export_format == 'standard':
-            wb = generate_utp_xlsx(program)
-            filename += ".xlsx"
-        elif export_format == 'tgu':
-            wb = generate_tgu_utp_xlsx(program)
-            filename = f"TGU_{program.id}.xlsx"
-        elif export_format == 'appendix3':
-            wb = generate_appendix3_xlsx(program)
-            filename = f"Appendix3_{program.id}.xlsx"
-
-        if wb:
-            response = HttpResponse(
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            wb.save(response)
-            return response
+    if export_format in DOCUMENT_TYPES:
+        response = HttpResponse(
+            render_curriculum_xlsx(program, export_format),
+            content_type=XLSX_CONTENT_TYPE
+        )
+        response['Content-Disposition'] = f'attachment; filename="{curriculum_filename(program, export_format)}"'
+        return response
 
     if request.method == 'POST':
         program_form = EducationProgramForm(request.POST, instance=program)
@@ -977,93 +259,7 @@ def program_details(request, pk):
         if program_form.is_valid() and section_formset.is_valid() and topics_formset.is_valid():
             with transaction.atomic():
                 program = program_form.save()
-
-                # 1. Удаляем темы, помеченные пользователем (DELETE=True)
-                for form in topics_formset:
-                    if form.cleaned_data.get('DELETE') and form.instance.pk:
-                        form.instance.delete()
-
-                # 2. Обрабатываем разделы
-                temp_id_to_section = {}
-                deleted_section_ids = set()
-
-                for form in section_formset:
-                    if form.cleaned_data.get('DELETE'):
-                        if form.instance.pk:
-                            # Удаляем все темы этого раздела вручную (если они ещё есть)
-                            ProgramTopics.objects.filter(section=form.instance).delete()
-                            form.instance.delete()
-                            deleted_section_ids.add(form.instance.pk)
-                        continue
-
-                    section = form.save(commit=False)
-                    section.program = program
-                    temp_id = form.cleaned_data.get('temp_id')
-                    section.save()
-                    if temp_id:
-                        temp_id_to_section[temp_id] = section
-                    if section.pk:
-                        temp_id_to_section[str(section.pk)] = section
-
-                # 3. Обрабатываем оставшиеся темы (не удалённые)
-                topics_by_section = {}  # ключ: id раздела, значение: список (form, section)
-
-                for form in topics_formset:
-                    if form.cleaned_data.get('DELETE'):
-                        continue  # уже удалены
-
-                    section_temp = form.cleaned_data.get('section_temp')
-                    target_section = None
-
-                    if section_temp in temp_id_to_section:
-                        target_section = temp_id_to_section[section_temp]
-                    else:
-                        try:
-                            section_id = int(section_temp)
-                            if section_id not in deleted_section_ids:
-                                target_section = ProgramSection.objects.get(pk=section_id, program=program)
-                        except (ValueError, ProgramSection.DoesNotExist):
-                            pass
-
-                    if target_section:
-                        topics_by_section.setdefault(target_section.id, []).append((form, target_section))
-                    else:
-                        # Раздел не найден — удаляем тему (orphan)
-                        if form.instance.pk:
-                            form.instance.delete()
-
-                # 4. Сохраняем темы с пересчитанным order
-                for section_id, topics in topics_by_section.items():
-                    for idx, (form, section) in enumerate(topics, start=1):
-                        topic = form.save(commit=False)
-                        topic.section = section
-                        topic.order = idx
-                        topic.save()
-
-                # 5. Пересчитываем order разделов по порядку формсета
-                sections_in_order = []
-                for form in section_formset:
-                    if form.cleaned_data.get('DELETE'):
-                        continue
-                    # Определяем сохранённый раздел
-                    temp_id = form.cleaned_data.get('temp_id')
-                    if temp_id and temp_id in temp_id_to_section:
-                        section = temp_id_to_section[temp_id]
-                    elif form.instance.pk and form.instance.pk not in deleted_section_ids:
-                        section = form.instance
-                    else:
-                        continue
-                    sections_in_order.append(section)
-
-                for idx, section in enumerate(sections_in_order, start=1):
-                    if section.order != idx:
-                        section.order = idx
-                        section.save()
-
-                # 6. Обновляем общую трудоёмкость программы
-                total = sum((s.workload or 0) for s in program.sections.all()) + (program.final_attestation or 0)
-                program.academic_hours = total
-                program.save()
+                save_curriculum(program, section_formset, topics_formset)
 
                 messages.success(request, 'Программа успешно обновлена!')
                 return redirect('education_planner:program_details', pk=program.pk)
@@ -1095,20 +291,21 @@ def program_details(request, pk):
             if section_temp:
                 topics_by_section.setdefault(section_temp, []).append(form)
 
-        # Подготовка таблицы УТП и требований (как было)
-        requirements = check_for_requirements(program)
+        # Таблицы УТП и проверка требований строятся по одному снимку учебного плана
+        curriculum = load_curriculum(program)
+        requirements = check_for_requirements(program, curriculum)
         tables = {
             'ВНИИ': {
                 'export_url': '?export=standard',
-                'rows': build_utp_table(program),
+                'rows': build_utp_table(program, curriculum),
             },
             'ТГУ': {
                 'export_url': '?export=tgu',
-                'rows': build_tgu_table(program),
+                'rows': build_tgu_table(program, curriculum),
             },
             'ИРПО': {
                 'export_url': '?export=appendix3',
-                'rows': build_appendix3_table(program),
+                'rows': build_appendix3_table(program, curriculum),
             }
         }
         context = {
@@ -1121,6 +318,20 @@ def program_details(request, pk):
         }
         return render(request, 'education_planner/program_details.html', context)
 
+@login_required
+def agreement_curricula_zip(request, pk):
+    """ZIP-архив учебных планов всех программ договора"""
+    agreement = get_object_or_404(EduAgreement, pk=pk)
+    document_type = request.GET.get('type') or document_type_for_agreement(agreement)
+    if document_type not in DOCUMENT_TYPES:
+        return JsonResponse({'success': False, 'message': f'Неизвестный вид документа: {document_type}'}, status=400)
+
+    programs = EducationProgram.objects.filter(quotas__agreement=agreement, quotas__is_active=True).distinct().order_by('name')
+    response = HttpResponse(content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="curricula_{agreement.pk}_{document_type}.zip"'
+    curricula_zip(programs, document_type, response)
+    return response
+
 @login_required
 def agreements_dashboard(request):
     """Главная страница управления договорами"""
@@ -1130,10 +341,10 @@ def agreements_dashboard(request):
     status = request.GET.get('status', '')
     
     # Базовый queryset с предзагрузкой связанных данных
-    agreements = EduAgreement.objects.prefetch_related(
-        Prefetch('quotas', queryset=Quota.objects.filter(is_active=True).select_related('education_program')),
+    # Итоги по квотам считаются в SQL (with_totals), активные квоты предзагружаются
+    agreements = EduAgreement.objects.with_totals().with_active_quotas().prefetch_related(
         Prefetch('supplements', queryset=Supplement.objects.order_by('-signing_date'))
-    ).select_related()
+    )
     
     # Применяем фильтры
     if search_query:
@@ -1182,7 +393,6 @@ def agreements_dashboard(request):
     context = {
         'page_obj': page_obj,
         'agreements': page_obj.object_list,
-        'all_agreements': agreements,  # Для статистики нужны все, не только на странице
         'programs': programs,
         'programs_grouped': json.dumps(programs_grouped, ensure_ascii=False),
         'unique_program_names': unique_program_names,
@@ -1781,6 +991,7 @@ def analyze_quotas_excel(request):
         unrecognized_regions = []
         region_suggestions = {}
         total_rows = 0
+        region_resolver = RegionResolver()
         
         for index, row in df.iterrows():
             total_rows += 1
@@ -1792,14 +1003,12 @@ def analyze_quotas_excel(request):
                 regions_names = [clean_text_data(name) for name in regions_text.split(',') if clean_text_data(name)]
                 
                 for region_name in regions_names:
-                    region, match_type = find_region_without_creating(region_name)
+                    region, match_type = find_region_without_creating(region_name, region_resolver)
                     
                     if match_type == 'not_found':
                         if region_name not in [ur['original'] for ur in unrecognized_regions]:
                             # Ищем возможные совпадения для предложений
-                            suggestions = Region.objects.filter(
-                                name__icontains=region_name[:3] if len(region_name) > 3 else region_name
-                            )[:5]
+                            suggestions = region_resolver.suggest(region_name)
                             
                             unrecognized_regions.append({
                                 'original': region_name,
@@ -1813,9 +1022,9 @@ def analyze_quotas_excel(request):
         if default_storage.exists(file_path):
             default_storage.delete(file_path)
         
-        # Сохраняем данные файла в сессии для последующего импорта
-        request.session['import_file_data'] = df.to_json()
-        request.session['import_file_name'] = excel_file.name
+        # Сохраняем разобранный файл во временное хранилище, в сессии — только токен
+        discard_staged(request.session.get('import_token'))
+        request.session['import_token'] = stage_dataframe(df, 'quotas', {'file_name': excel_file.name})
         request.session.modified = True  # Принудительно сохраняем сессию
         
         return JsonResponse({
@@ -1852,210 +1061,33 @@ def save_region_mappings(request):
 
 def process_excel_import(df, file_name, region_mappings={}, use_old_region_logic=False):
     """Универсальная функция для обработки импорта Excel"""
-    from datetime import datetime
-    import pandas as pd
-    
-    # Проверяем необходимые колонки
-    required_columns = [
-        'договор_номер', 'программа_название', 'программа_тип', 'программа_часы', 
-        'программа_форма', 'регионы', 'количество', 'стоимость_за_заявку'
-    ]
-    
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    return JsonResponse(import_quotas_dataframe(df, region_mappings, use_old_region_logic))
+
+
+def import_quotas_dataframe(df, region_mappings=None, use_old_region_logic=False, progress=None):
+    """Импорт квот из таблицы шаблона, возвращает результат для JSON-ответа"""
+    missing_columns = [col for col in QUOTA_REQUIRED_COLUMNS if col not in df.columns]
     if missing_columns:
-        return JsonResponse({
+        return {
             'success': False, 
             'message': get_missing_columns_message(missing_columns, is_supplement=False)
-        })
+        }
     
-    # Статистика
-    created_count = 0
-    error_count = 0
-    errors = []
+    importer = QuotaBulkImporter(
+        region_mappings=region_mappings,
+        create_regions=use_old_region_logic,
+        progress=progress
+    )
+    report = importer.import_quotas(df)
     
-    with transaction.atomic():
-        for index, row in df.iterrows():
-            try:
-                agreement_number = clean_text_data(row['договор_номер'])
-                program_name = clean_text_data(row['программа_название'])
-                program_type = clean_text_data(row['программа_тип'])
-                program_form = clean_text_data(row['программа_форма'])
-                regions_text = clean_text_data(row['регионы'])
-                
-                # Ищем договор сначала, чтобы проверить федерального оператора
-                agreement = EduAgreement.objects.filter(number=agreement_number).first()
-                if not agreement:
-                    errors.append(f'Строка {index + 2}: Договор {agreement_number} не найден')
-                    error_count += 1
-                    continue
-
-                # Для ВНИИ регионы не обязательны
-                required_fields = [agreement_number, program_name]
-                if agreement.federal_operator != 'VNII':
-                    required_fields.append(regions_text)
-                
-                if not all(required_fields):
-                    errors.append(f'Строка {index + 2}: Отсутствуют обязательные данные')
-                    error_count += 1
-                    continue
-
-                # Ищем или создаем программу
-                program = EducationProgram.objects.filter(
-                    name__icontains=program_name,
-                    academic_hours=int(row['программа_часы'])
-                ).first()
-                
-                if not program:
-                    # Создаем программу автоматически
-                    try:
-                        # Определяем тип программы
-                        program_type_choices = {
-                            'дпо пк': EducationProgram.ProgramType.ADVANCED,
-                            'повышение квалификации': EducationProgram.ProgramType.ADVANCED,
-                            'профессиональная переподготовка': EducationProgram.ProgramType.PROFESSIONAL_RE,
-                            'профессиональное обучение': EducationProgram.ProgramType.PROFESSIONAL,
-                            'программы профессионального обучения': EducationProgram.ProgramType.PROFESSIONAL
-                        }
-                        
-                        program_type_key = program_type.lower()
-                        program_type_value = program_type_choices.get(program_type_key, EducationProgram.ProgramType.ADVANCED)
-                        
-                        # Определяем форму обучения
-                        study_form_choices = {
-                            'очная': EducationProgram.StudyForm.FULL_TIME,
-                            'заочная': EducationProgram.StudyForm.DISTANCE,
-                            'очно-заочная': EducationProgram.StudyForm.PART_TIME,
-                            'дистанционная': EducationProgram.StudyForm.DISTANCE
-                        }
-                        
-                        study_form_key = program_form.lower()
-                        study_form_value = study_form_choices.get(study_form_key, EducationProgram.StudyForm.FULL_TIME)
-                        
-                        program = EducationProgram.objects.create(
-                            name=program_name,
-                            program_type=program_type_value,
-                            academic_hours=int(row['программа_часы']),
-                            study_form=study_form_value,
-                            description=f'Автоматически создана при импорте квот'
-                        )
-                        
-                    except Exception as e:
-                        errors.append(f'Строка {index + 2}: Ошибка создания программы "{program_name}" - {str(e)}')
-                        error_count += 1
-                        continue
-
-                # Парсим регионы с улучшенной обработкой скобок
-                regions_names = []
-                for name in regions_text.split(','):
-                    cleaned_name = clean_text_data(name)
-                    if cleaned_name:
-                        # Убираем содержимое в скобках и лишние пробелы
-                        cleaned_name = re.sub(r'\([^)]*\)', '', cleaned_name).strip()
-                        if cleaned_name:
-                            regions_names.append(cleaned_name)
-                
-                regions = []
-                
-                for region_name in regions_names:
-                    if use_old_region_logic:
-                        # Старая логика с автоматическим созданием
-                        region, message = find_or_create_region(region_name)
-                        if region:
-                            regions.append(region)
-                        else:
-                            errors.append(f'Строка {index + 2}: {message}')
-                    else:
-                        # Новая логика с пользовательскими выборами
-                        region, match_type = find_region_without_creating(region_name)
-                        
-                        if region:
-                            regions.append(region)
-                        else:
-                            # Если не найден, ищем в пользовательских выборах
-                            if region_name in region_mappings:
-                                mapping_info = region_mappings[region_name]
-                                
-                                if mapping_info['action'] == 'map':
-                                    # Пользователь выбрал существующий регион
-                                    mapped_region = Region.objects.filter(id=mapping_info['region_id']).first()
-                                    if mapped_region:
-                                        regions.append(mapped_region)
-                                    else:
-                                        errors.append(f'Строка {index + 2}: Выбранный регион (ID: {mapping_info["region_id"]}) не найден')
-                                        
-                                elif mapping_info['action'] == 'create':
-                                    # Пользователь выбрал создать новый регион
-                                    new_region_name = mapping_info['new_name']
-                                    
-                                    # Проверяем, не создан ли уже этот регион
-                                    existing_region = Region.objects.filter(name=new_region_name).first()
-                                    if existing_region:
-                                        regions.append(existing_region)
-                                    else:
-                                        try:
-                                            new_region = Region.objects.create(
-                                                name=new_region_name,
-                                                code=new_region_name[:10].upper().replace(' ', '_').replace('-', '_'),
-                                                is_active=True
-                                            )
-                                            regions.append(new_region)
-                                        except Exception as e:
-                                            errors.append(f'Строка {index + 2}: Ошибка создания региона "{new_region_name}": {str(e)}')
-                                            
-                                elif mapping_info['action'] == 'skip':
-                                    # Пользователь выбрал пропустить этот регион
-                                    continue
-                            else:
-                                # Регион не найден и нет пользовательского выбора
-                                errors.append(f'Строка {index + 2}: Регион "{region_name}" не найден и не настроен')
-                
-                # Для ВНИИ регионы не обязательны
-                if not regions and agreement.federal_operator != 'VNII':
-                    error_count += 1
-                    continue
-
-                # Обрабатываем даты
-                start_date = None
-                end_date = None
-                
-                if 'дата_начала' in df.columns and pd.notna(row['дата_начала']):
-                    try:
-                        start_date = datetime.strptime(str(row['дата_начала']), '%d.%m.%Y').date()
-                    except:
-                        pass
-                
-                if 'дата_окончания' in df.columns and pd.notna(row['дата_окончания']):
-                    try:
-                        end_date = datetime.strptime(str(row['дата_окончания']), '%d.%m.%Y').date()
-                    except:
-                        pass
-
-                # Создаем квоту
-                quota = Quota.objects.create(
-                    agreement=agreement,
-                    education_program=program,
-                    quantity=int(row['количество']),
-                    cost_per_quota=float(row['стоимость_за_заявку']),
-                    start_date=start_date,
-                    end_date=end_date
-                )
-                
-                # Устанавливаем регионы
-                quota.regions.set(regions)
-                
-                created_count += 1
-                
-            except Exception as e:
-                errors.append(f'Строка {index + 2}: Ошибка импорта - {str(e)}')
-                error_count += 1
-
-    # Возвращаем результат
-    return JsonResponse({
+    return {
         'success': True,
-        'created_count': created_count,
-        'error_count': error_count,
-        'errors': errors[:10]  # Ограничиваем количество ошибок для отображения
-    })
+        'created_count': report['created_count'],
+        'error_count': report['error_count'],
+        'created_programs': len(report['created_programs']),
+        'created_regions': report['created_regions'],
+        'errors': (report['errors'] + report['warnings'])[:10]  # Ограничиваем количество ошибок для отображения
+    }
 
 
 @login_required
@@ -2104,236 +1136,39 @@ def import_quotas_excel_direct(request):
 @require_http_methods(["POST"])
 def import_quotas_excel(request):
     """Финальный импорт квот из Excel файла с пользовательскими настройками регионов"""
-    import pandas as pd
-    from datetime import datetime
-    import json
-    
     try:
-        # Получаем данные из сессии
-        import_file_data = request.session.get('import_file_data')
+        # Получаем токен загруженного файла из сессии
+        import_token = request.session.get('import_token')
         region_mappings = request.session.get('region_mappings', {})
         
         # Отладочная информация
         session_keys = list(request.session.keys())
         print(f"DEBUG: Ключи сессии: {session_keys}")
-        print(f"DEBUG: Есть import_file_data: {import_file_data is not None}")
+        print(f"DEBUG: Есть import_token: {import_token is not None}")
         print(f"DEBUG: Размер region_mappings: {len(region_mappings)}")
         
-        if not import_file_data:
+        try:
+            meta = get_staged_meta(import_token, 'quotas')
+        except StagedImportNotFound as e:
             return JsonResponse({
                 'success': False, 
-                'message': f'Данные файла не найдены. Ключи сессии: {session_keys}. Повторите анализ файла.'
+                'message': f'{e} Ключи сессии: {session_keys}.'
             })
         
-        # Восстанавливаем DataFrame из JSON
-        df = pd.read_json(import_file_data)
-        file_name = request.session.get('import_file_name', 'excel_file.xlsx')
-        
         # Очищаем сессию
-        del request.session['import_file_data']
+        del request.session['import_token']
         if 'region_mappings' in request.session:
             del request.session['region_mappings']
-        if 'import_file_name' in request.session:
-            del request.session['import_file_name']
-        
-        # Выполняем импорт с пользовательскими настройками
-        return process_excel_import(df, file_name, region_mappings, use_old_region_logic=False)
-        
-        # Проверяем необходимые колонки
-        required_columns = [
-            'договор_номер', 'программа_название', 'программа_тип', 'программа_часы', 
-            'программа_форма', 'регионы', 'количество', 'стоимость_за_заявку'
-        ]
-        
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            return JsonResponse({
-                'success': False, 
-                'message': get_missing_columns_message(missing_columns, is_supplement=False)
-            })
-        
-        # Статистика
-        created_count = 0
-        error_count = 0
-        errors = []
-        
-        with transaction.atomic():
-            for index, row in df.iterrows():
-                try:
-                    # Очищаем текстовые данные
-                    agreement_number = clean_text_data(row['договор_номер'])
-                    program_name = clean_text_data(row['программа_название'])
-                    program_type = clean_text_data(row['программа_тип'])
-                    program_form = clean_text_data(row['программа_форма'])
-                    regions_text = clean_text_data(row['регионы'])
-                    
-                    # Ищем договор
-                    agreement = EduAgreement.objects.filter(
-                        number=agreement_number
-                    ).first()
-                    
-                    if not agreement:
-                        errors.append(f'Строка {index + 2}: Договор {agreement_number} не найден')
-                        error_count += 1
-                        continue
-
-                    # Ищем или создаем программу обучения
-                    program = EducationProgram.objects.filter(
-                        name__icontains=program_name,
-                        academic_hours=int(row['программа_часы'])
-                    ).first()
-                    
-                    if not program:
-                        # Создаем программу автоматически
-                        try:
-                            # Определяем тип программы
-                            program_type_choices = {
-                                'повышение квалификации': EducationProgram.ProgramType.ADVANCED,
-                                'профессиональная переподготовка': EducationProgram.ProgramType.PROFESSIONAL_RE,
-                                'программы профессионального обучения': EducationProgram.ProgramType.PROFESSIONAL,
-                                'профессиональное обучение': EducationProgram.ProgramType.PROFESSIONAL
-                            }
-                            
-                            program_type_key = program_type.lower()
-                            program_type_value = program_type_choices.get(program_type_key, EducationProgram.ProgramType.ADVANCED)
-                            
-                            # Определяем форму обучения
-                            study_form_choices = {
-                                'очная': EducationProgram.StudyForm.FULL_TIME,
-                                'заочная': EducationProgram.StudyForm.DISTANCE,
-                                'очно-заочная': EducationProgram.StudyForm.PART_TIME,
-                                'дистанционная': EducationProgram.StudyForm.DISTANCE
-                            }
-                            
-                            study_form_key = program_form.lower()
-                            study_form_value = study_form_choices.get(study_form_key, EducationProgram.StudyForm.FULL_TIME)
-                            
-                            program = EducationProgram.objects.create(
-                                name=program_name,
-                                program_type=program_type_value,
-                                academic_hours=int(row['программа_часы']),
-                                study_form=study_form_value,
-                                description=f'Автоматически создана при импорте квот'
-                            )
-                            
-                        except Exception as e:
-                            errors.append(f'Строка {index + 2}: Ошибка создания программы "{program_name}" - {str(e)}')
-                            error_count += 1
-                            continue
-
-                    # Парсим регионы с использованием пользовательских выборов (для ВНИИ регионы не обязательны)
-                    regions_names = []
-                    regions = []
-                    
-                    if agreement.federal_operator != 'VNII' and regions_text:
-                        regions_names = [clean_text_data(name) for name in regions_text.split(',') if clean_text_data(name)]
-                    
-                    for region_name in regions_names:
-                        # Сначала пытаемся найти регион стандартным способом
-                        region, match_type = find_region_without_creating(region_name)
-                        
-                        if region:
-                            regions.append(region)
-                        else:
-                            # Если не найден, ищем в пользовательских выборах
-                            if region_name in region_mappings:
-                                mapping_info = region_mappings[region_name]
-                                
-                                if mapping_info['action'] == 'map':
-                                    # Пользователь выбрал существующий регион
-                                    mapped_region = Region.objects.filter(id=mapping_info['region_id']).first()
-                                    if mapped_region:
-                                        regions.append(mapped_region)
-                                    else:
-                                        errors.append(f'Строка {index + 2}: Выбранный регион (ID: {mapping_info["region_id"]}) не найден')
-                                        
-                                elif mapping_info['action'] == 'create':
-                                    # Пользователь выбрал создать новый регион
-                                    new_region_name = mapping_info['new_name']
-                                    
-                                    # Проверяем, не создан ли уже этот регион
-                                    existing_region = Region.objects.filter(name=new_region_name).first()
-                                    if existing_region:
-                                        regions.append(existing_region)
-                                    else:
-                                        try:
-                                            new_region = Region.objects.create(
-                                                name=new_region_name,
-                                                code=new_region_name[:10].upper().replace(' ', '_').replace('-', '_'),
-                                                is_active=True
-                                            )
-                                            regions.append(new_region)
-                                        except Exception as e:
-                                            errors.append(f'Строка {index + 2}: Ошибка создания региона "{new_region_name}": {str(e)}')
-                                            
-                                elif mapping_info['action'] == 'skip':
-                                    # Пользователь выбрал пропустить этот регион
-                                    continue
-                            else:
-                                # Регион не найден и нет пользовательского выбора
-                                errors.append(f'Строка {index + 2}: Регион "{region_name}" не найден и не настроен')
-                    
-                    # Для ВНИИ регионы не обязательны
-                    if not regions and agreement.federal_operator != 'VNII':
-                        error_count += 1
-                        continue
-
-                    # Обрабатываем даты
-                    start_date = None
-                    end_date = None
-                    
-                    if 'дата_начала' in df.columns and pd.notna(row['дата_начала']):
-                        try:
-                            if isinstance(row['дата_начала'], str):
-                                start_date = datetime.strptime(row['дата_начала'], '%d.%m.%Y').date()
-                            else:
-                                start_date = row['дата_начала'].date()
-                        except (ValueError, AttributeError):
-                            errors.append(f'Строка {index + 2}: Неверный формат даты начала')
-                    
-                    if 'дата_окончания' in df.columns and pd.notna(row['дата_окончания']):
-                        try:
-                            if isinstance(row['дата_окончания'], str):
-                                end_date = datetime.strptime(row['дата_окончания'], '%d.%m.%Y').date()
-                            else:
-                                end_date = row['дата_окончания'].date()
-                        except (ValueError, AttributeError):
-                            errors.append(f'Строка {index + 2}: Неверный формат даты окончания')
-
-                    # Валидация дат
-                    if start_date and end_date and start_date > end_date:
-                        errors.append(f'Строка {index + 2}: Дата начала не может быть позже даты окончания')
-                        error_count += 1
-                        continue
-
-                    # Создаем квоту
-                    quota = Quota.objects.create(
-                        agreement=agreement,
-                        education_program=program,
-                        quantity=int(row['количество']),
-                        start_date=start_date,
-                        end_date=end_date,
-                        cost_per_quota=float(row['стоимость_за_заявку']),
-                        is_active=True
-                    )
-                    quota.regions.set(regions)
-                    created_count += 1
-
-                except Exception as e:
-                    errors.append(f'Строка {index + 2}: Ошибка импорта - {str(e)}')
-                    error_count += 1
         
-        # Удаляем временный файл
-        if os.path.exists(full_path):
-            os.remove(full_path)
-        
-        return JsonResponse({
-            'success': True,
-            'message': f'Импорт завершен! Создано квот: {created_count}',
-            'created_count': created_count,
-            'error_count': error_count,
-            'errors': errors[:10]  # Ограничиваем количество ошибок для отображения
-        })
+        # Импорт выполняется в фоновой задаче, страница опрашивает status_url
+        job, created = enqueue_import(
+            ImportJob.Kind.QUOTAS,
+            dedup_key=f'quotas:{import_token}',
+            user=request.user,
+            params={'token': import_token, 'region_mappings': region_mappings},
+            file_name=meta.get('file_name', 'excel_file.xlsx'),
+        )
+        return JsonResponse({'success': True, **job_status_payload(job)})
         
     except Exception as e:
         return JsonResponse({
@@ -2342,6 +1177,28 @@ def import_quotas_excel(request):
         })
 
 
+def run_quota_import(job, progress):
+    """Импорт квот из подготовленного анализом файла (обработчик ImportJob)"""
+    token = job.params['token']
+    try:
+        df, meta = load_staged(token, 'quotas')
+        progress.set_total(len(df))
+        result = import_quotas_dataframe(
+            df,
+            job.params.get('region_mappings') or {},
+            use_old_region_logic=False,
+            progress=progress.set
+        )
+    finally:
+        discard_staged(token)
+    
+    progress.created = result.get('created_count', 0)
+    progress.error_count = result.get('error_count', 0)
+    progress.errors = result.get('errors', [])
+    result['message'] = result.get('message') or f"Импорт завершен! Создано квот: {result['created_count']}"
+    return result
+
+
 @login_required
 def download_quota_template(request):
     """Скачивание шаблона Excel для импорта квот"""
@@ -2455,6 +1312,7 @@ def analyze_supplement_excel(request):
         # Очищаем и парсим данные
         new_quotas = []
         unrecognized_regions = set()
+        region_resolver = RegionResolver()
         
         for index, row in df.iterrows():
             if pd.isna(row['Программа обучения']) or pd.isna(row['Количество мест']) or pd.isna(row['Длительность']):
@@ -2562,7 +1420,7 @@ def analyze_supplement_excel(request):
             valid_regions = []
             if agreement.federal_operator != 'VNII':
                 for region_name in regions_names:
-                    region, match_type = find_region_without_creating(region_name)
+                    region, match_type = find_region_without_creating(region_name, region_resolver)
                     if match_type != 'not_found' and region:
                         valid_regions.append(region.name)
                     else:
@@ -2587,13 +1445,13 @@ def analyze_supplement_excel(request):
                     'cost_per_quota': cost_per_quota
                 })
         
-        # Сохраняем данные в сессии
-        request.session['supplement_file_data'] = {
+        # Сохраняем данные во временное хранилище, в сессии — только токен
+        discard_staged(request.session.get('supplement_import_token'))
+        request.session['supplement_import_token'] = stage_dataframe(df, 'supplement', {
             'agreement_id': agreement_id,
-            'new_quotas': new_quotas
-        }
-        request.session['supplement_file_name'] = file.name
-        request.session['supplement_df_data'] = df.to_json()
+            'new_quotas': new_quotas,
+            'file_name': file.name,
+        })
         request.session.modified = True
         
         # Подготавливаем ответ
@@ -2609,13 +1467,11 @@ def analyze_supplement_excel(request):
         if unrecognized_regions:
             for region_name in unrecognized_regions:
                 # Ищем похожие регионы для предложений
-                suggestions = Region.objects.filter(
-                    name__icontains=region_name[:3] if len(region_name) > 3 else region_name
-                ).values_list('name', flat=True)[:5]
+                suggestions = region_resolver.suggest(region_name)
                 
                 response_data['unrecognized_regions'].append({
                     'name': region_name,
-                    'suggestions': list(suggestions)
+                    'suggestions': [region.name for region in suggestions]
                 })
         
         return JsonResponse(response_data)
@@ -2633,12 +1489,12 @@ def import_supplement_excel(request):
     Заменяет все квоты договора на новые из файла
     """
     try:
-        # Получаем данные из сессии
-        if 'supplement_file_data' not in request.session:
-            return JsonResponse({'success': False, 'message': 'Данные файла не найдены. Повторите анализ файла.'})
-        
-        file_data = request.session['supplement_file_data']
-        file_name = request.session.get('supplement_file_name', 'unknown.xlsx')
+        # Получаем данные по токену из сессии
+        supplement_token = request.session.get('supplement_import_token')
+        try:
+            file_data = get_staged_meta(supplement_token, 'supplement')
+        except StagedImportNotFound as e:
+            return JsonResponse({'success': False, 'message': str(e)})
         
         # Получаем mappings регионов, если есть
         region_mappings = request.session.get('supplement_region_mappings', {})
@@ -2659,225 +1515,95 @@ def import_supplement_excel(request):
         
         agreement_id = file_data['agreement_id']
         
-        try:
-            agreement = EduAgreement.objects.get(id=agreement_id)
-        except EduAgreement.DoesNotExist:
+        if not EduAgreement.objects.filter(id=agreement_id).exists():
             return JsonResponse({'success': False, 'message': 'Договор не найден'})
         
-        # Читаем данные из сессии повторно
-        df_data = request.session.get('supplement_df_data')
-        if not df_data:
-            return JsonResponse({'success': False, 'message': 'Данные Excel файла не найдены'})
-        
-        # Используем StringIO для корректного чтения JSON
-        import io
-        df = pd.read_json(io.StringIO(df_data))
-        created_quotas = []
-        
-
-        
-        with transaction.atomic():
-            # Обрабатываем дату подписания
-            signing_date = None
-            if supplement_signing_date:
-                try:
-                    from datetime import datetime
-                    signing_date = datetime.strptime(supplement_signing_date, '%Y-%m-%d').date()
-                except ValueError:
-                    signing_date = None
-            
-            # Создаем дополнительное соглашение
-            supplement = Supplement.objects.create(
-                agreement=agreement,
-                number=supplement_number,
-                description=supplement_description or f'Импорт из файла {file_name}',
-                status=supplement_status,
-                signing_date=signing_date
-            )
-            
-            # 1. Деактивируем все старые квоты
-            agreement.quotas.update(is_active=False)
-            
-            # 2. Создаем новые квоты из файла
-            for index, row in df.iterrows():
-                try:
-                    program_name = clean_text_data(str(row['Программа обучения']))
-                    study_form_text = clean_text_data(str(row.get('Форма обучения', '')))
-                    duration_text = clean_text_data(str(row.get('Длительность', '')))
-                    # Для ВНИИ регионы не обязательны
-                    if agreement.federal_operator != 'VNII':
-                        regions_text = clean_text_data(str(row.get('Регионы реализации', '')))
-                    else:
-                        regions_text = ''
-                    
-                    # Парсим количество
-                    try:
-                        quantity = int(float(str(row['Количество мест']).replace(' ', '')))
-                    except (ValueError, TypeError):
-                        continue
-                    
-                    if quantity <= 0:
-                        continue
-                    
-                    # Парсим длительность
-                    duration = None
-                    if duration_text:
-                        try:
-                            import re
-                            duration_match = re.search(r'(\d+)', duration_text)
-                            if duration_match:
-                                duration = int(duration_match.group(1))
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if not duration:
-                        continue
-                    
-                    # Находим программу
-                    programs = EducationProgram.objects.filter(name__icontains=program_name)
-                    
-                    # Не фильтруем по типу программы, так как колонка содержит форму обучения
-                    
-                    if duration:
-                        programs = programs.filter(academic_hours=duration)
-                    
-                    if not programs.exists():
-                        # Автоматически создаём программу если не найдена
-                        try:
-                            default_type = EducationProgram.ProgramType.ADVANCED
-                            study_form_map = {
-                                'очная': EducationProgram.StudyForm.FULL_TIME,
-                                'заочная': EducationProgram.StudyForm.DISTANCE,
-                                'очно-заочная': EducationProgram.StudyForm.PART_TIME,
-                                'дистанционная': EducationProgram.StudyForm.DISTANCE
-                            }
-                            study_form_value = study_form_map.get(study_form_text.lower(), EducationProgram.StudyForm.FULL_TIME) if study_form_text else EducationProgram.StudyForm.FULL_TIME
-                            program = EducationProgram.objects.create(
-                                name=program_name,
-                                program_type=default_type,
-                                academic_hours=duration,
-                                study_form=study_form_value,
-                                description='Автоматически создана при анализе доп. соглашения'
-                            )
-                        except Exception:
-                            continue
-                    else:
-                        program = programs.first()
-                    
-                    # Парсим регионы (для ВНИИ регионы не обязательны)
-                    valid_regions = []
-                    if agreement.federal_operator != 'VNII' and regions_text:
-                        regions_names = [clean_text_data(name.strip()) for name in regions_text.split(',')]
-                        regions_names = [name for name in regions_names if name]
-                        
-                        for region_name in regions_names:
-                            # Применяем mapping если есть
-                            if region_name in region_mappings:
-                                mapping = region_mappings[region_name]
-                                if mapping['action'] == 'map':
-                                    region_name = mapping['target_region']
-                                elif mapping['action'] == 'skip':
-                                    continue
-                            
-                            try:
-                                region = Region.objects.get(name=region_name)
-                                valid_regions.append(region)
-                            except Region.DoesNotExist:
-                                continue
-                        
-                        # Для не-ВНИИ регионы обязательны
-                        if not valid_regions:
-                            continue
-                    
-                    # Парсим даты (для ВНИИ даты не обрабатываются)
-                    start_date = None
-                    end_date = None
-                    cost_per_quota = None
-                    
-                    if agreement.federal_operator != 'VNII':
-                        # Дата начала
-                        if 'Дата начала' in row and pd.notna(row['Дата начала']):
-                            try:
-                                from datetime import datetime
-                                start_date_str = str(row['Дата начала']).strip()
-                                if start_date_str and start_date_str != 'nan':
-                                    # Пробуем разные форматы дат
-                                    for date_format in ['%d.%m.%Y', '%Y-%m-%d', '%d/%m/%Y']:
-                                        try:
-                                            start_date = datetime.strptime(start_date_str, date_format).date()
-                                            break
-                                        except ValueError:
-                                            continue
-                            except (ValueError, TypeError):
-                                pass
-                        
-                        # Дата окончания
-                        if 'Дата окончания' in row and pd.notna(row['Дата окончания']):
-                            try:
-                                from datetime import datetime
-                                end_date_str = str(row['Дата окончания']).strip()
-                                if end_date_str and end_date_str != 'nan':
-                                    # Пробуем разные форматы дат
-                                    for date_format in ['%d.%m.%Y', '%Y-%m-%d', '%d/%m/%Y']:
-                                        try:
-                                            end_date = datetime.strptime(end_date_str, date_format).date()
-                                            break
-                                        except ValueError:
-                                            continue
-                            except (ValueError, TypeError):
-                                pass
-                    
-                    # Стоимость за заявку
-                    if 'Стоимость за заявку' in row and pd.notna(row['Стоимость за заявку']):
-                        try:
-                            cost_str = str(row['Стоимость за заявку']).replace(' ', '').replace(',', '.')
-                            # Убираем символы валюты
-                            import re
-                            cost_str = re.sub(r'[^\d.,]', '', cost_str)
-                            if cost_str and cost_str != 'nan':
-                                cost_per_quota = float(cost_str)
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    # Создаем новую квоту
-                    quota = Quota.objects.create(
-                        agreement=agreement,
-                        education_program=program,
-                        quantity=quantity,
-                        start_date=start_date,
-                        end_date=end_date,
-                        cost_per_quota=cost_per_quota,
-                        is_active=True
-                    )
-                    quota.regions.set(valid_regions)
-                    created_quotas.append(quota)
-                    
-                except Exception as e:
-                    continue
+        # Квоты договора заменяются в фоновой задаче; два импорта по одному договору одновременно не идут
+        job, created = enqueue_import(
+            ImportJob.Kind.SUPPLEMENT,
+            dedup_key=f'agreement:{agreement_id}',
+            user=request.user,
+            params={
+                'token': supplement_token,
+                'agreement_id': agreement_id,
+                'region_mappings': region_mappings,
+                'number': supplement_number,
+                'description': supplement_description,
+                'signing_date': supplement_signing_date,
+                'status': supplement_status,
+            },
+            file_name=file_data.get('file_name', 'unknown.xlsx'),
+        )
+        if not created:
+            return JsonResponse({
+                'success': False,
+                'message': f'Импорт по этому договору уже выполняется (задача #{job.pk}). Дождитесь его завершения.'
+            })
         
-        # Очищаем сессию
-        if 'supplement_file_data' in request.session:
-            del request.session['supplement_file_data']
-        if 'supplement_file_name' in request.session:
-            del request.session['supplement_file_name']
+        # Очищаем сессию (временное хранилище очистит задача)
+        if 'supplement_import_token' in request.session:
+            del request.session['supplement_import_token']
         if 'supplement_region_mappings' in request.session:
             del request.session['supplement_region_mappings']
-        if 'supplement_df_data' in request.session:
-            del request.session['supplement_df_data']
         request.session.modified = True
         
-        return JsonResponse({
-            'success': True,
-            'supplement_id': supplement.id,
-            'supplement_number': supplement.number,
-            'quotas_count': len(created_quotas),
-            'message': f'Дополнительное соглашение №{supplement.number} успешно создано. Квоты договора заменены ({len(created_quotas)} новых квот)'
-        })
+        return JsonResponse({'success': True, **job_status_payload(job)})
         
     except Exception as e:
         return JsonResponse({'success': False, 'message': f'Ошибка импорта: {str(e)}'})
 
 
+def run_supplement_import(job, progress):
+    """Создание доп. соглашения и замена квот договора (обработчик ImportJob)"""
+    params = job.params
+    token = params['token']
+    df, file_data = load_staged(token, 'supplement')
+    progress.set_total(len(df))
+    file_name = file_data.get('file_name', 'unknown.xlsx')
+    agreement = EduAgreement.objects.get(id=params['agreement_id'])
+    
+    importer = QuotaBulkImporter(region_mappings=params.get('region_mappings') or {}, progress=progress.set)
+    
+    with transaction.atomic():
+        # Обрабатываем дату подписания
+        signing_date = None
+        if params.get('signing_date'):
+            try:
+                from datetime import datetime
+                signing_date = datetime.strptime(params['signing_date'], '%Y-%m-%d').date()
+            except ValueError:
+                signing_date = None
+        
+        # Создаем дополнительное соглашение
+        supplement = Supplement.objects.create(
+            agreement=agreement,
+            number=params['number'],
+            description=params.get('description') or f'Импорт из файла {file_name}',
+            status=params.get('status', 'NEGOTIATION'),
+            signing_date=signing_date
+        )
+        
+        # 1. Деактивируем все старые квоты
+        agreement.quotas.update(is_active=False)
+        
+        # 2. Создаем новые квоты из файла
+        report = importer.import_supplement(df, agreement)
+    
+    discard_staged(token)
+    progress.created = report['created_count']
+    progress.errors = (report['skipped'] + report['warnings'])[:200]
+    
+    return {
+        'success': True,
+        'supplement_id': supplement.id,
+        'supplement_number': supplement.number,
+        'quotas_count': report['created_count'],
+        'skipped_count': report['skipped_count'],
+        'skipped': (report['skipped'] + report['warnings'])[:10],
+        'message': f'Дополнительное соглашение №{supplement.number} успешно создано. Квоты договора заменены ({report["created_count"]} новых квот)'
+    }
+
+
 @login_required
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -2981,6 +1707,149 @@ def download_supplement_template(request):
     return response
 
 
+def build_quota_data(quota):
+    """Потребности, распределение по регионам, заявки и покрытие одной квоты (строка сводного дашборда)"""
+    # Подсчитываем потребности для квоты
+    demands = quota.demands.filter(status=Demand.DemandStatus.ACTIVE)
+    total_demand = demands.aggregate(total=models.Sum('quantity'))['total'] or 0
+    
+    # Получаем распределение квот по регионам
+    distributions = []
+    if quota.regions.count() > 1:
+        # Если квота на несколько регионов, проверяем распределение
+        # (распределения квоты берутся одним запросом или из prefetch_related)
+        distributions_by_region = {d.region_id: d for d in quota.distributions.all()}
+        for region in quota.regions.all():
+            distribution = distributions_by_region.get(region.id)
+            # Если распределения нет, создаем его с нулевым количеством
+            if not distribution:
+                distribution = QuotaDistribution.objects.create(
+                    quota=quota,
+                    region=region,
+                    allocated_quantity=0
+                )
+            allocated = distribution.allocated_quantity
+            
+            # Потребности для региона и конкретного периода
+            region_demands = demands.filter(
+                region=region,
+                start_date=quota.start_date,
+                end_date=quota.end_date
+            )
+            # Также включаем потребности без указания дат (старые записи)
+            region_demands_legacy = demands.filter(
+                region=region,
+                start_date__isnull=True,
+                end_date__isnull=True
+            )
+            region_demands = region_demands | region_demands_legacy
+            region_demand_quantity = region_demands.aggregate(total=models.Sum('quantity'))['total'] or 0
+            
+            # Заявки для региона (с фильтрацией по дате квоты)
+            region_applications = get_matching_applications_by_region(quota, region, quota.start_date)
+            
+            # Процент покрытия для региона
+            region_coverage = calculate_coverage_percent(allocated, region_demand_quantity, region_applications['total'])
+            
+            distributions.append({
+                'region': region,
+                'allocated': allocated,
+                'demands': region_demands,
+                'total_demand': region_demand_quantity,
+                'applications': region_applications,
+                'coverage_percent': region_coverage['main'],
+                'coverage_by_demand': region_coverage['by_demand'],
+                'coverage_by_quota': region_coverage['by_quota']
+            })
+    else:
+        # Если квота на один регион
+        region = quota.regions.first()
+        if region:
+            # Потребности для региона и конкретного периода
+            region_demands = demands.filter(
+                region=region,
+                start_date=quota.start_date,
+                end_date=quota.end_date
+            )
+            # Также включаем потребности без указания дат (старые записи)
+            region_demands_legacy = demands.filter(
+                region=region,
+                start_date__isnull=True,
+                end_date__isnull=True
+            )
+            region_demands = region_demands | region_demands_legacy
+            region_demand_quantity = region_demands.aggregate(total=models.Sum('quantity'))['total'] or 0
+            
+            # Заявки для региона (с фильтрацией по дате квоты)
+            region_applications = get_matching_applications_by_region(quota, region, quota.start_date)
+            
+            # Процент покрытия для региона
+            region_coverage = calculate_coverage_percent(quota.quantity, region_demand_quantity, region_applications['total'])
+            
+            distributions.append({
+                'region': region,
+                'allocated': quota.quantity,
+                'demands': region_demands,
+                'total_demand': region_demand_quantity,
+                'applications': region_applications,
+                'coverage_percent': region_coverage['main'],
+                'coverage_by_demand': region_coverage['by_demand'],
+                'coverage_by_quota': region_coverage['by_quota']
+            })
+    
+    # Подсчитываем общие заявки для квоты (сумма по всем регионам)
+    applications_data = {'submitted': 0, 'in_training': 0, 'completed': 0, 'total': 0}
+    for dist in distributions:
+        applications_data['submitted'] += dist['applications']['submitted']
+        applications_data['in_training'] += dist['applications']['in_training']
+        applications_data['completed'] += dist['applications']['completed']
+        applications_data['total'] += dist['applications']['total']
+    
+    # Рассчитываем покрытие для всей квоты
+    quota_coverage = calculate_coverage_percent(quota.quantity, total_demand, applications_data['total'])
+    
+    quota_data = {
+        'quota': quota,
+        'distributions': distributions,
+        'total_demand': total_demand,
+        'demands': demands,
+        'applications': applications_data,
+        'coverage_percent': quota_coverage['main'],
+        'coverage_by_demand': quota_coverage['by_demand'],
+        'coverage_by_quota': quota_coverage['by_quota']
+    }
+    return quota_data
+
+
+def quota_coverage_payload(quota_data):
+    """JSON-представление строки квоты из build_quota_data (для обновления дашборда без перезагрузки)"""
+    def counts(applications):
+        return {key: applications[key] for key in ('submitted', 'in_training', 'completed', 'total')}
+
+    return {
+        'quota_id': quota_data['quota'].id,
+        'quantity': quota_data['quota'].quantity,
+        'total_demand': quota_data['total_demand'],
+        'applications': counts(quota_data['applications']),
+        'coverage_percent': quota_data['coverage_percent'],
+        'coverage_by_demand': quota_data['coverage_by_demand'],
+        'coverage_by_quota': quota_data['coverage_by_quota'],
+        'distributions': [
+            {
+                'region_id': dist['region'].id,
+                'region_name': dist['region'].name,
+                'allocated': dist['allocated'],
+                'total_demand': dist['total_demand'],
+                'applications': counts(dist['applications']),
+                'coverage_percent': dist['coverage_percent'],
+                'coverage_by_demand': dist['coverage_by_demand'],
+                'coverage_by_quota': dist['coverage_by_quota'],
+            }
+            for dist in quota_data['distributions']
+        ]
+    }
+
+
 @login_required
 def quota_summary_dashboard(request):
     """Сводный дашборд квот, потребностей и заявок"""
@@ -3018,113 +1887,9 @@ def quota_summary_dashboard(request):
                 'coverage_percent': 0
             }
         
-        # Подсчитываем потребности для квоты
-        demands = quota.demands.filter(status=Demand.DemandStatus.ACTIVE)
-        total_demand = demands.aggregate(total=models.Sum('quantity'))['total'] or 0
-        
-        # Получаем распределение квот по регионам
-        distributions = []
-        if quota.regions.count() > 1:
-            # Если квота на несколько регионов, проверяем распределение
-            for region in quota.regions.all():
-                distribution = quota.distributions.filter(region=region).first()
-                # Если распределения нет, создаем его с нулевым количеством
-                if not distribution:
-                    distribution = QuotaDistribution.objects.create(
-                        quota=quota,
-                        region=region,
-                        allocated_quantity=0
-                    )
-                allocated = distribution.allocated_quantity
-                
-                # Потребности для региона и конкретного периода
-                region_demands = demands.filter(
-                    region=region,
-                    start_date=quota.start_date,
-                    end_date=quota.end_date
-                )
-                # Также включаем потребности без указания дат (старые записи)
-                region_demands_legacy = demands.filter(
-                    region=region,
-                    start_date__isnull=True,
-                    end_date__isnull=True
-                )
-                region_demands = region_demands | region_demands_legacy
-                region_demand_quantity = region_demands.aggregate(total=models.Sum('quantity'))['total'] or 0
-                
-                # Заявки для региона (с фильтрацией по дате квоты)
-                region_applications = get_matching_applications_by_region(quota, region, quota.start_date)
-                
-                # Процент покрытия для региона
-                region_coverage = calculate_coverage_percent(allocated, region_demand_quantity, region_applications['total'])
-                
-                distributions.append({
-                    'region': region,
-                    'allocated': allocated,
-                    'demands': region_demands,
-                    'total_demand': region_demand_quantity,
-                    'applications': region_applications,
-                    'coverage_percent': region_coverage['main'],
-                    'coverage_by_demand': region_coverage['by_demand'],
-                    'coverage_by_quota': region_coverage['by_quota']
-                })
-        else:
-            # Если квота на один регион
-            region = quota.regions.first()
-            if region:
-                # Потребности для региона и конкретного периода
-                region_demands = demands.filter(
-                    region=region,
-                    start_date=quota.start_date,
-                    end_date=quota.end_date
-                )
-                # Также включаем потребности без указания дат (старые записи)
-                region_demands_legacy = demands.filter(
-                    region=region,
-                    start_date__isnull=True,
-                    end_date__isnull=True
-                )
-                region_demands = region_demands | region_demands_legacy
-                region_demand_quantity = region_demands.aggregate(total=models.Sum('quantity'))['total'] or 0
-                
-                # Заявки для региона (с фильтрацией по дате квоты)
-                region_applications = get_matching_applications_by_region(quota, region, quota.start_date)
-                
-                # Процент покрытия для региона
-                region_coverage = calculate_coverage_percent(quota.quantity, region_demand_quantity, region_applications['total'])
-                
-                distributions.append({
-                    'region': region,
-                    'allocated': quota.quantity,
-                    'demands': region_demands,
-                    'total_demand': region_demand_quantity,
-                    'applications': region_applications,
-                    'coverage_percent': region_coverage['main'],
-                    'coverage_by_demand': region_coverage['by_demand'],
-                    'coverage_by_quota': region_coverage['by_quota']
-                })
-        
-        # Подсчитываем общие заявки для квоты (сумма по всем регионам)
-        applications_data = {'submitted': 0, 'in_training': 0, 'completed': 0, 'total': 0}
-        for dist in distributions:
-            applications_data['submitted'] += dist['applications']['submitted']
-            applications_data['in_training'] += dist['applications']['in_training']
-            applications_data['completed'] += dist['applications']['completed']
-            applications_data['total'] += dist['applications']['total']
-        
-        # Рассчитываем покрытие для всей квоты
-        quota_coverage = calculate_coverage_percent(quota.quantity, total_demand, applications_data['total'])
-        
-        quota_data = {
-            'quota': quota,
-            'distributions': distributions,
-            'total_demand': total_demand,
-            'demands': demands,
-            'applications': applications_data,
-            'coverage_percent': quota_coverage['main'],
-            'coverage_by_demand': quota_coverage['by_demand'],
-            'coverage_by_quota': quota_coverage['by_quota']
-        }
+        quota_data = build_quota_data(quota)
+        total_demand = quota_data['total_demand']
+        applications_data = quota_data['applications']
         
         programs_data[program_id]['quotas'].append(quota_data)
         programs_data[program_id]['total_quota'] += quota.quantity
@@ -3860,39 +2625,55 @@ def manage_demand(request):
         return JsonResponse({'success': False, 'message': f'Ошибка: {str(e)}'})
 
 
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+def manage_demands_batch(request):
+    """Пакетное управление потребностями РОИВ: {"operations": [{...}, ...]} в формате manage_demand"""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Некорректный JSON'}, status=400)
+
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list):
+        return JsonResponse({'success': False, 'message': 'Ожидается список операций operations'}, status=400)
+
+    try:
+        results = DemandBatch(user=request.user).run(operations)
+    except DemandOperationError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': f'Ошибка: {str(e)}'})
+
+    error_count = sum(1 for result in results if not result['success'])
+    return JsonResponse({
+        'success': error_count == 0,
+        'applied_count': len(results) - error_count,
+        'error_count': error_count,
+        'results': results
+    })
+
+
 @login_required
 @csrf_exempt
 @require_http_methods(["POST"])
 def distribute_quota(request):
-    """Распределение квоты между регионами"""
+    """Распределение квоты между регионами; в ответе — обновлённое покрытие этой квоты"""
     try:
         data = json.loads(request.body)
-        quota = get_object_or_404(Quota, pk=data['quota_id'])
-        distributions = data.get('distributions', [])
-        
-        # Проверяем, что сумма распределений не превышает квоту
-        total_allocated = sum(d['quantity'] for d in distributions)
-        if total_allocated > quota.quantity:
-            return JsonResponse({
-                'success': False,
-                'message': f'Сумма распределений ({total_allocated}) превышает квоту ({quota.quantity})'
-            })
-        
-        # Удаляем старые распределения
-        quota.distributions.all().delete()
-        
-        # Создаем новые распределения
-        for dist in distributions:
-            region = get_object_or_404(Region, pk=dist['region_id'])
-            QuotaDistribution.objects.create(
-                quota=quota,
-                region=region,
-                allocated_quantity=dist['quantity']
-            )
-        
+        try:
+            quota = save_quota_distribution(data.get('quota_id'), data.get('distributions', []))
+        except QuotaDistributionError as e:
+            return JsonResponse({'success': False, 'message': str(e)})
+
+        quota = Quota.objects.select_related('education_program').prefetch_related(
+            'regions', 'distributions'
+        ).get(pk=quota.pk)
         return JsonResponse({
             'success': True,
-            'message': 'Квота успешно распределена'
+            'message': 'Квота успешно распределена',
+            'coverage': quota_coverage_payload(build_quota_data(quota))
         })
         
     except Exception as e: